@@ -95,11 +95,15 @@ def CommonChecks(input_api, output_api):
           output_api,
           unit_tests=[
               J('.', 'emma_coverage_stats_test.py'),
+              J('.', 'fast_local_dev_server_test.py'),
               J('.', 'list_class_verification_failures_test.py'),
+              J('pylib', 'base', 'test_collection_test.py'),
               J('pylib', 'constants', 'host_paths_unittest.py'),
+              J('pylib', 'dex', 'dex_parser_test.py'),
               J('pylib', 'gtest', 'gtest_test_instance_test.py'),
               J('pylib', 'instrumentation',
                 'instrumentation_test_instance_test.py'),
+              J('pylib', 'instrumentation', 'test_list_cache_test.py'),
               J('pylib', 'local', 'device', 'local_device_gtest_run_test.py'),
               J('pylib', 'local', 'device',
                 'local_device_instrumentation_test_run_test.py'),
@@ -110,16 +114,24 @@ def CommonChecks(input_api, output_api):
               J('pylib', 'output', 'noop_output_manager_test.py'),
               J('pylib', 'output', 'remote_output_manager_test.py'),
               J('pylib', 'results', 'json_results_test.py'),
+              J('pylib', 'results', 'test_timings_test.py'),
+              J('pylib', 'symbols', 'deobfuscator_test.py'),
               J('pylib', 'utils', 'chrome_proxy_utils_test.py'),
               J('pylib', 'utils', 'decorators_test.py'),
               J('pylib', 'utils', 'device_dependencies_test.py'),
               J('pylib', 'utils', 'dexdump_test.py'),
               J('pylib', 'utils', 'gold_utils_test.py'),
               J('pylib', 'utils', 'test_filter_test.py'),
+              J('gyp', 'compile_java_test.py'),
+              J('gyp', 'compile_resources_test.py'),
               J('gyp', 'dex_test.py'),
+              J('gyp', 'util', 'artifact_cache_test.py'),
+              J('gyp', 'util', 'build_config_index_test.py'),
               J('gyp', 'util', 'build_utils_test.py'),
+              J('gyp', 'util', 'class_file_utils_test.py'),
               J('gyp', 'util', 'manifest_utils_test.py'),
               J('gyp', 'util', 'md5_check_test.py'),
+              J('gyp', 'util', 'persistent_worker_test.py'),
               J('gyp', 'util', 'resource_utils_test.py'),
           ],
           env=pylib_test_env,
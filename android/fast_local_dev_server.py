@@ -7,19 +7,56 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import hashlib
 import json
+import math
 import os
 import queue
+import re
 import shutil
 import socket
+import stat
 import subprocess
 import sys
+import tempfile
 import threading
+import time
 from typing import Callable, Dict, List, Optional, Tuple
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'gyp'))
+from util import build_utils
 from util import server_utils
 
+sys.path.append(os.path.join(os.path.dirname(__file__), os.pardir))
+import gn_helpers
+
+# Lower values run first. Errorprone results are usually what the developer is
+# waiting on, whereas lint is slow and rarely blocks anyone.
+_TASK_TYPE_PRIORITIES = {
+    'compile_java.py': 0,
+    'bytecode_processor.py': 1,
+    'lint.py': 2,
+}
+_DEFAULT_TASK_TYPE_PRIORITY = 1
+# Used for tasks without any duration history.
+_DEFAULT_EXPECTED_DURATION = 30.0
+# Tasks queued for longer than this run before all non-overdue tasks, so that
+# slow tasks are not starved by a steady stream of fast ones.
+_MAX_QUEUE_WAIT_SECONDS = 10 * 60
+# Weight of the latest duration in each target's moving average.
+_DURATION_HISTORY_WEIGHT = 0.3
+_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'chromium_build_server')
+_DEFAULT_HISTORY_PATH = os.path.join(_CACHE_DIR, 'task_durations.json')
+_DEFAULT_RESULT_CACHE_PATH = os.path.join(_CACHE_DIR, 'task_results.json')
+_FILE_ARG_RE = re.compile(r'@FileArg\((.*?)[:)]')
+# Flags of build server scripts whose values are outputs, which change after
+# every run.
+_OUTPUT_FLAGS = ('--cache-dir', '--depfile', '--generated-dir', '--jar-path',
+                 '--lint-gen-dir', '--output', '--stamp')
+
 
 def log(msg: str, *, end: str = ''):
   # Shrink the message (leaving a 2-char prefix and use the rest of the room
@@ -42,26 +79,51 @@ class TaskStats:
   _num_processes = 0
   _completed_tasks = 0
   _total_tasks = 0
+  _queued_tasks = 0
+  _started_tasks = 0
+  _total_wait_time = 0.0
+  _finished_runs = 0
+  _total_run_time = 0.0
   _lock = threading.Lock()
 
   @classmethod
   def no_running_processes(cls):
     return cls._num_processes == 0
 
+  @classmethod
+  def num_running_processes(cls):
+    return cls._num_processes
+
   @classmethod
   def add_task(cls):
-    # Only the main thread calls this, so there is no need for locking.
-    cls._total_tasks += 1
+    with cls._lock:
+      cls._total_tasks += 1
+      cls._queued_tasks += 1
+
+  @classmethod
+  def add_cached_task(cls):
+    with cls._lock:
+      cls._total_tasks += 1
+      cls._completed_tasks += 1
+
+  @classmethod
+  def dequeue_task(cls):
+    with cls._lock:
+      cls._queued_tasks -= 1
 
   @classmethod
-  def add_process(cls):
+  def add_process(cls, wait_time: float):
     with cls._lock:
       cls._num_processes += 1
+      cls._started_tasks += 1
+      cls._total_wait_time += wait_time
 
   @classmethod
-  def remove_process(cls):
+  def remove_process(cls, run_time: float):
     with cls._lock:
       cls._num_processes -= 1
+      cls._finished_runs += 1
+      cls._total_run_time += run_time
 
   @classmethod
   def complete_task(cls):
@@ -73,34 +135,223 @@ class TaskStats:
     # Ninja's prefix is: [205 processes, 6/734 @ 6.5/s : 0.922s ]
     # Time taken and task completion rate are not important for the build server
     # since it is always running in the background and uses idle priority for
-    # its tasks.
+    # its tasks. Average queue wait and run times show whether tasks are
+    # starved.
     with cls._lock:
       word = 'process' if cls._num_processes == 1 else 'processes'
+      avg_wait = cls._total_wait_time / max(1, cls._started_tasks)
+      avg_run = cls._total_run_time / max(1, cls._finished_runs)
       return (f'{cls._num_processes} {word}, '
-              f'{cls._completed_tasks}/{cls._total_tasks}')
+              f'{cls._completed_tasks}/{cls._total_tasks}, '
+              f'{cls._queued_tasks} queued, '
+              f'wait {avg_wait:.1f}s, run {avg_run:.1f}s')
 
 
-class TaskManager:
-  """Class to encapsulate a threadsafe queue and handle deactivating it."""
+def _read_json(path: Optional[str], default):
+  if path:
+    try:
+      with open(path) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      pass
+  return default
+
+
+def _write_json_atomically(path: str, data):
+  dirname = os.path.dirname(path)
+  try:
+    os.makedirs(dirname, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=dirname, delete=False) as f:
+      json.dump(data, f)
+    os.replace(f.name, path)
+  except OSError as e:
+    log(f'Failed to write {path}: {e}', end='\n')
+
+
+class DurationHistory:
+  """Persists a moving average of how long each target's task takes."""
+
+  def __init__(self, path: Optional[str]):
+    self._path = path
+    self._lock = threading.Lock()
+    self._durations: Dict[str, float] = _read_json(path, {})
+
+  def expected_duration(self, task: Task) -> float:
+    with self._lock:
+      return self._durations.get(task.name, _DEFAULT_EXPECTED_DURATION)
 
-  def __init__(self):
-    self._queue: queue.SimpleQueue[Task] = queue.SimpleQueue()
+  def record(self, task: Task, duration: float):
+    with self._lock:
+      old = self._durations.get(task.name)
+      if old is not None:
+        duration = (_DURATION_HISTORY_WEIGHT * duration +
+                    (1 - _DURATION_HISTORY_WEIGHT) * old)
+      self._durations[task.name] = duration
+      if self._path:
+        _write_json_atomically(self._path, self._durations)
+
+
+class ResultCache:
+  """Persists the input digest of each target's last successful run."""
+
+  def __init__(self, path: Optional[str]):
+    self._path = path
+    self._lock = threading.Lock()
+    self._digests: Dict[str, str] = _read_json(path, {})
+
+  @staticmethod
+  def _key(task: Task) -> str:
+    return f'{task.cwd}:{task.name}'
+
+  def is_up_to_date(self, task: Task) -> bool:
+    if task.input_digest is None:
+      return False
+    with self._lock:
+      return self._digests.get(self._key(task)) == task.input_digest
+
+  def record(self, task: Task):
+    with self._lock:
+      if task.succeeded and task.input_digest is not None:
+        self._digests[self._key(task)] = task.input_digest
+      else:
+        # Never serve a stale success after a failure.
+        self._digests.pop(self._key(task), None)
+      if self._path:
+        _write_json_atomically(self._path, self._digests)
+
+
+def _read_depfile_inputs(depfile_path: str) -> List[str]:
+  with open(depfile_path) as f:
+    contents = f.read()
+  # Parses the format written by build_utils.WriteDepfile().
+  inputs = contents.split(':', 1)[1].replace('\\\n', ' ')
+  return [
+      p.replace('\0', ' ')
+      for p in inputs.replace('\\ ', '\0').split()
+  ]
+
+
+def _parse_command_paths(cmd: List[str]) -> Tuple[Optional[str], List[str]]:
+  """Returns the depfile of |cmd|, and the paths it names that are not outputs.
+
+  Paths are the values of flags (GN lists included) and @FileArg files.
+  """
+  depfile = None
+  paths = []
+  args = iter(cmd)
+  for arg in args:
+    flag, has_value, value = arg.partition('=')
+    if flag in _OUTPUT_FLAGS:
+      if not has_value:
+        value = next(args, '')
+      if flag == '--depfile':
+        depfile = value
+      continue
+    if not flag.startswith('--'):
+      value = arg
+    paths.extend(_FILE_ARG_RE.findall(value))
+    try:
+      paths.extend(p for p in build_utils.ParseGnList(value)
+                   if isinstance(p, str))
+    except gn_helpers.GNError:
+      pass
+  return depfile, paths
+
+
+def _compute_input_digest(cwd: str, cmd: List[str],
+                          stamp_file: str) -> Optional[str]:
+  """Returns a digest of a request's command line and input files.
+
+  Inputs are the files listed in the depfile written by the task's previous
+  run, plus those named on the command line other than outputs. Returns None
+  when the task declares a depfile that does not exist yet, since its inputs
+  are then unknown.
+  """
+  depfile, paths = _parse_command_paths(cmd)
+  paths = set(paths)
+  if depfile:
+    try:
+      paths.update(_read_depfile_inputs(os.path.join(cwd, depfile)))
+    except (OSError, IndexError):
+      return None
+  # The stamp file is an output, so it changes after every run.
+  paths.discard(stamp_file)
+
+  md5 = hashlib.md5(json.dumps([cwd, cmd]).encode('utf-8'))
+  for path in sorted(paths):
+    try:
+      st = os.stat(os.path.join(cwd, path))
+    except (OSError, ValueError):
+      continue
+    if stat.S_ISDIR(st.st_mode):
+      continue
+    md5.update(f'{path}\0{st.st_size}\0{st.st_mtime_ns}\0'.encode('utf-8'))
+  return md5.hexdigest()
+
+
+def _num_available_cpus() -> int:
+  """Returns the number of CPUs usable by this process, honoring cgroups."""
+  count = len(os.sched_getaffinity(0))
+  try:
+    with open('/sys/fs/cgroup/cpu.max') as f:
+      quota, period = f.read().split()
+    if quota != 'max':
+      count = min(count, max(1, math.ceil(int(quota) / int(period))))
+  except (OSError, ValueError):
+    pass
+  return count
+
+
+def _cpu_pressure() -> Optional[float]:
+  """Returns the % of time some tasks stalled on CPU over the last 10s."""
+  try:
+    with open('/proc/pressure/cpu') as f:
+      for line in f:
+        if line.startswith('some '):
+          fields = dict(kv.split('=') for kv in line.split()[1:])
+          return float(fields['avg10'])
+  except (OSError, ValueError, KeyError):
+    pass
+  return None
+
+
+class TaskManager:
+  """Class to encapsulate a threadsafe task queue and handle deactivating it.
+
+  Tasks are started in order of: overdue tasks (oldest first), then task type
+  priority, then shortest expected duration (from DurationHistory).
+  """
+
+  def __init__(self,
+               history: DurationHistory,
+               result_cache: ResultCache,
+               max_jobs: Optional[int] = None,
+               max_cpu_pressure: float = 50.0):
+    self._queue: List[Task] = []
+    self._lock = threading.Lock()
     self._deactivated = False
+    self._history = history
+    self._result_cache = result_cache
+    self._num_cpus = _num_available_cpus()
+    self._max_jobs = max_jobs or self._num_cpus
+    self._max_cpu_pressure = max_cpu_pressure
 
   def add_task(self, task: Task):
     assert not self._deactivated
     TaskStats.add_task()
-    self._queue.put(task)
+    task.expected_duration = self._history.expected_duration(task)
+    with self._lock:
+      self._queue.append(task)
     log(f'QUEUED {task.name}')
     self._maybe_start_tasks()
 
   def deactivate(self):
     self._deactivated = True
-    while not self._queue.empty():
-      try:
-        task = self._queue.get_nowait()
-      except queue.Empty:
-        return
+    with self._lock:
+      tasks = self._queue
+      self._queue = []
+    for task in tasks:
+      TaskStats.dequeue_task()
       task.terminate()
 
   @staticmethod
@@ -112,6 +363,22 @@ class TaskManager:
     assert False, 'Could not read /proc/stat'
     return 0
 
+  def _pop_next_task(self) -> Optional[Task]:
+    with self._lock:
+      if not self._queue:
+        return None
+      now = time.time()
+      task = min(self._queue, key=lambda t: t.sort_key(now))
+      self._queue.remove(task)
+    TaskStats.dequeue_task()
+    return task
+
+  def _on_task_complete(self, task: Task):
+    if task.run_time is not None:
+      self._history.record(task, task.run_time)
+      self._result_cache.record(task)
+    self._maybe_start_tasks()
+
   def _maybe_start_tasks(self):
     if self._deactivated:
       return
@@ -119,20 +386,23 @@ class TaskManager:
     # processes will not cause new tasks to be started while the overall load is
     # heavy.
     cur_load = max(self._num_running_processes(), os.getloadavg()[0])
+    pressure = _cpu_pressure()
+    overloaded = pressure is not None and pressure > self._max_cpu_pressure
     num_started = 0
     # Always start a task if we don't have any running, so that all tasks are
     # eventually finished. Try starting up tasks when the overall load is light.
-    # Limit to at most 2 new tasks to prevent ramping up too fast. There is a
-    # chance where multiple threads call _maybe_start_tasks and each gets to
-    # spawn up to 2 new tasks, but since the only downside is some build tasks
-    # get worked on earlier rather than later, it is not worth mitigating.
-    while num_started < 2 and (TaskStats.no_running_processes()
-                               or num_started + cur_load < os.cpu_count()):
-      try:
-        next_task = self._queue.get_nowait()
-      except queue.Empty:
+    # There is a chance where multiple threads call _maybe_start_tasks and
+    # each starts tasks, but since the only downside is some build tasks get
+    # worked on earlier rather than later, it is not worth mitigating.
+    while TaskStats.no_running_processes() or (
+        not overloaded
+        and TaskStats.num_running_processes() < self._max_jobs
+        and num_started + cur_load < self._num_cpus):
+      next_task = self._pop_next_task()
+      if not next_task:
         return
-      num_started += next_task.start(self._maybe_start_tasks)
+      num_started += next_task.start(
+          functools.partial(self._on_task_complete, next_task))
 
 
 # TODO(wnwen): Break this into Request (encapsulating what ninja sends) and Task
@@ -151,11 +421,112 @@ class Task:
     self._proc: Optional[subprocess.Popen] = None
     self._thread: Optional[threading.Thread] = None
     self._return_code: Optional[int] = None
+    self.enqueue_time = time.time()
+    self.expected_duration = _DEFAULT_EXPECTED_DURATION
+    self._start_time: Optional[float] = None
+    # Set only when the task's process ran to completion.
+    self.run_time: Optional[float] = None
+    self.succeeded = False
+    # Computed by Server's digest thread before the task is queued.
+    self.input_digest: Optional[str] = None
+    self._cached = False
+    self._finished = False
+    self._output: List[str] = []
+    # Guards _output and _finished, and notifies waiters when they change.
+    self._output_condition = threading.Condition()
 
   @property
   def key(self):
     return (self.cwd, self.name)
 
+  @property
+  def is_pending(self) -> bool:
+    """Whether the task is queued or running and has not been terminated."""
+    return not self._terminated and self._return_code is None
+
+  @property
+  def state(self) -> str:
+    if self._cached:
+      return 'cached'
+    if self._terminated:
+      return 'terminated'
+    if self._return_code is not None:
+      return 'succeeded' if self.succeeded else 'failed'
+    if self._proc:
+      return 'running'
+    return 'queued'
+
+  def matches(self, cwd: Optional[str], name: Optional[str],
+              stamp_file: Optional[str]) -> bool:
+    """Returns whether the task matches all given filters."""
+    if cwd and os.path.realpath(cwd) != os.path.realpath(self.cwd):
+      return False
+    if name and name != self.name:
+      return False
+    if stamp_file and (os.path.normpath(os.path.join(self.cwd, stamp_file)) !=
+                       os.path.normpath(os.path.join(self.cwd,
+                                                     self.stamp_file))):
+      return False
+    return True
+
+  def to_json(self):
+    now = time.time()
+    if self._start_time is None:
+      wait_time = now - self.enqueue_time
+      run_time = None
+    else:
+      wait_time = self._start_time - self.enqueue_time
+      run_time = self.run_time
+      if run_time is None and self.state == 'running':
+        run_time = now - self._start_time
+    return {
+        'name': self.name,
+        'cwd': self.cwd,
+        'stamp_file': self.stamp_file,
+        'state': self.state,
+        'return_code': self._return_code,
+        'wait_time': wait_time,
+        'run_time': run_time,
+    }
+
+  def complete_from_cache(self):
+    """Marks the task as succeeded without running it."""
+    self._cached = True
+    self.succeeded = True
+    with self._output_condition:
+      self._finished = True
+      self._output_condition.notify_all()
+
+  def wait(self):
+    """Blocks until the task has finished or been terminated."""
+    with self._output_condition:
+      self._output_condition.wait_for(lambda: self._finished)
+
+  def iter_output(self):
+    """Yields lines of output as they are produced until the task finishes."""
+    index = 0
+    while True:
+      with self._output_condition:
+        self._output_condition.wait_for(
+            lambda: self._finished or len(self._output) > index)
+        lines = self._output[index:]
+        finished = self._finished
+      index += len(lines)
+      yield from lines
+      if finished:
+        return
+
+  @property
+  def priority(self) -> int:
+    script = os.path.basename(self.cmd[0]) if self.cmd else ''
+    return _TASK_TYPE_PRIORITIES.get(script, _DEFAULT_TASK_TYPE_PRIORITY)
+
+  def sort_key(self, now: float):
+    """Returns the key used to pick which queued task to start next."""
+    if now - self.enqueue_time > _MAX_QUEUE_WAIT_SECONDS:
+      return (0, self.enqueue_time)
+    return (1, self.priority, self.expected_duration, self.enqueue_time)
+
   def start(self, on_complete_callback: Callable[[], None]) -> int:
     """Starts the task if it has not already been terminated.
 
@@ -173,7 +544,8 @@ class Task:
       # Use os.nice(19) to ensure the lowest priority (idle) for these analysis
       # tasks since we want to avoid slowing down the actual build.
       # TODO(wnwen): Use ionice to reduce resource consumption.
-      TaskStats.add_process()
+      self._start_time = time.time()
+      TaskStats.add_process(self._start_time - self.enqueue_time)
       log(f'STARTING {self.name}')
       # This use of preexec_fn is sufficiently simple, just one os.nice call.
       # pylint: disable=subprocess-popen-preexec-fn
@@ -215,19 +587,28 @@ class Task:
   def _complete_when_process_finishes(self,
                                       on_complete_callback: Callable[[], None]):
     assert self._proc
-    # We know Popen.communicate will return a str and not a byte since it is
-    # constructed with text=True.
-    stdout: str = self._proc.communicate()[0]
+    # Read line by line so that clients can stream the output. Lines are str
+    # rather than bytes since the process is constructed with text=True.
+    for line in self._proc.stdout:
+      with self._output_condition:
+        self._output.append(line)
+        self._output_condition.notify_all()
+    self._proc.stdout.close()
+    self._proc.wait()
+    stdout = ''.join(self._output)
     self._return_code = self._proc.returncode
-    TaskStats.remove_process()
-    self._complete(stdout)
+    run_time = time.time() - self._start_time
+    if not self._terminated:
+      self.run_time = run_time
+    TaskStats.remove_process(run_time)
+    self.succeeded = self._complete(stdout)
     on_complete_callback()
 
-  def _complete(self, stdout: str = ''):
+  def _complete(self, stdout: str = '') -> bool:
     """Update the user and ninja after the task has run or been terminated.
 
-    This method should only be run once per task. Avoid modifying the task so
-    that this method does not need locking."""
+    Returns whether the task succeeded. This method should only be run once per
+    task. Avoid modifying the task so that this method does not need locking."""
 
     TaskStats.complete_task()
     failed = False
@@ -262,48 +643,176 @@ class Task:
       # file has a later modified time. Thus we do not need to worry about the
       # script being run by the build server updating the mtime incorrectly.
       pass
+    with self._output_condition:
+      self._finished = True
+      self._output_condition.notify_all()
+    return not failed
+
+
+class Server:
+  """Handles requests from build scripts and clients (see server_utils.py)."""
+
+  def __init__(self,
+               task_manager: TaskManager,
+               result_cache: ResultCache,
+               output_directory: Optional[str] = None):
+    self._task_manager = task_manager
+    self._result_cache = result_cache
+    self._output_directory = output_directory and os.path.abspath(
+        output_directory)
+    # Since dicts in python can contain anything, explicitly type tasks to help
+    # make static type checking more useful.
+    self._tasks: Dict[Tuple[str, str], Task] = {}
+    self._lock = threading.Lock()
+    # Input digests stat many files, so new tasks are handled on a single
+    # thread, in the order they were received.
+    self._new_tasks: queue.Queue[Optional[Task]] = queue.Queue()
+    self._digest_thread = threading.Thread(target=self._process_new_tasks,
+                                           daemon=True)
+    self._digest_thread.start()
+
+  def serve_forever(self, sock: socket.socket):
+    while True:
+      conn = sock.accept()[0]
+      # Some requests (e.g. waiting for tasks) block until tasks finish, so
+      # handle each connection on its own thread.
+      threading.Thread(target=self._handle_connection,
+                       args=(conn, ),
+                       daemon=True).start()
+
+  def shutdown(self):
+    self._new_tasks.put(None)
+    self._digest_thread.join()
+    # Gracefully shut down the task manager, terminating all queued tasks.
+    self._task_manager.deactivate()
+    # Terminate all currently running tasks.
+    with self._lock:
+      tasks = list(self._tasks.values())
+    for task in tasks:
+      task.terminate()
 
-
-def _listen_for_request_data(sock: socket.socket):
-  while True:
-    conn = sock.accept()[0]
-    received = []
+  def _handle_connection(self, conn: socket.socket):
     with conn:
+      received = []
       while True:
         data = conn.recv(4096)
         if not data:
           break
         received.append(data)
-    if received:
-      yield json.loads(b''.join(received))
+      if not received:
+        return
+      try:
+        for response in self._handle_request(json.loads(b''.join(received))):
+          server_utils.SendMessage(conn, response)
+      except (BrokenPipeError, ConnectionResetError):
+        # Build scripts do not wait for a response.
+        pass
 
+  def _handle_request(self, data):
+    # Requests from clients that predate versioning are all new tasks.
+    version = data.get('version', 0)
+    message_type = data.get('message_type', server_utils.ADD_TASK)
+    if version > server_utils.PROTOCOL_VERSION:
+      yield {
+          'error': f'Unsupported protocol version {version}, server supports '
+          f'up to {server_utils.PROTOCOL_VERSION}.'
+      }
+      return
+    if message_type == server_utils.ADD_TASK:
+      yield self._add_task(data)
+    elif message_type == server_utils.QUERY_STATUS:
+      yield self._query_status(data)
+    elif message_type == server_utils.WAIT_FOR_TASKS:
+      yield from self._wait_for_tasks(data)
+    elif message_type == server_utils.CANCEL_TASKS:
+      yield self._cancel_tasks(data)
+    elif message_type == server_utils.STREAM_OUTPUT:
+      yield from self._stream_output(data)
+    else:
+      yield {'error': f'Unknown message type: {message_type}'}
 
-def _process_requests(sock: socket.socket):
-  # Since dicts in python can contain anything, explicitly type tasks to help
-  # make static type checking more useful.
-  tasks: Dict[Tuple[str, str], Task] = {}
-  task_manager = TaskManager()
-  try:
-    log('READY... Remember to set android_static_analysis="build_server" in '
-        'args.gn files')
-    for data in _listen_for_request_data(sock):
-      task = Task(name=data['name'],
-                  cwd=data['cwd'],
-                  cmd=data['cmd'],
-                  stamp_file=data['stamp_file'])
-      existing_task = tasks.get(task.key)
-      if existing_task:
+  def _find_tasks(self, data) -> List[Task]:
+    # Tasks are findable only once their requests have been processed.
+    self._new_tasks.join()
+    with self._lock:
+      return [
+          t for t in self._tasks.values()
+          if t.matches(data.get('cwd'), data.get('name'),
+                       data.get('stamp_file'))
+      ]
+
+  def _add_task(self, data):
+    if self._output_directory and (os.path.realpath(data['cwd']) !=
+                                   os.path.realpath(self._output_directory)):
+      return {'error': f'This server only accepts tasks from '
+              f'{self._output_directory}.'}
+    self._new_tasks.put(
+        Task(name=data['name'],
+             cwd=data['cwd'],
+             cmd=data['cmd'],
+             stamp_file=data['stamp_file']))
+    return {'result': 'queued'}
+
+  def _process_new_tasks(self):
+    while True:
+      task = self._new_tasks.get()
+      try:
+        if task is None:
+          return
+        task.input_digest = _compute_input_digest(task.cwd, task.cmd,
+                                                  task.stamp_file)
+        self._schedule_task(task)
+      finally:
+        self._new_tasks.task_done()
+
+  def _schedule_task(self, task: Task):
+    with self._lock:
+      existing_task = self._tasks.get(task.key)
+      if existing_task and existing_task.is_pending:
+        if (task.input_digest is not None
+            and existing_task.input_digest == task.input_digest):
+          # Nothing changed, so let the existing task finish.
+          log(f'COALESCED {task.name}')
+          return
         existing_task.terminate()
-      tasks[task.key] = task
-      task_manager.add_task(task)
-  except KeyboardInterrupt:
-    log('STOPPING SERVER...', end='\n')
-    # Gracefully shut down the task manager, terminating all queued tasks.
-    task_manager.deactivate()
-    # Terminate all currently running tasks.
-    for task in tasks.values():
+      self._tasks[task.key] = task
+      if self._result_cache.is_up_to_date(task):
+        task.complete_from_cache()
+        TaskStats.add_cached_task()
+        log(f'CACHED {task.name}')
+        return
+    self._task_manager.add_task(task)
+
+  def _query_status(self, data):
+    return {
+        'stats': TaskStats.prefix(),
+        'tasks': [t.to_json() for t in self._find_tasks(data)],
+    }
+
+  def _wait_for_tasks(self, data):
+    """Waits for matching tasks, including any that replace them meanwhile."""
+    while True:
+      pending = [t for t in self._find_tasks(data) if t.is_pending]
+      if not pending:
+        break
+      for task in pending:
+        task.wait()
+    yield self._query_status(data)
+
+  def _cancel_tasks(self, data):
+    cancelled = [t for t in self._find_tasks(data) if t.is_pending]
+    for task in cancelled:
       task.terminate()
-    log('STOPPED', end='\n')
+    return {'cancelled': [t.name for t in cancelled]}
+
+  def _stream_output(self, data):
+    tasks = self._find_tasks(data)
+    if len(tasks) != 1:
+      yield {'error': f'Expected one matching task, found {len(tasks)}.'}
+      return
+    for line in tasks[0].iter_output():
+      yield {'output': line}
+    yield tasks[0].to_json()
 
 
 def main():
@@ -312,23 +821,58 @@ def main():
       '--fail-if-not-running',
       action='store_true',
       help='Used by GN to fail fast if the build server is not running.')
+  parser.add_argument('-C',
+                      '--output-directory',
+                      help='Only accept tasks from this output directory. '
+                      'Allows running one server per output directory. By '
+                      'default, tasks from all output directories are '
+                      'accepted.')
+  parser.add_argument('-j',
+                      '--jobs',
+                      type=int,
+                      help='Maximum number of tasks to run at once. Defaults '
+                      'to the number of available CPUs.')
+  parser.add_argument('--max-cpu-pressure',
+                      type=float,
+                      default=50.0,
+                      help='Do not start new tasks while the CPU pressure '
+                      '(%% of time some processes waited for a CPU over the '
+                      'last 10s, from /proc/pressure/cpu) is above this.')
+  parser.add_argument('--history-file',
+                      default=_DEFAULT_HISTORY_PATH,
+                      help='Where to persist per-target task durations, used '
+                      'to run shorter tasks first. Pass "" to disable.')
+  parser.add_argument('--result-cache-file',
+                      default=_DEFAULT_RESULT_CACHE_PATH,
+                      help='Where to persist the input digests of successful '
+                      'tasks, so that they are not re-run when re-requested '
+                      'with unchanged inputs. Pass "" to disable.')
   args = parser.parse_args()
   if args.fail_if_not_running:
-    with socket.socket(socket.AF_UNIX) as sock:
-      try:
-        sock.connect(server_utils.SOCKET_ADDRESS)
-      except socket.error:
-        print('Build server is not running and '
-              'android_static_analysis="build_server" is set.\nPlease run '
-              'this command in a separate terminal:\n\n'
-              '$ build/android/fast_local_dev_server.py\n')
-        return 1
-      else:
-        return 0
+    if server_utils.IsServerRunning(args.output_directory or os.getcwd()):
+      return 0
+    print('Build server is not running and '
+          'android_static_analysis="build_server" is set.\nPlease run '
+          'this command in a separate terminal:\n\n'
+          '$ build/android/fast_local_dev_server.py\n')
+    return 1
   with socket.socket(socket.AF_UNIX) as sock:
-    sock.bind(server_utils.SOCKET_ADDRESS)
+    sock.bind(server_utils.GetSocketAddress(args.output_directory))
     sock.listen()
-    _process_requests(sock)
+    result_cache = ResultCache(args.result_cache_file)
+    task_manager = TaskManager(DurationHistory(args.history_file),
+                               result_cache,
+                               max_jobs=args.jobs,
+                               max_cpu_pressure=args.max_cpu_pressure)
+    server = Server(task_manager, result_cache, args.output_directory)
+    try:
+      log('READY... Remember to set android_static_analysis="build_server" '
+          'in args.gn files')
+      server.serve_forever(sock)
+    except KeyboardInterrupt:
+      log('STOPPING SERVER...', end='\n')
+      server.shutdown()
+      log('STOPPED', end='\n')
   return 0
 
 
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Queries and controls a running fast_local_dev_server.py.
+
+Examples:
+  # Show all tasks from the output directory.
+  fast_local_dev_server_client.py -C out/Debug status
+  # Wait for all of its tasks to finish. Fails if any of them failed.
+  fast_local_dev_server_client.py -C out/Debug wait
+  # Wait for the task that writes a specific stamp file.
+  fast_local_dev_server_client.py -C out/Debug wait --stamp-file foo.stamp
+  # Follow the output of a task.
+  fast_local_dev_server_client.py -C out/Debug output --name //foo:bar__lint
+  # Cancel all queued and running tasks.
+  fast_local_dev_server_client.py -C out/Debug cancel
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'gyp'))
+from util import server_utils
+
+_COMMANDS = {
+    'status': server_utils.QUERY_STATUS,
+    'wait': server_utils.WAIT_FOR_TASKS,
+    'cancel': server_utils.CANCEL_TASKS,
+    'output': server_utils.STREAM_OUTPUT,
+}
+
+
+def _FormatTask(task):
+  run_time = task['run_time']
+  run_time = '-' if run_time is None else f'{run_time:.1f}s'
+  return (f'{task["state"]:<10} wait={task["wait_time"]:.1f}s '
+          f'run={run_time} {task["name"]}')
+
+
+def _PrintStatus(response):
+  for task in response['tasks']:
+    print(_FormatTask(task))
+  print(f'[{response["stats"]}]')
+  return 1 if any(t['state'] == 'failed' for t in response['tasks']) else 0
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('command', choices=sorted(_COMMANDS))
+  parser.add_argument('-C',
+                      '--output-directory',
+                      default=os.getcwd(),
+                      help='Output directory of the tasks. Defaults to the '
+                      'current directory.')
+  parser.add_argument('--all-output-directories',
+                      action='store_true',
+                      help='Do not filter tasks by output directory.')
+  parser.add_argument('--name', help='Only consider the task for this target.')
+  parser.add_argument('--stamp-file',
+                      help='Only consider the task that writes this stamp '
+                      'file (relative to the output directory).')
+  args = parser.parse_args()
+
+  output_directory = os.path.abspath(args.output_directory)
+  kwargs = {}
+  if not args.all_output_directories:
+    kwargs['cwd'] = output_directory
+  if args.name:
+    kwargs['name'] = args.name
+  if args.stamp_file:
+    kwargs['stamp_file'] = args.stamp_file
+
+  try:
+    responses = server_utils.SendRequest(_COMMANDS[args.command],
+                                         output_directory=output_directory,
+                                         **kwargs)
+    ret = 0
+    for response in responses:
+      if 'error' in response:
+        sys.stderr.write(response['error'] + '\n')
+        return 1
+      if 'output' in response:
+        sys.stdout.write(response['output'])
+      elif 'tasks' in response:
+        ret = _PrintStatus(response)
+      elif 'cancelled' in response:
+        for name in response['cancelled']:
+          print(f'Cancelled {name}')
+      elif 'state' in response:
+        print(_FormatTask(response))
+        ret = 1 if response['state'] == 'failed' else 0
+    return ret
+  except ConnectionRefusedError as e:
+    sys.stderr.write(f'{e}\n')
+    return 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import sys
+import tempfile
+import unittest
+
+import fast_local_dev_server as server
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'gyp'))
+from util import server_utils
+
+
+def _CreateTask(name, script, enqueue_time=0.0, expected_duration=1.0):
+  task = server.Task(name=name,
+                     cwd='/out',
+                     cmd=[f'../../build/android/gyp/{script}'],
+                     stamp_file='')
+  task.enqueue_time = enqueue_time
+  task.expected_duration = expected_duration
+  return task
+
+
+class TaskOrderTest(unittest.TestCase):
+  def _Order(self, tasks, now=1.0):
+    return [t.name for t in sorted(tasks, key=lambda t: t.sort_key(now))]
+
+  def testTaskTypePriority(self):
+    tasks = [
+        _CreateTask('lint', 'lint.py'),
+        _CreateTask('errorprone', 'compile_java.py', expected_duration=100),
+        _CreateTask('bytecode', 'bytecode_processor.py'),
+    ]
+    self.assertEqual(['errorprone', 'bytecode', 'lint'], self._Order(tasks))
+
+  def testShortestJobFirst(self):
+    tasks = [
+        _CreateTask('slow', 'lint.py', expected_duration=60),
+        _CreateTask('fast', 'lint.py', expected_duration=5),
+    ]
+    self.assertEqual(['fast', 'slow'], self._Order(tasks))
+
+  def testOverdueTasksRunFirst(self):
+    now = server._MAX_QUEUE_WAIT_SECONDS + 10
+    tasks = [
+        _CreateTask('new', 'compile_java.py', enqueue_time=now),
+        _CreateTask('overdue', 'lint.py', enqueue_time=0),
+    ]
+    self.assertEqual(['overdue', 'new'], self._Order(tasks, now=now))
+
+
+class DurationHistoryTest(unittest.TestCase):
+  def testPersistsMovingAverage(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, 'sub', 'history.json')
+      task = _CreateTask('lint', 'lint.py')
+      history = server.DurationHistory(path)
+      self.assertEqual(server._DEFAULT_EXPECTED_DURATION,
+                       history.expected_duration(task))
+      history.record(task, 10)
+      history.record(task, 20)
+      expected = 10 + server._DURATION_HISTORY_WEIGHT * 10
+      self.assertAlmostEqual(expected, history.expected_duration(task))
+      reloaded = server.DurationHistory(path)
+      self.assertAlmostEqual(expected, reloaded.expected_duration(task))
+
+  def testIgnoresCorruptFile(self):
+    with tempfile.NamedTemporaryFile('w') as f:
+      f.write('{not json')
+      f.flush()
+      history = server.DurationHistory(f.name)
+      self.assertEqual(server._DEFAULT_EXPECTED_DURATION,
+                       history.expected_duration(_CreateTask('a', 'lint.py')))
+
+
+class InputDigestTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self._cwd = self._tmp_dir.name
+    self._cmd = [
+        'script.py', '--depfile', 'out.d', '--config=in.json', '--stamp',
+        'out.stamp'
+    ]
+    self._Write('in.json', '{}')
+
+  def tearDown(self):
+    self._tmp_dir.cleanup()
+
+  def _Write(self, path, contents):
+    with open(os.path.join(self._cwd, path), 'w') as f:
+      f.write(contents)
+
+  def _Digest(self):
+    return server._compute_input_digest(self._cwd, self._cmd, 'out.stamp')
+
+  def testMissingDepfile(self):
+    self.assertIsNone(self._Digest())
+
+  def testInputsChangeDigest(self):
+    self._Write('out.d', 'out.stamp: \\\n dep.txt \\\n dep\\ 2.txt\n')
+    self._Write('dep.txt', 'a')
+    self._Write('dep 2.txt', 'a')
+    digest = self._Digest()
+    self.assertIsNotNone(digest)
+    self._Write('out.stamp', '')
+    self.assertEqual(digest, self._Digest())
+
+    self._Write('dep 2.txt', 'ab')
+    second_digest = self._Digest()
+    self.assertNotEqual(digest, second_digest)
+    self._Write('in.json', '{"a": 1}')
+    self.assertNotEqual(second_digest, self._Digest())
+
+  def testOutputsDoNotChangeDigest(self):
+    self._Write('out.d', 'out.stamp: \\\n in.json\n')
+    self._cmd += ['--jar-path', 'out.jar', '--output=out.txt']
+    digest = self._Digest()
+    self._Write('out.jar', 'a')
+    self._Write('out.txt', 'a')
+    self.assertEqual(digest, self._Digest())
+
+  def testGnListInputsChangeDigest(self):
+    self._Write('out.d', 'out.stamp: \\\n in.json\n')
+    self._cmd.append('--classpath=["a.jar", "b.jar"]')
+    self._Write('b.jar', 'a')
+    digest = self._Digest()
+    self._Write('b.jar', 'ab')
+    self.assertNotEqual(digest, self._Digest())
+
+  def testCommandChangesDigest(self):
+    self._Write('out.d', 'out.stamp: \\\n in.json\n')
+    digest = self._Digest()
+    self._cmd.append('--warnings-as-errors')
+    self.assertNotEqual(digest, self._Digest())
+
+
+class ResultCacheTest(unittest.TestCase):
+  def testRecordAndPersist(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, 'results.json')
+      task = _CreateTask('lint', 'lint.py')
+      task.input_digest = 'abc'
+      cache = server.ResultCache(path)
+      self.assertFalse(cache.is_up_to_date(task))
+
+      task.succeeded = True
+      cache.record(task)
+      self.assertTrue(cache.is_up_to_date(task))
+      self.assertTrue(server.ResultCache(path).is_up_to_date(task))
+
+      task.input_digest = 'def'
+      self.assertFalse(cache.is_up_to_date(task))
+
+      # A failure with the same inputs must not be served from the cache.
+      task.input_digest = 'abc'
+      task.succeeded = False
+      cache.record(task)
+      self.assertFalse(server.ResultCache(path).is_up_to_date(task))
+
+
+class ServerTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.TemporaryDirectory()
+    self._cwd = self._tmp_dir.name
+    result_cache = server.ResultCache(None)
+    task_manager = server.TaskManager(server.DurationHistory(None),
+                                      result_cache)
+    self._server = server.Server(task_manager, result_cache, self._cwd)
+
+  def tearDown(self):
+    self._server.shutdown()
+    self._tmp_dir.cleanup()
+
+  def _Request(self, message_type, **kwargs):
+    data = dict(kwargs,
+                version=server_utils.PROTOCOL_VERSION,
+                message_type=message_type)
+    return list(self._server._handle_request(data))
+
+  def _AddTask(self, name, code, version=server_utils.PROTOCOL_VERSION):
+    data = {
+        'name': name,
+        'cmd': [sys.executable, '-c', f'print("{name}"); exit({code})'],
+        'cwd': self._cwd,
+        'stamp_file': f'{name}.stamp',
+    }
+    if version:
+      data.update(version=version, message_type=server_utils.ADD_TASK)
+    return list(self._server._handle_request(data))
+
+  def testWaitAndStatus(self):
+    self.assertEqual([{'result': 'queued'}], self._AddTask('a', 0))
+    # Requests without a version are from older build scripts.
+    self.assertEqual([{'result': 'queued'}], self._AddTask('b', 1, version=0))
+    [response] = self._Request(server_utils.WAIT_FOR_TASKS, cwd=self._cwd)
+    states = {t['name']: t['state'] for t in response['tasks']}
+    # Any output is treated as a failure.
+    self.assertEqual({'a': 'failed', 'b': 'failed'}, states)
+
+    [response] = self._Request(server_utils.QUERY_STATUS, name='a')
+    self.assertEqual(['a'], [t['name'] for t in response['tasks']])
+
+  def testStreamOutput(self):
+    self._AddTask('a', 0)
+    responses = self._Request(server_utils.STREAM_OUTPUT, stamp_file='a.stamp')
+    self.assertEqual({'output': 'a\n'}, responses[0])
+    self.assertEqual('failed', responses[-1]['state'])
+
+  def testErrors(self):
+    [response] = self._Request('unknown')
+    self.assertIn('error', response)
+    [response] = self._Request(server_utils.ADD_TASK,
+                               name='a',
+                               cmd=['true'],
+                               cwd='/',
+                               stamp_file='a.stamp')
+    self.assertIn('error', response)
+    [response] = list(
+        self._server._handle_request({
+            'version': server_utils.PROTOCOL_VERSION + 1,
+            'message_type': server_utils.QUERY_STATUS
+        }))
+    self.assertIn('error', response)
+
+  def testCancel(self):
+    self._AddTask('a', 0)
+    self._AddTask('b', 0)
+    self._Request(server_utils.CANCEL_TASKS)
+    [response] = self._Request(server_utils.QUERY_STATUS)
+    self.assertTrue(
+        all(t['state'] in ('terminated', 'failed') for t in response['tasks']))
+
+
+if __name__ == '__main__':
+  unittest.main()
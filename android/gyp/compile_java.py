@@ -4,7 +4,10 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import functools
+import itertools
+import json
 import logging
 import multiprocessing
 import optparse
@@ -17,8 +20,10 @@ import zipfile
 
 import javac_output_processor
 from util import build_utils
+from util import class_file_utils
 from util import md5_check
 from util import jar_info_utils
+from util import persistent_worker
 from util import server_utils
 
 _JAVAC_EXTRACTOR = os.path.join(build_utils.DIR_SOURCE_ROOT, 'third_party',
@@ -366,12 +371,241 @@ class _InfoFileContext:
     logging.info('Completed info file: %s', output_path)
 
 
-def _CreateJarFile(jar_path, service_provider_configuration_dir,
-                   additional_jar_files, classes_dir):
+class _ClassDeps:
+  """Dependencies between the classes of a .jar, used for partial compiles.
+
+  Stored next to the .jar, and ignored if the .jar was modified since.
+  """
+  _VERSION = 1
+
+  def __init__(self, class_infos):
+    # Internal class name -> class_file_utils.ClassInfo.
+    self._class_infos = class_infos
+
+  @staticmethod
+  def _Path(jar_path):
+    return jar_path + '.class_deps.json'
+
+  @staticmethod
+  def _JarStat(jar_path):
+    st = os.stat(jar_path)
+    return [st.st_size, st.st_mtime_ns]
+
+  @classmethod
+  def FromJar(cls, jar_path):
+    class_infos = {}
+    with zipfile.ZipFile(jar_path) as z:
+      for name in z.namelist():
+        if name.endswith('.class'):
+          info = class_file_utils.ParseClassFile(z.read(name))
+          class_infos[info.name] = info
+    return cls(class_infos)
+
+  @classmethod
+  def Load(cls, jar_path):
+    """Returns the _ClassDeps of |jar_path|, or None if missing or stale."""
+    try:
+      with open(cls._Path(jar_path)) as f:
+        data = json.load(f)
+    except (IOError, ValueError):
+      return None
+    if (data.get('version') != cls._VERSION
+        or data['jar_stat'] != cls._JarStat(jar_path)):
+      return None
+    names = data['names']
+    class_infos = {}
+    for name, (supertypes, references, constants_digest) in zip(
+        names, data['classes']):
+      class_infos[name] = class_file_utils.ClassInfo(
+          name, [names[i] for i in supertypes],
+          {names[i]
+           for i in references}, constants_digest)
+    return cls(class_infos)
+
+  def Write(self, jar_path):
+    # Only dependencies between classes of the .jar are stored.
+    names = sorted(self._class_infos)
+    indices = {name: i for i, name in enumerate(names)}
+    classes = []
+    for name in names:
+      info = self._class_infos[name]
+      classes.append([
+          [indices[n] for n in info.supertypes if n in indices],
+          sorted(indices[n] for n in info.references if n in indices),
+          info.constants_digest,
+      ])
+    data = {
+        'version': self._VERSION,
+        'jar_stat': self._JarStat(jar_path),
+        'names': names,
+        'classes': classes,
+    }
+    with build_utils.AtomicOutput(self._Path(jar_path), mode='w') as f:
+      json.dump(data, f, separators=(',', ':'))
+
+  def Update(self, removed_classes, classes_dir):
+    """Replaces |removed_classes| by the .class files in |classes_dir|."""
+    for name in removed_classes:
+      self._class_infos.pop(name, None)
+    for path in build_utils.FindInDirectory(classes_dir, '*.class'):
+      with open(path, 'rb') as f:
+        info = class_file_utils.ParseClassFile(f.read())
+      self._class_infos[info.name] = info
+
+  def ClassNames(self):
+    return self._class_infos.keys()
+
+  def GetConstantsDigest(self, class_name):
+    info = self._class_infos.get(class_name)
+    return info and info.constants_digest
+
+  def FindDependents(self, class_names):
+    """Returns the classes that use the ABI of any of |class_names|.
+
+    This includes classes that refer to subtypes of |class_names|, since
+    subtypes inherit their ABI.
+    """
+    subtypes = collections.defaultdict(list)
+    for info in self._class_infos.values():
+      for supertype in info.supertypes:
+        subtypes[supertype].append(info.name)
+    changed = set()
+    stack = list(class_names)
+    while stack:
+      name = stack.pop()
+      if name not in changed:
+        changed.add(name)
+        stack.extend(subtypes.get(name, ()))
+    return {
+        info.name
+        for info in self._class_infos.values()
+        if not changed.isdisjoint(info.references)
+    }
+
+
+def _SourceForClass(jar_info, class_name):
+  # The .info file lists only top-level classes.
+  top_level_name = class_name.split('$', 1)[0]
+  return jar_info.get(top_level_name.replace('/', '.'))
+
+
+def _PlanPartialCompile(changes, options, jar_path, jar_info_path, java_files,
+                        class_deps):
+  """Determines which .java files need to be recompiled.
+
+  Args:
+    class_deps: The _ClassDeps of |jar_path|, or None.
+
+  Returns:
+    None when everything needs to be recompiled. Otherwise, a tuple of:
+      * The .java files to compile.
+      * The internal names of classes to remove from the old .jar, or None to
+        just overwrite classes that are recompiled.
+  """
+  if (changes.HasStringChanges() or not os.path.exists(jar_path)
+      or (jar_info_path and not os.path.exists(jar_info_path))):
+    return None
+  changed_java_files = set()
+  header_jar_changed = False
+  for path in changes.IterChangedPaths():
+    if path.endswith('.java'):
+      changed_java_files.add(path)
+    elif path == options.header_jar:
+      header_jar_changed = True
+    else:
+      return None
+
+  # The header jar contains the ABI of |java_files|. Without it, and without
+  # the dependency information, a partial compile is possible only when the
+  # header jar did not change, since this means no signatures changed.
+  if not class_deps:
+    if header_jar_changed:
+      return None
+    return sorted(changed_java_files), None
+
+  jar_info = jar_info_utils.ParseJarInfoFile(jar_info_path)
+  stale_classes = set()
+  if header_jar_changed:
+    # Partial compiles reuse the old .info file, which lists top-level
+    # classes. It must be regenerated when any of them is added or removed.
+    for subpath in itertools.chain(
+        changes.IterAddedSubpaths(options.header_jar),
+        changes.IterRemovedSubpaths(options.header_jar)):
+      if subpath.endswith('.class') and '$' not in subpath:
+        logging.info('Top-level class added or removed: %s', subpath)
+        return None
+
+    abi_changed_classes = set()
+    with zipfile.ZipFile(options.header_jar) as header_jar:
+      header_names = set(header_jar.namelist())
+      for subpath in changes.IterChangedSubpaths(options.header_jar):
+        if not subpath.endswith('.class'):
+          continue
+        class_name = subpath[:-len('.class')]
+        abi_changed_classes.add(class_name)
+        # Compile-time constants are inlined into classes that use them, so
+        # uses of them cannot be found.
+        old_digest = class_deps.GetConstantsDigest(class_name)
+        new_digest = None
+        if subpath in header_names:
+          new_digest = class_file_utils.ParseClassFile(
+              header_jar.read(subpath)).constants_digest
+        if old_digest != new_digest:
+          logging.info('Constants of %s changed', class_name)
+          return None
+    stale_classes = class_deps.FindDependents(abi_changed_classes)
+
+  java_files_set = set(java_files)
+  to_compile = set(changed_java_files)
+  for class_name in stale_classes:
+    source = _SourceForClass(jar_info, class_name)
+    # Sources from .srcjars are not extracted for partial compiles.
+    if source not in java_files_set:
+      logging.info('No .java file for %s', class_name)
+      return None
+    to_compile.add(source)
+
+  removed_classes = {
+      c
+      for c in class_deps.ClassNames()
+      if _SourceForClass(jar_info, c) in to_compile
+  }
+  logging.info('Recompiling %d changed and %d dependent .java files',
+               len(changed_java_files),
+               len(to_compile) - len(changed_java_files))
+  return sorted(to_compile), removed_classes
+
+
+def _CreateJarFile(jar_path,
+                   service_provider_configuration_dir,
+                   additional_jar_files,
+                   classes_dir,
+                   base_jar_path=None,
+                   removed_classes=None):
+  """Creates the .jar from |classes_dir| and other files.
+
+  Args:
+    base_jar_path: Optional path of a .jar with classes to add (e.g. from a
+        previous compile) unless they are in |classes_dir|.
+    removed_classes: Internal names of classes in |base_jar_path| to omit.
+  """
   logging.info('Start creating jar file: %s', jar_path)
   with build_utils.AtomicOutput(jar_path) as f:
     with zipfile.ZipFile(f.name, 'w') as z:
-      build_utils.ZipDir(z, classes_dir)
+      if base_jar_path:
+        removed_classes = removed_classes or ()
+
+        def base_path_filter(path):
+          # Other entries are re-added below.
+          return (path.endswith('.class')
+                  and path[:-len('.class')] not in removed_classes)
+
+        build_utils.OverlayZipDir(z,
+                                  base_jar_path,
+                                  classes_dir,
+                                  base_path_filter=base_path_filter)
+      else:
+        build_utils.ZipDir(z, classes_dir)
       if service_provider_configuration_dir:
         config_files = build_utils.FindInDirectory(
             service_provider_configuration_dir)
@@ -458,8 +692,8 @@ def _RunCompiler(changes,
     intermediates_out_dir: Directory for saving intermediate outputs.
         If None a temporary directory is used.
     enable_partial_javac: Enables compiling only Java files which have changed
-        in the special case that no method signatures have changed. This is
-        useful for large GN targets.
+        and those that depend on changed signatures. This is useful for large
+        GN targets.
         Not supported if compiling generates outputs other than |jar_path| and
         |jar_info_path|.
   """
@@ -479,30 +713,35 @@ def _RunCompiler(changes,
     service_provider_configuration = os.path.join(
         temp_dir, 'service_provider_configuration')
 
+    base_jar_path = None
+    removed_classes = None
+    class_deps = None
     if java_files:
       os.makedirs(classes_dir)
 
+      partial_compile = None
       if enable_partial_javac:
-        all_changed_paths_are_java = all(
-            p.endswith(".java") for p in changes.IterChangedPaths())
-        if (all_changed_paths_are_java and not changes.HasStringChanges()
-            and os.path.exists(jar_path)
-            and (jar_info_path is None or os.path.exists(jar_info_path))):
-          # Log message is used by tests to determine whether partial javac
-          # optimization was used.
-          logging.info('Using partial javac optimization for %s compile' %
-                       (jar_path))
-
-          # Header jar corresponding to |java_files| did not change.
-          # As a build speed optimization (crbug.com/1170778), re-compile only
-          # java files which have changed. Re-use old jar .info file.
-          java_files = list(changes.IterChangedPaths())
-          java_srcjars = None
-
-          # Reuse old .info file.
-          save_info_file = False
-
-          build_utils.ExtractAll(jar_path, classes_dir, pattern='*.class')
+        if jar_info_path and os.path.exists(jar_path):
+          class_deps = _ClassDeps.Load(jar_path)
+        partial_compile = _PlanPartialCompile(changes, options, jar_path,
+                                              jar_info_path, java_files,
+                                              class_deps)
+      if partial_compile:
+        # Log message is used by tests to determine whether partial javac
+        # optimization was used.
+        logging.info('Using partial javac optimization for %s compile' %
+                     (jar_path))
+
+        # As a build speed optimization (crbug.com/1170778), re-compile only
+        # java files which have changed, and those that use the signatures of
+        # classes that changed. Classes of other files are copied from the
+        # old jar. Re-use old jar .info file.
+        java_files, removed_classes = partial_compile
+        java_srcjars = None
+        base_jar_path = jar_path
+
+        # Reuse old .info file.
+        save_info_file = False
 
     if save_info_file:
       info_file_context = _InfoFileContext(options.chromium_code,
@@ -559,20 +798,33 @@ def _RunCompiler(changes,
 
       logging.debug('Build command %s', cmd)
       start = time.time()
-      build_utils.CheckOutput(cmd,
-                              print_stdout=options.chromium_code,
-                              stdout_filter=process_javac_output_partial,
-                              stderr_filter=process_javac_output_partial,
-                              fail_on_output=options.warnings_as_errors)
+      persistent_worker.CheckOutput(
+          cmd,
+          print_stdout=options.chromium_code,
+          stdout_filter=process_javac_output_partial,
+          stderr_filter=process_javac_output_partial,
+          fail_on_output=options.warnings_as_errors)
       end = time.time() - start
       logging.info('Java compilation took %ss', end)
 
-    _CreateJarFile(jar_path, service_provider_configuration,
-                   options.additional_jar_files, classes_dir)
+    _CreateJarFile(jar_path,
+                   service_provider_configuration,
+                   options.additional_jar_files,
+                   classes_dir,
+                   base_jar_path=base_jar_path,
+                   removed_classes=removed_classes)
 
     if save_info_file:
       info_file_context.Commit(jar_info_path)
 
+    if jar_info_path:
+      logging.info('Writing class dependencies')
+      if class_deps and removed_classes is not None:
+        class_deps.Update(removed_classes, classes_dir)
+      else:
+        class_deps = _ClassDeps.FromJar(jar_path)
+      class_deps.Write(jar_path)
+
     logging.info('Completed all steps in _RunCompiler')
   finally:
     if info_file_context:
@@ -775,14 +1027,18 @@ def main(argv):
   ]
 
   # Use md5_check for |pass_changes| feature.
-  md5_check.CallAndWriteDepfileIfStale(lambda changes: _OnStaleMd5(
-      changes, options, javac_cmd, javac_args, java_files),
-                                       options,
-                                       depfile_deps=depfile_deps,
-                                       input_paths=input_paths,
-                                       input_strings=input_strings,
-                                       output_paths=output_paths,
-                                       pass_changes=True)
+  md5_check.CallAndWriteDepfileIfStale(
+      lambda changes: _OnStaleMd5(changes, options, javac_cmd, javac_args,
+                                  java_files),
+      options,
+      depfile_deps=depfile_deps,
+      input_paths=input_paths,
+      input_strings=input_strings,
+      output_paths=output_paths,
+      pass_changes=True,
+      # Changed classes in the header jar are the ones with changed ABIs.
+      track_subpaths_allowlist=[options.header_jar]
+      if options.header_jar else None)
 
 
 if __name__ == '__main__':
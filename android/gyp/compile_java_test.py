@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import argparse
+import os
+import unittest
+import zipfile
+
+import compile_java
+from util import md5_check
+from util import temp_dir_test_case
+
+
+def _Metadata(java_files, header_entries):
+  metadata = md5_check._Metadata(track_entries=True)
+  for path, tag in java_files:
+    metadata.AddFile(path, tag)
+  metadata.AddZipFile('header.jar', header_entries)
+  return metadata
+
+
+class PlanPartialCompileTest(temp_dir_test_case.TempDirTestCase):
+  def setUp(self):
+    super().setUp()
+    self.jar_path = os.path.join(self.temp_dir, 'foo.jar')
+    self.jar_info_path = self.jar_path + '.info'
+    with zipfile.ZipFile(self.jar_path, 'w') as z:
+      z.writestr('org/Foo.class', b'')
+    with open(self.jar_info_path, 'w') as f:
+      f.write('org.Foo,Foo.java\n')
+    self.options = argparse.Namespace(header_jar='header.jar')
+    self.class_deps = compile_java._ClassDeps({})
+
+  def _Plan(self, old_metadata, new_metadata):
+    changes = md5_check.Changes(old_metadata, new_metadata, False, [], [])
+    return compile_java._PlanPartialCompile(changes, self.options,
+                                            self.jar_path, self.jar_info_path,
+                                            ['Foo.java'], self.class_deps)
+
+  def testHeaderJarUnchanged(self):
+    header_entries = [('org/Foo.class', '1')]
+    old_metadata = _Metadata([('Foo.java', '1')], header_entries)
+    new_metadata = _Metadata([('Foo.java', '2')], header_entries)
+    self.assertEqual((['Foo.java'], set()),
+                     self._Plan(old_metadata, new_metadata))
+
+  def testAddedTopLevelClass(self):
+    # Adding a class without constants to an existing file must regenerate
+    # the .info file, which requires a full compile.
+    old_metadata = _Metadata([('Foo.java', '1')], [('org/Foo.class', '1')])
+    new_metadata = _Metadata([('Foo.java', '2')],
+                             [('org/Foo.class', '1'),
+                              ('org/FooHelper.class', '1')])
+    self.assertIsNone(self._Plan(old_metadata, new_metadata))
+
+  def testRemovedTopLevelClass(self):
+    old_metadata = _Metadata([('Foo.java', '1')],
+                             [('org/Foo.class', '1'),
+                              ('org/FooHelper.class', '1')])
+    new_metadata = _Metadata([('Foo.java', '2')], [('org/Foo.class', '1')])
+    self.assertIsNone(self._Plan(old_metadata, new_metadata))
+
+
+if __name__ == '__main__':
+  unittest.main()
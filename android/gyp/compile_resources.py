@@ -27,6 +27,7 @@ import sys
 import textwrap
 from xml.etree import ElementTree
 
+from util import artifact_cache
 from util import build_utils
 from util import diff_utils
 from util import manifest_utils
@@ -45,6 +46,10 @@ _PNG_WEBP_EXCLUSION_PATTERN = re.compile('|'.join([
     r'.*daydream_icon_.*\.png'
 ]))
 
+# Bump when changing how extracted dependency resources are transformed before
+# being compiled, to invalidate cached compiled resources.
+_DEP_TRANSFORMS_VERSION = '2'
+
 
 def _ParseArgs(args):
   """Parses command line options.
@@ -182,7 +187,15 @@ def _ParseArgs(args):
   input_opts.add_argument('--webp-binary', default='',
                           help='Path to the cwebp binary.')
   input_opts.add_argument(
-      '--webp-cache-dir', help='The directory to store webp image cache.')
+      '--artifact-cache-dir',
+      help='Directory in which to cache converted images and compiled '
+      'resources. May be shared between output directories.')
+  input_opts.add_argument(
+      '--artifact-cache-max-size-mb',
+      type=int,
+      default=artifact_cache.DEFAULT_MAX_SIZE_MB,
+      help='Size above which the least recently used artifacts are evicted '
+      'from --artifact-cache-dir.')
 
   input_opts.add_argument(
       '--no-xml-namespaces',
@@ -507,33 +520,50 @@ def _ComputeSha1(path):
   return hashlib.sha1(data).hexdigest()
 
 
-def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache_dir):
-  sha1_hash = _ComputeSha1(png_path)
+def _ExtractedPngDigests(cache, dep_zip, dep_subdirs):
+  """Returns a dict of path -> sha1 for .png files extracted from |dep_zip|.
+
+  Digests are memoized by |cache| for as long as |dep_zip| does not change, so
+  that the extracted files need not be read.
+  """
+  # See resource_utils.ExtractDeps() for how these are named.
+  subdir_name = dep_zip.replace(os.path.sep, '_')
+  ret = {}
+  for name, digest in cache.ZipEntryDigests(dep_zip).items():
+    if not name.endswith('.png'):
+      continue
+    for dep_subdir in dep_subdirs:
+      # Non-empty for zips with multiple resource directories.
+      name_prefix = os.path.basename(dep_subdir)[len(subdir_name) + 1:]
+      if not name_prefix:
+        ret[os.path.join(dep_subdir, name)] = digest
+      elif name.startswith(name_prefix + '/'):
+        ret[os.path.join(dep_subdir, name[len(name_prefix) + 1:])] = digest
+  return ret
+
+
+def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, cache,
+                         png_digests):
+  # Locale-based renames do not apply to images, so extracted paths match.
+  sha1_hash = png_digests.get(png_path) or _ComputeSha1(png_path)
 
   # The set of arguments that will appear in the cache key.
   quality_args = ['-m', '6', '-q', '100', '-lossless']
 
-  webp_cache_path = os.path.join(
-      webp_cache_dir, '{}-{}-{}'.format(sha1_hash, cwebp_version,
-                                        ''.join(quality_args)))
   # No need to add .webp. Android can load images fine without them.
   webp_path = os.path.splitext(png_path)[0]
 
-  cache_hit = os.path.exists(webp_cache_path)
-  if cache_hit:
-    os.link(webp_cache_path, webp_path)
-  else:
-    # We place the generated webp image to webp_path, instead of in the
-    # webp_cache_dir to avoid concurrency issues.
-    args = [cwebp_binary, png_path, '-o', webp_path, '-quiet'] + quality_args
+  def convert(output_path):
+    args = [cwebp_binary, png_path, '-o', output_path, '-quiet'] + quality_args
     subprocess.check_call(args)
 
-    try:
-      os.link(webp_path, webp_cache_path)
-    except OSError:
-      # Because of concurrent run, a webp image may already exists in
-      # webp_cache_path.
-      pass
+  if cache:
+    key = artifact_cache.MakeKey('webp', sha1_hash, cwebp_version,
+                                 *quality_args)
+    cache_hit = cache.GetOrCreate(key, webp_path, convert)
+  else:
+    convert(webp_path)
+    cache_hit = False
 
   os.remove(png_path)
   original_dir = os.path.dirname(os.path.dirname(png_path))
@@ -542,17 +572,18 @@ def _ConvertToWebPSingle(png_path, cwebp_binary, cwebp_version, webp_cache_dir):
   return rename_tuple, cache_hit
 
 
-def _ConvertToWebP(cwebp_binary, png_paths, path_info, webp_cache_dir):
-  cwebp_version = subprocess.check_output([cwebp_binary, '-version']).rstrip()
+def _ConvertToWebP(cwebp_binary, png_paths, path_info, cache, png_digests):
+  cwebp_version = subprocess.check_output([cwebp_binary, '-version'],
+                                          text=True).rstrip()
   shard_args = [(f, ) for f in png_paths
                 if not _PNG_WEBP_EXCLUSION_PATTERN.match(f)]
 
-  build_utils.MakeDirectory(webp_cache_dir)
   results = parallel.BulkForkAndCall(_ConvertToWebPSingle,
                                      shard_args,
                                      cwebp_binary=cwebp_binary,
                                      cwebp_version=cwebp_version,
-                                     webp_cache_dir=webp_cache_dir)
+                                     cache=cache,
+                                     png_digests=png_digests)
   total_cache_hits = 0
   for rename_tuple, cache_hit in results:
     path_info.RegisterRename(*rename_tuple)
@@ -578,43 +609,54 @@ def _RemoveImageExtensions(directory, path_info):
             os.path.relpath(path_no_extension, directory))
 
 
-def _CompileSingleDep(index, dep_subdir, keep_predicate, aapt2_path,
-                      partials_dir):
+def _CompileSingleDep(index, dep_subdir, keep_predicate, cache_key, aapt2_path,
+                      partials_dir, cache):
   unique_name = '{}_{}'.format(index, os.path.basename(dep_subdir))
   partial_path = os.path.join(partials_dir, '{}.zip'.format(unique_name))
 
-  compile_command = [
-      aapt2_path,
-      'compile',
-      # TODO(wnwen): Turn this on once aapt2 forces 9-patch to be crunched.
-      # '--no-crunch',
-      '--dir',
-      dep_subdir,
-      '-o',
-      partial_path
-  ]
-
-  # There are resources targeting API-versions lower than our minapi. For
-  # various reasons it's easier to let aapt2 ignore these than for us to
-  # remove them from our build (e.g. it's from a 3rd party library).
-  build_utils.CheckOutput(
-      compile_command,
-      stderr_filter=lambda output: build_utils.FilterLines(
-          output, r'ignoring configuration .* for (styleable|attribute)'))
+  def compile_dep(output_path):
+    compile_command = [
+        aapt2_path,
+        'compile',
+        # TODO(wnwen): Turn this on once aapt2 forces 9-patch to be crunched.
+        # '--no-crunch',
+        '--dir',
+        dep_subdir,
+        '-o',
+        output_path
+    ]
 
-  # Filtering these files is expensive, so only apply filters to the partials
-  # that have been explicitly targeted.
-  if keep_predicate:
-    logging.debug('Applying .arsc filtering to %s', dep_subdir)
-    protoresources.StripUnwantedResources(partial_path, keep_predicate)
-  return partial_path
+    # There are resources targeting API-versions lower than our minapi. For
+    # various reasons it's easier to let aapt2 ignore these than for us to
+    # remove them from our build (e.g. it's from a 3rd party library).
+    build_utils.CheckOutput(
+        compile_command,
+        stderr_filter=lambda output: build_utils.FilterLines(
+            output, r'ignoring configuration .* for (styleable|attribute)'))
+
+    # Filtering these files is expensive, so only apply filters to the
+    # partials that have been explicitly targeted.
+    if keep_predicate:
+      logging.debug('Applying .arsc filtering to %s', dep_subdir)
+      protoresources.StripUnwantedResources(output_path, keep_predicate)
+
+  if cache_key:
+    cache_hit = cache.GetOrCreate(cache_key, partial_path, compile_dep)
+  else:
+    compile_dep(partial_path)
+    cache_hit = False
+  return partial_path, cache_hit
 
 
-def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
-  patterns = [
+def _GetValuesFilterPatterns(exclusion_rules, dep_subdir):
+  return [
       x[1] for x in exclusion_rules
       if build_utils.MatchesGlob(dep_subdir, [x[0]])
   ]
+
+
+def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
+  patterns = _GetValuesFilterPatterns(exclusion_rules, dep_subdir)
   if not patterns:
     return None
 
@@ -622,22 +664,51 @@ def _CreateValuesKeepPredicate(exclusion_rules, dep_subdir):
   return lambda x: not any(r.search(x) for r in regexes)
 
 
-def _CompileDeps(aapt2_path, dep_subdirs, dep_subdir_overlay_set, temp_dir,
-                 exclusion_rules):
+def _CompileDeps(aapt2_path,
+                 dep_subdirs,
+                 dep_subdir_overlay_set,
+                 temp_dir,
+                 exclusion_rules,
+                 cache=None,
+                 dep_subdir_input_keys=None):
+  """Compiles each of |dep_subdirs| into a partial .zip of .flat files.
+
+  Args:
+    cache: Optional ArtifactCache to reuse compiled partials from.
+    dep_subdir_input_keys: Dict of dep_subdir -> key for the resources it
+      contains. Directories without a key are always compiled.
+  Returns:
+    The list of partials to pass to aapt2 link.
+  """
   partials_dir = os.path.join(temp_dir, 'partials')
   build_utils.MakeDirectory(partials_dir)
 
-  job_params = [(i, dep_subdir,
-                 _CreateValuesKeepPredicate(exclusion_rules, dep_subdir))
-                for i, dep_subdir in enumerate(dep_subdirs)]
+  aapt2_digest = cache.FileDigest(aapt2_path) if cache else None
+  job_params = []
+  for i, dep_subdir in enumerate(dep_subdirs):
+    cache_key = None
+    input_key = (dep_subdir_input_keys or {}).get(dep_subdir)
+    if cache and input_key:
+      # .flat files embed the absolute path of resources.
+      cache_key = artifact_cache.MakeKey(
+          'aapt2 compile', aapt2_digest, input_key,
+          os.path.abspath(dep_subdir),
+          *_GetValuesFilterPatterns(exclusion_rules, dep_subdir))
+    job_params.append(
+        (i, dep_subdir, _CreateValuesKeepPredicate(exclusion_rules,
+                                                   dep_subdir), cache_key))
 
   # Filtering is slow, so ensure jobs with keep_predicate are started first.
   job_params.sort(key=lambda x: not x[2])
-  partials = list(
+  results = list(
       parallel.BulkForkAndCall(_CompileSingleDep,
                                job_params,
                                aapt2_path=aapt2_path,
-                               partials_dir=partials_dir))
+                               partials_dir=partials_dir,
+                               cache=cache))
+  partials = [partial for partial, _ in results]
+  logging.debug('aapt2 compile cache: %d/%d',
+                sum(cache_hit for _, cache_hit in results), len(results))
 
   partials_cmd = list()
   for i, partial in enumerate(partials):
@@ -730,6 +801,23 @@ def _FilterResourceFiles(dep_subdirs, keep_predicate):
   return png_paths
 
 
+def _GetDepTransformsKey(options, cache):
+  """Returns a key for the options that affect how extracted dependency
+  resources are transformed before being compiled."""
+  parts = [
+      _DEP_TRANSFORMS_VERSION,
+      repr(options.resource_exclusion_regex),
+      repr(options.resource_exclusion_exceptions),
+      repr(options.locale_allowlist),
+      repr(options.shared_resources_allowlist_locales),
+  ]
+  if options.shared_resources_allowlist:
+    parts.append(cache.FileDigest(options.shared_resources_allowlist))
+  if options.png_to_webp:
+    parts.append(cache.FileDigest(options.webp_binary))
+  return artifact_cache.MakeKey(*parts)
+
+
 def _PackageApk(options, build):
   """Compile and link resources with aapt2.
 
@@ -739,15 +827,33 @@ def _PackageApk(options, build):
   Returns:
     The manifest package name for the APK.
   """
+  cache = None
+  if options.artifact_cache_dir:
+    cache = artifact_cache.ArtifactCache(options.artifact_cache_dir,
+                                         options.artifact_cache_max_size_mb)
+
   logging.debug('Extracting resource .zips')
   dep_subdirs = []
   dep_subdir_overlay_set = set()
+  png_digests = {}
+  # Keys for the contents of each dep_subdir once transformed.
+  dep_subdir_input_keys = {}
+  dep_transforms_key = cache and _GetDepTransformsKey(options, cache)
   for dependency_res_zip in options.dependencies_res_zips:
     extracted_dep_subdirs = resource_utils.ExtractDeps([dependency_res_zip],
                                                        build.deps_dir)
     dep_subdirs += extracted_dep_subdirs
     if dependency_res_zip in options.dependencies_res_zip_overlays:
       dep_subdir_overlay_set.update(extracted_dep_subdirs)
+    if cache:
+      input_key = artifact_cache.MakeKey(cache.FileDigest(dependency_res_zip),
+                                         dep_transforms_key)
+      dep_subdir_input_keys.update(
+          (d, input_key) for d in extracted_dep_subdirs)
+      if options.png_to_webp:
+        png_digests.update(
+            _ExtractedPngDigests(cache, dependency_res_zip,
+                                 extracted_dep_subdirs))
 
   logging.debug('Applying locale transformations')
   path_info = resource_utils.ResourceInfoFile()
@@ -764,8 +870,8 @@ def _PackageApk(options, build):
 
   if png_paths and options.png_to_webp:
     logging.debug('Converting png->webp')
-    _ConvertToWebP(options.webp_binary, png_paths, path_info,
-                   options.webp_cache_dir)
+    _ConvertToWebP(options.webp_binary, png_paths, path_info, cache,
+                   png_digests)
   logging.debug('Applying drawable transformations')
   for directory in dep_subdirs:
     _MoveImagesToNonMdpiFolders(directory, path_info)
@@ -773,9 +879,16 @@ def _PackageApk(options, build):
 
   logging.debug('Running aapt2 compile')
   exclusion_rules = [x.split(':', 1) for x in options.values_filter_rules]
-  partials = _CompileDeps(options.aapt2_path, dep_subdirs,
-                          dep_subdir_overlay_set, build.temp_dir,
-                          exclusion_rules)
+  partials = _CompileDeps(options.aapt2_path,
+                          dep_subdirs,
+                          dep_subdir_overlay_set,
+                          build.temp_dir,
+                          exclusion_rules,
+                          cache=cache,
+                          dep_subdir_input_keys=dep_subdir_input_keys)
+  if cache:
+    cache.Trim()
+    cache.Close()
 
   link_command = [
       options.aapt2_path,
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import argparse
+import os
+import unittest
+
+import compile_resources
+from util import artifact_cache
+from util import build_utils
+
+
+class CompileResourcesTest(unittest.TestCase):
+  def testDepTransformsKey(self):
+    with build_utils.TempDir() as tmp_dir:
+      cache = artifact_cache.ArtifactCache(os.path.join(tmp_dir, 'cache'))
+
+      def write_file(name, data):
+        path = os.path.join(tmp_dir, name)
+        with open(path, 'w') as f:
+          f.write(data)
+        return path
+
+      allowlist = write_file('allowlist.txt', 'int string foo 0x7f010001\n')
+      webp_binary = write_file('cwebp', 'v1')
+      options = argparse.Namespace(resource_exclusion_regex='',
+                                   resource_exclusion_exceptions=[],
+                                   locale_allowlist=['en-US'],
+                                   shared_resources_allowlist=allowlist,
+                                   shared_resources_allowlist_locales=['fr'],
+                                   png_to_webp=True,
+                                   webp_binary=webp_binary)
+      keys = {compile_resources._GetDepTransformsKey(options, cache)}
+
+      def assert_new_key(**kwargs):
+        changed = argparse.Namespace(**vars(options))
+        vars(changed).update(kwargs)
+        key = compile_resources._GetDepTransformsKey(changed, cache)
+        self.assertNotIn(key, keys)
+        keys.add(key)
+
+      assert_new_key(resource_exclusion_regex=r'.*\.png')
+      assert_new_key(resource_exclusion_exceptions=['foo.png'])
+      assert_new_key(locale_allowlist=['en-US', 'de'])
+      assert_new_key(shared_resources_allowlist_locales=['fr', 'it'])
+      assert_new_key(png_to_webp=False)
+      assert_new_key(shared_resources_allowlist=None)
+
+      # Changing the contents of the files is enough.
+      write_file('allowlist.txt', 'int string bar 0x7f010002\n')
+      assert_new_key()
+      write_file('cwebp', 'v2.0')
+      assert_new_key()
+      cache.Close()
+
+
+if __name__ == '__main__':
+  unittest.main()
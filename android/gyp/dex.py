@@ -6,7 +6,12 @@
 
 import argparse
 import collections
+import concurrent.futures
+import contextlib
+import fcntl
+import heapq
 import logging
+import marshal
 import os
 import re
 import shutil
@@ -17,6 +22,7 @@ import zipfile
 
 from util import build_utils
 from util import md5_check
+from util import persistent_worker
 from util import zipalign
 
 
@@ -55,6 +61,18 @@ _SKIPPED_CLASS_FILE_NAMES = (
     'module-info.class',  # Explicitly skipped by r8/utils/FileUtils#isClassFile
 )
 
+# Machine-wide number of D8 processes that dex.py invocations may run in
+# addition to their first one (which ninja already accounts for).
+_EXTRA_D8_PROCESSES_ENV_VARIABLE = 'DEX_EXTRA_D8_PROCESSES'
+_EXTRA_D8_SLOTS_DIR = os.path.join(tempfile.gettempdir(),
+                                   'chromium_d8_slots_%d' % os.getuid())
+# Dexing fewer classes per D8 process would be dominated by JVM startup.
+_MIN_CLASSES_PER_D8 = 1000
+
+_DESUGAR_DEPS_PREFIX = '  <-  '
+# marshal's format is specific to the Python version.
+_DESUGAR_DEPS_INDEX_VERSION = '1_py%d%d' % sys.version_info[:2]
+
 
 def _ParseArgs(args):
   args = build_utils.ExpandFileArgs(args)
@@ -208,9 +226,9 @@ def _RunD8(dex_cmd, input_paths, output_path, warnings_as_errors,
     # stdout sometimes spams with things like:
     # Stripped invalid locals information from 1 method.
     try:
-      build_utils.CheckOutput(dex_cmd,
-                              stderr_filter=stderr_filter,
-                              fail_on_output=warnings_as_errors)
+      persistent_worker.CheckOutput(dex_cmd,
+                                    stderr_filter=stderr_filter,
+                                    fail_on_output=warnings_as_errors)
     except Exception:
       if orig_dex_cmd is not dex_cmd:
         sys.stderr.write('Full command: ' + shlex.join(orig_dex_cmd) + '\n')
@@ -268,11 +286,11 @@ def _IntermediateDexFilePathsFromInputJars(class_inputs, incremental_dir):
   """Returns a list of all intermediate dex file paths."""
   dex_files = []
   for jar in class_inputs:
-    with zipfile.ZipFile(jar, 'r') as z:
-      for subpath in z.namelist():
-        if _IsClassFile(subpath):
-          subpath = subpath[:-5] + 'dex'
-          dex_files.append(os.path.join(incremental_dir, subpath))
+    for entry in build_utils.ReadZipCentralDirectory(jar):
+      subpath = entry[0]
+      if _IsClassFile(subpath):
+        subpath = subpath[:-5] + 'dex'
+        dex_files.append(os.path.join(incremental_dir, subpath))
   return dex_files
 
 
@@ -287,7 +305,7 @@ def _DeleteStaleIncrementalDexFiles(dex_dir, dex_files):
 
 def _ParseDesugarDeps(desugar_dependencies_file):
   # pylint: disable=line-too-long
-  """Returns a dict of dependent/dependency mapping parsed from the file.
+  """Returns a dict of dependent -> set of dependencies parsed from the file.
 
   Example file format:
   $ tail out/Debug/gen/base/base_java__dex.desugardeps
@@ -302,34 +320,107 @@ def _ParseDesugarDeps(desugar_dependencies_file):
     <-  org/chromium/base/task/TaskRunnerImpl$Natives.class
   """
   # pylint: enable=line-too-long
-  dependents_from_dependency = collections.defaultdict(set)
+  dependencies_from_dependent = collections.defaultdict(set)
   if desugar_dependencies_file and os.path.exists(desugar_dependencies_file):
     with open(desugar_dependencies_file, 'r') as f:
       dependent = None
       for line in f:
         line = line.rstrip()
-        if line.startswith('  <-  '):
-          dependency = line[len('  <-  '):]
-          # Note that this is a reversed mapping from the one in CustomD8.java.
-          dependents_from_dependency[dependency].add(dependent)
+        if line.startswith(_DESUGAR_DEPS_PREFIX):
+          dependency = line[len(_DESUGAR_DEPS_PREFIX):]
+          dependencies_from_dependent[dependent].add(dependency)
         else:
           dependent = line
-  return dependents_from_dependency
+  return dependencies_from_dependent
+
+
+class _DesugarDeps:
+  """The contents of a .desugardeps file, indexed in both directions.
 
+  Parsing the text file is slow for large targets, so both mappings are also
+  stored in a marshal file next to it (<path>.index), which is used as long as
+  the text file is unchanged.
+  """
+
+  def __init__(self, dependencies_from_dependent=None,
+               dependents_from_dependency=None):
+    # Dependent -> dependencies.
+    self._dependencies = dependencies_from_dependent or {}
+    # Dependency -> dependents. Computed lazily.
+    self._dependents = dependents_from_dependency
 
-def _ComputeRequiredDesugarClasses(changes, desugar_dependencies_file,
-                                   class_inputs, classpath):
-  dependents_from_dependency = _ParseDesugarDeps(desugar_dependencies_file)
+  @staticmethod
+  def _IndexPath(path):
+    return path + '.index'
+
+  @classmethod
+  def Load(cls, path):
+    try:
+      st = os.stat(path)
+    except FileNotFoundError:
+      return cls()
+    try:
+      with open(cls._IndexPath(path), 'rb') as f:
+        version, stat_key, dependencies, dependents = marshal.loads(f.read())
+      if (version == _DESUGAR_DEPS_INDEX_VERSION
+          and stat_key == (st.st_size, st.st_mtime_ns)):
+        return cls(dependencies, dependents)
+    except (OSError, EOFError, ValueError, TypeError):
+      pass
+    logging.debug('Parsing %s', path)
+    return cls(_ParseDesugarDeps(path))
+
+  def _GetDependentsDict(self):
+    if self._dependents is None:
+      dependents = collections.defaultdict(list)
+      for dependent in sorted(self._dependencies):
+        for dependency in self._dependencies[dependent]:
+          dependents[dependency].append(dependent)
+      self._dependents = dict(dependents)
+    return self._dependents
+
+  def GetDependents(self, dependency):
+    return self._GetDependentsDict().get(dependency, ())
+
+  def Update(self, other_path):
+    """Adds the dependencies from another .desugardeps file."""
+    for dependent, dependencies in _ParseDesugarDeps(other_path).items():
+      dependencies.update(self._dependencies.get(dependent, ()))
+      self._dependencies[dependent] = dependencies
+    self._dependents = None
+
+  def Write(self, path):
+    lines = []
+    dependencies = {}
+    for dependent in sorted(self._dependencies):
+      dependencies[dependent] = sorted(self._dependencies[dependent])
+      lines.append(dependent + '\n')
+      lines.extend(_DESUGAR_DEPS_PREFIX + d + '\n'
+                   for d in dependencies[dependent])
+    with build_utils.AtomicOutput(path, mode='w') as f:
+      f.writelines(lines)
+    self._dependencies = dependencies
+    self._dependents = None
+    st = os.stat(path)
+    with build_utils.AtomicOutput(self._IndexPath(path)) as f:
+      f.write(
+          marshal.dumps((_DESUGAR_DEPS_INDEX_VERSION,
+                         (st.st_size, st.st_mtime_ns), dependencies,
+                         self._GetDependentsDict())))
+
+
+def _ComputeRequiredDesugarClasses(changes, desugar_deps, class_inputs,
+                                   classpath):
   required_classes = set()
   # Gather classes that need to be re-desugared from changes in the classpath.
   for jar in classpath:
     for subpath in changes.IterChangedSubpaths(jar):
       dependency = '{}:{}'.format(jar, subpath)
-      required_classes.update(dependents_from_dependency[dependency])
+      required_classes.update(desugar_deps.GetDependents(dependency))
 
   for jar in class_inputs:
     for subpath in changes.IterChangedSubpaths(jar):
-      required_classes.update(dependents_from_dependency[subpath])
+      required_classes.update(desugar_deps.GetDependents(subpath))
 
   return required_classes
 
@@ -340,26 +431,109 @@ def _IsClassFile(path):
   return path.endswith('.class')
 
 
-def _ExtractClassFiles(changes, tmp_dir, class_inputs, required_classes_set):
-  classes_list = []
+def _ListClassFilesToDex(changes, class_inputs, required_classes_set):
+  """Returns (jar, zip entry) of each class file that needs to be dexed."""
+  ret = []
+  seen = set()
   for jar in class_inputs:
+    changed_class_set = None
     if changes:
-      changed_class_list = (set(changes.IterChangedSubpaths(jar))
-                            | required_classes_set)
-      predicate = lambda x: x in changed_class_list and _IsClassFile(x)
-    else:
-      predicate = _IsClassFile
+      changed_class_set = (set(changes.IterChangedSubpaths(jar))
+                           | required_classes_set)
+    for entry in build_utils.ReadZipCentralDirectory(jar):
+      subpath = entry[0]
+      if not _IsClassFile(subpath):
+        continue
+      if changed_class_set is not None and subpath not in changed_class_set:
+        continue
+      if subpath in seen:
+        raise Exception('Duplicate class file {} in {}'.format(subpath, jar))
+      seen.add(subpath)
+      ret.append((jar, entry))
+  return ret
+
+
+def _ExtractClassFiles(class_files, extract_dir):
+  """Extracts |class_files| from their jars, reading each jar only once.
 
-    classes_list.extend(
-        build_utils.ExtractAll(jar, path=tmp_dir, predicate=predicate))
-  return classes_list
+  Args:
+    class_files: List of (jar, zip entry), as returned by
+        _ListClassFilesToDex().
+    extract_dir: Directory to extract to.
+  Returns:
+    The extracted paths.
+  """
+  entries_by_jar = collections.defaultdict(list)
+  for jar, entry in class_files:
+    entries_by_jar[jar].append(entry)
+  paths = []
+  made_dirs = set()
+  for jar, entries in entries_by_jar.items():
+    with open(jar, 'rb') as in_file:
+      for entry in entries:
+        path = os.path.join(extract_dir, entry[0])
+        dirname = os.path.dirname(path)
+        if dirname not in made_dirs:
+          os.makedirs(dirname, exist_ok=True)
+          made_dirs.add(dirname)
+        with open(path, 'wb') as f:
+          f.write(build_utils.ReadZipEntry(in_file, entry))
+        paths.append(path)
+  return paths
+
+
+def _SplitIntoChunks(class_files, num_chunks):
+  """Splits |class_files| into up to |num_chunks| lists of similar total size.
+
+  Assigns files from largest to smallest to the chunk with the smallest total
+  size so far.
+  """
+  chunks = [[] for _ in range(num_chunks)]
+  heap = [(0, i) for i in range(num_chunks)]
+  for class_file in sorted(class_files, key=lambda x: x[1][4], reverse=True):
+    size, i = heapq.heappop(heap)
+    chunks[i].append(class_file)
+    heapq.heappush(heap, (size + class_file[1][4], i))
+  return [c for c in chunks if c]
+
+
+def _MaxExtraD8Processes():
+  value = os.environ.get(_EXTRA_D8_PROCESSES_ENV_VARIABLE)
+  if value is None:
+    # Most cores are usually used by other build steps.
+    return (os.cpu_count() or 1) // 4
+  try:
+    return int(value)
+  except ValueError:
+    return 0
+
+
+@contextlib.contextmanager
+def _AcquireExtraD8Slots(max_slots):
+  """Yields the number of extra D8 processes that this invocation may run.
+
+  Each extra process holds a lock file, so that at most
+  _MaxExtraD8Processes() run at a time across all dex.py invocations.
+  """
+  num_slots = _MaxExtraD8Processes()
+  acquired = 0
+  with contextlib.ExitStack() as stack:
+    if max_slots > 0 and num_slots > 0:
+      build_utils.MakeDirectory(_EXTRA_D8_SLOTS_DIR)
+    for slot in range(num_slots):
+      if acquired >= max_slots:
+        break
+      lock_file = stack.enter_context(
+          open(os.path.join(_EXTRA_D8_SLOTS_DIR, '%d.lock' % slot), 'w'))
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        continue
+      acquired += 1
+    yield acquired
 
 
 def _CreateIntermediateDexFiles(changes, options, tmp_dir, dex_cmd):
-  # Create temporary directory for classes to be extracted to.
-  tmp_extract_dir = os.path.join(tmp_dir, 'tmp_extract_dir')
-  os.mkdir(tmp_extract_dir)
-
   # Do a full rebuild when changes occur in non-input files.
   allowed_changed = set(options.class_inputs)
   allowed_changed.update(options.dex_inputs)
@@ -373,35 +547,61 @@ def _CreateIntermediateDexFiles(changes, options, tmp_dir, dex_cmd):
                   strings_changed, non_direct_input_changed)
     changes = None
 
-  if changes is None:
+  if changes is None or not options.desugar_dependencies:
+    # Since incremental dexing only ever adds to the desugar dependencies,
+    # whenever full dexes are required they are recomputed from scratch.
+    desugar_deps = _DesugarDeps()
     required_desugar_classes_set = set()
   else:
+    desugar_deps = _DesugarDeps.Load(options.desugar_dependencies)
     required_desugar_classes_set = _ComputeRequiredDesugarClasses(
-        changes, options.desugar_dependencies, options.class_inputs,
-        options.classpath)
+        changes, desugar_deps, options.class_inputs, options.classpath)
     logging.debug('Class files needing re-desugar: %d',
                   len(required_desugar_classes_set))
-  class_files = _ExtractClassFiles(changes, tmp_extract_dir,
-                                   options.class_inputs,
-                                   required_desugar_classes_set)
-  logging.debug('Extracted class files: %d', len(class_files))
+  class_files = _ListClassFilesToDex(changes, options.class_inputs,
+                                     required_desugar_classes_set)
+  logging.debug('Class files to dex: %d', len(class_files))
 
   # If the only change is deleting a file, class_files will be empty.
-  if class_files:
-    # Dex necessary classes into intermediate dex files.
-    dex_cmd = dex_cmd + ['--intermediate', '--file-per-class-file']
-    if options.desugar_dependencies and not options.skip_custom_d8:
-      # Adding os.sep to remove the entire prefix.
-      dex_cmd += ['--file-tmp-prefix', tmp_extract_dir + os.sep]
-      if changes is None and os.path.exists(options.desugar_dependencies):
-        # Since incremental dexing only ever adds to the desugar_dependencies
-        # file, whenever full dexes are required the .desugardeps files need to
-        # be manually removed.
-        os.unlink(options.desugar_dependencies)
-    _RunD8(dex_cmd, class_files, options.incremental_dir,
-           options.warnings_as_errors,
-           options.show_desugar_default_interface_warnings)
-    logging.debug('Dexed class files.')
+  if not class_files:
+    return
+
+  # Dex necessary classes into intermediate dex files. Large sets of classes
+  # are split into chunks that are dexed by concurrent D8 processes.
+  dex_cmd = dex_cmd + ['--intermediate', '--file-per-class-file']
+  max_extra_processes = len(class_files) // _MIN_CLASSES_PER_D8 - 1
+  with _AcquireExtraD8Slots(max_extra_processes) as num_extra_processes:
+    chunks = _SplitIntoChunks(class_files, num_extra_processes + 1)
+    logging.debug('Dexing in %d chunks', len(chunks))
+
+    def dex_chunk(extract_dir, chunk_paths):
+      chunk_cmd = dex_cmd
+      desugar_deps_path = None
+      if options.desugar_dependencies:
+        desugar_deps_path = extract_dir + '.desugardeps'
+        chunk_cmd = chunk_cmd + ['--desugar-dependencies', desugar_deps_path]
+        # Adding os.sep to remove the entire prefix.
+        chunk_cmd += ['--file-tmp-prefix', extract_dir + os.sep]
+      _RunD8(chunk_cmd, chunk_paths, options.incremental_dir,
+             options.warnings_as_errors,
+             options.show_desugar_default_interface_warnings)
+      return desugar_deps_path
+
+    with concurrent.futures.ThreadPoolExecutor(len(chunks)) as executor:
+      futures = []
+      for index, chunk in enumerate(chunks):
+        # Extracting is I/O bound, so chunks are extracted one at a time while
+        # previous chunks are being dexed.
+        extract_dir = os.path.join(tmp_dir, 'tmp_extract_dir{}'.format(index))
+        chunk_paths = _ExtractClassFiles(chunk, extract_dir)
+        futures.append(executor.submit(dex_chunk, extract_dir, chunk_paths))
+      desugar_deps_paths = [f.result() for f in futures]
+  logging.debug('Dexed class files.')
+
+  if options.desugar_dependencies:
+    for path in desugar_deps_paths:
+      desugar_deps.Update(path)
+    desugar_deps.Write(options.desugar_dependencies)
 
 
 def _OnStaleMd5(changes, options, final_dex_inputs, dex_cmd):
@@ -439,6 +639,9 @@ def main(args):
 
   options.class_inputs += options.class_inputs_filearg
   options.dex_inputs += options.dex_inputs_filearg
+  if not (options.desugar and options.classpath and not options.skip_custom_d8):
+    # Only CustomD8 records desugar dependencies, and only when desugaring.
+    options.desugar_dependencies = None
 
   input_paths = options.class_inputs + options.dex_inputs
   input_paths.append(options.r8_jar_path)
@@ -487,10 +690,13 @@ def main(args):
     dex_cmd += ['--no-desugaring']
   elif options.classpath:
     # The classpath is used by D8 to for interface desugaring.
-    if options.desugar_dependencies and not options.skip_custom_d8:
-      dex_cmd += ['--desugar-dependencies', options.desugar_dependencies]
-      if track_subpaths_allowlist:
+    if options.desugar_dependencies:
+      if options.incremental_dir:
+        # Each D8 process records dependencies of the classes it dexes, which
+        # are then merged. See _CreateIntermediateDexFiles().
         track_subpaths_allowlist += options.classpath
+      else:
+        dex_cmd += ['--desugar-dependencies', options.desugar_dependencies]
     depfile_deps += options.classpath
     input_paths += options.classpath
     # Still pass the entire classpath in case a new dependency is needed by
@@ -518,7 +724,10 @@ def main(args):
       lambda changes: _OnStaleMd5(changes, options, final_dex_inputs, dex_cmd),
       options,
       input_paths=input_paths,
-      input_strings=dex_cmd + [str(bool(options.incremental_dir))],
+      input_strings=dex_cmd + [
+          str(bool(options.incremental_dir)),
+          str(options.desugar_dependencies)
+      ],
       output_paths=output_paths,
       pass_changes=True,
       track_subpaths_allowlist=track_subpaths_allowlist,
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks intermediate dexing of dex.py using a fake D8.
+
+The fake D8 sleeps for a fixed startup time plus a time per class file, and
+writes an empty .dex file and a desugar dependency per class file. This
+measures the overhead of dex.py itself and the effect of splitting the classes
+into chunks, assuming that D8 processes are not starved of cores.
+
+Run with:
+  build/android/gyp/dex_benchmark.py [--num-classes N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import zipfile
+
+import dex
+from util import build_utils
+
+_FAKE_D8 = """\
+import os
+import sys
+import time
+
+args = []
+for arg in sys.argv[1:]:
+  if arg.startswith('@'):
+    with open(arg[1:]) as f:
+      args += f.read().splitlines()
+  else:
+    args.append(arg)
+output = args[args.index('--output') + 1]
+deps_path = args[args.index('--desugar-dependencies') + 1]
+prefix = args[args.index('--file-tmp-prefix') + 1]
+inputs = [a for a in args if a.endswith('.class')]
+time.sleep({startup_seconds} + {seconds_per_class} * len(inputs))
+with open(deps_path, 'w') as deps_file:
+  for path in inputs:
+    subpath = path[len(prefix):]
+    dex_path = os.path.join(output, subpath[:-len('class')] + 'dex')
+    os.makedirs(os.path.dirname(dex_path), exist_ok=True)
+    open(dex_path, 'wb').close()
+    deps_file.write(subpath + '\\n  <-  org/chromium/Iface.class\\n')
+"""
+
+
+class _FullRebuild:
+  """Stands in for md5_check.Changes when everything needs to be rebuilt."""
+
+  def HasStringChanges(self):
+    return True
+
+  def IterChangedPaths(self):
+    return iter(())
+
+
+def _CreateSyntheticJar(path, num_classes):
+  with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+    for i in range(num_classes):
+      name = 'org/chromium/pkg%d/Class%d.class' % (i % 100, i)
+      # Sizes vary so that chunks need balancing.
+      z.writestr(name, b'\xca\xfe\xba\xbe' * (10 + i % 500))
+
+
+def _Report(name, func, repeat):
+  times = timeit.repeat(func, number=1, repeat=repeat)
+  print('{:<40} min={:.0f}ms'.format(name, min(times) * 1000))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num-classes', type=int, default=20000)
+  parser.add_argument('--extra-processes', type=int, default=3)
+  parser.add_argument('--startup-seconds', type=float, default=1.0)
+  parser.add_argument('--seconds-per-class', type=float, default=0.0002)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  with build_utils.TempDir() as tmp_dir:
+    fake_d8_path = os.path.join(tmp_dir, 'fake_d8.py')
+    with open(fake_d8_path, 'w') as f:
+      f.write(
+          _FAKE_D8.format(startup_seconds=args.startup_seconds,
+                          seconds_per_class=args.seconds_per_class))
+    jar_path = os.path.join(tmp_dir, 'classes.jar')
+    _CreateSyntheticJar(jar_path, args.num_classes)
+    print('Synthetic jar with {} classes'.format(args.num_classes))
+
+    options = argparse.Namespace(
+        class_inputs=[jar_path],
+        dex_inputs=[],
+        classpath=[],
+        incremental_dir=os.path.join(tmp_dir, 'dex'),
+        desugar_dependencies=os.path.join(tmp_dir, 'classes.desugardeps'),
+        warnings_as_errors=False,
+        show_desugar_default_interface_warnings=False)
+
+    def create_intermediate_dex_files(extra_processes):
+      os.environ[dex._EXTRA_D8_PROCESSES_ENV_VARIABLE] = str(extra_processes)
+      with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        dex._CreateIntermediateDexFiles(_FullRebuild(), options, work_dir,
+                                        [sys.executable, fake_d8_path])
+
+    for extra_processes in sorted({0, args.extra_processes}):
+      _Report('{} extra D8 processes'.format(extra_processes),
+              lambda n=extra_processes: create_intermediate_dex_files(n),
+              args.repeat)
+
+    def parse_desugar_deps():
+      return dex._DesugarDeps(dex._ParseDesugarDeps(
+          options.desugar_dependencies)).GetDependents('')
+
+    def load_desugar_deps():
+      return dex._DesugarDeps.Load(options.desugar_dependencies).GetDependents(
+          '')
+
+    _Report('Parse .desugardeps', parse_desugar_deps, args.repeat)
+    _Report('Load .desugardeps index', load_desugar_deps, args.repeat)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -3,9 +3,22 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import os
 import unittest
+import zipfile
 
 import dex
+from util import build_utils
+
+# pylint: disable=line-too-long
+_DESUGAR_DEPS = """\
+org/chromium/Impl.class
+  <-  org/chromium/Iface.class
+  <-  obj/base.jar:org/chromium/Base.class
+org/chromium/Other.class
+  <-  org/chromium/Iface.class
+"""
+# pylint: enable=line-too-long
 
 
 class DexTest(unittest.TestCase):
@@ -45,6 +58,68 @@ Warning: Specification conversion: The following prefixes do not ...
     expected = ''
     self.assertEqual(filter_func(output), expected)
 
+  def testDesugarDeps(self):
+    with build_utils.TempDir() as tmp_dir:
+      path = os.path.join(tmp_dir, 'foo.desugardeps')
+      with open(path, 'w') as f:
+        f.write(_DESUGAR_DEPS)
+      desugar_deps = dex._DesugarDeps.Load(path)
+      self.assertEqual(['org/chromium/Impl.class', 'org/chromium/Other.class'],
+                       sorted(desugar_deps.GetDependents(
+                           'org/chromium/Iface.class')))
+
+      update_path = os.path.join(tmp_dir, 'update.desugardeps')
+      with open(update_path, 'w') as f:
+        f.write('org/chromium/Other.class\n  <-  org/chromium/Base2.class\n')
+      desugar_deps.Update(update_path)
+      desugar_deps.Write(path)
+      self.assertEqual(['org/chromium/Other.class'],
+                       list(desugar_deps.GetDependents(
+                           'org/chromium/Base2.class')))
+
+      # Loads from the index, which matches the text file.
+      os.unlink(update_path)
+      loaded = dex._DesugarDeps.Load(path)
+      self.assertEqual(['org/chromium/Other.class'],
+                       list(loaded.GetDependents('org/chromium/Base2.class')))
+      self.assertEqual(
+          {
+              'org/chromium/Impl.class': {
+                  'org/chromium/Iface.class',
+                  'obj/base.jar:org/chromium/Base.class',
+              },
+              'org/chromium/Other.class':
+              {'org/chromium/Iface.class', 'org/chromium/Base2.class'},
+          }, dex._ParseDesugarDeps(path))
+
+  def testSplitIntoChunks(self):
+    class_files = [('a.jar', ('C%d.class' % i, 0, 0, 0, size, 0, 0))
+                   for i, size in enumerate([5, 1, 4, 2, 3, 3])]
+    chunks = dex._SplitIntoChunks(class_files, 3)
+    self.assertEqual(3, len(chunks))
+    self.assertEqual([6, 6, 6], [sum(e[4] for _, e in c) for c in chunks])
+    self.assertEqual(1, len(dex._SplitIntoChunks(class_files[:1], 3)))
+
+  def testExtractClassFiles(self):
+    with build_utils.TempDir() as tmp_dir:
+      jar_path = os.path.join(tmp_dir, 'a.jar')
+      with zipfile.ZipFile(jar_path, 'w') as z:
+        z.writestr('org/A.class', b'a' * 100, zipfile.ZIP_DEFLATED)
+        z.writestr('org/B.class', b'b')
+        z.writestr('org/', b'')
+        z.writestr('module-info.class', b'm')
+      class_files = dex._ListClassFilesToDex(None, [jar_path], set())
+      self.assertEqual(['org/A.class', 'org/B.class'],
+                       [e[0] for _, e in class_files])
+      extract_dir = os.path.join(tmp_dir, 'extracted')
+      paths = dex._ExtractClassFiles(class_files, extract_dir)
+      self.assertEqual([
+          os.path.join(extract_dir, 'org', 'A.class'),
+          os.path.join(extract_dir, 'org', 'B.class')
+      ], paths)
+      with open(paths[0], 'rb') as f:
+        self.assertEqual(b'a' * 100, f.read())
+
 
 if __name__ == '__main__':
   unittest.main()
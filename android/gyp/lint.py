@@ -8,6 +8,10 @@
 from __future__ import print_function
 
 import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
 import os
 import shutil
@@ -63,6 +67,13 @@ _DISABLED_FOR_TESTS = [
 _RES_ZIP_DIR = 'RESZIPS'
 _SRCJAR_DIR = 'SRCJARS'
 _AAR_DIR = 'AARS'
+_PARTIAL_RESULTS_DIR = 'PARTIAL'
+
+# Sharding targets with fewer sources than this per shard is not worth the
+# overhead of another lint JVM.
+_MIN_SOURCES_PER_SHARD = 200
+# Bump to discard partial results of previous versions of this script.
+_PARTIAL_RESULTS_VERSION = 1
 
 
 def _SrcRelative(path):
@@ -70,17 +81,7 @@ def _SrcRelative(path):
   return os.path.relpath(path, build_utils.DIR_SOURCE_ROOT)
 
 
-def _GenerateProjectFile(android_manifest,
-                         android_sdk_root,
-                         cache_dir,
-                         sources=None,
-                         classpath=None,
-                         srcjar_sources=None,
-                         resource_sources=None,
-                         custom_lint_jars=None,
-                         custom_annotation_zips=None,
-                         android_sdk_version=None,
-                         baseline_path=None):
+def _GenerateProjectRoot(android_sdk_root, cache_dir, baseline_path=None):
   project = ElementTree.Element('project')
   root = ElementTree.SubElement(project, 'root')
   # Run lint from output directory: crbug.com/1115594
@@ -93,38 +94,113 @@ def _GenerateProjectFile(android_manifest,
     baseline.set('file', baseline_path)
   cache = ElementTree.SubElement(project, 'cache')
   cache.set('dir', cache_dir)
-  main_module = ElementTree.SubElement(project, 'module')
-  main_module.set('name', 'main')
-  main_module.set('android', 'true')
-  main_module.set('library', 'false')
+  return project
+
+
+def _GenerateModule(project,
+                    name,
+                    android_manifest,
+                    library=False,
+                    sources=None,
+                    classpath=None,
+                    resource_sources=None,
+                    custom_lint_jars=None,
+                    custom_annotation_zips=None,
+                    android_sdk_version=None,
+                    partial_results_dir=None):
+  module = ElementTree.SubElement(project, 'module')
+  module.set('name', name)
+  module.set('android', 'true')
+  module.set('library', 'true' if library else 'false')
   if android_sdk_version:
-    main_module.set('compile_sdk_version', android_sdk_version)
-  manifest = ElementTree.SubElement(main_module, 'manifest')
+    module.set('compile_sdk_version', android_sdk_version)
+  if partial_results_dir:
+    module.set('partial-results-dir', partial_results_dir)
+  manifest = ElementTree.SubElement(module, 'manifest')
   manifest.set('file', android_manifest)
-  if srcjar_sources:
-    for srcjar_file in srcjar_sources:
-      src = ElementTree.SubElement(main_module, 'src')
-      src.set('file', srcjar_file)
   if sources:
     for source in sources:
-      src = ElementTree.SubElement(main_module, 'src')
+      src = ElementTree.SubElement(module, 'src')
       src.set('file', source)
   if classpath:
     for file_path in classpath:
-      classpath_element = ElementTree.SubElement(main_module, 'classpath')
+      classpath_element = ElementTree.SubElement(module, 'classpath')
       classpath_element.set('file', file_path)
   if resource_sources:
     for resource_file in resource_sources:
-      resource = ElementTree.SubElement(main_module, 'resource')
+      resource = ElementTree.SubElement(module, 'resource')
       resource.set('file', resource_file)
   if custom_lint_jars:
     for lint_jar in custom_lint_jars:
-      lint = ElementTree.SubElement(main_module, 'lint-checks')
+      lint = ElementTree.SubElement(module, 'lint-checks')
       lint.set('file', lint_jar)
   if custom_annotation_zips:
     for annotation_zip in custom_annotation_zips:
-      annotation = ElementTree.SubElement(main_module, 'annotations')
+      annotation = ElementTree.SubElement(module, 'annotations')
       annotation.set('file', annotation_zip)
+  return module
+
+
+def _GenerateShardModule(project, shard_module, classpath, custom_lint_jars,
+                         custom_annotation_zips, android_sdk_version):
+  name, sources, android_manifest, partial_results_dir = shard_module
+  return _GenerateModule(project,
+                         name,
+                         android_manifest,
+                         library=True,
+                         sources=sources,
+                         classpath=classpath,
+                         custom_lint_jars=custom_lint_jars,
+                         custom_annotation_zips=custom_annotation_zips,
+                         android_sdk_version=android_sdk_version,
+                         partial_results_dir=partial_results_dir)
+
+
+def _GenerateProjectFile(android_manifest,
+                         android_sdk_root,
+                         cache_dir,
+                         sources=None,
+                         classpath=None,
+                         srcjar_sources=None,
+                         resource_sources=None,
+                         custom_lint_jars=None,
+                         custom_annotation_zips=None,
+                         android_sdk_version=None,
+                         baseline_path=None,
+                         partial_results_dir=None,
+                         shard_modules=None,
+                         shard_classpath=None):
+  """Returns the project.xml tree.
+
+  Args:
+    partial_results_dir: Where the results of --analyze-only runs of the main
+        module are stored.
+    shard_modules: Optional list of (name, sources, manifest,
+        partial_results_dir) of library modules that the main module depends
+        on.
+    shard_classpath: Classpath of |shard_modules|.
+  """
+  project = _GenerateProjectRoot(android_sdk_root, cache_dir, baseline_path)
+  if shard_modules:
+    for shard_module in shard_modules:
+      _GenerateShardModule(project, shard_module, shard_classpath,
+                           custom_lint_jars, custom_annotation_zips,
+                           android_sdk_version)
+  main_sources = (srcjar_sources or []) + (sources or [])
+  main_module = _GenerateModule(project,
+                                'main',
+                                android_manifest,
+                                sources=main_sources,
+                                classpath=classpath,
+                                resource_sources=resource_sources,
+                                custom_lint_jars=custom_lint_jars,
+                                custom_annotation_zips=custom_annotation_zips,
+                                android_sdk_version=android_sdk_version,
+                                partial_results_dir=partial_results_dir)
+  if shard_modules:
+    for shard_module in shard_modules:
+      dep = ElementTree.SubElement(main_module, 'dep')
+      dep.set('module', shard_module[0])
   return project
 
 
@@ -177,6 +253,133 @@ def _GenerateAndroidManifest(original_manifest_path, extra_manifest_paths,
   return doc
 
 
+def _GenerateLibraryManifest(android_manifest_tree):
+  """Returns a manifest with only the package and <uses-sdk> of the app's."""
+  manifest = android_manifest_tree.getroot()
+  root = ElementTree.Element('manifest')
+  root.set('package', manifest_utils.GetPackage(manifest))
+  root.append(manifest.find('./uses-sdk'))
+  return root
+
+
+def _ShardSources(sources, num_shards):
+  """Splits |sources| into at most |num_shards| named shards.
+
+  Sources are assigned by directory, so that the shard of a source does not
+  depend on other sources. This keeps the partial results of shards whose
+  sources did not change valid.
+  """
+  num_shards = min(num_shards, len(sources) // _MIN_SOURCES_PER_SHARD)
+  if num_shards < 2:
+    return []
+  shards = collections.defaultdict(list)
+  for source in sources:
+    digest = hashlib.md5(os.path.dirname(source).encode('utf-8')).digest()
+    index = int.from_bytes(digest[:4], 'little') % num_shards
+    shards['shard{}'.format(index)].append(source)
+  return sorted(shards.items())
+
+
+def _ComputeDigest(strings=(), content_paths=(), stat_paths=()):
+  """Returns a digest of |strings| and files.
+
+  Args:
+    content_paths: Files to hash the contents of.
+    stat_paths: Files to hash the size and mtime of. Used for large files
+        which are rewritten only when they change (e.g. classpath jars).
+  """
+  md5 = hashlib.md5()
+  md5.update(str(_PARTIAL_RESULTS_VERSION).encode('utf-8'))
+  for string in strings:
+    md5.update(b'\0' + string.encode('utf-8'))
+  for path in content_paths:
+    md5.update(b'\0' + path.encode('utf-8') + b'\0')
+    with open(path, 'rb') as f:
+      md5.update(f.read())
+  for path in stat_paths:
+    st = os.stat(path)
+    md5.update('\0{}\0{}\0{}'.format(path, st.st_size,
+                                     st.st_mtime_ns).encode('utf-8'))
+  return md5.hexdigest()
+
+
+def _ExtractIfChanged(zip_path, extract_dir, incremental):
+  """Extracts |zip_path| into a clean |extract_dir|.
+
+  Args:
+    incremental: Whether to reuse the previous extraction if |zip_path| is
+        unchanged since.
+  Returns:
+    The extracted paths.
+  """
+  stamp_path = extract_dir + '.extracted.json'
+  if incremental and os.path.exists(stamp_path):
+    with open(stamp_path) as f:
+      stamp = json.load(f)
+    if (stamp['digest'] == _ComputeDigest(stat_paths=[zip_path])
+        and os.path.isdir(extract_dir)):
+      return stamp['paths']
+  shutil.rmtree(extract_dir, True)
+  os.makedirs(extract_dir)
+  paths = build_utils.ExtractAll(zip_path, path=extract_dir)
+  if incremental:
+    with build_utils.AtomicOutput(stamp_path, mode='w') as f:
+      json.dump({
+          'digest': _ComputeDigest(stat_paths=[zip_path]),
+          'paths': paths
+      }, f)
+  return paths
+
+
+def _AnalyzeModules(modules, lint_gen_dir, build_cmd, run_lint):
+  """Runs lint --analyze-only for modules whose partial results are stale.
+
+  Args:
+    modules: List of (name, digest, project_root) for each module, where
+        project_root is a project.xml tree containing only that module. Its
+        partial results directory must be lint_gen_dir/PARTIAL/<name>.
+    lint_gen_dir: Directory containing the project.xml files.
+    build_cmd: Function that returns the lint command for a number of
+        parallel runs.
+    run_lint: Function that runs a lint command.
+  """
+  partial_results_root = os.path.join(lint_gen_dir, _PARTIAL_RESULTS_DIR)
+  build_utils.MakeDirectory(partial_results_root)
+  stale_modules = []
+  for name, digest, project_root in modules:
+    digest_path = os.path.join(partial_results_root, name + '.md5')
+    if os.path.exists(digest_path):
+      with open(digest_path) as f:
+        if f.read() == digest:
+          continue
+      # Invalidate before analyzing, in case lint fails.
+      os.unlink(digest_path)
+    stale_modules.append((name, digest, digest_path, project_root))
+  logging.info('Analyzing %d of %d lint modules', len(stale_modules),
+               len(modules))
+  if not stale_modules:
+    return
+
+  cmd = build_cmd(len(stale_modules))
+
+  def analyze(module):
+    name, digest, digest_path, project_root = module
+    results_dir = os.path.join(partial_results_root, name)
+    shutil.rmtree(results_dir, ignore_errors=True)
+    os.makedirs(results_dir)
+    project_xml_path = os.path.join(lint_gen_dir, 'project_{}.xml'.format(name))
+    _WriteXmlFile(project_root, project_xml_path)
+    run_lint(cmd + ['--analyze-only', '--project', project_xml_path])
+    os.unlink(project_xml_path)
+    with build_utils.AtomicOutput(digest_path, mode='w') as f:
+      f.write(digest)
+
+  with concurrent.futures.ThreadPoolExecutor(len(stale_modules)) as executor:
+    # Re-raises the first failure.
+    for _ in executor.map(analyze, stale_modules):
+      pass
+
+
 def _WriteXmlFile(root, path):
   logging.info('Writing xml file %s', path)
   build_utils.MakeDirectory(os.path.dirname(path))
@@ -208,7 +411,9 @@ def _RunLint(create_cache,
              lint_gen_dir,
              baseline,
              testonly_target=False,
-             warnings_as_errors=False):
+             warnings_as_errors=False,
+             num_shards=1,
+             header_jars=None):
   logging.info('Lint starting')
 
   if create_cache:
@@ -235,7 +440,7 @@ def _RunLint(create_cache,
   pathvar_src = os.path.join(
       root_path, os.path.relpath(build_utils.DIR_SOURCE_ROOT, start=root_path))
 
-  cmd = build_utils.JavaCmd(xmx=lint_xmx) + [
+  lint_args = [
       '-cp',
       '{}:{}'.format(lint_jar_path, custom_lint_jar_path),
       'org.chromium.build.CustomLint',
@@ -252,7 +457,7 @@ def _RunLint(create_cache,
   ]
 
   if testonly_target:
-    cmd.extend(['--disable', ','.join(_DISABLED_FOR_TESTS)])
+    lint_args.extend(['--disable', ','.join(_DISABLED_FOR_TESTS)])
 
   if not manifest_path:
     manifest_path = os.path.join(build_utils.DIR_SOURCE_ROOT, 'build',
@@ -263,7 +468,24 @@ def _RunLint(create_cache,
   config_xml_node = _GenerateConfigXmlTree(config_path, backported_methods)
   generated_config_path = os.path.join(lint_gen_dir, 'config.xml')
   _WriteXmlFile(config_xml_node, generated_config_path)
-  cmd.extend(['--config', generated_config_path])
+  lint_args.extend(['--config', generated_config_path])
+
+  def build_cmd(num_parallel_runs):
+    # Parallel runs each analyze only part of the target.
+    xmx = lint_xmx if num_parallel_runs == 1 else '1G'
+    return build_utils.JavaCmd(xmx=xmx) + lint_args
+
+  cmd = build_cmd(1)
+
+  # Large targets are analyzed as several modules using lint's partial analysis
+  # (--analyze-only), in parallel. The partial results of a module are reused
+  # until its inputs change, and a final --report-only run merges them.
+  shards = []
+  if (not create_cache and not creating_baseline and num_shards > 1
+      and header_jars):
+    shards = _ShardSources(sources, num_shards)
+  incremental = bool(shards)
+  input_resource_sources = list(resource_sources)
 
   logging.info('Generating Android manifest file')
   android_manifest_tree = _GenerateAndroidManifest(manifest_path,
@@ -282,10 +504,8 @@ def _RunLint(create_cache,
     # Use a consistent root and name rather than a temporary file so that
     # suppressions can be local to the lint target and the resource target.
     resource_dir = os.path.join(resource_root_dir, resource_zip)
-    shutil.rmtree(resource_dir, True)
-    os.makedirs(resource_dir)
     resource_sources.extend(
-        build_utils.ExtractAll(resource_zip, path=resource_dir))
+        _ExtractIfChanged(resource_zip, resource_dir, incremental))
 
   logging.info('Extracting aars')
   aar_root_dir = os.path.join(lint_gen_dir, _AAR_DIR)
@@ -296,9 +516,7 @@ def _RunLint(create_cache,
       # Use relative source for aar files since they are not generated.
       aar_dir = os.path.join(aar_root_dir,
                              os.path.splitext(_SrcRelative(aar))[0])
-      shutil.rmtree(aar_dir, True)
-      os.makedirs(aar_dir)
-      aar_files = build_utils.ExtractAll(aar, path=aar_dir)
+      aar_files = _ExtractIfChanged(aar, aar_dir, incremental)
       for f in aar_files:
         if f.endswith('lint.jar'):
           custom_lint_jars.append(f)
@@ -313,30 +531,106 @@ def _RunLint(create_cache,
       # Use path without extensions since otherwise the file name includes
       # .srcjar and lint treats it as a srcjar.
       srcjar_dir = os.path.join(srcjar_root_dir, os.path.splitext(srcjar)[0])
-      shutil.rmtree(srcjar_dir, True)
-      os.makedirs(srcjar_dir)
       # Sadly lint's srcjar support is broken since it only considers the first
       # srcjar. Until we roll a lint version with that fixed, we need to extract
       # it ourselves.
-      srcjar_sources.extend(build_utils.ExtractAll(srcjar, path=srcjar_dir))
+      srcjar_sources.extend(
+          _ExtractIfChanged(srcjar, srcjar_dir, incremental))
+
+  # This filter is necessary for JDK11.
+  stderr_filter = build_utils.FilterReflectiveAccessJavaWarnings
+  stdout_filter = lambda x: build_utils.FilterLines(x, 'No issues found')
+
+  start = time.time()
+  main_results_dir = None
+  shard_modules = None
+  shard_classpath = None
+  if shards:
+    partial_results_root = os.path.join(lint_gen_dir, _PARTIAL_RESULTS_DIR)
+    library_manifest_path = os.path.join(lint_gen_dir,
+                                         'LibraryAndroidManifest.xml')
+    _WriteXmlFile(_GenerateLibraryManifest(android_manifest_tree),
+                  library_manifest_path)
+    main_results_dir = os.path.join(partial_results_root, 'main')
+    # Sources of a shard may refer to classes from any other shard or from
+    # srcjars, which are resolved from the header jars of the linted sources.
+    shard_classpath = classpath + [j for j in header_jars if j not in classpath]
+    shard_modules = [(name, shard_sources, library_manifest_path,
+                      os.path.join(partial_results_root, name))
+                     for name, shard_sources in shards]
+
+    # Inputs common to all modules. Jars are rewritten only when they change.
+    # The header jars of the linted sources are left out, since any signature
+    # change in one shard would otherwise invalidate all of them. Issues that
+    # depend on another shard's signatures (e.g. its @IntDef annotations) are
+    # thus found only once the shard's own inputs change.
+    common_strings = lint_args + [android_sdk_root, str(android_sdk_version)]
+    dep_jars = [j for j in classpath if j not in header_jars]
+    common_stat_paths = ([lint_jar_path, custom_lint_jar_path] + dep_jars +
+                         (aars or []))
+    modules = []
+    for shard_module in shard_modules:
+      project_root = _GenerateProjectRoot(android_sdk_root, cache_dir)
+      _GenerateShardModule(project_root, shard_module, shard_classpath,
+                           custom_lint_jars, custom_annotation_zips,
+                           android_sdk_version)
+      digest = _ComputeDigest(
+          strings=common_strings + [shard_module[0]],
+          content_paths=[generated_config_path, library_manifest_path] +
+          shard_module[1],
+          stat_paths=common_stat_paths)
+      modules.append((shard_module[0], digest, project_root))
+    main_project_root = _GenerateProjectFile(
+        lint_android_manifest_path,
+        android_sdk_root,
+        cache_dir,
+        classpath=classpath,
+        srcjar_sources=srcjar_sources,
+        resource_sources=resource_sources,
+        custom_lint_jars=custom_lint_jars,
+        custom_annotation_zips=custom_annotation_zips,
+        android_sdk_version=android_sdk_version,
+        partial_results_dir=main_results_dir)
+    main_digest = _ComputeDigest(
+        strings=common_strings,
+        content_paths=[generated_config_path, lint_android_manifest_path] +
+        input_resource_sources,
+        stat_paths=common_stat_paths + (srcjars or []) + resource_zips)
+    modules.append(('main', main_digest, main_project_root))
+
+    def run_analysis(analysis_cmd):
+      build_utils.CheckOutput(analysis_cmd,
+                              print_stdout=True,
+                              stdout_filter=stdout_filter,
+                              stderr_filter=stderr_filter,
+                              fail_on_output=warnings_as_errors)
+
+    _AnalyzeModules(modules, lint_gen_dir, build_cmd, run_analysis)
+    logging.info('Analysis took %ss', time.time() - start)
+    cmd += ['--report-only']
 
   logging.info('Generating project file')
-  project_file_root = _GenerateProjectFile(lint_android_manifest_path,
-                                           android_sdk_root, cache_dir, sources,
-                                           classpath, srcjar_sources,
-                                           resource_sources, custom_lint_jars,
-                                           custom_annotation_zips,
-                                           android_sdk_version, baseline)
+  # When sharded, the main module's sources are in |shard_modules|.
+  project_file_root = _GenerateProjectFile(
+      lint_android_manifest_path,
+      android_sdk_root,
+      cache_dir,
+      sources=None if shards else sources,
+      classpath=classpath,
+      srcjar_sources=srcjar_sources,
+      resource_sources=resource_sources,
+      custom_lint_jars=custom_lint_jars,
+      custom_annotation_zips=custom_annotation_zips,
+      android_sdk_version=android_sdk_version,
+      baseline_path=baseline,
+      partial_results_dir=main_results_dir,
+      shard_modules=shard_modules,
+      shard_classpath=shard_classpath)
 
   project_xml_path = os.path.join(lint_gen_dir, 'project.xml')
   _WriteXmlFile(project_file_root, project_xml_path)
   cmd += ['--project', project_xml_path]
 
-  # This filter is necessary for JDK11.
-  stderr_filter = build_utils.FilterReflectiveAccessJavaWarnings
-  stdout_filter = lambda x: build_utils.FilterLines(x, 'No issues found')
-
-  start = time.time()
   logging.debug('Lint command %s', ' '.join(cmd))
   failed = True
 
@@ -369,9 +663,11 @@ def _RunLint(create_cache,
     end = time.time() - start
     logging.info('Lint command took %ss', end)
     if not is_debug:
-      shutil.rmtree(aar_root_dir, ignore_errors=True)
-      shutil.rmtree(resource_root_dir, ignore_errors=True)
-      shutil.rmtree(srcjar_root_dir, ignore_errors=True)
+      # Extracted files are reused by incremental runs.
+      if not incremental:
+        shutil.rmtree(aar_root_dir, ignore_errors=True)
+        shutil.rmtree(resource_root_dir, ignore_errors=True)
+        shutil.rmtree(srcjar_root_dir, ignore_errors=True)
       os.unlink(project_xml_path)
 
   logging.info('Lint completed')
@@ -449,6 +745,16 @@ def _ParseArgs(argv):
   parser.add_argument('--baseline',
                       help='Baseline file to ignore existing errors and fail '
                       'on new errors.')
+  parser.add_argument('--num-shards',
+                      type=int,
+                      default=1,
+                      help='Maximum number of shards to analyze the java '
+                      'sources of large targets in, in parallel. Analysis of '
+                      'shards whose inputs did not change is reused.')
+  parser.add_argument('--header-jars',
+                      help='List of the header jars of the linted java '
+                      'sources, which shards are analyzed against. Required '
+                      'for --num-shards.')
 
   args = parser.parse_args(build_utils.ExpandFileArgs(argv))
   args.java_sources = build_utils.ParseGnList(args.java_sources)
@@ -458,6 +764,7 @@ def _ParseArgs(argv):
   args.extra_manifest_paths = build_utils.ParseGnList(args.extra_manifest_paths)
   args.resource_zips = build_utils.ParseGnList(args.resource_zips)
   args.classpath = build_utils.ParseGnList(args.classpath)
+  args.header_jars = build_utils.ParseGnList(args.header_jars)
 
   if args.baseline:
     assert os.path.basename(args.baseline) == 'lint-baseline.xml', (
@@ -491,7 +798,7 @@ def main():
     resource_sources.extend(build_utils.ReadSourcesList(resource_sources_file))
 
   possible_depfile_deps = (args.srcjars + args.resource_zips + sources +
-                           resource_sources + [
+                           resource_sources + args.header_jars + [
                                args.baseline,
                                args.manifest_path,
                            ])
@@ -517,7 +824,9 @@ def main():
            args.lint_gen_dir,
            args.baseline,
            testonly_target=args.testonly,
-           warnings_as_errors=args.warnings_as_errors)
+           warnings_as_errors=args.warnings_as_errors,
+           num_shards=args.num_shards,
+           header_jars=args.header_jars)
   logging.info('Creating stamp file')
   build_utils.Touch(args.stamp)
 
@@ -12,6 +12,7 @@ import time
 
 import javac_output_processor
 from util import build_utils
+from util import persistent_worker
 
 
 def ProcessJavacOutput(output, target_name):
@@ -125,11 +126,11 @@ def main(argv):
 
     logging.debug('Command: %s', cmd)
     start = time.time()
-    build_utils.CheckOutput(cmd,
-                            print_stdout=True,
-                            stdout_filter=process_javac_output_partial,
-                            stderr_filter=process_javac_output_partial,
-                            fail_on_output=options.warnings_as_errors)
+    persistent_worker.CheckOutput(cmd,
+                                  print_stdout=True,
+                                  stdout_filter=process_javac_output_partial,
+                                  stderr_filter=process_javac_output_partial,
+                                  fail_on_output=options.warnings_as_errors)
     end = time.time() - start
     logging.info('Header compilation took %ss', end)
 
@@ -0,0 +1,199 @@
+// Copyright 2023 The Chromium Authors
+// Use of this source code is governed by a BSD-style license that can be
+// found in the LICENSE file.
+
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.File;
+import java.io.IOException;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.StandardProtocolFamily;
+import java.net.UnixDomainSocketAddress;
+import java.nio.channels.Channels;
+import java.nio.channels.ServerSocketChannel;
+import java.nio.channels.SocketChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.security.Permission;
+
+/**
+ * Runs a Java tool's main() repeatedly within a single JVM.
+ *
+ * <p>Started by build/android/gyp/util/persistent_worker.py using the source-file launcher:
+ *
+ * <pre>
+ *   java -Djava.security.manager=allow -cp TOOL_CLASSPATH PersistentWorker.java \
+ *       SOCKET_PATH MAIN_CLASS IDLE_TIMEOUT_SECONDS
+ * </pre>
+ *
+ * <p>The SecurityManager that turns the tool's System.exit() calls into exceptions requires
+ * -Djava.security.manager=allow on JDK 18+.
+ *
+ * <p>Requests are served one at a time. See persistent_worker.py for the protocol.
+ */
+public class PersistentWorker {
+    private static final int STATUS_OK = 0;
+    private static final int STATUS_ERROR = 1;
+    private static final int ACCEPTED = 0;
+
+    private static volatile long sLastActivityMillis = System.currentTimeMillis();
+    private static volatile boolean sBusy;
+
+    /** Thrown in place of System.exit() so that the worker keeps running. */
+    private static class ExitException extends SecurityException {
+        final int mStatus;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            mStatus = status;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        Path socketPath = Paths.get(args[0]);
+        Method mainMethod = Class.forName(args[1]).getMethod("main", String[].class);
+        long idleTimeoutMillis = Long.parseLong(args[2]) * 1000;
+        String workingDir = new File("").getAbsolutePath();
+
+        System.setSecurityManager(new SecurityManager() {
+            @Override
+            public void checkExit(int status) {
+                throw new ExitException(status);
+            }
+
+            @Override
+            public void checkPermission(Permission perm) {}
+        });
+
+        Files.deleteIfExists(socketPath);
+        ServerSocketChannel server = ServerSocketChannel.open(StandardProtocolFamily.UNIX);
+        server.bind(UnixDomainSocketAddress.of(socketPath));
+        startIdleWatchdog(socketPath, idleTimeoutMillis);
+
+        while (true) {
+            try (SocketChannel channel = server.accept()) {
+                markBusy();
+                DataInputStream in = new DataInputStream(Channels.newInputStream(channel));
+                DataOutputStream out = new DataOutputStream(
+                        new BufferedOutputStream(Channels.newOutputStream(channel)));
+                String[] request = readRequest(in);
+                if (request.length == 0) {
+                    exit(socketPath);
+                }
+                // Once accepted, clients do not resend the request to another worker.
+                out.writeInt(ACCEPTED);
+                out.flush();
+                handleRequest(request, mainMethod, workingDir, out);
+                out.flush();
+            } catch (IOException e) {
+                e.printStackTrace();
+            } finally {
+                sBusy = false;
+                sLastActivityMillis = System.currentTimeMillis();
+            }
+        }
+    }
+
+    // Synchronized with the idle watchdog, so that a worker never exits while it is busy.
+    private static synchronized void markBusy() {
+        sBusy = true;
+    }
+
+    private static void startIdleWatchdog(Path socketPath, long idleTimeoutMillis) {
+        Thread thread = new Thread(() -> {
+            while (true) {
+                try {
+                    Thread.sleep(Math.min(idleTimeoutMillis, 60 * 1000));
+                } catch (InterruptedException e) {
+                    return;
+                }
+                synchronized (PersistentWorker.class) {
+                    long idleMillis = System.currentTimeMillis() - sLastActivityMillis;
+                    if (!sBusy && idleMillis > idleTimeoutMillis) {
+                        exit(socketPath);
+                    }
+                }
+            }
+        });
+        thread.setDaemon(true);
+        thread.start();
+    }
+
+    private static void exit(Path socketPath) {
+        try {
+            Files.deleteIfExists(socketPath);
+        } catch (IOException e) {
+            // Clients remove stale sockets before starting a worker.
+        }
+        // halt() rather than exit() to bypass the SecurityManager.
+        Runtime.getRuntime().halt(0);
+    }
+
+    private static String[] readRequest(DataInputStream in) throws IOException {
+        String[] ret = new String[in.readInt()];
+        for (int i = 0; i < ret.length; i++) {
+            byte[] data = new byte[in.readInt()];
+            in.readFully(data);
+            ret[i] = new String(data, StandardCharsets.UTF_8);
+        }
+        return ret;
+    }
+
+    private static void writeString(DataOutputStream out, byte[] data) throws IOException {
+        out.writeInt(data.length);
+        out.write(data);
+    }
+
+    private static void handleRequest(String[] request, Method mainMethod, String workingDir,
+            DataOutputStream out) throws IOException {
+        // The JVM cannot change its working directory, so workers are keyed by it.
+        if (!request[0].equals(workingDir)) {
+            out.writeInt(STATUS_ERROR);
+            out.writeInt(0);
+            writeString(out, new byte[0]);
+            writeString(out,
+                    ("Worker is running in " + workingDir + ", not " + request[0])
+                            .getBytes(StandardCharsets.UTF_8));
+            return;
+        }
+        String[] toolArgs = new String[request.length - 1];
+        System.arraycopy(request, 1, toolArgs, 0, toolArgs.length);
+
+        ByteArrayOutputStream stdout = new ByteArrayOutputStream();
+        ByteArrayOutputStream stderr = new ByteArrayOutputStream();
+        PrintStream origOut = System.out;
+        PrintStream origErr = System.err;
+        System.setOut(new PrintStream(stdout, true, StandardCharsets.UTF_8));
+        System.setErr(new PrintStream(stderr, true, StandardCharsets.UTF_8));
+        int exitCode = 0;
+        try {
+            mainMethod.invoke(null, (Object) toolArgs);
+        } catch (InvocationTargetException e) {
+            Throwable cause = e.getCause();
+            if (cause instanceof ExitException) {
+                exitCode = ((ExitException) cause).mStatus;
+            } else {
+                cause.printStackTrace();
+                exitCode = 1;
+            }
+        } catch (IllegalAccessException e) {
+            e.printStackTrace();
+            exitCode = 1;
+        } finally {
+            System.out.flush();
+            System.err.flush();
+            System.setOut(origOut);
+            System.setErr(origErr);
+        }
+        out.writeInt(STATUS_OK);
+        out.writeInt(exitCode);
+        writeString(out, stdout.toByteArray());
+        writeString(out, stderr.toByteArray());
+    }
+}
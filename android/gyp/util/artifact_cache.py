@@ -0,0 +1,248 @@
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""A size-bounded, content-addressed cache of build artifacts.
+
+Expensive per-file transforms (e.g. converting a .png to .webp) store their
+outputs under a key derived from the digests of their inputs and from the tool
+version and flags used to create them. Since keys do not depend on paths, the
+cache can be shared by all output directories of a checkout (or of a machine).
+
+  * Artifacts are published atomically (hard-linked or copied to a temporary
+    name, then renamed into place), so concurrent builds never see partial
+    files.
+  * Artifacts are hard-linked out of the cache where possible. Neither
+    published nor fetched files may be modified in place.
+  * The modification time of an artifact is its last use. When the cache
+    grows beyond its size limit, Trim() evicts the least recently used ones.
+  * Digests of input files (and of zip file entries) are memoized in an sqlite
+    database keyed by path, size and mtime, so that unchanged inputs need not
+    be read to compute keys.
+
+Fetch(), Publish() and GetOrCreate() only touch the filesystem and so can be
+called from forked worker processes. Everything else must be called from the
+process that created the cache.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import marshal
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import zipfile
+
+from util import build_utils
+
+DEFAULT_MAX_SIZE_MB = 2048
+# Bump when changing what is stored. marshal's format is specific to the
+# Python version.
+_SCHEMA_VERSION = '1_py%d%d' % sys.version_info[:2]
+# Scanning a large cache takes a while, so do it at most this often.
+_MIN_TRIM_INTERVAL_SECONDS = 60
+# Trim to below the limit so that the next few builds need not trim again.
+_TRIM_TARGET_FRACTION = 0.9
+
+
+def _StatKey(path):
+  st = os.stat(path)
+  return st.st_mtime_ns, st.st_size
+
+
+def MakeKey(*parts):
+  """Returns a cache key for an artifact derived from |parts| (strs)."""
+  sha1 = hashlib.sha1()
+  for part in parts:
+    part = part.encode('utf-8')
+    sha1.update(b'%d:' % len(part))
+    sha1.update(part)
+  return sha1.hexdigest()
+
+
+def _ComputeSha1(path):
+  sha1 = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      sha1.update(chunk)
+  return sha1.hexdigest()
+
+
+class ArtifactCache:
+  """A directory of artifacts, keyed by MakeKey()."""
+
+  def __init__(self, cache_dir, max_size_mb=DEFAULT_MAX_SIZE_MB):
+    self._cache_dir = os.path.abspath(cache_dir)
+    self._artifacts_dir = os.path.join(self._cache_dir, 'artifacts')
+    self._max_size = max_size_mb * 1024 * 1024
+    self._conn = None
+    build_utils.MakeDirectory(self._artifacts_dir)
+
+  def _Connection(self):
+    if self._conn is None:
+      self._conn = sqlite3.connect(os.path.join(self._cache_dir,
+                                                'digests.sqlite'),
+                                   timeout=60,
+                                   isolation_level=None)
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute('PRAGMA synchronous=NORMAL')
+      self._conn.execute(
+          f'CREATE TABLE IF NOT EXISTS digests_v{_SCHEMA_VERSION} '
+          '(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, '
+          'digests BLOB)')
+    return self._conn
+
+  def Close(self):
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+  def _GetMemoizedDigests(self, path, compute_func):
+    path = os.path.abspath(path)
+    stat_key = _StatKey(path)
+    conn = self._Connection()
+    row = conn.execute(
+        f'SELECT mtime_ns, size, digests FROM digests_v{_SCHEMA_VERSION} '
+        'WHERE path = ?', (path, )).fetchone()
+    if row and tuple(row[:2]) == stat_key:
+      return marshal.loads(row[2])
+    ret = compute_func(path)
+    # The file may have changed while it was being read.
+    if _StatKey(path) == stat_key:
+      conn.execute(
+          f'INSERT OR REPLACE INTO digests_v{_SCHEMA_VERSION} '
+          'VALUES (?, ?, ?, ?)', (path, ) + stat_key + (marshal.dumps(ret), ))
+    return ret
+
+  def FileDigest(self, path):
+    """Returns the sha1 of the file at |path|.
+
+    Only memoize files at stable paths (e.g. build outputs), since the memo
+    keeps an entry for each path.
+    """
+    return self._GetMemoizedDigests(path, _ComputeSha1)
+
+  def ZipEntryDigests(self, zip_path):
+    """Returns a dict of entry name -> sha1 of the entries of a zip file."""
+
+    def compute_digests(path):
+      ret = {}
+      with zipfile.ZipFile(path) as z:
+        for info in z.infolist():
+          if not info.is_dir():
+            ret[info.filename] = hashlib.sha1(z.read(info)).hexdigest()
+      return ret
+
+    return self._GetMemoizedDigests(zip_path, compute_digests)
+
+  def _ArtifactPath(self, key):
+    return os.path.join(self._artifacts_dir, key[:2], key)
+
+  def Fetch(self, key, dest_path):
+    """Places the artifact for |key| at |dest_path|.
+
+    Returns:
+      Whether the artifact was in the cache.
+    """
+    artifact_path = self._ArtifactPath(key)
+    try:
+      os.link(artifact_path, dest_path)
+    except FileNotFoundError:
+      return False
+    except OSError:
+      # E.g. the cache is on another filesystem.
+      try:
+        shutil.copyfile(artifact_path, dest_path)
+      except FileNotFoundError:
+        return False
+    try:
+      os.utime(artifact_path)
+    except OSError:
+      # Evicted in the meantime, which is fine since it was already copied.
+      pass
+    return True
+
+  def Publish(self, key, src_path):
+    """Stores the file at |src_path| as the artifact for |key|."""
+    artifact_path = self._ArtifactPath(key)
+    build_utils.MakeDirectory(os.path.dirname(artifact_path))
+    tmp_path = '{}.{}.tmp'.format(artifact_path, os.getpid())
+    try:
+      os.link(src_path, tmp_path)
+    except OSError:
+      shutil.copyfile(src_path, tmp_path)
+    try:
+      os.replace(tmp_path, artifact_path)
+    except OSError:
+      os.unlink(tmp_path)
+      raise
+
+  def GetOrCreate(self, key, dest_path, create_func):
+    """Fetches |key| to |dest_path|, or calls create_func(dest_path) and
+    publishes the result.
+
+    Returns:
+      Whether the artifact was in the cache.
+    """
+    if self.Fetch(key, dest_path):
+      return True
+    create_func(dest_path)
+    self.Publish(key, dest_path)
+    return False
+
+  @contextlib.contextmanager
+  def _TrimLock(self, force):
+    """Yields whether this process should trim the cache."""
+    stamp_path = os.path.join(self._cache_dir, 'trim.stamp')
+    if not force and os.path.exists(stamp_path) and (
+        time.time() - os.path.getmtime(stamp_path) <
+        _MIN_TRIM_INTERVAL_SECONDS):
+      yield False
+      return
+    with open(os.path.join(self._cache_dir, 'trim.lock'), 'w') as lock_file:
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        # Another process is trimming.
+        yield False
+        return
+      yield True
+      build_utils.Touch(stamp_path)
+
+  def Trim(self, force=False):
+    """Evicts least recently used artifacts while the cache is too large.
+
+    Args:
+      force: Trim even if another process recently did.
+    Returns:
+      The number of evicted artifacts.
+    """
+    with self._TrimLock(force) as should_trim:
+      if not should_trim:
+        return 0
+      artifacts = []
+      total_size = 0
+      for shard in os.scandir(self._artifacts_dir):
+        for entry in os.scandir(shard.path):
+          if entry.name.endswith('.tmp'):
+            continue
+          st = entry.stat()
+          artifacts.append((st.st_mtime_ns, st.st_size, entry.path))
+          total_size += st.st_size
+      if total_size <= self._max_size:
+        return 0
+      artifacts.sort()
+      target_size = self._max_size * _TRIM_TARGET_FRACTION
+      num_evicted = 0
+      for _, size, path in artifacts:
+        if total_size <= target_size:
+          break
+        try:
+          os.unlink(path)
+        except FileNotFoundError:
+          pass
+        total_size -= size
+        num_evicted += 1
+      return num_evicted
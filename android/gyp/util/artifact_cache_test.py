@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import sys
+import unittest
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import artifact_cache
+from util import temp_dir_test_case
+
+
+class ArtifactCacheTest(temp_dir_test_case.TempDirTestCase):
+  def setUp(self):
+    super().setUp()
+    self.cache = artifact_cache.ArtifactCache(
+        os.path.join(self.temp_dir, 'cache'))
+
+  def tearDown(self):
+    self.cache.Close()
+
+  def _Path(self, name):
+    return os.path.join(self.temp_dir, name)
+
+  def _WriteFile(self, name, data):
+    with open(self._Path(name), 'w') as f:
+      f.write(data)
+    return self._Path(name)
+
+  def _ReadFile(self, name):
+    with open(self._Path(name)) as f:
+      return f.read()
+
+  def testMakeKey(self):
+    self.assertEqual(artifact_cache.MakeKey('a', 'b'),
+                     artifact_cache.MakeKey('a', 'b'))
+    self.assertNotEqual(artifact_cache.MakeKey('a', 'b'),
+                        artifact_cache.MakeKey('ab'))
+
+  def testGetOrCreate(self):
+    calls = []
+
+    def create(path):
+      calls.append(path)
+      with open(path, 'w') as f:
+        f.write('artifact')
+
+    key = artifact_cache.MakeKey('input')
+    self.assertFalse(self.cache.GetOrCreate(key, self._Path('out1'), create))
+    self.assertTrue(self.cache.GetOrCreate(key, self._Path('out2'), create))
+    self.assertEqual([self._Path('out1')], calls)
+    self.assertEqual('artifact', self._ReadFile('out2'))
+
+  def testPublishReplaces(self):
+    key = artifact_cache.MakeKey('input')
+    self.cache.Publish(key, self._WriteFile('a', 'old'))
+    self.cache.Publish(key, self._WriteFile('b', 'new'))
+    self.assertTrue(self.cache.Fetch(key, self._Path('out')))
+    self.assertEqual('new', self._ReadFile('out'))
+
+  def testTrim(self):
+    cache = artifact_cache.ArtifactCache(os.path.join(self.temp_dir, 'cache'),
+                                         max_size_mb=2)
+    keys = [artifact_cache.MakeKey(str(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+      cache.Publish(key, self._WriteFile(str(i), 'x' * (1024 * 1024)))
+      artifact_path = cache._ArtifactPath(key)
+      os.utime(artifact_path, ns=(i, i))
+    # Fetching marks keys[0] as most recently used.
+    self.assertTrue(cache.Fetch(keys[0], self._Path('out')))
+    self.assertEqual(2, cache.Trim())
+    self.assertTrue(cache.Fetch(keys[0], self._Path('out2')))
+    self.assertFalse(cache.Fetch(keys[1], self._Path('out3')))
+    self.assertFalse(cache.Fetch(keys[2], self._Path('out4')))
+    # Other processes do not trim again right away.
+    self.assertEqual(0, self.cache.Trim())
+
+  def testFileDigest(self):
+    path = self._WriteFile('input', 'a')
+    digest = self.cache.FileDigest(path)
+    self.assertEqual(digest, self.cache.FileDigest(path))
+    # A stale memo entry is not used.
+    self._WriteFile('input', 'bb')
+    self.assertNotEqual(digest, self.cache.FileDigest(path))
+
+  def testZipEntryDigests(self):
+    zip_path = self._Path('res.zip')
+    with zipfile.ZipFile(zip_path, 'w') as z:
+      z.writestr('drawable/', '')
+      z.writestr('drawable/a.png', 'a')
+      z.writestr('drawable/b.png', 'b')
+    digests = self.cache.ZipEntryDigests(zip_path)
+    self.assertEqual(['drawable/a.png', 'drawable/b.png'], sorted(digests))
+    self.assertNotEqual(digests['drawable/a.png'], digests['drawable/b.png'])
+    self.assertEqual(
+        digests, self.cache.ZipEntryDigests(os.path.relpath(zip_path)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,298 @@
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""An on-disk index of .build_config.json files.
+
+write_build_config.py runs once per target, and each run used to parse the
+.build_config.json of every transitive dependency and recompute the ordered
+transitive closure of its deps. This index, shared by all runs within an output
+directory, stores for each config:
+  * Its "deps_info" section, in marshal format (much faster to load than JSON).
+  * The ordered transitive closure of its dependencies, as path ids, along
+    with the size and mtime of each of its members when it was computed.
+
+Entries are validated against the size and mtime of the config files they were
+computed from: a stored closure is reused as long as none of its members
+changed, and only configs that changed are re-parsed. Since each config is
+written at most once per build, an unchanged mtime+size reliably means
+unchanged contents.
+
+The index is an sqlite database at $BUILD_CONFIG_INDEX_PATH (default:
+.build_config_index.sqlite in the output directory). Set the variable to an
+empty string to disable it.
+"""
+
+import array
+import json
+import logging
+import marshal
+import os
+import sqlite3
+import sys
+
+from util import build_utils
+
+ENV_VARIABLE = 'BUILD_CONFIG_INDEX_PATH'
+_DEFAULT_PATH = '.build_config_index.sqlite'
+# Bump when changing what is stored. marshal's format is specific to the
+# Python version.
+_SCHEMA_VERSION = '2_py%d%d' % sys.version_info[:2]
+
+
+def _StatKey(path):
+  st = os.stat(path)
+  return st.st_mtime_ns, st.st_size
+
+
+def MergeClosures(closures, extra_node=None):
+  """Merges ordered closures, keeping the first occurrence of each node.
+
+  Merging the DFS post-orders of each of |closures| in order gives the same
+  result as a single DFS over all of them.
+  """
+  seen = set()
+  ret = []
+  for closure in closures:
+    for node in closure:
+      if node not in seen:
+        seen.add(node)
+        ret.append(node)
+  if extra_node is not None and extra_node not in seen:
+    ret.append(extra_node)
+  return ret
+
+
+class BuildConfigIndex:
+  """Index of deps_info sections and transitive dependency closures."""
+
+  def __init__(self, db_path):
+    self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    self._conn.execute('PRAGMA journal_mode=WAL')
+    self._conn.execute('PRAGMA synchronous=NORMAL')
+    self._paths_table = 'paths_v' + _SCHEMA_VERSION
+    self._configs_table = 'configs_v' + _SCHEMA_VERSION
+    self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self._paths_table} '
+                       '(id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL)')
+    self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self._configs_table} '
+                       '(id INTEGER PRIMARY KEY, mtime_ns INTEGER, '
+                       'size INTEGER, deps_info BLOB, closure BLOB, '
+                       'closure_keys BLOB)')
+    self._path_by_id = {}
+    self._id_by_path = {}
+    self._LoadPathIds()
+    self._stat_keys = {}
+    # Path -> (mtime_ns, size, deps_info) as stored, or None.
+    self._rows = {}
+    # Path -> row, or None if there is no row for the current version.
+    self._fresh_rows = {}
+    self._deps_infos = {}
+    self._closures = {}
+    # Entries to write on Flush(), by path.
+    self._new_deps_infos = {}
+    self._new_closures = {}
+
+  def _LoadPathIds(self):
+    for path_id, path in self._conn.execute(
+        f'SELECT id, path FROM {self._paths_table}'):
+      self._path_by_id[path_id] = path
+      self._id_by_path[path] = path_id
+
+  def _GetStatKey(self, path):
+    ret = self._stat_keys.get(path)
+    if ret is None:
+      ret = _StatKey(path)
+      self._stat_keys[path] = ret
+    return ret
+
+  def _LoadRows(self, paths):
+    """Reads the stored rows of |paths| with a minimal number of queries."""
+    paths = [p for p in paths if p not in self._rows]
+    ids = []
+    for path in paths:
+      self._rows[path] = None
+      path_id = self._id_by_path.get(path)
+      if path_id is not None:
+        ids.append(path_id)
+    # Stay below SQLITE_MAX_VARIABLE_NUMBER.
+    for i in range(0, len(ids), 900):
+      chunk = ids[i:i + 900]
+      for row in self._conn.execute(
+          'SELECT id, mtime_ns, size, deps_info FROM '
+          f'{self._configs_table} WHERE id IN ({",".join("?" * len(chunk))})',
+          chunk):
+        self._rows[self._path_by_id[row[0]]] = row[1:]
+
+  def _GetFreshRow(self, path):
+    """Returns the stored row for |path| if the config has not changed since."""
+    ret = self._fresh_rows.get(path, False)
+    if ret is False:
+      if path not in self._rows:
+        self._LoadRows([path])
+      ret = self._rows[path]
+      try:
+        if ret and self._GetStatKey(path) != (ret[0], ret[1]):
+          ret = None
+      except OSError:
+        ret = None
+      self._fresh_rows[path] = ret
+    return ret
+
+  def _DecodeClosure(self, blob):
+    ids = array.array('I')
+    ids.frombytes(blob)
+    if any(i not in self._path_by_id for i in ids):
+      # Added by another process since this one started.
+      self._LoadPathIds()
+    return [self._path_by_id[i] for i in ids]
+
+  def _GetStoredClosure(self, path):
+    path_id = self._id_by_path.get(path)
+    if path_id is None:
+      return None
+    # Closures are not part of rows since only few of them are used.
+    row = self._conn.execute(
+        f'SELECT closure, closure_keys FROM {self._configs_table} WHERE '
+        'id = ?', (path_id, )).fetchone()
+    if not row or not row[0] or not row[1]:
+      return None
+    closure = self._DecodeClosure(row[0])
+    keys = array.array('q')
+    keys.frombytes(row[1])
+    if len(keys) != 2 * len(closure):
+      return None
+    # The closure is still valid if none of its members changed since it was
+    # computed, since that means none of their deps changed. Members' own rows
+    # cannot be used for this, as they may have been refreshed since.
+    try:
+      for i, member in enumerate(closure):
+        if self._GetStatKey(member) != (keys[2 * i], keys[2 * i + 1]):
+          return None
+    except OSError:
+      return None
+    # Its members' deps_info are likely to be needed too.
+    self._LoadRows(closure)
+    return closure
+
+  def LoadedPaths(self):
+    """Returns the paths of all configs whose deps_info was loaded."""
+    return list(self._deps_infos)
+
+  def Prefetch(self, paths):
+    """Reads the deps_info of |paths| from the index in bulk."""
+    self._LoadRows(paths)
+
+  def GetDepsInfo(self, path):
+    """Returns the "deps_info" section of the config at |path|.
+
+    The returned dict is shared by all callers.
+    """
+    ret = self._deps_infos.get(path)
+    if ret is not None:
+      return ret
+    row = self._GetFreshRow(path)
+    if row and row[2]:
+      ret = marshal.loads(row[2])
+    else:
+      with open(path) as f:
+        ret = json.load(f)['deps_info']
+      # Serialize now, since callers may modify the returned dict.
+      self._new_deps_infos[path] = marshal.dumps(ret)
+    self._deps_infos[path] = ret
+    return ret
+
+  def _GetKnownClosure(self, path):
+    ret = self._closures.get(path)
+    if ret is None:
+      ret = self._GetStoredClosure(path)
+      if ret is not None:
+        self._closures[path] = ret
+    return ret
+
+  def GetClosure(self, path, deps_func):
+    """Returns the transitive dependencies of |path| in DFS post-order.
+
+    |path| is the last element. The result is the same as
+    build_utils.GetSortedTransitiveDependencies([path], deps_func), and is
+    stored in the index on Flush().
+
+    Args:
+      path: Path to a config.
+      deps_func: A function that takes a config path and returns the paths of
+          its direct dependencies. Must be a function of the config contents.
+    """
+    ret = self._GetKnownClosure(path)
+    if ret is None:
+      # Reuses the known closures of dependencies.
+      ret = build_utils.TransitiveDependencies(
+          deps_func, known_closure_func=self._GetKnownClosure).Get(path)
+      self._closures[path] = ret
+      self._new_closures[path] = ret
+    return ret
+
+  def _GetOrCreatePathId(self, path):
+    path_id = self._id_by_path.get(path)
+    if path_id is None:
+      self._conn.execute(
+          f'INSERT OR IGNORE INTO {self._paths_table} (path) VALUES (?)',
+          (path, ))
+      path_id = self._conn.execute(
+          f'SELECT id FROM {self._paths_table} WHERE path = ?',
+          (path, )).fetchone()[0]
+      self._id_by_path[path] = path_id
+      self._path_by_id[path_id] = path
+    return path_id
+
+  def Flush(self):
+    """Writes new entries to the database."""
+    if not self._new_deps_infos and not self._new_closures:
+      return
+    self._conn.execute('BEGIN IMMEDIATE')
+    try:
+      for path, blob in self._new_deps_infos.items():
+        mtime_ns, size = self._GetStatKey(path)
+        # Closures carry their own validation keys, so they are kept.
+        self._conn.execute(
+            f'INSERT INTO {self._configs_table} (id, mtime_ns, size, '
+            'deps_info) VALUES (?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET '
+            'deps_info=excluded.deps_info, mtime_ns=excluded.mtime_ns, '
+            'size=excluded.size',
+            (self._GetOrCreatePathId(path), mtime_ns, size, blob))
+      for path, closure in self._new_closures.items():
+        mtime_ns, size = self._GetStatKey(path)
+        ids = array.array('I', (self._GetOrCreatePathId(p) for p in closure))
+        keys = array.array('q')
+        for member in closure:
+          keys.extend(self._GetStatKey(member))
+        self._conn.execute(
+            f'INSERT INTO {self._configs_table} (id, mtime_ns, size, closure, '
+            'closure_keys) VALUES (?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE '
+            'SET deps_info=CASE WHEN mtime_ns=excluded.mtime_ns AND '
+            'size=excluded.size THEN deps_info END, '
+            'closure=excluded.closure, closure_keys=excluded.closure_keys, '
+            'mtime_ns=excluded.mtime_ns, size=excluded.size',
+            (self._GetOrCreatePathId(path), mtime_ns, size, ids.tobytes(),
+             keys.tobytes()))
+      self._conn.execute('COMMIT')
+    except:
+      self._conn.execute('ROLLBACK')
+      raise
+    self._new_deps_infos.clear()
+    self._new_closures.clear()
+
+  def Close(self):
+    self._conn.close()
+
+
+def Open():
+  """Returns the BuildConfigIndex for the current output directory, or None.
+
+  Returns None when the index is disabled or cannot be opened.
+  """
+  db_path = os.environ.get(ENV_VARIABLE, _DEFAULT_PATH)
+  if not db_path:
+    return None
+  try:
+    return BuildConfigIndex(db_path)
+  except sqlite3.Error as e:
+    logging.warning('Not using %s: %s', db_path, e)
+    return None
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_config_index
+from util import build_utils
+
+# Each node's direct deps, in order.
+_GRAPH = {
+    'a': ['b', 'c'],
+    'b': ['d', 'e'],
+    'c': ['e', 'f'],
+    'd': [],
+    'e': ['f'],
+    'f': [],
+}
+
+
+class BuildConfigIndexTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.db_path = os.path.join(self.temp_dir, 'index.sqlite')
+    self.num_writes = 0
+    for name, deps in _GRAPH.items():
+      self._WriteConfig(name, deps)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir)
+
+  def _Path(self, name):
+    return os.path.join(self.temp_dir, name + '.build_config.json')
+
+  def _WriteConfig(self, name, deps):
+    deps_info = {
+        'name': name,
+        'deps_configs': [self._Path(d) for d in deps],
+    }
+    with open(self._Path(name), 'w') as f:
+      json.dump({'deps_info': deps_info}, f)
+    # Make sure rewrites are detected even on filesystems with coarse mtimes.
+    self.num_writes += 1
+    os.utime(self._Path(name), ns=(0, self.num_writes))
+
+  def _OpenIndex(self):
+    index = build_config_index.BuildConfigIndex(self.db_path)
+    self.addCleanup(index.Close)
+    calls = []
+
+    def deps_func(path):
+      calls.append(path)
+      return index.GetDepsInfo(path)['deps_configs']
+
+    return index, deps_func, calls
+
+  def _ExpectedClosure(self, name):
+    def deps_func(path):
+      with open(path) as f:
+        return json.load(f)['deps_info']['deps_configs']
+
+    return build_utils.GetSortedTransitiveDependencies([self._Path(name)],
+                                                       deps_func)
+
+  def testMatchesGetSortedTransitiveDependencies(self):
+    index, deps_func, _ = self._OpenIndex()
+    for name in _GRAPH:
+      self.assertEqual(self._ExpectedClosure(name),
+                       index.GetClosure(self._Path(name), deps_func))
+
+  def testMergeClosures(self):
+    index, deps_func, _ = self._OpenIndex()
+    paths = [self._Path('c'), self._Path('b')]
+    expected = build_utils.GetSortedTransitiveDependencies(
+        paths, lambda p: index.GetDepsInfo(p)['deps_configs'])
+    actual = build_config_index.MergeClosures(
+        index.GetClosure(p, deps_func) for p in paths)
+    self.assertEqual(expected, actual)
+
+  def testPersistsClosures(self):
+    index, deps_func, _ = self._OpenIndex()
+    expected = index.GetClosure(self._Path('a'), deps_func)
+    index.Flush()
+
+    index, deps_func, calls = self._OpenIndex()
+    self.assertEqual(expected, index.GetClosure(self._Path('a'), deps_func))
+    self.assertEqual([], calls)
+    self.assertEqual('a', index.GetDepsInfo(self._Path('a'))['name'])
+
+  def testInvalidatesChangedConfigs(self):
+    index, deps_func, _ = self._OpenIndex()
+    for name in 'bdf':
+      index.GetClosure(self._Path(name), deps_func)
+    index.Flush()
+
+    # Stored closures that do not contain "e" are still used.
+    self._WriteConfig('e', ['d'])
+    index, deps_func, calls = self._OpenIndex()
+    self.assertEqual(self._ExpectedClosure('a'),
+                     index.GetClosure(self._Path('a'), deps_func))
+    self.assertNotIn(self._Path('d'), calls)
+    self.assertNotIn(self._Path('f'), calls)
+    self.assertEqual([self._Path('d')],
+                     index.GetDepsInfo(self._Path('e'))['deps_configs'])
+
+  def testInvalidatesClosuresOfChangedMembers(self):
+    for name, deps in (('c', []), ('d', []), ('b', ['c']), ('a', ['b'])):
+      self._WriteConfig(name, deps)
+    index, deps_func, _ = self._OpenIndex()
+    index.GetClosure(self._Path('a'), deps_func)
+    index.Flush()
+
+    # Another index refreshes the row of "b" without computing any closure.
+    self._WriteConfig('b', ['d'])
+    index, _, _ = self._OpenIndex()
+    index.GetDepsInfo(self._Path('b'))
+    index.Flush()
+
+    index, deps_func, _ = self._OpenIndex()
+    self.assertEqual([self._Path('d'), self._Path('b'), self._Path('a')],
+                     index.GetClosure(self._Path('a'), deps_func))
+
+  def testDetectsCycles(self):
+    self._WriteConfig('f', ['a'])
+    index, deps_func, _ = self._OpenIndex()
+    with self.assertRaises(build_utils.DependencyCycleError):
+      index.GetClosure(self._Path('a'), deps_func)
+
+  def testDisabled(self):
+    os.environ[build_config_index.ENV_VARIABLE] = ''
+    try:
+      self.assertIsNone(build_config_index.Open())
+    finally:
+      del os.environ[build_config_index.ENV_VARIABLE]
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -6,22 +6,26 @@
 
 import atexit
 import collections
+import concurrent.futures
 import contextlib
 import filecmp
 import fnmatch
 import json
 import logging
+import mmap
 import os
 import pipes
 import re
 import shlex
 import shutil
 import stat
+import struct
 import subprocess
 import sys
 import tempfile
 import time
 import zipfile
+import zlib
 
 sys.path.append(os.path.join(os.path.dirname(__file__),
                              os.pardir, os.pardir, os.pardir))
@@ -263,13 +267,45 @@ def CheckOutput(args,
     stdout = stdout.decode('utf-8')
     stderr = stderr.decode('utf-8')
 
+  return ProcessCommandOutput(args,
+                              cwd,
+                              child.returncode,
+                              stdout,
+                              stderr,
+                              print_stdout=print_stdout,
+                              print_stderr=print_stderr,
+                              stdout_filter=stdout_filter,
+                              stderr_filter=stderr_filter,
+                              fail_on_output=fail_on_output,
+                              fail_func=fail_func)
+
+
+def ProcessCommandOutput(args,
+                         cwd,
+                         returncode,
+                         stdout,
+                         stderr,
+                         print_stdout=False,
+                         print_stderr=True,
+                         stdout_filter=None,
+                         stderr_filter=None,
+                         fail_on_output=True,
+                         fail_func=lambda returncode, stderr: returncode != 0):
+  """Applies CheckOutput()'s filtering and failure logic to a finished command.
+
+  Useful for commands that are not run via subprocess (e.g. by a persistent
+  worker). See CheckOutput() for the meaning of the arguments.
+
+  Returns:
+    The filtered stdout.
+  """
   if stdout_filter is not None:
     stdout = stdout_filter(stdout)
 
   if stderr_filter is not None:
     stderr = stderr_filter(stderr)
 
-  if fail_func and fail_func(child.returncode, stderr):
+  if fail_func and fail_func(returncode, stderr):
     raise CalledProcessError(cwd, args, stdout + stderr)
 
   if print_stdout:
@@ -380,6 +416,110 @@ def ExtractAll(zip_path, path=None, no_clobber=True, pattern=None,
   return extracted
 
 
+_ZIP_EOCD_SIGNATURE = b'PK\x05\x06'
+_ZIP_EOCD = struct.Struct('<4s4H2LH')
+_ZIP64_EOCD_LOCATOR_SIGNATURE = b'PK\x06\x07'
+_ZIP64_EOCD_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_EOCD_SIGNATURE = b'PK\x06\x06'
+_ZIP64_EOCD = struct.Struct('<4sQ2H2L4Q')
+_ZIP_CENTRAL_DIR_SIGNATURE = b'PK\x01\x02'
+_ZIP_CENTRAL_DIR = struct.Struct('<4s4B4HL2L5H2L')
+_ZIP_MAX_COMMENT = 0xFFFF
+_ZIP_UTF8_FLAG = 0x800
+_ZIP64_EXTRA_ID = 0x0001
+
+
+def _FindZipCentralDirectory(buf):
+  """Returns (offset, size, num_entries) of the central directory in |buf|."""
+  search_start = max(0, len(buf) - _ZIP_EOCD.size - _ZIP_MAX_COMMENT)
+  eocd_offset = buf.rfind(_ZIP_EOCD_SIGNATURE, search_start)
+  if eocd_offset == -1:
+    raise zipfile.BadZipFile('End of central directory not found')
+  (_, _, _, _, num_entries, cd_size, cd_offset,
+   _) = _ZIP_EOCD.unpack_from(buf, eocd_offset)
+
+  locator_offset = eocd_offset - _ZIP64_EOCD_LOCATOR.size
+  if (locator_offset >= 0 and buf[locator_offset:locator_offset + 4] ==
+      _ZIP64_EOCD_LOCATOR_SIGNATURE):
+    _, _, zip64_eocd_offset, _ = _ZIP64_EOCD_LOCATOR.unpack_from(
+        buf, locator_offset)
+    (signature, _, _, _, _, _, _, num_entries, cd_size,
+     cd_offset) = _ZIP64_EOCD.unpack_from(buf, zip64_eocd_offset)
+    if signature != _ZIP64_EOCD_SIGNATURE:
+      raise zipfile.BadZipFile('Corrupt zip64 end of central directory')
+  return cd_offset, cd_size, num_entries
+
+
+def _ParseZip64Extra(extra, file_size, compress_size, header_offset):
+  """Returns sizes & offset with 0xFFFFFFFF values replaced from |extra|."""
+  pos = 0
+  while pos + 4 <= len(extra):
+    field_id, field_size = struct.unpack_from('<2H', extra, pos)
+    pos += 4
+    if field_id == _ZIP64_EXTRA_ID:
+      values = iter(struct.unpack_from('<%dQ' % (field_size // 8), extra, pos))
+      if file_size == 0xFFFFFFFF:
+        file_size = next(values)
+      if compress_size == 0xFFFFFFFF:
+        compress_size = next(values)
+      if header_offset == 0xFFFFFFFF:
+        header_offset = next(values)
+      break
+    pos += field_size
+  return file_size, compress_size, header_offset
+
+
+def ReadZipCentralDirectory(zip_path):
+  """Returns the entries of a zip file by reading only its central directory.
+
+  This is much faster than zipfile.ZipFile().infolist() for large zips since
+  only the end of the file is read and no ZipInfo objects are created.
+
+  Args:
+    zip_path: Path to the zip file.
+
+  Returns:
+    A list of (filename, crc32, compress_type, compress_size, file_size,
+    header_offset, external_attr) tuples, in central directory order.
+    Directory entries are included.
+  """
+  with open(zip_path, 'rb') as f:
+    try:
+      buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError as e:
+      raise zipfile.BadZipFile('Empty zip file: ' + zip_path) from e
+  try:
+    cd_offset, cd_size, num_entries = _FindZipCentralDirectory(buf)
+    return _ParseZipCentralDirectory(buf[cd_offset:cd_offset + cd_size],
+                                     num_entries)
+  finally:
+    buf.close()
+
+
+def _ParseZipCentralDirectory(data, num_entries):
+  ret = []
+  unpack_from = _ZIP_CENTRAL_DIR.unpack_from
+  record_size = _ZIP_CENTRAL_DIR.size
+  pos = 0
+  for _ in range(num_entries):
+    (signature, _, _, _, _, flag_bits, compress_type, _, _, crc, compress_size,
+     file_size, filename_len, extra_len, comment_len, _, _, external_attr,
+     header_offset) = unpack_from(data, pos)
+    if signature != _ZIP_CENTRAL_DIR_SIGNATURE:
+      raise zipfile.BadZipFile('Bad central directory record')
+    pos += record_size
+    filename = data[pos:pos + filename_len].decode(
+        'utf-8' if flag_bits & _ZIP_UTF8_FLAG else 'cp437')
+    pos += filename_len
+    if 0xFFFFFFFF in (file_size, compress_size, header_offset):
+      file_size, compress_size, header_offset = _ParseZip64Extra(
+          data[pos:pos + extra_len], file_size, compress_size, header_offset)
+    pos += extra_len + comment_len
+    ret.append((filename, crc, compress_type, compress_size, file_size,
+                header_offset, external_attr))
+  return ret
+
+
 def HermeticDateTime(timestamp=None):
   """Returns a constant ZipInfo.date_time tuple.
 
@@ -481,12 +621,92 @@ def AddToZipHermetic(zip_file,
   zip_file.writestr(zipinfo, data, compress_type)
 
 
+def _ReadAndCompressForZip(src_path, compress, default_compress_type):
+  """Returns (compress_type, external_attr_bits, crc, file_size, data).
+
+  Matches what AddToZipHermetic() would write for |src_path|.
+  """
+  st = os.stat(src_path)
+  mode_bits = 0
+  for mode in (stat.S_IXUSR, stat.S_IXGRP, stat.S_IXOTH):
+    if st.st_mode & mode:
+      mode_bits |= mode << 16
+  with open(src_path, 'rb') as f:
+    data = f.read()
+
+  if len(data) < 16:
+    compress = False
+  compress_type = default_compress_type
+  if compress is not None:
+    compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+
+  crc = zlib.crc32(data)
+  file_size = len(data)
+  if compress_type == zipfile.ZIP_DEFLATED:
+    # Same settings as zipfile uses, so that output is identical.
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  -15)
+    data = compressor.compress(data) + compressor.flush()
+  return compress_type, mode_bits, crc, file_size, data
+
+
+def _DoZipParallel(out_zip, entries, num_workers):
+  """Adds files to |out_zip| in order, compressing them on a thread pool.
+
+  zlib releases the GIL while compressing, so threads are enough to use
+  multiple cores. At most a small multiple of |num_workers| files are held in
+  memory at once.
+
+  Args:
+    out_zip: ZipFile (opened for writing to a seekable file) to add to.
+    entries: List of (zip_path, fs_path, compress, date_time) tuples.
+    num_workers: Number of compression threads.
+  """
+  max_in_flight = 2 * num_workers
+  pending = collections.deque()
+
+  def write_next():
+    zip_path, fs_path, compress, date_time, future = pending.popleft()
+    if future is None:
+      AddToZipHermetic(out_zip,
+                       zip_path,
+                       src_path=fs_path,
+                       compress=compress,
+                       date_time=date_time)
+      return
+    compress_type, mode_bits, crc, file_size, data = future.result()
+    zipinfo = HermeticZipInfo(filename=zip_path, date_time=date_time)
+    zipinfo.external_attr |= mode_bits
+    zipinfo.compress_type = compress_type
+    zipinfo.CRC = crc
+    zipinfo.file_size = file_size
+    zipinfo.compress_size = len(data)
+    # Matches the heuristic used by ZipFile._open_to_write().
+    zip64 = file_size * 1.05 > zipfile.ZIP64_LIMIT
+    _WriteZipEntryRaw(out_zip, zipinfo, (data, ), zip64)
+
+  with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+    for zip_path, fs_path, compress, date_time in entries:
+      _CheckZipPath(zip_path)
+      future = None
+      # Symlinks are cheap, so are written directly by AddToZipHermetic().
+      if not os.path.islink(fs_path):
+        future = executor.submit(_ReadAndCompressForZip, fs_path, compress,
+                                 out_zip.compression)
+      pending.append((zip_path, fs_path, compress, date_time, future))
+      if len(pending) >= max_in_flight:
+        write_next()
+    while pending:
+      write_next()
+
+
 def DoZip(inputs,
           output,
           base_dir=None,
           compress_fn=None,
           zip_prefix_path=None,
-          timestamp=None):
+          timestamp=None,
+          num_workers=None):
   """Creates a zip file from a list of files.
 
   Args:
@@ -497,6 +717,8 @@ def DoZip(inputs,
         By default, items will be |zipfile.ZIP_STORED|.
     zip_prefix_path: Path prepended to file path in zip file.
     timestamp: Unix timestamp to use for files in the archive.
+    num_workers: When > 1, compress files using this many threads. The output
+        is identical to that of the serial path.
   """
   if base_dir is None:
     base_dir = '.'
@@ -516,22 +738,35 @@ def DoZip(inputs,
     out_zip = zipfile.ZipFile(output, 'w')
 
   date_time = HermeticDateTime(timestamp)
+  entries = []
+  for zip_path, fs_path in input_tuples:
+    if zip_prefix_path:
+      zip_path = os.path.join(zip_prefix_path, zip_path)
+    compress = compress_fn(zip_path) if compress_fn else None
+    entries.append((zip_path, fs_path, compress, date_time))
+
   try:
-    for zip_path, fs_path in input_tuples:
-      if zip_prefix_path:
-        zip_path = os.path.join(zip_prefix_path, zip_path)
-      compress = compress_fn(zip_path) if compress_fn else None
-      AddToZipHermetic(out_zip,
-                       zip_path,
-                       src_path=fs_path,
-                       compress=compress,
-                       date_time=date_time)
+    # pylint: disable=protected-access
+    if (num_workers and num_workers > 1 and out_zip._seekable
+        and out_zip.compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)):
+      _DoZipParallel(out_zip, entries, num_workers)
+    else:
+      for zip_path, fs_path, compress, date_time in entries:
+        AddToZipHermetic(out_zip,
+                         zip_path,
+                         src_path=fs_path,
+                         compress=compress,
+                         date_time=date_time)
   finally:
     if output is not out_zip:
       out_zip.close()
 
 
-def ZipDir(output, base_dir, compress_fn=None, zip_prefix_path=None):
+def ZipDir(output,
+           base_dir,
+           compress_fn=None,
+           zip_prefix_path=None,
+           num_workers=None):
   """Creates a zip file from a directory."""
   inputs = []
   for root, _, files in os.walk(base_dir):
@@ -544,7 +779,8 @@ def ZipDir(output, base_dir, compress_fn=None, zip_prefix_path=None):
         output,
         base_dir,
         compress_fn=compress_fn,
-        zip_prefix_path=zip_prefix_path)
+        zip_prefix_path=zip_prefix_path,
+        num_workers=num_workers)
   else:
     with AtomicOutput(output) as f:
       DoZip(
@@ -552,7 +788,61 @@ def ZipDir(output, base_dir, compress_fn=None, zip_prefix_path=None):
           f,
           base_dir,
           compress_fn=compress_fn,
-          zip_prefix_path=zip_prefix_path)
+          zip_prefix_path=zip_prefix_path,
+          num_workers=num_workers)
+
+
+def OverlayZipDir(out_zip, base_zip, overlay_dir, base_path_filter=None):
+  """Adds the entries of |base_zip| overlaid with the files in |overlay_dir|.
+
+  The result is the same as ZipDir() of a directory containing both, without
+  extracting |base_zip|: its entries are copied without being recompressed.
+
+  Args:
+    out_zip: ZipFile instance to add files to.
+    base_zip: Path of the zip whose entries to add.
+    overlay_dir: Directory of files that replace (or are added to) the entries
+        of |base_zip|.
+    base_path_filter: Called for each entry path of |base_zip|. Returns whether
+        to keep the entry.
+  """
+  base_entries = {}
+  for entry in ReadZipCentralDirectory(base_zip):
+    if entry[0][-1] != '/' and (not base_path_filter
+                                or base_path_filter(entry[0])):
+      base_entries[entry[0]] = entry
+  overlay_paths = {}
+  for root, _, files in os.walk(overlay_dir):
+    for f in files:
+      path = os.path.join(root, f)
+      overlay_paths[os.path.relpath(path, overlay_dir)] = path
+
+  date_time = HermeticDateTime()
+  in_zip = None
+  with open(base_zip, 'rb') as in_file:
+    try:
+      for zip_path in sorted(base_entries.keys() | overlay_paths.keys()):
+        src_path = overlay_paths.get(zip_path)
+        if src_path is not None:
+          AddToZipHermetic(out_zip,
+                           zip_path,
+                           src_path=src_path,
+                           date_time=date_time)
+          continue
+        entry = base_entries[zip_path]
+        compress = out_zip.compression != zipfile.ZIP_STORED
+        if _CanCopyZipEntryRaw(out_zip, entry[2], compress):
+          _CopyZipEntryRaw(out_zip, in_file, entry, zip_path)
+          continue
+        if in_zip is None:
+          in_zip = zipfile.ZipFile(base_zip)
+        AddToZipHermetic(out_zip,
+                         zip_path,
+                         data=in_zip.read(zip_path),
+                         date_time=date_time)
+    finally:
+      if in_zip is not None:
+        in_zip.close()
 
 
 def MatchesGlob(path, filters):
@@ -560,9 +850,122 @@ def MatchesGlob(path, filters):
   return filters and any(fnmatch.fnmatch(path, f) for f in filters)
 
 
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_ZIP_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _CanCopyZipEntryRaw(out_zip, compress_type, compress):
+  """Returns whether an entry can be copied without recompressing it."""
+  # pylint: disable=protected-access
+  if not out_zip._seekable:
+    return False
+  if compress_type == zipfile.ZIP_STORED:
+    return not compress
+  if compress_type == zipfile.ZIP_DEFLATED:
+    return compress is None or compress
+  return False
+
+
+def _WriteZipEntryRaw(out_zip, zipinfo, chunks, zip64):
+  """Writes an entry whose CRC, sizes, and compressed data are already known.
+
+  Mirrors ZipFile._open_to_write() & _ZipWriteFile.close() so that the
+  resulting bytes are the same as if ZipFile had compressed the data.
+
+  Args:
+    out_zip: ZipFile (opened for writing to a seekable file) to add to.
+    zipinfo: ZipInfo with CRC, compress_type, compress_size & file_size set.
+    chunks: Iterable of bytes making up the (compressed) entry data.
+    zip64: Whether to write zip64 extra fields.
+  """
+  # pylint: disable=protected-access
+  with out_zip._lock:
+    if out_zip._writing:
+      raise ValueError('Cannot write while another write handle is open.')
+    out_zip.fp.seek(out_zip.start_dir)
+    zipinfo.header_offset = out_zip.fp.tell()
+    out_zip._writecheck(zipinfo)
+    out_zip._didModify = True
+    out_zip.fp.write(zipinfo.FileHeader(zip64))
+    for chunk in chunks:
+      out_zip.fp.write(chunk)
+    out_zip.start_dir = out_zip.fp.tell()
+    out_zip.filelist.append(zipinfo)
+    out_zip.NameToInfo[zipinfo.filename] = zipinfo
+
+
+def _SeekToZipEntryData(in_file, entry):
+  in_file.seek(entry[5])
+  (signature, _, _, _, _, _, _, _, _, filename_len,
+   extra_len) = _ZIP_LOCAL_HEADER.unpack(in_file.read(_ZIP_LOCAL_HEADER.size))
+  if signature != _ZIP_LOCAL_HEADER_SIGNATURE:
+    raise zipfile.BadZipFile('Bad local file header for ' + entry[0])
+  in_file.seek(filename_len + extra_len, os.SEEK_CUR)
+
+
+def ReadZipEntry(in_file, entry):
+  """Returns the uncompressed data of a zip entry.
+
+  Together with ReadZipCentralDirectory(), this allows reading some entries of
+  a large zip without creating a ZipFile (which parses all of its entries).
+
+  Args:
+    in_file: Binary file object of the zip.
+    entry: Tuple as returned by ReadZipCentralDirectory().
+  """
+  _, crc, compress_type, compress_size, file_size, _, _ = entry
+  _SeekToZipEntryData(in_file, entry)
+  data = in_file.read(compress_size)
+  if compress_type == zipfile.ZIP_DEFLATED:
+    data = zlib.decompress(data, -zlib.MAX_WBITS)
+  elif compress_type != zipfile.ZIP_STORED:
+    raise zipfile.BadZipFile('Unsupported compression for ' + entry[0])
+  if len(data) != file_size or zlib.crc32(data) != crc:
+    raise zipfile.BadZipFile('Bad CRC-32 for ' + entry[0])
+  return data
+
+
+def _CopyZipEntryRaw(out_zip, in_file, entry, dst_name):
+  """Copies a zip entry's compressed bytes from |in_file| into |out_zip|.
+
+  Only the local and central directory headers are rewritten (to use
+  hermetic timestamps and |dst_name|). The data and CRC are not re-computed.
+
+  Args:
+    out_zip: ZipFile (opened for writing to a seekable file) to add to.
+    in_file: Binary file object of the input zip.
+    entry: Tuple as returned by ReadZipCentralDirectory().
+    dst_name: Path of the entry within |out_zip|.
+  """
+  _, crc, compress_type, compress_size, file_size, _, _ = entry
+  _SeekToZipEntryData(in_file, entry)
+
+  def iter_chunks():
+    remaining = compress_size
+    while remaining:
+      chunk = in_file.read(min(remaining, _ZIP_COPY_CHUNK_SIZE))
+      if not chunk:
+        raise zipfile.BadZipFile('Truncated data for ' + entry[0])
+      yield chunk
+      remaining -= len(chunk)
+
+  zipinfo = HermeticZipInfo(filename=dst_name)
+  _CheckZipPath(zipinfo.filename)
+  zipinfo.compress_type = compress_type
+  zipinfo.CRC = crc
+  zipinfo.compress_size = compress_size
+  zipinfo.file_size = file_size
+  zip64 = max(compress_size, file_size) > zipfile.ZIP64_LIMIT
+  _WriteZipEntryRaw(out_zip, zipinfo, iter_chunks(), zip64)
+
+
 def MergeZips(output, input_zips, path_transform=None, compress=None):
   """Combines all files from |input_zips| into |output|.
 
+  Entries are copied without being decompressed whenever their compression
+  method already matches |compress|.
+
   Args:
     output: Path, fileobj, or ZipFile instance to add files to.
     input_zips: Iterable of paths to zip files to merge.
@@ -578,36 +981,196 @@ def MergeZips(output, input_zips, path_transform=None, compress=None):
     out_zip = zipfile.ZipFile(output, 'w')
 
   try:
-    for in_file in input_zips:
-      with zipfile.ZipFile(in_file, 'r') as in_zip:
-        for info in in_zip.infolist():
-          # Ignore directories.
-          if info.filename[-1] == '/':
-            continue
-          dst_name = path_transform(info.filename)
-          if not dst_name:
-            continue
-          already_added = dst_name in added_names
-          if not already_added:
+    for in_path in input_zips:
+      in_zip = None
+      with open(in_path, 'rb') as in_file:
+        try:
+          for entry in ReadZipCentralDirectory(in_path):
+            filename = entry[0]
+            # Ignore directories.
+            if filename[-1] == '/':
+              continue
+            dst_name = path_transform(filename)
+            if not dst_name or dst_name in added_names:
+              continue
+            added_names.add(dst_name)
+
+            compress_type = entry[2]
+            if _CanCopyZipEntryRaw(out_zip, compress_type, compress):
+              _CopyZipEntryRaw(out_zip, in_file, entry, dst_name)
+              continue
+
+            if in_zip is None:
+              in_zip = zipfile.ZipFile(in_path, 'r')
             if compress is not None:
               compress_entry = compress
             else:
-              compress_entry = info.compress_type != zipfile.ZIP_STORED
-            AddToZipHermetic(
-                out_zip,
-                dst_name,
-                data=in_zip.read(info),
-                compress=compress_entry)
-            added_names.add(dst_name)
+              compress_entry = compress_type != zipfile.ZIP_STORED
+            AddToZipHermetic(out_zip,
+                             dst_name,
+                             data=in_zip.read(filename),
+                             compress=compress_entry)
+        finally:
+          if in_zip is not None:
+            in_zip.close()
   finally:
     if output is not out_zip:
       out_zip.close()
 
 
+class DependencyCycleError(Exception):
+  """Raised when a dependency graph is not acyclic."""
+
+  def __init__(self, cycle):
+    super().__init__('Dependency cycle: ' + ' -> '.join(str(n) for n in cycle))
+    self.cycle = cycle
+
+
+def _VisitDepthFirst(top, deps_func, done, out, known_closure_func=None):
+  """Appends the transitive deps of |top| not in |done| to |out| in DFS order.
+
+  Uses an explicit stack since dependency chains can be deeper than the
+  recursion limit.
+
+  Args:
+    top: A list of the top level nodes.
+    deps_func: A function that takes a node and returns a list of its direct
+        dependencies.
+    done: A dict of visited nodes, which must be closed under dependencies.
+        Updated with all nodes appended to |out|.
+    out: A list to append nodes to.
+    known_closure_func: An optional function that takes a node and returns its
+        sorted transitive dependencies if known, or None.
+  """
+  # Hot loop, so avoids attribute lookups where possible.
+  out_append = out.append
+  # Nodes whose dependencies are being visited, outermost first.
+  in_progress = {}
+  # (node, iterator over its remaining deps) for the ancestors of |node|.
+  stack = []
+  push = stack.append
+  pop = stack.pop
+
+  def splice(closure):
+    # Same as visiting the node since |done| is closed under dependencies.
+    for dep in closure:
+      if dep not in done:
+        done[dep] = None
+        out_append(dep)
+
+  for node in top:
+    if node in done:
+      continue
+    if known_closure_func:
+      known = known_closure_func(node)
+      if known is not None:
+        splice(known)
+        continue
+    in_progress[node] = None
+    deps_iter = iter(deps_func(node))
+    while True:
+      for dep in deps_iter:
+        if dep in done:
+          continue
+        if dep in in_progress:
+          path = list(in_progress)
+          raise DependencyCycleError(path[path.index(dep):] + [dep])
+        if known_closure_func:
+          known = known_closure_func(dep)
+          if known is not None:
+            splice(known)
+            continue
+        in_progress[dep] = None
+        push((node, deps_iter))
+        node = dep
+        deps_iter = iter(deps_func(dep))
+        break
+      else:
+        del in_progress[node]
+        done[node] = None
+        out_append(node)
+        if not stack:
+          break
+        node, deps_iter = pop()
+
+
+class TransitiveDependencies:
+  """Computes transitive dependencies in sorted order, with memoization.
+
+  The results of Get() and GetSorted() are memoized, and later traversals
+  splice in memoized closures of single nodes instead of revisiting their
+  dependencies. Closures of intermediate nodes are not memoized, which keeps
+  memory linear in the size of the results rather than quadratic in the size
+  of the graph.
+  """
+
+  def __init__(self, deps_func, known_closure_func=None):
+    """Initializes the instance.
+
+    Args:
+      deps_func: A function that takes a node and returns a list of its direct
+          dependencies. Called at most once per node.
+      known_closure_func: An optional function that takes a node and returns
+          its sorted transitive dependencies (ending with the node itself) if
+          they are known from elsewhere, or None.
+    """
+    self._deps_func = deps_func
+    self._known_closure_func = known_closure_func
+    self._deps_cache = {}
+    # Node -> tuple of its transitive deps.
+    self._closures = {}
+    # Tuple of top level nodes -> tuple of their transitive deps.
+    self._sorted_deps = {}
+
+  def _GetDeps(self, node):
+    ret = self._deps_cache.get(node)
+    if ret is None:
+      ret = self._deps_func(node)
+      self._deps_cache[node] = ret
+    return ret
+
+  def _GetKnownClosure(self, node):
+    ret = self._closures.get(node)
+    if ret is None and self._known_closure_func:
+      ret = self._known_closure_func(node)
+      if ret is not None:
+        ret = tuple(ret)
+        self._closures[node] = ret
+    return ret
+
+  def _Visit(self, top):
+    out = []
+    known_closure_func = None
+    if self._closures or self._known_closure_func:
+      known_closure_func = self._GetKnownClosure
+    _VisitDepthFirst(top, self._GetDeps, {}, out, known_closure_func)
+    return tuple(out)
+
+  def Get(self, node):
+    """Returns the transitive dependencies of |node|, ending with |node|."""
+    ret = self._GetKnownClosure(node)
+    if ret is None:
+      ret = self._Visit([node])
+      self._closures[node] = ret
+    return list(ret)
+
+  def GetSorted(self, top):
+    """Returns the transitive dependencies of all nodes in |top|.
+
+    Equivalent to GetSortedTransitiveDependencies(top, deps_func).
+    """
+    top = tuple(top)
+    ret = self._sorted_deps.get(top)
+    if ret is None:
+      ret = self._Visit(top)
+      self._sorted_deps[top] = ret
+    return list(ret)
+
+
 def GetSortedTransitiveDependencies(top, deps_func):
   """Gets the list of all transitive dependencies in sorted order.
 
-  There should be no cycles in the dependency graph (crashes if cycles exist).
+  Use TransitiveDependencies to run several queries over the same graph.
 
   Args:
     top: A list of the top level nodes
@@ -616,19 +1179,13 @@ def GetSortedTransitiveDependencies(top, deps_func):
   Returns:
     A list of all transitive dependencies of nodes in top, in order (a node will
     appear in the list at a higher index than all of its dependencies).
+  Raises:
+    DependencyCycleError: If a cycle is reachable from |top|.
   """
   # Find all deps depth-first, maintaining original order in the case of ties.
-  deps_map = collections.OrderedDict()
-  def discover(nodes):
-    for node in nodes:
-      if node in deps_map:
-        continue
-      deps = deps_func(node)
-      discover(deps)
-      deps_map[node] = deps
-
-  discover(top)
-  return list(deps_map)
+  out = []
+  _VisitDepthFirst(top, deps_func, {}, out)
+  return out
 
 
 def InitLogging(enabling_env):
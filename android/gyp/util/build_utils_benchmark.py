@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Micro-benchmarks for build_utils helpers.
+
+Run with:
+  build/android/gyp/util/build_utils_benchmark.py [--benchmark NAME]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+import zipfile
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+
+
+def _CreateSyntheticJar(path, num_entries):
+  with zipfile.ZipFile(path, 'w') as z:
+    for i in range(num_entries):
+      name = 'org/chromium/pkg%d/Class%d.class' % (i % 100, i)
+      z.writestr(name, b'\xca\xfe\xba\xbe' + name.encode('ascii'))
+
+
+def _Report(name, func, repeat):
+  times = timeit.repeat(func, number=1, repeat=repeat)
+  print('{:<40} min={:.1f}ms'.format(name, min(times) * 1000))
+
+
+def _BenchmarkReadZipCentralDirectory(tmp_dir, args):
+  jar_path = os.path.join(tmp_dir, 'synthetic.jar')
+  _CreateSyntheticJar(jar_path, args.num_entries)
+  print('Synthetic jar with {} entries ({} bytes)'.format(
+      args.num_entries, os.path.getsize(jar_path)))
+
+  def zipfile_infolist():
+    with zipfile.ZipFile(jar_path) as z:
+      return [(i.filename, i.CRC) for i in z.infolist()]
+
+  def read_central_directory():
+    return [(e[0], e[1])
+            for e in build_utils.ReadZipCentralDirectory(jar_path)]
+
+  assert zipfile_infolist() == read_central_directory()
+  _Report('zipfile.ZipFile.infolist()', zipfile_infolist, args.repeat)
+  _Report('build_utils.ReadZipCentralDirectory()', read_central_directory,
+          args.repeat)
+
+
+def _BenchmarkMergeZips(tmp_dir, args):
+  jar_path = os.path.join(tmp_dir, 'synthetic.jar')
+  output_path = os.path.join(tmp_dir, 'merged.jar')
+  with zipfile.ZipFile(jar_path, 'w', zipfile.ZIP_DEFLATED) as z:
+    for i in range(args.num_entries):
+      name = 'org/chromium/pkg%d/Class%d.class' % (i % 100, i)
+      z.writestr(name, b'\xca\xfe\xba\xbe' + name.encode('ascii') * 20)
+  print('Synthetic jar with {} deflated entries ({} bytes)'.format(
+      args.num_entries, os.path.getsize(jar_path)))
+
+  _Report('MergeZips() (raw copy)',
+          lambda: build_utils.MergeZips(output_path, [jar_path]), args.repeat)
+  _Report(
+      'MergeZips(compress=False) (recompress)',
+      lambda: build_utils.MergeZips(output_path, [jar_path], compress=False),
+      args.repeat)
+
+
+def _BenchmarkZipDir(tmp_dir, args):
+  src_dir = os.path.join(tmp_dir, 'tree')
+  output_path = os.path.join(tmp_dir, 'tree.zip')
+  for i in range(args.num_entries):
+    path = os.path.join(src_dir, 'pkg%d' % (i % 100), 'File%d.java' % i)
+    if i < 100:
+      build_utils.MakeDirectory(os.path.dirname(path))
+    with open(path, 'wb') as f:
+      f.write(os.urandom(256) + b'package org.chromium;\n' * (i % 200))
+  print('Generated tree with {} files'.format(args.num_entries))
+
+  def zip_dir(num_workers):
+    build_utils.ZipDir(output_path,
+                       src_dir,
+                       compress_fn=lambda _: True,
+                       num_workers=num_workers)
+
+  _Report('ZipDir() (serial)', lambda: zip_dir(None), args.repeat)
+  _Report('ZipDir(num_workers={})'.format(args.num_workers),
+          lambda: zip_dir(args.num_workers), args.repeat)
+
+
+def _CreateSyntheticDag(num_nodes, max_deps=3, window=500):
+  # Like a build graph: nodes mostly depend on nearby (i.e. related) nodes.
+  rand = random.Random(0)
+  deps = []
+  for i in range(num_nodes):
+    lo = max(0, i - window)
+    deps.append(rand.sample(range(lo, i), min(i - lo, rand.randint(0,
+                                                                   max_deps))))
+  return deps
+
+
+def _BenchmarkTransitiveDependencies(tmp_dir, args):
+  del tmp_dir  # Unused.
+  deps = _CreateSyntheticDag(args.num_entries)
+  # As in write_build_config.py: queries for the direct deps of targets.
+  queries = [deps[i] for i in range(0, args.num_entries, 500)]
+  print('Synthetic DAG with {} nodes, {} queries'.format(
+      args.num_entries, len(queries)))
+
+  def one_off():
+    return [
+        build_utils.GetSortedTransitiveDependencies(q, deps.__getitem__)
+        for q in queries
+    ]
+
+  transitive_deps = build_utils.TransitiveDependencies(deps.__getitem__)
+
+  def memoized():
+    return [transitive_deps.GetSorted(q) for q in queries]
+
+  def memoized_first_pass():
+    nonlocal transitive_deps
+    transitive_deps = build_utils.TransitiveDependencies(deps.__getitem__)
+    return memoized()
+
+  assert one_off() == memoized_first_pass()
+  _Report('GetSortedTransitiveDependencies()', one_off, args.repeat)
+  _Report('TransitiveDependencies (first pass)', memoized_first_pass,
+          args.repeat)
+  _Report('TransitiveDependencies (repeated)', memoized, args.repeat)
+  _Report(
+      'GetSortedTransitiveDependencies(all)',
+      lambda: build_utils.GetSortedTransitiveDependencies(
+          range(args.num_entries - 1, -1, -1), deps.__getitem__), args.repeat)
+
+
+_BENCHMARKS = {
+    'central_directory': _BenchmarkReadZipCentralDirectory,
+    'merge_zips': _BenchmarkMergeZips,
+    'transitive_deps': _BenchmarkTransitiveDependencies,
+    'zip_dir': _BenchmarkZipDir,
+}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--benchmark',
+                      choices=sorted(_BENCHMARKS),
+                      action='append',
+                      help='Benchmarks to run (default: all).')
+  parser.add_argument('--num-entries',
+                      type=int,
+                      default=50000,
+                      help='Number of entries in synthetic archives and '
+                      'graphs.')
+  parser.add_argument('--num-workers',
+                      type=int,
+                      default=os.cpu_count(),
+                      help='Number of threads for parallel benchmarks.')
+  parser.add_argument('--repeat',
+                      type=int,
+                      default=5,
+                      help='Number of timed runs per benchmark.')
+  args = parser.parse_args()
+
+  with build_utils.TempDir() as tmp_dir:
+    for name in args.benchmark or sorted(_BENCHMARKS):
+      print('== ' + name)
+      _BENCHMARKS[name](tmp_dir, args)
+
+
+if __name__ == '__main__':
+  main()
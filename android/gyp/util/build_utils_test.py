@@ -6,7 +6,9 @@
 import collections
 import os
 import sys
+import tempfile
 import unittest
+import zipfile
 
 sys.path.insert(
     0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
@@ -43,6 +45,205 @@ class BuildUtilsTest(unittest.TestCase):
     actual = build_utils.GetSortedTransitiveDependencies(TOP, _DEPS.get)
     self.assertEqual(EXPECTED, actual)
 
+  def testGetSortedTransitiveDependencies_deepChain(self):
+    num_nodes = sys.getrecursionlimit() * 2
+    actual = build_utils.GetSortedTransitiveDependencies(
+        [num_nodes - 1], lambda n: [n - 1] if n else [])
+    self.assertEqual(list(range(num_nodes)), actual)
+
+  def testGetSortedTransitiveDependencies_cycle(self):
+    deps = {'a': ['b'], 'b': ['c', 'd'], 'c': [], 'd': ['e'], 'e': ['b']}
+    with self.assertRaises(build_utils.DependencyCycleError) as cm:
+      build_utils.GetSortedTransitiveDependencies(['a'], deps.get)
+    self.assertEqual(['b', 'd', 'e', 'b'], cm.exception.cycle)
+
+  def testTransitiveDependencies(self):
+    calls = []
+
+    def deps_func(node):
+      calls.append(node)
+      return _DEPS[node]
+
+    transitive_deps = build_utils.TransitiveDependencies(deps_func)
+    self.assertEqual(['a', 'd', 'f'], transitive_deps.Get('f'))
+    for top in (['c', 'e', 'g', 'h', 'i'], ['i', 'h', 'g', 'e', 'c'], ['f'],
+                ['h', 'i'], ['h', 'i']):
+      self.assertEqual(
+          build_utils.GetSortedTransitiveDependencies(top, _DEPS.get),
+          transitive_deps.GetSorted(top))
+    self.assertEqual(['a', 'd', 'f', 'e'], transitive_deps.Get('e'))
+    # Each node's deps are requested only once.
+    self.assertEqual(sorted(set(calls)), sorted(calls))
+
+  def testTransitiveDependencies_knownClosure(self):
+    known = {'f': ['x', 'f']}
+    transitive_deps = build_utils.TransitiveDependencies(
+        _DEPS.get, known_closure_func=known.get)
+    self.assertEqual(['x', 'f', 'i'], transitive_deps.Get('i'))
+
+  def testReadZipCentralDirectory(self):
+    with tempfile.NamedTemporaryFile(suffix='.zip') as f:
+      with zipfile.ZipFile(f, 'w') as z:
+        z.writestr('dir/', '')
+        z.writestr('dir/a.txt', 'a' * 100, zipfile.ZIP_DEFLATED)
+        z.writestr('b.txt', 'b')
+        z.writestr('\u00fcnicode.txt', '')
+        with z.open('zip64.txt', 'w', force_zip64=True) as entry:
+          entry.write(b'zip64')
+        z.comment = b'comment'
+      f.flush()
+
+      with zipfile.ZipFile(f.name) as z:
+        expected = [(i.filename, i.CRC, i.compress_type, i.compress_size,
+                     i.file_size, i.header_offset, i.external_attr)
+                    for i in z.infolist()]
+      actual = build_utils.ReadZipCentralDirectory(f.name)
+    self.assertEqual(expected, actual)
+
+  def testReadZipEntry(self):
+    with tempfile.NamedTemporaryFile(suffix='.zip') as f:
+      with zipfile.ZipFile(f, 'w') as z:
+        z.writestr('stored.txt', 'stored')
+        z.writestr('deflated.txt', 'a' * 100, zipfile.ZIP_DEFLATED)
+      f.flush()
+      entries = build_utils.ReadZipCentralDirectory(f.name)
+      with open(f.name, 'rb') as in_file:
+        self.assertEqual(
+            [b'stored', b'a' * 100],
+            [build_utils.ReadZipEntry(in_file, e) for e in entries])
+
+  def testReadZipCentralDirectory_invalid(self):
+    with tempfile.NamedTemporaryFile(suffix='.zip') as f:
+      f.write(b'not a zip file')
+      f.flush()
+      with self.assertRaises(zipfile.BadZipFile):
+        build_utils.ReadZipCentralDirectory(f.name)
+
+  def testMergeZips(self):
+    with build_utils.TempDir() as tmp_dir:
+      zip1 = os.path.join(tmp_dir, '1.zip')
+      zip2 = os.path.join(tmp_dir, '2.zip')
+      output = os.path.join(tmp_dir, 'out.zip')
+      with zipfile.ZipFile(zip1, 'w') as z:
+        z.writestr('dir/', '')
+        z.writestr('dir/deflated.txt', 'a' * 100, zipfile.ZIP_DEFLATED)
+        z.writestr('stored.txt', 'b' * 100)
+      with zipfile.ZipFile(zip2, 'w') as z:
+        z.writestr('dir/deflated.txt', 'duplicate', zipfile.ZIP_DEFLATED)
+        z.writestr('renamed.txt', 'c' * 100, zipfile.ZIP_DEFLATED)
+        z.writestr('skipped.txt', 'd')
+
+      def path_transform(path):
+        if path == 'skipped.txt':
+          return None
+        if path == 'renamed.txt':
+          return 'dir/renamed.txt'
+        return path
+
+      for compress in (None, True, False):
+        build_utils.MergeZips(output, [zip1, zip2],
+                              path_transform=path_transform,
+                              compress=compress)
+        with zipfile.ZipFile(output) as z:
+          self.assertIsNone(z.testzip())
+          infos = z.infolist()
+          self.assertEqual(
+              ['dir/deflated.txt', 'stored.txt', 'dir/renamed.txt'],
+              [i.filename for i in infos])
+          self.assertEqual(b'a' * 100, z.read('dir/deflated.txt'))
+          self.assertEqual(b'c' * 100, z.read('dir/renamed.txt'))
+          for info in infos:
+            self.assertEqual(build_utils.HermeticDateTime(), info.date_time)
+            if compress is None:
+              expected_type = (zipfile.ZIP_STORED if info.filename ==
+                               'stored.txt' else zipfile.ZIP_DEFLATED)
+            elif compress:
+              expected_type = zipfile.ZIP_DEFLATED
+            else:
+              expected_type = zipfile.ZIP_STORED
+            self.assertEqual(expected_type, info.compress_type, info.filename)
+
+  def testDoZip_parallelMatchesSerial(self):
+    with build_utils.TempDir() as tmp_dir:
+      src_dir = os.path.join(tmp_dir, 'src')
+      for i in range(50):
+        path = os.path.join(src_dir, 'dir%d' % (i % 3), 'file%d.txt' % i)
+        build_utils.MakeDirectory(os.path.dirname(path))
+        with open(path, 'w') as f:
+          f.write(str(i) * (i * 100))
+      os.chmod(os.path.join(src_dir, 'dir1', 'file1.txt'), 0o755)
+      os.symlink('file0.txt', os.path.join(src_dir, 'dir0', 'link.txt'))
+
+      def compress_fn(path):
+        return not path.endswith('5.txt')
+
+      serial_path = os.path.join(tmp_dir, 'serial.zip')
+      parallel_path = os.path.join(tmp_dir, 'parallel.zip')
+      build_utils.ZipDir(serial_path, src_dir, compress_fn=compress_fn)
+      build_utils.ZipDir(parallel_path,
+                         src_dir,
+                         compress_fn=compress_fn,
+                         num_workers=4)
+      with open(serial_path, 'rb') as f:
+        serial_data = f.read()
+      with open(parallel_path, 'rb') as f:
+        parallel_data = f.read()
+      self.assertEqual(serial_data, parallel_data)
+      with zipfile.ZipFile(parallel_path) as z:
+        self.assertIsNone(z.testzip())
+
+  def testOverlayZipDir(self):
+    with build_utils.TempDir() as tmp_dir:
+
+      def write_files(root_dir, files):
+        for path, data in files.items():
+          path = os.path.join(root_dir, path)
+          build_utils.MakeDirectory(os.path.dirname(path))
+          with open(path, 'w') as f:
+            f.write(data)
+        return root_dir
+
+      base_dir = write_files(
+          os.path.join(tmp_dir, 'base'), {
+              'a.class': 'a' * 100,
+              'b.class': 'old b',
+              'removed.class': 'removed',
+              'META-INF/MANIFEST.MF': 'manifest',
+          })
+      overlay_dir = write_files(os.path.join(tmp_dir, 'overlay'), {
+          'b.class': 'new b',
+          'c/d.class': 'd' * 100,
+      })
+      merged_dir = write_files(os.path.join(tmp_dir, 'merged'), {
+          'a.class': 'a' * 100,
+          'b.class': 'new b',
+          'c/d.class': 'd' * 100,
+      })
+      expected_zip = os.path.join(tmp_dir, 'expected.zip')
+      build_utils.ZipDir(expected_zip, merged_dir)
+
+      base_zip = os.path.join(tmp_dir, 'base.zip')
+      output = os.path.join(tmp_dir, 'out.zip')
+      # Entries are copied raw only when their compression matches.
+      for base_compress in (False, True):
+        build_utils.ZipDir(base_zip,
+                           base_dir,
+                           compress_fn=lambda _: base_compress)
+        for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+          with zipfile.ZipFile(output, 'w', compression) as z:
+            build_utils.OverlayZipDir(
+                z,
+                base_zip,
+                overlay_dir,
+                base_path_filter=lambda p: p != 'META-INF/MANIFEST.MF' and p
+                != 'removed.class')
+          with zipfile.ZipFile(output) as z, zipfile.ZipFile(
+              expected_zip) as expected:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(expected.namelist(), z.namelist())
+            for name in z.namelist():
+              self.assertEqual(expected.read(name), z.read(name), name)
+
 
 if __name__ == '__main__':
   unittest.main()
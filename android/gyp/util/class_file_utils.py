@@ -0,0 +1,167 @@
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Extracts dependency information from .class files.
+
+Only the parts of the class file format needed to find referenced classes,
+supertypes and compile-time constants are parsed:
+https://docs.oracle.com/javase/specs/jvms/se11/html/jvms-4.html
+"""
+
+import collections
+import hashlib
+import re
+import struct
+
+_MAGIC = b'\xca\xfe\xba\xbe'
+
+_CONSTANT_UTF8 = 1
+_CONSTANT_INTEGER = 3
+_CONSTANT_FLOAT = 4
+_CONSTANT_LONG = 5
+_CONSTANT_DOUBLE = 6
+_CONSTANT_CLASS = 7
+_CONSTANT_STRING = 8
+
+# Sizes of constant pool entries other than CONSTANT_Utf8, by tag.
+_CONSTANT_SIZES = {
+    _CONSTANT_INTEGER: 4,
+    _CONSTANT_FLOAT: 4,
+    _CONSTANT_LONG: 8,
+    _CONSTANT_DOUBLE: 8,
+    _CONSTANT_CLASS: 2,
+    _CONSTANT_STRING: 2,
+    9: 4,  # Fieldref
+    10: 4,  # Methodref
+    11: 4,  # InterfaceMethodref
+    12: 4,  # NameAndType
+    15: 3,  # MethodHandle
+    16: 2,  # MethodType
+    17: 4,  # Dynamic
+    18: 4,  # InvokeDynamic
+    19: 2,  # Module
+    20: 2,  # Package
+}
+
+_ACC_PRIVATE = 0x0002
+
+# Class names in field, method and generic signature descriptors.
+_DESCRIPTOR_CLASS_RE = re.compile(rb'L([^;<>\[()]+)[;<]')
+
+_U2 = struct.Struct('>H')
+_FIELD = struct.Struct('>HHHH')
+_ATTRIBUTE = struct.Struct('>HI')
+
+ClassInfo = collections.namedtuple(
+    'ClassInfo',
+    [
+        # Internal name of the class (e.g. "org/chromium/Foo$Bar").
+        'name',
+        # Internal names of the superclass and interfaces.
+        'supertypes',
+        # Internal names of all classes that the class mentions.
+        'references',
+        # Digest of the values of non-private constant fields, or None if there
+        # are none. Compilers inline these into other classes.
+        'constants_digest',
+    ])
+
+
+def _ParseConstantPool(data):
+  """Returns a list of (tag, value) indexed by constant pool index.
+
+  value is the bytes of CONSTANT_Utf8 entries, the name index of
+  CONSTANT_Class and CONSTANT_String entries, and the raw bytes of others.
+  """
+  (count, ) = _U2.unpack_from(data, 8)
+  pool = [None] * count
+  pos = 10
+  i = 1
+  while i < count:
+    tag = data[pos]
+    if tag == _CONSTANT_UTF8:
+      (length, ) = _U2.unpack_from(data, pos + 1)
+      pool[i] = (tag, data[pos + 3:pos + 3 + length])
+      pos += 3 + length
+    elif tag in (_CONSTANT_CLASS, _CONSTANT_STRING):
+      pool[i] = (tag, _U2.unpack_from(data, pos + 1)[0])
+      pos += 3
+    else:
+      size = _CONSTANT_SIZES.get(tag)
+      if size is None:
+        raise ValueError('Unknown constant pool tag: %d' % tag)
+      pool[i] = (tag, data[pos + 1:pos + 1 + size])
+      pos += 1 + size
+      if tag in (_CONSTANT_LONG, _CONSTANT_DOUBLE):
+        # These take two slots.
+        i += 1
+    i += 1
+  return pool, pos
+
+
+def _ClassName(pool, index):
+  return pool[pool[index][1]][1].decode('utf-8')
+
+
+def ParseClassFile(data):
+  """Returns the ClassInfo for the given .class file contents."""
+  if data[:4] != _MAGIC:
+    raise ValueError('Not a class file')
+  pool, pos = _ParseConstantPool(data)
+
+  references = set()
+  for entry in pool:
+    if entry is None:
+      continue
+    tag, value = entry
+    if tag == _CONSTANT_CLASS:
+      name = pool[value][1]
+      if name.startswith(b'['):
+        references.update(_DESCRIPTOR_CLASS_RE.findall(name))
+      else:
+        references.add(name)
+    elif tag == _CONSTANT_UTF8 and b'L' in value:
+      # Over-approximates, since it also matches string literals.
+      references.update(_DESCRIPTOR_CLASS_RE.findall(value))
+
+  _, this_class, super_class = struct.unpack_from('>HHH', data, pos)
+  pos += 6
+  (num_interfaces, ) = _U2.unpack_from(data, pos)
+  pos += 2
+  supertypes = [_ClassName(pool, super_class)] if super_class else []
+  for i in range(num_interfaces):
+    supertypes.append(_ClassName(pool, _U2.unpack_from(data, pos + 2 * i)[0]))
+  pos += 2 * num_interfaces
+
+  constants = []
+  (num_fields, ) = _U2.unpack_from(data, pos)
+  pos += 2
+  for _ in range(num_fields):
+    access_flags, name_index, descriptor_index, num_attributes = (
+        _FIELD.unpack_from(data, pos))
+    pos += _FIELD.size
+    for _ in range(num_attributes):
+      attribute_name_index, length = _ATTRIBUTE.unpack_from(data, pos)
+      pos += _ATTRIBUTE.size
+      if (not access_flags & _ACC_PRIVATE
+          and pool[attribute_name_index][1] == b'ConstantValue'):
+        tag, value = pool[_U2.unpack_from(data, pos)[0]]
+        if tag == _CONSTANT_STRING:
+          value = pool[value][1]
+        constants.append((pool[name_index][1], pool[descriptor_index][1],
+                          bytes([tag]), value))
+      pos += length
+
+  constants_digest = None
+  if constants:
+    md5 = hashlib.md5()
+    for constant in sorted(constants):
+      for part in constant:
+        md5.update(_U2.pack(len(part)))
+        md5.update(part)
+    constants_digest = md5.hexdigest()
+
+  name = _ClassName(pool, this_class)
+  references = {r.decode('utf-8') for r in references}
+  references.discard(name)
+  return ClassInfo(name, supertypes, references, constants_digest)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import class_file_utils
+
+_ACC_PUBLIC = 0x0001
+_ACC_PRIVATE = 0x0002
+_ACC_STATIC_FINAL = 0x0018
+
+
+class _ClassFileBuilder:
+  """Assembles minimal .class files, since no compiler is available."""
+
+  def __init__(self):
+    self._pool = []
+
+  def _Add(self, entry):
+    self._pool.append(entry)
+    return len(self._pool)
+
+  def Utf8(self, value):
+    value = value.encode('utf-8')
+    return self._Add(b'\x01' + struct.pack('>H', len(value)) + value)
+
+  def Class(self, name):
+    return self._Add(b'\x07' + struct.pack('>H', self.Utf8(name)))
+
+  def Int(self, value):
+    return self._Add(b'\x03' + struct.pack('>i', value))
+
+  def Long(self, value):
+    ret = self._Add(b'\x05' + struct.pack('>q', value))
+    # Longs take two slots.
+    self._pool.append(b'')
+    return ret
+
+  def String(self, value):
+    return self._Add(b'\x08' + struct.pack('>H', self.Utf8(value)))
+
+  def Build(self, name, super_name, interfaces=(), fields=()):
+    """Returns the class file bytes.
+
+    Args:
+      fields: List of (access_flags, name, descriptor, constant_index or None).
+    """
+    this_class = self.Class(name)
+    super_class = self.Class(super_name)
+    interface_indices = [self.Class(i) for i in interfaces]
+    field_data = b''
+    for access_flags, field_name, descriptor, constant_index in fields:
+      field_data += struct.pack('>HHH', access_flags, self.Utf8(field_name),
+                                self.Utf8(descriptor))
+      if constant_index is None:
+        field_data += struct.pack('>H', 0)
+      else:
+        field_data += struct.pack('>HHIH', 1, self.Utf8('ConstantValue'), 2,
+                                  constant_index)
+    data = b'\xca\xfe\xba\xbe' + struct.pack('>HHH', 0, 55, len(self._pool) + 1)
+    data += b''.join(self._pool)
+    data += struct.pack('>HHHH', _ACC_PUBLIC, this_class, super_class,
+                        len(interface_indices))
+    data += b''.join(struct.pack('>H', i) for i in interface_indices)
+    data += struct.pack('>H', len(fields)) + field_data
+    # Methods and attributes.
+    data += struct.pack('>HH', 0, 0)
+    return data
+
+
+def _BuildClass(constants=(), private_constants=()):
+  builder = _ClassFileBuilder()
+  builder.Long(1)
+  builder.Utf8('(Ljava/util/List<Lorg/Bar;>;[Lorg/Baz;)V')
+  builder.Class('[[Lorg/Array;')
+  builder.Class('org/Foo$Inner')
+  fields = [(_ACC_PUBLIC | _ACC_STATIC_FINAL, n, 'I', builder.Int(v))
+            for n, v in constants]
+  fields += [(_ACC_PRIVATE | _ACC_STATIC_FINAL, n, 'Ljava/lang/String;',
+              builder.String(v)) for n, v in private_constants]
+  fields.append((_ACC_PUBLIC, 'mField', 'Lorg/Field;', None))
+  return builder.Build('org/Foo', 'java/lang/Object', ['org/Iface'], fields)
+
+
+class ClassFileUtilsTest(unittest.TestCase):
+  def testParseClassFile(self):
+    info = class_file_utils.ParseClassFile(_BuildClass())
+    self.assertEqual('org/Foo', info.name)
+    self.assertEqual(['java/lang/Object', 'org/Iface'], info.supertypes)
+    self.assertEqual(
+        {
+            'java/lang/Object', 'org/Iface', 'java/util/List', 'org/Bar',
+            'org/Baz', 'org/Array', 'org/Foo$Inner', 'org/Field'
+        }, info.references)
+    self.assertIsNone(info.constants_digest)
+
+  def testConstantsDigest(self):
+    digest = class_file_utils.ParseClassFile(
+        _BuildClass(constants=[('A', 1), ('B', 2)])).constants_digest
+    self.assertIsNotNone(digest)
+    # Order and private constants do not matter.
+    self.assertEqual(
+        digest,
+        class_file_utils.ParseClassFile(
+            _BuildClass(constants=[('B', 2), ('A', 1)],
+                        private_constants=[('C', 'c')])).constants_digest)
+    self.assertNotEqual(
+        digest,
+        class_file_utils.ParseClassFile(
+            _BuildClass(constants=[('A', 1), ('B', 3)])).constants_digest)
+
+  def testNotAClassFile(self):
+    with self.assertRaises(ValueError):
+      class_file_utils.ParseClassFile(b'PK\x03\x04')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""A stand-in for PersistentWorker.java that runs Python tools.
+
+Speaks the same protocol as PersistentWorker.java (see persistent_worker.py),
+but MAIN_CLASS is the path to a Python file whose main(argv) is called for
+each request. Used to test persistent_worker.py without a JDK.
+
+Usage:
+  fake_persistent_worker.py SOCKET_PATH MAIN_CLASS IDLE_TIMEOUT_SECONDS
+"""
+
+import contextlib
+import importlib.util
+import io
+import os
+import socket
+import struct
+import sys
+import traceback
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import persistent_worker
+
+
+def _LoadTool(path):
+  spec = importlib.util.spec_from_file_location('fake_tool', path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+def _RunTool(tool, cwd, argv):
+  stdout = io.StringIO()
+  stderr = io.StringIO()
+  exit_code = 0
+  orig_cwd = os.getcwd()
+  # Unlike the JVM, Python can honor a per-request working directory.
+  os.chdir(cwd)
+  try:
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+      try:
+        tool.main(argv)
+      except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+      except Exception:  # pylint: disable=broad-except
+        traceback.print_exc()
+        exit_code = 1
+  finally:
+    os.chdir(orig_cwd)
+  return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+def main(argv):
+  socket_path, tool_path, idle_timeout = argv
+  tool = _LoadTool(tool_path)
+  with socket.socket(socket.AF_UNIX) as server:
+    server.bind(socket_path)
+    server.listen()
+    server.settimeout(float(idle_timeout))
+    while True:
+      try:
+        conn = server.accept()[0]
+      except socket.timeout:
+        os.unlink(socket_path)
+        break
+      with conn:
+        conn.settimeout(None)
+        request = persistent_worker.ReceiveRequest(conn)
+        if not request:
+          # Like PersistentWorker.java, removes the socket before closing the
+          # connection.
+          os.unlink(socket_path)
+          break
+        conn.sendall(struct.pack('>I', 0))
+        exit_code, stdout, stderr = _RunTool(tool, request[0], request[1:])
+        persistent_worker.SendResponse(conn, 0, exit_code, stdout, stderr)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
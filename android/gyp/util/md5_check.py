@@ -8,9 +8,18 @@ import difflib
 import hashlib
 import itertools
 import json
+import logging
+import mmap
 import os
+import sqlite3
+import struct
 import sys
-import zipfile
+import time
+
+try:
+  import xxhash
+except ImportError:
+  xxhash = None
 
 from util import build_utils
 
@@ -23,6 +32,24 @@ PRINT_EXPLANATIONS = int(os.environ.get('PRINT_BUILD_EXPLANATIONS', 0))
 # An escape hatch that causes all targets to be rebuilt.
 _FORCE_REBUILD = int(os.environ.get('FORCE_REBUILD', 0))
 
+# Directory (relative to the output directory) in which file digests are
+# memoized across actions. Set to an empty string to disable.
+_DIGEST_CACHE_DIR = os.environ.get('MD5_CHECK_DIGEST_CACHE_DIR',
+                                   '.md5_check_digests')
+
+# Name of the hash used for file tags. Included in the digest cache's table
+# name so that installing / removing xxhash does not mix digests.
+_HASH_NAME = 'xxh3' if xxhash is not None else 'blake2b'
+# Bump when changing what the digest cache stores.
+_DIGESTS_TABLE = 'digests_%s_v1' % _HASH_NAME
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Identifies stamp files written by _BinaryMetadata.
+_BINARY_MAGIC = b'MD5STAMP'
+
+# Files modified more recently than this are not added to the digest cache.
+_RACY_MTIME_WINDOW_NS = 2 * 10**9
+
 
 def CallAndWriteDepfileIfStale(on_stale_md5,
                                options,
@@ -85,6 +112,9 @@ def CallAndRecordIfStale(function,
   - the contents of any file within input_paths has changed, or
   - the contents of input_strings has changed.
 
+  File contents are hashed at most once per (path, size, mtime, inode) across
+  all actions of a build (see _DigestCache).
+
   To debug which files are out-of-date, set the environment variable:
       PRINT_MD5_DIFFS=1
 
@@ -115,14 +145,19 @@ def CallAndRecordIfStale(function,
   new_metadata.AddStrings(input_strings)
 
   zip_allowlist = set(track_subpaths_allowlist or [])
-  for path in input_paths:
-    # It's faster to md5 an entire zip file than it is to just locate & hash
-    # its central directory (which is what this used to do).
-    if path in zip_allowlist:
-      entries = _ExtractZipEntries(path)
-      new_metadata.AddZipFile(path, entries)
-    else:
-      new_metadata.AddFile(path, _ComputeTagForPath(path))
+  digest_cache = _DigestCache(_DIGEST_CACHE_DIR)
+  try:
+    for path in input_paths:
+      # It's faster to md5 an entire zip file than it is to just locate & hash
+      # its central directory (which is what this used to do).
+      if path in zip_allowlist:
+        entries = _ExtractZipEntries(path)
+        new_metadata.AddZipFile(path, entries)
+      else:
+        new_metadata.AddFile(path, digest_cache.GetDigest(path))
+    digest_cache.Flush()
+  finally:
+    digest_cache.Close()
 
   old_metadata = None
   force = force or _FORCE_REBUILD
@@ -135,11 +170,10 @@ def CallAndRecordIfStale(function,
     # of the build, and should be considered stale.
     too_new = [x for x in output_paths if os.path.getmtime(x) > record_mtime]
     if not too_new:
-      with open(record_path, 'r') as jsonfile:
-        try:
-          old_metadata = _Metadata.FromFile(jsonfile)
-        except:  # pylint: disable=bare-except
-          pass  # Not yet using new file format.
+      try:
+        old_metadata = _Metadata.FromPath(record_path)
+      except:  # pylint: disable=bare-except
+        pass  # Not yet using new file format.
 
   changes = Changes(old_metadata, new_metadata, force, missing_outputs, too_new)
   if not changes.HasChanges():
@@ -154,7 +188,9 @@ def CallAndRecordIfStale(function,
   args = (changes,) if pass_changes else ()
   function(*args)
 
-  with open(record_path, 'w') as f:
+  # Replace rather than overwrite the record since |old_metadata| may still be
+  # memory-mapped.
+  with build_utils.AtomicOutput(record_path, only_if_changed=False) as f:
     new_metadata.ToFile(f)
 
 
@@ -301,7 +337,8 @@ class _Metadata:
     track_entries: Enables per-file change tracking. Slower, but required for
         Changes functionality.
   """
-  # Schema:
+  # Stamps are written in a binary format (see _BinaryMetadata). Stamps written
+  # by older versions of this script use JSON, which can still be read:
   # {
   #   "files-md5": "VALUE",
   #   "strings-md5": "VALUE",
@@ -328,11 +365,36 @@ class _Metadata:
     # Map of (path, subpath) -> entry. Created upon first call to _GetEntry().
     self._file_map = None
 
+  @classmethod
+  def FromPath(cls, path):
+    """Returns metadata read from the given stamp file.
+
+    Binary stamps are memory-mapped, so only the header is read until
+    per-file information is queried.
+    """
+    with open(path, 'rb') as f:
+      if os.fstat(f.fileno()).st_size < _BinaryMetadata.HEADER.size:
+        return cls.FromFile(f)
+      data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if data[:len(_BINARY_MAGIC)] == _BINARY_MAGIC:
+      return _BinaryMetadata(data)
+    try:
+      return cls._FromJson(data[:])
+    finally:
+      data.close()
+
   @classmethod
   def FromFile(cls, fileobj):
-    """Returns a _Metadata initialized from a file object."""
+    """Returns metadata read from a binary file object."""
+    data = fileobj.read()
+    if data[:len(_BINARY_MAGIC)] == _BINARY_MAGIC:
+      return _BinaryMetadata(data)
+    return cls._FromJson(data)
+
+  @classmethod
+  def _FromJson(cls, data):
     ret = cls()
-    obj = json.load(fileobj)
+    obj = json.loads(data)
     ret._files_md5 = obj['files-md5']
     ret._strings_md5 = obj['strings-md5']
     ret._files = obj.get('input-files', [])
@@ -340,16 +402,15 @@ class _Metadata:
     return ret
 
   def ToFile(self, fileobj):
-    """Serializes metadata to the given file object."""
-    obj = {
-        'files-md5': self.FilesMd5(),
-        'strings-md5': self.StringsMd5(),
-    }
+    """Serializes metadata to the given binary file object."""
+    files = []
+    strings = []
     if self._track_entries:
-      obj['input-files'] = sorted(self._files, key=lambda e: e['path'])
-      obj['input-strings'] = self._strings
-
-    json.dump(obj, fileobj, indent=2)
+      files = sorted(self._files, key=lambda e: e['path'])
+      strings = self._strings
+    fileobj.write(
+        _BinaryMetadata.Serialize(self.FilesMd5(), self.StringsMd5(), files,
+                                  strings))
 
   def _AssertNotQueried(self):
     assert self._files_md5 is None
@@ -439,16 +500,270 @@ class _Metadata:
     return (entry['path'] for entry in subentries)
 
 
-def _ComputeTagForPath(path):
-  stat = os.stat(path)
-  if stat.st_size > 1 * 1024 * 1024:
-    # Fallback to mtime for large files so that md5_check does not take too long
-    # to run.
-    return stat.st_mtime
-  md5 = hashlib.md5()
+class _BinaryMetadata:
+  """Read-only metadata backed by a binary stamp file.
+
+  Supports the same queries as _Metadata. The aggregate md5s are stored in the
+  header so that checking for changes needs no decoding. The per-file table is
+  decoded upon first query, and each zip's entries only when queried for that
+  zip.
+
+  Layout (all integers are little-endian):
+    header: HEADER
+    string offsets: uint32[num_table_strings + 1], relative to the string data
+    string data: UTF-8 bytes of all strings, sorted
+    input strings: uint32[num_input_strings] indices into the string table
+    files: FILE_RECORD[num_files], sorted by path
+    entries: ENTRY_RECORD[num_entries], grouped by file
+  """
+  # magic, version, files_md5, strings_md5, num_table_strings, string_data_size,
+  # num_input_strings, num_files, num_entries.
+  HEADER = struct.Struct('<8sI32s32sIIIII')
+  # path index, tag index, first entry, num entries.
+  FILE_RECORD = struct.Struct('<IIII')
+  # subpath index, tag.
+  ENTRY_RECORD = struct.Struct('<IQ')
+  _VERSION = 1
+
+  def __init__(self, data):
+    (magic, version, files_md5, strings_md5, num_table_strings,
+     string_data_size, num_input_strings, num_files,
+     num_entries) = self.HEADER.unpack_from(data, 0)
+    assert magic == _BINARY_MAGIC
+    if version != self._VERSION:
+      raise Exception('Unsupported stamp version: %d' % version)
+    self._data = data
+    self._files_md5 = files_md5.decode('ascii')
+    self._strings_md5 = strings_md5.decode('ascii')
+    self._num_input_strings = num_input_strings
+    self._num_files = num_files
+    self._offsets_start = self.HEADER.size
+    self._string_data_start = self._offsets_start + 4 * (num_table_strings + 1)
+    self._input_strings_start = self._string_data_start + string_data_size
+    self._files_start = self._input_strings_start + 4 * num_input_strings
+    self._entries_start = (self._files_start +
+                           self.FILE_RECORD.size * num_files)
+    expected_size = self._entries_start + self.ENTRY_RECORD.size * num_entries
+    if len(data) != expected_size:
+      raise Exception('Truncated stamp file.')
+    # Map of path -> (tag, first entry, num entries). Created upon first call
+    # to _GetFileMap().
+    self._file_map = None
+    # Map of path -> {subpath: tag}.
+    self._entry_maps = {}
+
+  @classmethod
+  def Serialize(cls, files_md5, strings_md5, files, strings):
+    """Returns the binary encoding of the given metadata.
+
+    Args:
+      files_md5: Aggregate md5 of input files.
+      strings_md5: Aggregate md5 of input strings.
+      files: List of file dicts (see _Metadata), sorted by path.
+      strings: List of input strings.
+    """
+    table = set(strings)
+    for entry in files:
+      table.add(entry['path'])
+      table.add(str(entry['tag']))
+      table.update(e['path'] for e in entry.get('entries', ()))
+    table = sorted(table)
+    indices = {value: i for i, value in enumerate(table)}
+
+    encoded = [value.encode('utf-8') for value in table]
+    offsets = [0]
+    for value in encoded:
+      offsets.append(offsets[-1] + len(value))
+
+    file_records = []
+    entry_records = []
+    num_entries = 0
+    for entry in files:
+      subentries = entry.get('entries', ())
+      file_records.append(
+          cls.FILE_RECORD.pack(indices[entry['path']],
+                               indices[str(entry['tag'])], num_entries,
+                               len(subentries)))
+      entry_records.extend(
+          cls.ENTRY_RECORD.pack(indices[e['path']], e['tag'])
+          for e in subentries)
+      num_entries += len(subentries)
+
+    header = cls.HEADER.pack(_BINARY_MAGIC, cls._VERSION,
+                             files_md5.encode('ascii'),
+                             strings_md5.encode('ascii'), len(table),
+                             offsets[-1], len(strings), len(files),
+                             num_entries)
+    return b''.join(
+        itertools.chain((header, struct.pack('<%dI' % len(offsets),
+                                             *offsets)), encoded,
+                        (struct.pack('<%dI' % len(strings),
+                                     *(indices[s] for s in strings)), ),
+                        file_records, entry_records))
+
+  def _GetString(self, index):
+    start, end = struct.unpack_from('<II', self._data,
+                                    self._offsets_start + 4 * index)
+    start += self._string_data_start
+    end += self._string_data_start
+    return self._data[start:end].decode('utf-8')
+
+  def _GetFileMap(self):
+    if self._file_map is None:
+      self._file_map = {}
+      for path_idx, tag_idx, first, count in self.FILE_RECORD.iter_unpack(
+          self._data[self._files_start:self._entries_start]):
+        self._file_map[self._GetString(path_idx)] = (self._GetString(tag_idx),
+                                                     first, count)
+    return self._file_map
+
+  def _GetEntryMap(self, path):
+    entry_map = self._entry_maps.get(path)
+    if entry_map is None:
+      entry_map = {}
+      file_entry = self._GetFileMap().get(path)
+      if file_entry:
+        _, first, count = file_entry
+        start = self._entries_start + self.ENTRY_RECORD.size * first
+        end = start + self.ENTRY_RECORD.size * count
+        for subpath_idx, tag in self.ENTRY_RECORD.iter_unpack(
+            self._data[start:end]):
+          entry_map[self._GetString(subpath_idx)] = tag
+      self._entry_maps[path] = entry_map
+    return entry_map
+
+  def GetStrings(self):
+    """Returns the list of input strings."""
+    indices = struct.unpack_from('<%dI' % self._num_input_strings, self._data,
+                                 self._input_strings_start)
+    return [self._GetString(i) for i in indices]
+
+  def FilesMd5(self):
+    """Returns the aggregate md5 of input files."""
+    return self._files_md5
+
+  def StringsMd5(self):
+    """Returns the aggregate md5 of input strings."""
+    return self._strings_md5
+
+  def GetTag(self, path, subpath=None):
+    """Returns the tag for the given path / subpath."""
+    if subpath is None:
+      file_entry = self._GetFileMap().get(path)
+      return file_entry and file_entry[0]
+    return self._GetEntryMap(path).get(subpath)
+
+  def IterPaths(self):
+    """Returns a generator for all top-level paths."""
+    return iter(self._GetFileMap())
+
+  def IterSubpaths(self, path):
+    """Returns a generator for all subpaths in the given zip."""
+    return iter(self._GetEntryMap(path))
+
+
+def _NewHasher():
+  if xxhash is not None:
+    return xxhash.xxh3_128()
+  return hashlib.blake2b(digest_size=16)
+
+
+class _DigestCache:
+  """A persistent cache of file digests shared by all actions in a build.
+
+  Entries are keyed by absolute path and validated against (size, mtime_ns,
+  inode), so that unchanged inputs require only a stat(). They are stored in
+  an sqlite database, so that each action reads only the rows of its own
+  inputs, and concurrent actions insert rows without dropping each other's
+  entries.
+
+  Args:
+    cache_dir: Directory to store the database in. Caching is disabled when
+      empty.
+  """
+
+  def __init__(self, cache_dir):
+    self._db_path = cache_dir and os.path.join(os.path.abspath(cache_dir),
+                                               'digests.sqlite')
+    self._conn = None
+    self._new_entries = []
+
+  def _Connection(self):
+    if self._conn is None:
+      build_utils.MakeDirectory(os.path.dirname(self._db_path))
+      self._conn = sqlite3.connect(self._db_path,
+                                   timeout=60,
+                                   isolation_level=None)
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute('PRAGMA synchronous=NORMAL')
+      self._conn.execute(f'CREATE TABLE IF NOT EXISTS {_DIGESTS_TABLE} '
+                         '(path TEXT PRIMARY KEY, size INTEGER, '
+                         'mtime_ns INTEGER, ino INTEGER, digest TEXT)')
+    return self._conn
+
+  def _Disable(self, error):
+    # The cache is only an optimization.
+    logging.warning('Not using digest cache %s: %s', self._db_path, error)
+    self.Close()
+    self._db_path = None
+
+  def _Lookup(self, path, key):
+    try:
+      row = self._Connection().execute(
+          f'SELECT size, mtime_ns, ino, digest FROM {_DIGESTS_TABLE} '
+          'WHERE path = ?', (path, )).fetchone()
+    except (OSError, sqlite3.Error) as e:
+      self._Disable(e)
+      return None
+    if row and tuple(row[:3]) == key:
+      return row[3]
+    return None
+
+  def GetDigest(self, path):
+    """Returns the hex digest of the contents of |path|."""
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    if not self._db_path:
+      return _HashFile(path)
+
+    # Files can be paths relative to the output directory, or absolute.
+    path = os.path.abspath(path)
+    digest = self._Lookup(path, key)
+    if digest is None:
+      digest = _HashFile(path)
+      # A file modified within the same mtime tick as it was hashed would not
+      # be detected, so do not memoize files that have been modified recently.
+      if time.time_ns() - st.st_mtime_ns > _RACY_MTIME_WINDOW_NS:
+        self._new_entries.append((path, ) + key + (digest, ))
+    return digest
+
+  def Flush(self):
+    """Writes new entries to disk, in a single transaction."""
+    if not self._db_path or not self._new_entries:
+      return
+    try:
+      conn = self._Connection()
+      with conn:
+        conn.execute('BEGIN')
+        conn.executemany(
+            f'INSERT OR REPLACE INTO {_DIGESTS_TABLE} VALUES (?, ?, ?, ?, ?)',
+            self._new_entries)
+    except (OSError, sqlite3.Error) as e:
+      self._Disable(e)
+    self._new_entries = []
+
+  def Close(self):
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+
+def _HashFile(path):
+  hasher = _NewHasher()
   with open(path, 'rb') as f:
-    md5.update(f.read())
-  return md5.hexdigest()
+    for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+      hasher.update(chunk)
+  return hasher.hexdigest()
 
 
 def _ComputeInlineMd5(iterable):
@@ -462,10 +777,9 @@ def _ComputeInlineMd5(iterable):
 def _ExtractZipEntries(path):
   """Returns a list of (path, CRC32) of all files within |path|."""
   entries = []
-  with zipfile.ZipFile(path) as zip_file:
-    for zip_info in zip_file.infolist():
-      # Skip directories and empty files.
-      if zip_info.CRC:
-        entries.append(
-            (zip_info.filename, zip_info.CRC + zip_info.compress_type))
+  for (filename, crc, compress_type, _, _, _,
+       _) in build_utils.ReadZipCentralDirectory(path):
+    # Skip directories and empty files.
+    if crc:
+      entries.append((filename, crc + compress_type))
   return entries
@@ -4,7 +4,10 @@
 # found in the LICENSE file.
 
 import fnmatch
+import io
+import json
 import os
+import shutil
 import sys
 import tempfile
 import unittest
@@ -25,6 +28,160 @@ class TestMd5Check(unittest.TestCase):
   def setUp(self):
     self.called = False
     self.changes = None
+    self.cache_dir = tempfile.mkdtemp()
+    self.old_digest_cache_dir = md5_check._DIGEST_CACHE_DIR
+    md5_check._DIGEST_CACHE_DIR = self.cache_dir
+
+  def tearDown(self):
+    md5_check._DIGEST_CACHE_DIR = self.old_digest_cache_dir
+    shutil.rmtree(self.cache_dir)
+
+  def testMetadataRoundTrip(self):
+    metadata = md5_check._Metadata(track_entries=True)
+    metadata.AddStrings(['b', 'a'])
+    metadata.AddFile('foo.txt', 'abc')
+    metadata.AddZipFile('foo.jar', [('Foo.class', 123), ('Bar.class', 456)])
+    fileobj = io.BytesIO()
+    metadata.ToFile(fileobj)
+
+    fileobj.seek(0)
+    loaded = md5_check._Metadata.FromFile(fileobj)
+    self.assertEqual(metadata.FilesMd5(), loaded.FilesMd5())
+    self.assertEqual(metadata.StringsMd5(), loaded.StringsMd5())
+    self.assertEqual(['b', 'a'], loaded.GetStrings())
+    self.assertEqual(['foo.jar', 'foo.txt'], list(loaded.IterPaths()))
+    self.assertEqual('abc', loaded.GetTag('foo.txt'))
+    self.assertEqual(['Foo.class', 'Bar.class'],
+                     list(loaded.IterSubpaths('foo.jar')))
+    self.assertEqual(456, loaded.GetTag('foo.jar', 'Bar.class'))
+    self.assertIsNone(loaded.GetTag('foo.jar', 'Baz.class'))
+    self.assertEqual([], list(loaded.IterSubpaths('foo.txt')))
+
+  def testMetadataFromJson(self):
+    obj = {
+        'files-md5': 'files',
+        'strings-md5': 'strings',
+        'input-files': [{
+            'path': 'foo.jar',
+            'tag': 'abc',
+            'entries': [{
+                'path': 'Foo.class',
+                'tag': 123
+            }],
+        }],
+        'input-strings': ['a'],
+    }
+    loaded = md5_check._Metadata.FromFile(
+        io.BytesIO(json.dumps(obj).encode('utf-8')))
+    self.assertEqual('files', loaded.FilesMd5())
+    self.assertEqual('strings', loaded.StringsMd5())
+    self.assertEqual(['a'], loaded.GetStrings())
+    self.assertEqual(123, loaded.GetTag('foo.jar', 'Foo.class'))
+
+  def testDigestCache(self):
+    input_file = tempfile.NamedTemporaryFile(suffix='.txt')
+    input_file.write(b'contents')
+    input_file.flush()
+    old_mtime = os.path.getmtime(input_file.name) - 60
+    os.utime(input_file.name, (old_mtime, old_mtime))
+
+    cache = md5_check._DigestCache(self.cache_dir)
+    digest = cache.GetDigest(input_file.name)
+    cache.Flush()
+    cache.Close()
+    self.assertTrue(os.listdir(self.cache_dir))
+
+    # A fresh instance should serve the digest from disk without reading the
+    # file.
+    cache = md5_check._DigestCache(self.cache_dir)
+    real_hash_file = md5_check._HashFile
+    md5_check._HashFile = None
+    try:
+      self.assertEqual(digest, cache.GetDigest(input_file.name))
+    finally:
+      md5_check._HashFile = real_hash_file
+
+    # Changing the size or mtime invalidates the entry.
+    input_file.write(b' and more')
+    input_file.flush()
+    os.utime(input_file.name, (old_mtime, old_mtime))
+    self.assertNotEqual(digest, cache.GetDigest(input_file.name))
+    cache.Close()
+
+  def testDigestCache_skipsRecentlyModified(self):
+    input_file = tempfile.NamedTemporaryFile(suffix='.txt')
+    input_file.write(b'contents')
+    input_file.flush()
+
+    cache = md5_check._DigestCache(self.cache_dir)
+    cache.GetDigest(input_file.name)
+    cache.Flush()
+    cache.Close()
+
+    hashed_paths = []
+    real_hash_file = md5_check._HashFile
+    md5_check._HashFile = lambda p: hashed_paths.append(p) or real_hash_file(p)
+    cache = md5_check._DigestCache(self.cache_dir)
+    try:
+      cache.GetDigest(input_file.name)
+    finally:
+      md5_check._HashFile = real_hash_file
+      cache.Close()
+    self.assertEqual([input_file.name], hashed_paths)
+
+  def _WriteOldFiles(self, num_files):
+    input_dir = tempfile.mkdtemp(dir=self.cache_dir)
+    old_mtime = os.path.getmtime(input_dir) - 60
+    input_paths = []
+    for i in range(num_files):
+      path = os.path.join(input_dir, '%d.txt' % i)
+      with open(path, 'w') as f:
+        f.write(str(i))
+      os.utime(path, (old_mtime, old_mtime))
+      input_paths.append(path)
+    return input_paths
+
+  def testDigestCache_sharedByActions(self):
+    input_paths = self._WriteOldFiles(50)
+    input_dir = os.path.dirname(input_paths[0])
+    md5_check._DIGEST_CACHE_DIR = os.path.join(self.cache_dir, 'digests')
+
+    md5_check.CallAndRecordIfStale(lambda: None,
+                                   record_path=os.path.join(
+                                       input_dir, 'a.stamp'),
+                                   input_paths=input_paths)
+
+    # A different action with overlapping inputs does not re-hash them.
+    real_hash_file = md5_check._HashFile
+    md5_check._HashFile = None
+    try:
+      md5_check.CallAndRecordIfStale(lambda: None,
+                                     record_path=os.path.join(
+                                         input_dir, 'b.stamp'),
+                                     input_paths=input_paths[:10])
+    finally:
+      md5_check._HashFile = real_hash_file
+
+  def testDigestCache_concurrentFlushesMerge(self):
+    input_paths = self._WriteOldFiles(2)
+    cache_a = md5_check._DigestCache(self.cache_dir)
+    cache_b = md5_check._DigestCache(self.cache_dir)
+    digest_a = cache_a.GetDigest(input_paths[0])
+    digest_b = cache_b.GetDigest(input_paths[1])
+    cache_a.Flush()
+    cache_b.Flush()
+    cache_a.Close()
+    cache_b.Close()
+
+    cache = md5_check._DigestCache(self.cache_dir)
+    real_hash_file = md5_check._HashFile
+    md5_check._HashFile = None
+    try:
+      self.assertEqual(digest_a, cache.GetDigest(input_paths[0]))
+      self.assertEqual(digest_b, cache.GetDigest(input_paths[1]))
+    finally:
+      md5_check._HashFile = real_hash_file
+      cache.Close()
 
   def testCallAndRecordIfStale(self):
     input_strings = ['string1', 'string2']
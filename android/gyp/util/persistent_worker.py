@@ -0,0 +1,365 @@
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Runs Java tools in long-lived worker JVMs.
+
+JVM startup and JIT warmup are the largest fixed cost of running D8, turbine
+and javac. When the PERSISTENT_JAVA_WORKERS environment variable is set to a
+positive number, CheckOutput() sends a tool's arguments to an already-running
+worker JVM (see PersistentWorker.java) rather than starting a new one.
+
+Workers are keyed by JVM flags, classpath, main class and working directory.
+The environment variable's value is the maximum number of workers started for
+each key. When all are busy, the command is run as a normal subprocess. Workers
+exit after being idle for _IDLE_TIMEOUT_SECONDS.
+
+Protocol (integers are big-endian, strings are uint32 length + UTF-8 bytes):
+  Request:  uint32 N, followed by N strings. The first is the working
+            directory and the rest are the tool's arguments. N=0 requests
+            that the worker exit.
+  Accepted: uint32 0, sent once the worker has read a request and is committed
+            to running it.
+  Response: uint32 status, int32 exit code, stdout string, stderr string.
+            A non-zero status means the worker could not run the request and
+            stderr holds the reason.
+"""
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import socket
+import stat
+import struct
+import subprocess
+import tempfile
+import time
+
+from util import build_utils
+
+ENV_VARIABLE = 'PERSISTENT_JAVA_WORKERS'
+
+_WORKER_SOURCE = os.path.join(os.path.dirname(__file__),
+                              'PersistentWorker.java')
+_WORKER_DIR = os.path.join(tempfile.gettempdir(),
+                           'chromium_java_workers_%d' % os.getuid())
+_IDLE_TIMEOUT_SECONDS = 15 * 60
+_STARTUP_TIMEOUT_SECONDS = 60
+# Workers finish their current request before exiting.
+_STOP_TIMEOUT_SECONDS = 5 * 60
+
+# JVM options that consume the following argument.
+_JVM_OPTIONS_WITH_VALUES = ('-cp', '-classpath', '--class-path', '-jar',
+                            '--module-path', '-p', '--module', '-m',
+                            '--add-modules', '--add-exports', '--add-opens',
+                            '--add-reads')
+_JAVAC_MAIN_CLASS = 'com.sun.tools.javac.Main'
+
+_STATUS_OK = 0
+
+
+class WorkerError(Exception):
+  """Raised when a request could not be handled by a worker."""
+
+
+class _WorkerDiedError(Exception):
+  """Raised when a worker exits after accepting a request.
+
+  The tool may have partially run, so the request is not run again.
+  """
+
+
+def _NumWorkersPerKey():
+  try:
+    return int(os.environ.get(ENV_VARIABLE, '0'))
+  except ValueError:
+    return 0
+
+
+def _ParseCommand(cmd):
+  """Splits a java or javac command line into its worker parameters.
+
+  Returns:
+    A (jvm_args, classpath, main_class, tool_args) tuple, or None if the
+    command cannot be run by a worker.
+  """
+  if os.path.basename(cmd[0]) == 'javac':
+    java_path = os.path.join(os.path.dirname(cmd[0]), 'java')
+    jvm_args = [java_path] + [a[2:] for a in cmd[1:] if a.startswith('-J')]
+    tool_args = [a for a in cmd[1:] if not a.startswith('-J')]
+    return jvm_args, None, _JAVAC_MAIN_CLASS, tool_args
+
+  if os.path.basename(cmd[0]) != 'java':
+    return None
+  jvm_args = [cmd[0]]
+  classpath = None
+  i = 1
+  while i < len(cmd):
+    arg = cmd[i]
+    if arg in ('-cp', '-classpath', '--class-path') and i + 1 < len(cmd):
+      classpath = cmd[i + 1]
+      i += 2
+    elif arg in _JVM_OPTIONS_WITH_VALUES:
+      return None
+    elif arg.startswith('-'):
+      jvm_args.append(arg)
+      i += 1
+    else:
+      return jvm_args, classpath, arg, cmd[i + 1:]
+  return None
+
+
+def _WorkerKey(jvm_args, classpath, main_class, cwd):
+  md5 = hashlib.md5()
+  # Restart workers when the tool or worker is updated.
+  paths = [_WORKER_SOURCE] + (classpath.split(':') if classpath else [])
+  mtimes = [os.path.getmtime(p) if os.path.exists(p) else 0 for p in paths]
+  md5.update(repr((jvm_args, classpath, main_class, cwd, mtimes)).encode())
+  return md5.hexdigest()[:16]
+
+
+def _CreateWorkerCommand(jvm_args, classpath, main_class, socket_path):
+  """Returns the command that starts a worker listening on |socket_path|."""
+  cmd = list(jvm_args)
+  # Allows PersistentWorker to intercept System.exit() calls (JDK 18+).
+  cmd += ['-Djava.security.manager=allow']
+  if classpath:
+    cmd += ['-cp', classpath]
+  # Uses the source-file launcher, so that no build step is needed.
+  cmd += [
+      _WORKER_SOURCE, socket_path, main_class,
+      str(_IDLE_TIMEOUT_SECONDS)
+  ]
+  return cmd
+
+
+def _WriteString(parts, value):
+  data = value.encode('utf-8')
+  parts.append(struct.pack('>I', len(data)))
+  parts.append(data)
+
+
+def _RecvExactly(sock, size):
+  parts = []
+  while size:
+    data = sock.recv(min(size, 1024 * 1024))
+    if not data:
+      raise WorkerError('Worker closed the connection.')
+    parts.append(data)
+    size -= len(data)
+  return b''.join(parts)
+
+
+def _ReadUint32(sock):
+  return struct.unpack('>I', _RecvExactly(sock, 4))[0]
+
+
+def _ReadString(sock):
+  return _RecvExactly(sock, _ReadUint32(sock)).decode('utf-8')
+
+
+def SendRequest(sock, strings):
+  """Sends a request made up of |strings| (cwd followed by tool args)."""
+  parts = [struct.pack('>I', len(strings))]
+  for value in strings:
+    _WriteString(parts, value)
+  sock.sendall(b''.join(parts))
+
+
+def ReceiveRequest(sock):
+  """Returns the list of strings sent by SendRequest()."""
+  return [_ReadString(sock) for _ in range(_ReadUint32(sock))]
+
+
+def SendResponse(sock, status, exit_code, stdout, stderr):
+  """Sends the result of a request."""
+  parts = [struct.pack('>Ii', status, exit_code)]
+  _WriteString(parts, stdout)
+  _WriteString(parts, stderr)
+  sock.sendall(b''.join(parts))
+
+
+def ReceiveResponse(sock):
+  """Returns a (status, exit_code, stdout, stderr) tuple."""
+  status, exit_code = struct.unpack('>Ii', _RecvExactly(sock, 8))
+  return status, exit_code, _ReadString(sock), _ReadString(sock)
+
+
+def _CheckWorkerDir():
+  """Raises WorkerError unless _WORKER_DIR is private to the current user.
+
+  Workers run whatever requests their socket receives.
+  """
+  st = os.lstat(_WORKER_DIR)
+  if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+      or st.st_mode & 0o077):
+    raise WorkerError('%s is not a directory that only the current user can '
+                      'access.' % _WORKER_DIR)
+
+
+@contextlib.contextmanager
+def _AcquireWorkerSlot(key):
+  """Yields the path prefix of an idle worker slot for |key|.
+
+  Each slot is guarded by a lock file so that each worker handles one request
+  at a time.
+  """
+  try:
+    os.mkdir(_WORKER_DIR, 0o700)
+  except FileExistsError:
+    pass
+  _CheckWorkerDir()
+  for slot in range(_NumWorkersPerKey()):
+    prefix = os.path.join(_WORKER_DIR, '%s-%d' % (key, slot))
+    with open(prefix + '.lock', 'w') as lock_file:
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        continue
+      yield prefix
+      return
+  raise WorkerError('All workers are busy.')
+
+
+def _Connect(socket_path):
+  sock = socket.socket(socket.AF_UNIX)
+  try:
+    sock.connect(socket_path)
+  except OSError:
+    sock.close()
+    return None
+  return sock
+
+
+def _StartWorker(worker_cmd, socket_path, cwd, log_path):
+  """Starts a worker and returns a socket connected to it."""
+  if os.path.exists(socket_path):
+    os.unlink(socket_path)
+  logging.info('Starting persistent worker: %s', ' '.join(worker_cmd))
+  with open(log_path, 'w') as log_file:
+    proc = subprocess.Popen(worker_cmd,
+                            cwd=cwd,
+                            stdin=subprocess.DEVNULL,
+                            stdout=log_file,
+                            stderr=subprocess.STDOUT,
+                            start_new_session=True)
+  deadline = time.time() + _STARTUP_TIMEOUT_SECONDS
+  while time.time() < deadline:
+    if os.path.exists(socket_path):
+      sock = _Connect(socket_path)
+      if sock:
+        return sock
+    if proc.poll() is not None:
+      raise WorkerError('Worker exited with code %d. See %s' %
+                        (proc.returncode, log_path))
+    time.sleep(0.05)
+  proc.kill()
+  raise WorkerError('Worker did not start within %ds.' %
+                    _STARTUP_TIMEOUT_SECONDS)
+
+
+def _SendToWorker(sock, strings, log_path):
+  """Returns the worker's response to a request made up of |strings|.
+
+  Returns None if the worker did not accept the request, which happens when it
+  exits (e.g. when idle) just as the request is sent. The request can then be
+  sent to another worker.
+  """
+  with contextlib.closing(sock):
+    try:
+      SendRequest(sock, strings)
+      _ReadUint32(sock)
+    except (OSError, WorkerError):
+      return None
+    try:
+      return ReceiveResponse(sock)
+    except (OSError, WorkerError) as e:
+      raise _WorkerDiedError('Persistent worker exited while running the '
+                             'command (%s). See %s' % (e, log_path)) from e
+
+
+def _RunInWorker(parsed_cmd, cwd):
+  jvm_args, classpath, main_class, tool_args = parsed_cmd
+  key = _WorkerKey(jvm_args, classpath, main_class, cwd)
+  request = [cwd] + tool_args
+  with _AcquireWorkerSlot(key) as prefix:
+    socket_path = prefix + '.sock'
+    log_path = prefix + '.log'
+    response = None
+    sock = _Connect(socket_path)
+    if sock:
+      response = _SendToWorker(sock, request, log_path)
+      if response is None:
+        logging.info('Persistent worker %s exited, restarting it.',
+                     socket_path)
+    if response is None:
+      worker_cmd = _CreateWorkerCommand(jvm_args, classpath, main_class,
+                                        socket_path)
+      sock = _StartWorker(worker_cmd, socket_path, cwd, log_path)
+      response = _SendToWorker(sock, request, log_path)
+      if response is None:
+        raise WorkerError('Worker did not accept the request. See %s' %
+                          log_path)
+  status, exit_code, stdout, stderr = response
+  if status != _STATUS_OK:
+    raise WorkerError(stderr)
+  return exit_code, stdout, stderr
+
+
+def CheckOutput(args, cwd=None, **kwargs):
+  """Same as build_utils.CheckOutput(), but runs java in a persistent worker.
+
+  Falls back to build_utils.CheckOutput() when workers are not enabled, when
+  the command is not a plain java or javac command, or when no worker accepts
+  the command. Fails if the worker exits after accepting it.
+  """
+  cwd = cwd or os.getcwd()
+  parsed_cmd = None
+  if _NumWorkersPerKey() > 0 and 'env' not in kwargs:
+    parsed_cmd = _ParseCommand(args)
+  if parsed_cmd:
+    try:
+      exit_code, stdout, stderr = _RunInWorker(parsed_cmd, cwd)
+    except WorkerError as e:
+      logging.warning('Running without a persistent worker: %s', e)
+    except _WorkerDiedError as e:
+      raise build_utils.CalledProcessError(cwd, args, str(e)) from e
+    else:
+      logging.info('Ran in persistent worker: %s', ' '.join(args))
+      return build_utils.ProcessCommandOutput(args, cwd, exit_code, stdout,
+                                              stderr, **kwargs)
+  return build_utils.CheckOutput(args, cwd=cwd, **kwargs)
+
+
+def StopAllWorkers():
+  """Asks all running workers to exit, and waits until they have.
+
+  Workers remove their socket before exiting, and the connection is closed
+  once they exit.
+  """
+  if not os.path.exists(_WORKER_DIR):
+    return
+  try:
+    _CheckWorkerDir()
+  except WorkerError as e:
+    logging.warning('Not stopping persistent workers: %s', e)
+    return
+  for socket_path in glob.glob(os.path.join(_WORKER_DIR, '*.sock')):
+    sock = _Connect(socket_path)
+    if not sock:
+      continue
+    deadline = time.time() + _STOP_TIMEOUT_SECONDS
+    with contextlib.closing(sock):
+      sock.settimeout(_STOP_TIMEOUT_SECONDS)
+      try:
+        SendRequest(sock, [])
+        sock.recv(1)
+      except OSError:
+        # The worker was already exiting.
+        pass
+    while os.path.exists(socket_path) and time.time() < deadline:
+      time.sleep(0.05)
+    if os.path.exists(socket_path):
+      logging.warning('Persistent worker %s did not exit.', socket_path)
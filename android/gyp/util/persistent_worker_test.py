@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import glob
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from util import build_utils
+from util import persistent_worker
+
+_FAKE_WORKER = os.path.join(os.path.dirname(__file__),
+                            'fake_persistent_worker.py')
+
+_TOOL_SOURCE = """\
+import os
+import sys
+
+
+def main(argv):
+  if argv[0] == 'fail':
+    sys.stderr.write('tool failed\\n')
+    sys.exit(3)
+  if argv[0] == 'warn':
+    sys.stderr.write('warning: foo\\n')
+  print('pid=%d cwd=%s args=%s' % (os.getpid(), os.getcwd(), ','.join(argv)))
+"""
+
+
+def _CreateFakeWorkerCommand(jvm_args, classpath, main_class, socket_path):
+  del jvm_args, classpath  # Unused.
+  return [sys.executable, _FAKE_WORKER, socket_path, main_class, '60']
+
+
+class PersistentWorkerTest(unittest.TestCase):
+  def setUp(self):
+    self._tmp_dir = tempfile.mkdtemp()
+    self._tool_path = os.path.join(self._tmp_dir, 'tool.py')
+    with open(self._tool_path, 'w') as f:
+      f.write(_TOOL_SOURCE)
+    self._saved = (persistent_worker._WORKER_DIR,
+                   persistent_worker._CreateWorkerCommand,
+                   os.environ.get(persistent_worker.ENV_VARIABLE))
+    persistent_worker._WORKER_DIR = os.path.join(self._tmp_dir, 'workers')
+    persistent_worker._CreateWorkerCommand = _CreateFakeWorkerCommand
+    os.environ[persistent_worker.ENV_VARIABLE] = '2'
+
+  def tearDown(self):
+    persistent_worker.StopAllWorkers()
+    (persistent_worker._WORKER_DIR, persistent_worker._CreateWorkerCommand,
+     env_value) = self._saved
+    if env_value is None:
+      del os.environ[persistent_worker.ENV_VARIABLE]
+    else:
+      os.environ[persistent_worker.ENV_VARIABLE] = env_value
+    shutil.rmtree(self._tmp_dir)
+
+  def _Cmd(self, *args):
+    return ['java', '-Xmx1G', '-cp', 'unused.jar', self._tool_path] + list(args)
+
+  def _ParseOutput(self, output):
+    return dict(kv.split('=', 1) for kv in output.split())
+
+  def testWorkerIsReused(self):
+    first = self._ParseOutput(
+        persistent_worker.CheckOutput(self._Cmd('a', 'b'), cwd=self._tmp_dir))
+    second = self._ParseOutput(
+        persistent_worker.CheckOutput(self._Cmd('c'), cwd=self._tmp_dir))
+    self.assertEqual('a,b', first['args'])
+    self.assertEqual('c', second['args'])
+    self.assertEqual(first['pid'], second['pid'])
+    self.assertNotEqual(str(os.getpid()), first['pid'])
+    self.assertEqual(os.path.realpath(self._tmp_dir),
+                     os.path.realpath(first['cwd']))
+
+  def testWorkerPerWorkingDirectory(self):
+    other_dir = os.path.join(self._tmp_dir, 'other')
+    os.makedirs(other_dir)
+    first = self._ParseOutput(
+        persistent_worker.CheckOutput(self._Cmd('a'), cwd=self._tmp_dir))
+    second = self._ParseOutput(
+        persistent_worker.CheckOutput(self._Cmd('a'), cwd=other_dir))
+    self.assertNotEqual(first['pid'], second['pid'])
+    self.assertEqual(os.path.realpath(other_dir),
+                     os.path.realpath(second['cwd']))
+
+  def testFailureSemantics(self):
+    with self.assertRaises(build_utils.CalledProcessError) as cm:
+      persistent_worker.CheckOutput(self._Cmd('fail'), cwd=self._tmp_dir)
+    self.assertIn('tool failed', cm.exception.output)
+
+    # Output to stderr fails when fail_on_output=True, unless filtered.
+    with self.assertRaises(build_utils.CalledProcessError):
+      persistent_worker.CheckOutput(self._Cmd('warn'),
+                                    cwd=self._tmp_dir,
+                                    print_stderr=True)
+    persistent_worker.CheckOutput(
+        self._Cmd('warn'),
+        cwd=self._tmp_dir,
+        stderr_filter=lambda s: build_utils.FilterLines(s, 'warning:'))
+
+  def testRestartsDeadWorker(self):
+    first = self._ParseOutput(
+        persistent_worker.CheckOutput(self._Cmd('a'), cwd=self._tmp_dir))
+    persistent_worker.StopAllWorkers()
+    second = self._ParseOutput(
+        persistent_worker.CheckOutput(self._Cmd('a'), cwd=self._tmp_dir))
+    self.assertNotEqual(first['pid'], second['pid'])
+
+  def testStopAllWorkersWaits(self):
+    persistent_worker.CheckOutput(self._Cmd('a'), cwd=self._tmp_dir)
+    persistent_worker.StopAllWorkers()
+    self.assertEqual([], [
+        p for p in os.listdir(persistent_worker._WORKER_DIR)
+        if p.endswith('.sock')
+    ])
+
+  def testRestartsWorkerThatClosesConnection(self):
+    first = self._ParseOutput(
+        persistent_worker.CheckOutput(self._Cmd('a'), cwd=self._tmp_dir))
+    # Simulates a worker that exits right after accepting the connection, by
+    # replacing its socket with one that never responds.
+    socket_path = glob.glob(
+        os.path.join(persistent_worker._WORKER_DIR, '*.sock'))[0]
+    persistent_worker.StopAllWorkers()
+    with socket.socket(socket.AF_UNIX) as server:
+      server.bind(socket_path)
+      server.listen()
+
+      def close_connection():
+        server.accept()[0].close()
+
+      thread = threading.Thread(target=close_connection)
+      thread.start()
+      second = self._ParseOutput(
+          persistent_worker.CheckOutput(self._Cmd('b'), cwd=self._tmp_dir))
+      thread.join()
+    self.assertEqual('b', second['args'])
+    self.assertNotEqual(first['pid'], second['pid'])
+
+  def testFailsIfWorkerExitsAfterAcceptingRequest(self):
+    persistent_worker.CheckOutput(self._Cmd('a'), cwd=self._tmp_dir)
+    # Simulates a worker that crashes while running the tool.
+    socket_path = glob.glob(
+        os.path.join(persistent_worker._WORKER_DIR, '*.sock'))[0]
+    persistent_worker.StopAllWorkers()
+    requests = []
+    with socket.socket(socket.AF_UNIX) as server:
+      server.bind(socket_path)
+      server.listen()
+      socket_ino = os.stat(socket_path).st_ino
+
+      def accept_and_close():
+        with server.accept()[0] as conn:
+          requests.append(persistent_worker.ReceiveRequest(conn))
+          conn.sendall(struct.pack('>I', 0))
+
+      thread = threading.Thread(target=accept_and_close)
+      thread.start()
+      with self.assertRaises(build_utils.CalledProcessError) as cm:
+        persistent_worker.CheckOutput(self._Cmd('b'), cwd=self._tmp_dir)
+      thread.join()
+      # No new worker was started, since that would replace the socket.
+      self.assertEqual(socket_ino, os.stat(socket_path).st_ino)
+    self.assertIn('exited while running', cm.exception.output)
+    self.assertEqual(1, len(requests))
+
+  def testWorkerDirIsPrivate(self):
+    persistent_worker.CheckOutput(self._Cmd('a'), cwd=self._tmp_dir)
+    self.assertEqual(0o700,
+                     os.stat(persistent_worker._WORKER_DIR).st_mode & 0o777)
+
+  def testRefusesSharedWorkerDir(self):
+    os.mkdir(persistent_worker._WORKER_DIR)
+    os.chmod(persistent_worker._WORKER_DIR, 0o755)
+    parsed_cmd = persistent_worker._ParseCommand(self._Cmd('a'))
+    with self.assertRaises(persistent_worker.WorkerError):
+      persistent_worker._RunInWorker(parsed_cmd, self._tmp_dir)
+    self.assertEqual([], os.listdir(persistent_worker._WORKER_DIR))
+
+  def testCreateWorkerCommand(self):
+    cmd = self._saved[1](['java', '-Xmx1G'], 'a.jar', 'Main', 'w.sock')
+    # PersistentWorker.java installs a SecurityManager to trap System.exit().
+    self.assertIn('-Djava.security.manager=allow',
+                  cmd[:cmd.index(persistent_worker._WORKER_SOURCE)])
+
+  def testParseCommand(self):
+    self.assertEqual(
+        (['java', '-Xmx1G', '-Dfoo=bar'], 'a.jar:b.jar', 'Main', ['--x']),
+        persistent_worker._ParseCommand(
+            ['java', '-Xmx1G', '-Dfoo=bar', '-cp', 'a.jar:b.jar', 'Main',
+             '--x']))
+    self.assertEqual((['jdk/bin/java', '-Xmx2G'], None,
+                      'com.sun.tools.javac.Main', ['-g', '@files']),
+                     persistent_worker._ParseCommand(
+                         ['jdk/bin/javac', '-J-Xmx2G', '-g', '@files']))
+    self.assertIsNone(
+        persistent_worker._ParseCommand(['java', '-jar', 'foo.jar']))
+    self.assertIsNone(
+        persistent_worker._ParseCommand(['gomacc', 'jdk/bin/javac', '-g']))
+
+
+if __name__ == '__main__':
+  unittest.main()
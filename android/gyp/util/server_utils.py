@@ -1,8 +1,17 @@
 # Copyright 2021 The Chromium Authors
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
+"""Client side of the fast_local_dev_server.py protocol.
+
+Each connection carries a single request: the client sends one JSON object,
+shuts down its side of the connection for writing, and then reads responses
+until the server closes the connection. Responses are newline-delimited JSON
+objects. Every request includes PROTOCOL_VERSION and a message_type. Requests
+without a version are treated as ADD_TASK requests from older clients.
+"""
 
 import contextlib
+import hashlib
 import json
 import os
 import socket
@@ -12,6 +21,81 @@ import socket
 SOCKET_ADDRESS = '\0chromium_build_server_socket'
 BUILD_SERVER_ENV_VARIABLE = 'INVOKED_BY_BUILD_SERVER'
 
+PROTOCOL_VERSION = 1
+
+# Message types.
+ADD_TASK = 'add_task'
+QUERY_STATUS = 'query_status'
+WAIT_FOR_TASKS = 'wait_for_tasks'
+CANCEL_TASKS = 'cancel_tasks'
+STREAM_OUTPUT = 'stream_output'
+
+
+def GetSocketAddress(output_directory=None):
+  """Returns the socket of the server for |output_directory|.
+
+  Without an output directory, returns the socket of the server that accepts
+  tasks from all output directories.
+  """
+  if not output_directory:
+    return SOCKET_ADDRESS
+  path = os.path.realpath(output_directory).encode('utf-8')
+  return f'{SOCKET_ADDRESS}_{hashlib.md5(path).hexdigest()[:16]}'
+
+
+def _Connect(output_directory):
+  """Returns a socket connected to the server for |output_directory|.
+
+  Falls back to the global server. Returns None if neither is running.
+  """
+  for address in (GetSocketAddress(output_directory), SOCKET_ADDRESS):
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+      sock.connect(address)
+      return sock
+    except socket.error:
+      # Either the server has not been started or the server is not currently
+      # accepting new connections.
+      sock.close()
+  return None
+
+
+def IsServerRunning(output_directory=None):
+  sock = _Connect(output_directory)
+  if sock:
+    sock.close()
+  return sock is not None
+
+
+def SendMessage(sock, message):
+  sock.sendall(json.dumps(message).encode('utf8') + b'\n')
+
+
+def ReceiveMessages(sock):
+  """Yields each newline-delimited JSON object received until EOF."""
+  with sock.makefile('rb') as f:
+    for line in f:
+      if line.strip():
+        yield json.loads(line)
+
+
+def SendRequest(message_type, output_directory=None, **kwargs):
+  """Sends a request to the build server and yields its responses.
+
+  Raises:
+    ConnectionRefusedError: If no build server is running.
+  """
+  sock = _Connect(output_directory or os.getcwd())
+  if not sock:
+    raise ConnectionRefusedError('Build server is not running.')
+  with contextlib.closing(sock):
+    message = dict(kwargs,
+                   version=PROTOCOL_VERSION,
+                   message_type=message_type)
+    SendMessage(sock, message)
+    sock.shutdown(socket.SHUT_WR)
+    yield from ReceiveMessages(sock)
+
 
 def MaybeRunCommand(name, argv, stamp_file, force):
   """Returns True if the command was successfully sent to the build server."""
@@ -22,26 +106,24 @@ def MaybeRunCommand(name, argv, stamp_file, force):
   # sends another request to the build server.
   if BUILD_SERVER_ENV_VARIABLE in os.environ:
     return False
-  with contextlib.closing(socket.socket(socket.AF_UNIX)) as sock:
-    try:
-      sock.connect(SOCKET_ADDRESS)
-      sock.sendall(
-          json.dumps({
-              'name': name,
-              'cmd': argv,
-              'cwd': os.getcwd(),
-              'stamp_file': stamp_file,
-          }).encode('utf8'))
-    except socket.error as e:
-      # [Errno 111] Connection refused. Either the server has not been started
-      #             or the server is not currently accepting new connections.
-      if e.errno == 111:
-        if force:
-          raise RuntimeError(
-              '\n\nBuild server is not running and '
-              'android_static_analysis="build_server" is set.\nPlease run '
-              'this command in a separate terminal:\n\n'
-              '$ build/android/fast_local_dev_server.py\n\n') from None
-        return False
-      raise e
+  sock = _Connect(os.getcwd())
+  if not sock:
+    if force:
+      raise RuntimeError(
+          '\n\nBuild server is not running and '
+          'android_static_analysis="build_server" is set.\nPlease run '
+          'this command in a separate terminal:\n\n'
+          '$ build/android/fast_local_dev_server.py\n\n')
+    return False
+  # Do not wait for a response so that the build is not slowed down.
+  with contextlib.closing(sock):
+    SendMessage(
+        sock, {
+            'version': PROTOCOL_VERSION,
+            'message_type': ADD_TASK,
+            'name': name,
+            'cmd': argv,
+            'cwd': os.getcwd(),
+            'stamp_file': stamp_file,
+        })
   return True
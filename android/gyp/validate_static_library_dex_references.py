@@ -5,7 +5,6 @@
 
 import argparse
 import os
-import re
 import sys
 import zipfile
 
@@ -36,14 +35,8 @@ def _FindIllegalStaticLibraryReferences(static_lib_dex_files,
 
 def _DexFilesFromPath(path):
   if zipfile.is_zipfile(path):
-    with zipfile.ZipFile(path) as z:
-      return [
-          dex_parser.DexFile(bytearray(z.read(name))) for name in z.namelist()
-          if re.match(r'.*classes[0-9]*\.dex$', name)
-      ]
-  else:
-    with open(path) as f:
-      return dex_parser.DexFile(bytearray(f.read()))
+    return [dexfile for _, dexfile in dex_parser.IterDexFilesInZip(path)]
+  return [dex_parser.ReadDexFile(path)]
 
 
 def main(args):
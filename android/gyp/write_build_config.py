@@ -276,6 +276,11 @@ The list of all `deps_info['java_sources_file']` entries for all library
 dependencies that are chromium code. Note: this is a list of files, where each
 file contains a list of Java source files. This is used for lint.
 
+* `deps_info['lint_interface_jars']`:
+The `deps_info['interface_jar_path']` of each target whose sources are in
+`deps_info['lint_java_sources']`. Lint analyzes shards of the sources against
+them.
+
 * `deps_info['lint_aars']`:
 List of all aars from transitive java dependencies. This allows lint to collect
 their custom annotations.zip and run checks like @IntDef on their annotations.
@@ -550,12 +555,15 @@ This type corresponds to an Android app bundle (`.aab` file).
 import collections
 import itertools
 import json
+import logging
 import optparse
 import os
 import shutil
+import sqlite3
 import sys
 import xml.dom.minidom
 
+from util import build_config_index
 from util import build_utils
 from util import resource_utils
 
@@ -568,6 +576,8 @@ _RESOURCE_TYPES = ('android_assets', 'android_resources', 'system_java_library')
 
 # Cache of path -> JSON dict.
 _dep_config_cache = {}
+# Set by main() unless the index is disabled.
+_build_config_index = None
 
 
 class OrderedSet(collections.OrderedDict):
@@ -643,6 +653,8 @@ def GetDepConfigRoot(path):
 
 
 def GetDepConfig(path):
+  if _build_config_index and path not in _dep_config_cache:
+    return _build_config_index.GetDepsInfo(path)
   return GetDepConfigRoot(path)['deps_info']
 
 
@@ -654,16 +666,29 @@ def DepPathsOfType(wanted_type, config_paths):
   return [p for p in config_paths if GetDepConfig(p)['type'] == wanted_type]
 
 
+def _AllDepsConfigPaths(path):
+  config = GetDepConfig(path)
+  return config['deps_configs'] + config.get('public_deps_configs', [])
+
+
+# Shared by all unfiltered GetAllDepsConfigsInOrder() calls.
+_all_deps = build_utils.TransitiveDependencies(_AllDepsConfigPaths)
+
+
 def GetAllDepsConfigsInOrder(deps_config_paths, filter_func=None):
+  if not filter_func:
+    if _build_config_index:
+      # Reuses closures computed by other targets.
+      return build_config_index.MergeClosures(
+          _build_config_index.GetClosure(p, _AllDepsConfigPaths)
+          for p in deps_config_paths)
+    return _all_deps.GetSorted(deps_config_paths)
+
   def apply_filter(paths):
-    if filter_func:
-      return [p for p in paths if filter_func(GetDepConfig(p))]
-    return paths
+    return [p for p in paths if filter_func(GetDepConfig(p))]
 
   def discover(path):
-    config = GetDepConfig(path)
-    all_deps = config['deps_configs'] + config.get('public_deps_configs', [])
-    return apply_filter(all_deps)
+    return apply_filter(_AllDepsConfigPaths(path))
 
   deps_config_paths = apply_filter(deps_config_paths)
   deps_config_paths = build_utils.GetSortedTransitiveDependencies(
@@ -690,6 +715,8 @@ class Deps:
   def __init__(self, direct_deps_config_paths):
     self._all_deps_config_paths = GetAllDepsConfigsInOrder(
         direct_deps_config_paths)
+    if _build_config_index:
+      _build_config_index.Prefetch(self._all_deps_config_paths)
     self._direct_deps_configs = [
         GetDepConfig(p) for p in direct_deps_config_paths
     ]
@@ -781,23 +808,27 @@ def _MergeAssets(all_assets):
   return create_list(compressed), create_list(uncompressed), locale_paks
 
 
-def _ResolveGroupsAndPublicDeps(config_paths):
-  """Returns a list of configs with all groups inlined."""
+def _GroupAndPublicDepsConfigPaths(config_path):
+  config = GetDepConfig(config_path)
+  if config['type'] == 'group':
+    # Groups combine public_deps with deps_configs, so no need to check
+    # public_config_paths separately.
+    return config['deps_configs']
+  if config['type'] == 'android_resources':
+    # android_resources targets do not support public_deps, but instead treat
+    # all resource deps as public deps.
+    return DepPathsOfType('android_resources', config['deps_configs'])
+
+  return config.get('public_deps_configs', [])
 
-  def helper(config_path):
-    config = GetDepConfig(config_path)
-    if config['type'] == 'group':
-      # Groups combine public_deps with deps_configs, so no need to check
-      # public_config_paths separately.
-      return config['deps_configs']
-    if config['type'] == 'android_resources':
-      # android_resources targets do not support public_deps, but instead treat
-      # all resource deps as public deps.
-      return DepPathsOfType('android_resources', config['deps_configs'])
 
-    return config.get('public_deps_configs', [])
+_groups_and_public_deps = build_utils.TransitiveDependencies(
+    _GroupAndPublicDepsConfigPaths)
 
-  return build_utils.GetSortedTransitiveDependencies(config_paths, helper)
+
+def _ResolveGroupsAndPublicDeps(config_paths):
+  """Returns a list of configs with all groups inlined."""
+  return _groups_and_public_deps.GetSorted(config_paths)
 
 
 def _DepsFromPaths(dep_paths,
@@ -932,12 +963,15 @@ def _CompareClasspathPriority(dep):
 def _CopyBuildConfigsForDebugging(debug_dir):
   shutil.rmtree(debug_dir, ignore_errors=True)
   os.makedirs(debug_dir)
-  for src_path in _dep_config_cache:
+  src_paths = set(_dep_config_cache)
+  if _build_config_index:
+    src_paths.update(_build_config_index.LoadedPaths())
+  for src_path in src_paths:
     dst_path = os.path.join(debug_dir, src_path)
     assert dst_path.startswith(debug_dir), dst_path
     os.makedirs(os.path.dirname(dst_path), exist_ok=True)
     shutil.copy(src_path, dst_path)
-  print(f'Copied {len(_dep_config_cache)} .build_config.json into {debug_dir}')
+  print(f'Copied {len(src_paths)} .build_config.json into {debug_dir}')
 
 
 def main(argv):
@@ -1172,6 +1206,9 @@ def main(argv):
   if options.fail:
     parser.error('\n'.join(build_utils.ParseGnList(options.fail)))
 
+  global _build_config_index
+  _build_config_index = build_config_index.Open()
+
   lib_options = ['unprocessed_jar_path', 'interface_jar_path']
   device_lib_options = ['device_jar_path', 'dex_path']
   required_options_map = {
@@ -1667,17 +1704,20 @@ def main(argv):
     lint_aars = set()
     lint_srcjars = set()
     lint_java_sources = set()
+    lint_interface_jars = set()
     lint_resource_sources = set()
     lint_resource_zips = set()
 
     if options.java_sources_file:
       lint_java_sources.add(options.java_sources_file)
+      lint_interface_jars.add(deps_info['interface_jar_path'])
     if options.bundled_srcjars:
       lint_srcjars.update(deps_info['bundled_srcjars'])
     for c in all_library_deps:
       if c['chromium_code'] and c['requires_android']:
         if 'java_sources_file' in c:
           lint_java_sources.add(c['java_sources_file'])
+          lint_interface_jars.add(c['interface_jar_path'])
         lint_srcjars.update(c['bundled_srcjars'])
       if 'aar_path' in c:
         lint_aars.add(c['aar_path'])
@@ -1698,6 +1738,7 @@ def main(argv):
     deps_info['lint_aars'] = sorted(lint_aars)
     deps_info['lint_srcjars'] = sorted(lint_srcjars)
     deps_info['lint_java_sources'] = sorted(lint_java_sources)
+    deps_info['lint_interface_jars'] = sorted(lint_interface_jars)
     deps_info['lint_resource_sources'] = sorted(lint_resource_sources)
     deps_info['lint_resource_zips'] = sorted(lint_resource_zips)
     deps_info['lint_extra_android_manifests'] = []
@@ -1715,6 +1756,7 @@ def main(argv):
     lint_aars = set()
     lint_srcjars = set()
     lint_java_sources = set()
+    lint_interface_jars = set()
     lint_resource_sources = set()
     lint_resource_zips = set()
     lint_extra_android_manifests = set()
@@ -1732,12 +1774,14 @@ def main(argv):
       lint_aars.update(c['lint_aars'])
       lint_srcjars.update(c['lint_srcjars'])
       lint_java_sources.update(c['lint_java_sources'])
+      lint_interface_jars.update(c['lint_interface_jars'])
       lint_resource_sources.update(c['lint_resource_sources'])
       lint_resource_zips.update(c['lint_resource_zips'])
     deps_info['jni'] = {'all_source': sorted(jni_all_source)}
     deps_info['lint_aars'] = sorted(lint_aars)
     deps_info['lint_srcjars'] = sorted(lint_srcjars)
     deps_info['lint_java_sources'] = sorted(lint_java_sources)
+    deps_info['lint_interface_jars'] = sorted(lint_interface_jars)
     deps_info['lint_resource_sources'] = sorted(lint_resource_sources)
     deps_info['lint_resource_zips'] = sorted(lint_resource_zips)
     deps_info['lint_extra_android_manifests'] = sorted(
@@ -2067,6 +2111,12 @@ def main(argv):
 
   build_utils.WriteJson(config, options.build_config, only_if_changed=True)
 
+  if _build_config_index:
+    try:
+      _build_config_index.Flush()
+    except sqlite3.Error as e:
+      logging.warning('Failed to update build config index: %s', e)
+
   if options.depfile:
     build_utils.WriteDepfile(options.depfile, options.build_config,
                              sorted(set(all_inputs)))
@@ -13,6 +13,9 @@ import zipfile
 
 from util import build_utils
 
+# Compressing more input than this is worth spreading across cores.
+_MIN_PARALLEL_COMPRESS_BYTES = 16 * 1024 * 1024
+
 
 def main(args):
   args = build_utils.ExpandFileArgs(args)
@@ -47,11 +50,16 @@ def main(args):
       depfile_deps = None
       if options.input_files:
         files = build_utils.ParseGnList(options.input_files)
+        num_workers = None
+        if (options.compress and sum(os.path.getsize(p) for p in files) >=
+            _MIN_PARALLEL_COMPRESS_BYTES):
+          num_workers = os.cpu_count()
         build_utils.DoZip(
             files,
             out_zip,
             base_dir=options.input_files_base_dir,
-            compress_fn=lambda _: options.compress)
+            compress_fn=lambda _: options.compress,
+            num_workers=num_workers)
 
       if options.input_zips:
         files = build_utils.ParseGnList(options.input_zips)
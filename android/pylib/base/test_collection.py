@@ -3,80 +3,178 @@
 # found in the LICENSE file.
 
 
+import collections
 import threading
 
 
+class _Item:
+  """A test in a TestCollection."""
+
+  __slots__ = ('test', 'cost', 'failed_worker')
+
+  def __init__(self, test, cost, failed_worker=None):
+    self.test = test
+    self.cost = cost
+    # The worker that failed to run the test, which should not get it again.
+    self.failed_worker = failed_worker
+
+
 class TestCollection:
-  """A threadsafe collection of tests.
+  """A threadsafe collection of tests, shared by workers (e.g. devices).
+
+  Tests are handed out from a shared queue, most expensive first when costs are
+  given. Each worker also has a local queue of tests meant for it, such as
+  tests that failed on another worker. Workers take tests from their local
+  queue first, then from the shared queue, and then steal tests from the
+  local queue of the most loaded other worker.
 
   Args:
     tests: List of tests to put in the collection.
+    cost_fn: Optional function returning the expected cost (e.g. duration) of
+      a test. Costlier tests are handed out first, so that they do not end up
+      running last on a single worker. Without it, tests are handed out in
+      order.
   """
 
-  def __init__(self, tests=None):
+  def __init__(self, tests=None, cost_fn=None):
     if not tests:
       tests = []
-    self._lock = threading.Lock()
-    self._tests = []
-    self._tests_in_progress = 0
-    # Used to signal that an item is available or all items have been handled.
-    self._item_available_or_all_done = threading.Event()
-    for t in tests:
-      self.add(t)
+    self._cost_fn = cost_fn or (lambda _: 1)
+    # Signaled when a test is added or all tests have been handled.
+    self._cond = threading.Condition(threading.Lock())
+    items = [_Item(t, self._cost_fn(t)) for t in tests]
+    if cost_fn:
+      # Stable, so tests with equal costs stay in order.
+      items.sort(key=lambda i: i.cost, reverse=True)
+    self._shared = collections.deque(items)
+    self._local = {}
+    self._local_costs = {}
+    self._tests_in_progress = len(items)
+
+  def _take(self, worker):
+    """Returns the next test for |worker|, or None. Must hold |self._cond|."""
+    local = self._local.get(worker)
+    if local:
+      item = local.popleft()
+      self._local_costs[worker] -= item.cost
+      return item
+    if self._shared:
+      return self._shared.popleft()
+    return self._steal(worker)
 
-  def _pop(self):
-    """Pop a test from the collection.
+  def _steal(self, worker):
+    """Takes a test from the most loaded other worker. Must hold |self._cond|.
+
+    Tests are stolen from the end of local queues, leaving the tests that
+    their owner is about to run.
+    """
+    victims = sorted(((cost, w) for w, cost in self._local_costs.items()
+                      if w != worker and self._local[w]),
+                     key=lambda c_w: c_w[0],
+                     reverse=True)
+    for _, victim in victims:
+      queue = self._local[victim]
+      for i in range(len(queue) - 1, -1, -1):
+        item = queue[i]
+        if item.failed_worker != worker:
+          del queue[i]
+          self._local_costs[victim] -= item.cost
+          return item
+    return None
+
+  def _pop(self, worker=None):
+    """Pop a test from the collection for |worker|.
 
     Waits until a test is available or all tests have been handled.
 
     Returns:
       A test or None if all tests have been handled.
     """
-    while True:
-      # Wait for a test to be available or all tests to have been handled.
-      self._item_available_or_all_done.wait()
-      with self._lock:
-        # Check which of the two conditions triggered the signal.
+    with self._cond:
+      while True:
         if self._tests_in_progress == 0:
           return None
-        try:
-          return self._tests.pop(0)
-        except IndexError:
-          # Another thread beat us to the available test, wait again.
-          self._item_available_or_all_done.clear()
+        item = self._take(worker)
+        if item is not None:
+          return item.test
+        self._cond.wait()
+
+  def _register(self, worker):
+    with self._cond:
+      self._local.setdefault(worker, collections.deque())
+      self._local_costs.setdefault(worker, 0)
 
-  def add(self, test):
+  def _unregister(self, worker):
+    """Returns the local tests of a worker that stopped to the shared queue."""
+    with self._cond:
+      local = self._local.pop(worker, None)
+      self._local_costs.pop(worker, None)
+      if local:
+        self._shared.extendleft(reversed(local))
+        self._cond.notify_all()
+
+  def add(self, test, failed_worker=None):
     """Add a test to the collection.
 
     Args:
       test: A test to add.
+      failed_worker: The worker that failed to run |test|, if any. The test is
+        then given to the least loaded other worker, if there is one.
     """
-    with self._lock:
-      self._tests.append(test)
-      self._item_available_or_all_done.set()
+    with self._cond:
+      item = _Item(test, self._cost_fn(test), failed_worker)
       self._tests_in_progress += 1
+      others = [(cost, w) for w, cost in self._local_costs.items()
+                if w != failed_worker]
+      if failed_worker is None or not others:
+        self._shared.append(item)
+        self._cond.notify()
+        return
+      _, worker = min(others, key=lambda c_w: c_w[0])
+      self._local[worker].append(item)
+      self._local_costs[worker] += item.cost
+      # Wake up all workers, as only some of them may take this test.
+      self._cond.notify_all()
 
   def test_completed(self):
     """Indicate that a test has been fully handled."""
-    with self._lock:
+    with self._cond:
       self._tests_in_progress -= 1
       if self._tests_in_progress == 0:
         # All tests have been handled, signal all waiting threads.
-        self._item_available_or_all_done.set()
+        self._cond.notify_all()
+
+  def iter_for_worker(self, worker):
+    """Iterate through tests for |worker| until all have been handled.
+
+    Args:
+      worker: A hashable identifying the caller (e.g. a device serial), or
+        None for callers without a local queue.
+    """
+    if worker is not None:
+      self._register(worker)
+    try:
+      while True:
+        r = self._pop(worker)
+        if r is None:
+          break
+        yield r
+    finally:
+      if worker is not None:
+        self._unregister(worker)
 
   def __iter__(self):
     """Iterate through tests in the collection until all have been handled."""
-    while True:
-      r = self._pop()
-      if r is None:
-        break
-      yield r
+    return self.iter_for_worker(None)
 
   def __len__(self):
     """Return the number of tests currently in the collection."""
-    return len(self._tests)
+    with self._cond:
+      return len(self._shared) + sum(len(q) for q in self._local.values())
 
   def test_names(self):
     """Return a list of the names of the tests currently in the collection."""
-    with self._lock:
-      return list(t.test for t in self._tests)
+    with self._cond:
+      return [i.test.test for i in self._shared] + [
+          i.test.test for q in self._local.values() for i in q
+      ]
@@ -0,0 +1,160 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Simulates running tests from a TestCollection on fake devices.
+
+Each fake device is a thread that "runs" tests by sleeping for their duration.
+Durations follow a log-normal distribution, so that a few tests take much
+longer than the rest, and one device fails some of the tests it runs so that
+they are rerun. Reports how long it takes for all devices to finish compared
+to the ideal time, and how long it takes to drain large collections.
+
+Run with:
+  PYTHONPATH=build/android build/android/pylib/base/test_collection_benchmark.py
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+import timeit
+
+from pylib.base import test_collection
+
+
+class _ListTestCollection:
+  """The previous TestCollection, which hands out tests from a single list."""
+
+  def __init__(self, tests):
+    self._lock = threading.Lock()
+    self._tests = []
+    self._tests_in_progress = 0
+    self._item_available_or_all_done = threading.Event()
+    for t in tests:
+      self.add(t)
+
+  def _pop(self):
+    while True:
+      self._item_available_or_all_done.wait()
+      with self._lock:
+        if self._tests_in_progress == 0:
+          return None
+        try:
+          return self._tests.pop(0)
+        except IndexError:
+          self._item_available_or_all_done.clear()
+
+  def add(self, test, failed_worker=None):
+    # pylint: disable=unused-argument
+    with self._lock:
+      self._tests.append(test)
+      self._item_available_or_all_done.set()
+      self._tests_in_progress += 1
+
+  def test_completed(self):
+    with self._lock:
+      self._tests_in_progress -= 1
+      if self._tests_in_progress == 0:
+        self._item_available_or_all_done.set()
+
+  def iter_for_worker(self, _worker):
+    while True:
+      r = self._pop()
+      if r is None:
+        break
+      yield r
+
+
+def _Simulate(tests, durations, num_devices, failure_rate, rand):
+  """Returns how long it takes |num_devices| to run all of |tests|."""
+  failing_device = 0
+  reruns = set()
+  lock = threading.Lock()
+
+  def run(device):
+    for test in tests.iter_for_worker(device):
+      time.sleep(durations[test])
+      with lock:
+        failed = (device == failing_device and test not in reruns
+                  and rand.random() < failure_rate)
+        if failed:
+          reruns.add(test)
+      if failed:
+        tests.add(test, failed_worker=device)
+      tests.test_completed()
+
+  threads = [
+      threading.Thread(target=run, args=(d, )) for d in range(num_devices)
+  ]
+  start = time.time()
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  return time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num-devices', type=int, default=20)
+  parser.add_argument('--num-tests', type=int, default=2000)
+  parser.add_argument('--total-seconds',
+                      type=float,
+                      default=20,
+                      help='Total duration of all tests.')
+  parser.add_argument('--sigma',
+                      type=float,
+                      default=1.5,
+                      help='Skew of the log-normal distribution of durations.')
+  parser.add_argument('--failure-rate',
+                      type=float,
+                      default=0.05,
+                      help='Fraction of tests that fail on the flaky device.')
+  parser.add_argument('--drain-size', type=int, default=200000)
+  args = parser.parse_args()
+
+  rand = random.Random(0)
+  durations = [
+      rand.lognormvariate(0, args.sigma) for _ in range(args.num_tests)
+  ]
+  scale = args.total_seconds / sum(durations)
+  durations = [d * scale for d in durations]
+  ideal = max(args.total_seconds / args.num_devices, max(durations))
+  print('{} tests on {} devices, ideal={:.0f}ms, longest test={:.0f}ms'.format(
+      args.num_tests, args.num_devices, ideal * 1000,
+      max(durations) * 1000))
+
+  tests = list(range(args.num_tests))
+  configs = [
+      ('List', lambda: _ListTestCollection(tests)),
+      ('Deque', lambda: test_collection.TestCollection(tests)),
+      ('Deque with cost hints',
+       lambda: test_collection.TestCollection(tests,
+                                              cost_fn=durations.__getitem__)),
+  ]
+  for name, create in configs:
+    elapsed = _Simulate(create(), durations, args.num_devices,
+                        args.failure_rate, random.Random(1))
+    print('{:<40} {:.0f}ms ({:.2f}x ideal)'.format(name, elapsed * 1000,
+                                                  elapsed / ideal))
+
+  drain_tests = list(range(args.drain_size))
+
+  def drain(tests):
+    for _ in tests.iter_for_worker(0):
+      tests.test_completed()
+
+  for name, create in (
+      ('Drain list', lambda: _ListTestCollection(drain_tests)),
+      ('Drain deque', lambda: test_collection.TestCollection(drain_tests)),
+  ):
+    times = timeit.repeat(lambda create=create: drain(create()),
+                          number=1,
+                          repeat=3)
+    print('{:<40} min={:.0f}ms'.format(name, min(times) * 1000))
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for test_collection."""
+
+import threading
+import unittest
+
+from pylib.base import test_collection
+
+
+def _Drain(tests, worker=None):
+  ret = []
+  for test in tests.iter_for_worker(worker):
+    ret.append(test)
+    tests.test_completed()
+  return ret
+
+
+class TestCollectionTest(unittest.TestCase):
+  def testIter(self):
+    tests = test_collection.TestCollection(['a', 'b', 'c'])
+    self.assertEqual(3, len(tests))
+    self.assertEqual(['a', 'b', 'c'], _Drain(tests))
+    self.assertEqual(0, len(tests))
+
+  def testIter_empty(self):
+    self.assertEqual([], list(test_collection.TestCollection()))
+
+  def testCostFn(self):
+    costs = {'a': 1, 'b': 5, 'c': 1, 'd': 3}
+    tests = test_collection.TestCollection(['a', 'b', 'c', 'd'],
+                                           cost_fn=costs.get)
+    self.assertEqual(['b', 'd', 'a', 'c'], _Drain(tests))
+
+  def testAdd_failedWorker(self):
+    tests = test_collection.TestCollection(['a', 'b'])
+    it1 = tests.iter_for_worker('device1')
+    it2 = tests.iter_for_worker('device2')
+    self.assertEqual('a', next(it1))
+    self.assertEqual('b', next(it2))
+    tests.add('a', failed_worker='device1')
+    tests.test_completed()
+    tests.add('c')
+    # The rerun goes to device2 even though device1 asks first.
+    self.assertEqual('c', next(it1))
+    tests.test_completed()
+    self.assertEqual('a', next(it2))
+    tests.test_completed()
+    tests.test_completed()
+    self.assertEqual([], list(it1))
+    self.assertEqual([], list(it2))
+
+  def testAdd_failedWorker_noOtherWorker(self):
+    tests = test_collection.TestCollection(['a'])
+    self.assertEqual('a', next(tests.iter_for_worker('device1')))
+    tests.add('a', failed_worker='device1')
+    tests.test_completed()
+    self.assertEqual(['a'], _Drain(tests, 'device1'))
+
+  def testSteal(self):
+    tests = test_collection.TestCollection(['a', 'b'])
+    it1 = tests.iter_for_worker('device1')
+    it2 = tests.iter_for_worker('device2')
+    self.assertEqual('a', next(it1))
+    self.assertEqual('b', next(it2))
+    for test in ('x', 'y', 'z'):
+      tests.add(test, failed_worker='device2')
+    tests.test_completed()
+    tests.test_completed()
+    # The reruns all go to device1, and a new worker steals the last one.
+    self.assertEqual('z', next(tests.iter_for_worker('device3')))
+    tests.test_completed()
+    self.assertEqual(['x', 'y'], _Drain(tests, 'device1'))
+
+  def testStoppedWorker(self):
+    tests = test_collection.TestCollection(['a', 'b'])
+    it1 = tests.iter_for_worker('device1')
+    it2 = tests.iter_for_worker('device2')
+    self.assertEqual('a', next(it1))
+    self.assertEqual('b', next(it2))
+    tests.add('a', failed_worker='device1')
+    tests.test_completed()
+    # device2 stops (e.g. it became unreachable), so its tests are returned
+    # to the shared queue.
+    it2.close()
+    tests.test_completed()
+    self.assertEqual(['a'], list(t for t in it1 if not tests.test_completed()))
+
+  def testThreads(self):
+    tests = test_collection.TestCollection(range(1000))
+    results = [[] for _ in range(4)]
+    # Makes sure that all workers have started before tests are rerun.
+    started = threading.Barrier(4)
+
+    def run(worker):
+      for test in tests.iter_for_worker(worker):
+        if not results[worker]:
+          started.wait()
+        if test % 10 == 0 and test < 1000 and worker == 0:
+          tests.add(test + 1000, failed_worker=worker)
+        results[worker].append(test)
+        tests.test_completed()
+
+    threads = [threading.Thread(target=run, args=(i, )) for i in range(4)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(
+        sorted(sum(results, [])),
+        sorted(list(range(1000)) +
+               [t + 1000 for t in results[0] if t % 10 == 0 and t < 1000]))
+    self.assertFalse([t for t in results[0] if t >= 1000])
+
+
+if __name__ == '__main__':
+  unittest.main()
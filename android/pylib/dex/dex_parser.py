@@ -10,8 +10,11 @@ is provided, but it does not include error handling or validation.
 """
 
 import argparse
+import array
 import collections
 import errno
+import functools
+import mmap
 import os
 import re
 import struct
@@ -60,120 +63,206 @@ _ClassDefItem = collections.namedtuple(
     'ClassDefItem',
     'class_idx,access_flags,superclass_idx,interfaces_off,source_file_idx,'
     'annotations_off,class_data_off,static_values_off')
+_FieldIdItem = collections.namedtuple('FieldIdItem',
+                                      'class_idx,type_idx,name_idx')
+_EncodedMethod = collections.namedtuple('EncodedMethod',
+                                        'method_idx,access_flags,code_off')
+_ClassDataItem = collections.namedtuple('ClassDataItem',
+                                        'direct_methods,virtual_methods')
+# Lists of (field, method or parameter index, annotations_off).
+_AnnotationsDirectoryItem = collections.namedtuple(
+    'AnnotationsDirectoryItem', 'class_annotations_off,field_annotations,'
+    'method_annotations,parameter_annotations')
+_AnnotationItem = collections.namedtuple('AnnotationItem',
+                                         'visibility,annotation')
+# |elements| is a list of (name string index, EncodedValue).
+EncodedAnnotation = collections.namedtuple('EncodedAnnotation',
+                                           'type_idx,elements')
+# |value| is an int (for integral types and for indices into the section of
+# the type), float, bool, None, list of EncodedValues or EncodedAnnotation.
+EncodedValue = collections.namedtuple('EncodedValue', 'value_type,value')
+
+# https://source.android.com/devices/tech/dalvik/dex-format#encoding
+VALUE_BYTE = 0x00
+VALUE_SHORT = 0x02
+VALUE_CHAR = 0x03
+VALUE_INT = 0x04
+VALUE_LONG = 0x06
+VALUE_FLOAT = 0x10
+VALUE_DOUBLE = 0x11
+VALUE_METHOD_TYPE = 0x15
+VALUE_METHOD_HANDLE = 0x16
+VALUE_STRING = 0x17
+VALUE_TYPE = 0x18
+VALUE_FIELD = 0x19
+VALUE_METHOD = 0x1a
+VALUE_ENUM = 0x1b
+VALUE_ARRAY = 0x1c
+VALUE_ANNOTATION = 0x1d
+VALUE_NULL = 0x1e
+VALUE_BOOLEAN = 0x1f
+
+_SIGNED_VALUE_TYPES = (VALUE_BYTE, VALUE_SHORT, VALUE_INT, VALUE_LONG)
+
+VISIBILITY_BUILD = 0x00
+VISIBILITY_RUNTIME = 0x01
+VISIBILITY_SYSTEM = 0x02
+
+ACC_PUBLIC = 0x1
+ACC_ABSTRACT = 0x400
+
+# superclass_idx of java.lang.Object.
+NO_INDEX = 0xffffffff
+
+_UBYTE = struct.Struct('<B')
+_USHORT = struct.Struct('<H')
+_UINT = struct.Struct('<I')
+
+_DEX_PATH_RE = re.compile(r'.*classes\d*\.dex$')
 
 
 class _MemoryItemList:
-  """Base class for repeated memory items."""
+  """Base class for repeated memory items.
 
-  def __init__(self,
-               reader,
-               offset,
-               size,
-               factory,
-               alignment=None,
-               first_item_offset=None):
-    """Creates the item list using the specific item factory.
+  Items are decoded when they are accessed rather than up front.
+  """
+
+  def __init__(self, reader, offset, size):
+    """Creates the item list.
 
     Args:
-      reader: _DexReader used for decoding the memory item.
+      reader: _DexReader used for decoding the memory items.
       offset: Offset from start of the file to the item list, serving as the
         key for some item types.
       size: Number of memory items in the list.
-      factory: Function to extract each memory item from a _DexReader.
-      alignment: Optional integer specifying the alignment for the memory
-        section represented by this list.
-      first_item_offset: Optional, specifies a different offset to use for
-        extracting memory items (default is to use offset).
     """
+    self._reader = reader
     self.offset = offset
     self.size = size
-    reader.Seek(first_item_offset or offset)
-    self._items = [factory(reader) for _ in range(size)]
 
-    if alignment:
-      reader.AlignUpTo(alignment)
+  def _GetItem(self, index):
+    raise NotImplementedError()
 
   def __iter__(self):
-    return iter(self._items)
+    return (self._GetItem(i) for i in range(self.size))
 
   def __getitem__(self, key):
-    return self._items[key]
+    if isinstance(key, slice):
+      return [self._GetItem(i) for i in range(*key.indices(self.size))]
+    if key < 0:
+      key += self.size
+    if not 0 <= key < self.size:
+      raise IndexError('{} index out of range'.format(type(self).__name__))
+    return self._GetItem(key)
 
   def __len__(self):
-    return len(self._items)
+    return self.size
 
   def __repr__(self):
     item_type_part = ''
     if self.size != 0:
-      item_type = type(self._items[0])
+      item_type = type(self._GetItem(0))
       item_type_part = ', item type={}'.format(item_type.__name__)
 
     return '{}(offset={:#x}, size={}{})'.format(
         type(self).__name__, self.offset, self.size, item_type_part)
 
 
+class _StructItemList(_MemoryItemList):
+  """A list of fixed-size memory items that map directly onto a struct."""
+  _STRUCT = None
+  _ITEM_TYPE = None
+
+  def _GetItem(self, index):
+    return self._ITEM_TYPE._make(
+        self._STRUCT.unpack_from(self._reader.data,
+                                 self.offset + index * self._STRUCT.size))
+
+  def __iter__(self):
+    end = self.offset + self.size * self._STRUCT.size
+    return map(self._ITEM_TYPE._make,
+               self._STRUCT.iter_unpack(self._reader.data[self.offset:end]))
+
+
 class _TypeIdItemList(_MemoryItemList):
   def __init__(self, reader, offset, size):
-    factory = lambda x: _TypeIdItem(x.ReadUInt())
-    super().__init__(reader, offset, size, factory)
+    super().__init__(reader, offset, size)
+    # The string index of each type's descriptor, which is all that
+    # type_id_items contain.
+    self.descriptor_idxs = reader.ReadUIntArray(offset, size)
 
+  def _GetItem(self, index):
+    return _TypeIdItem(self.descriptor_idxs[index])
 
-class _ProtoIdItemList(_MemoryItemList):
-  def __init__(self, reader, offset, size):
-    factory = lambda x: _ProtoIdItem(x.ReadUInt(), x.ReadUInt(), x.ReadUInt())
-    super().__init__(reader, offset, size, factory)
 
+class _ProtoIdItemList(_StructItemList):
+  _STRUCT = struct.Struct('<III')
+  _ITEM_TYPE = _ProtoIdItem
 
-class _MethodIdItemList(_MemoryItemList):
-  def __init__(self, reader, offset, size):
-    factory = (
-        lambda x: _MethodIdItem(x.ReadUShort(), x.ReadUShort(), x.ReadUInt()))
-    super().__init__(reader, offset, size, factory)
+
+class _MethodIdItemList(_StructItemList):
+  _STRUCT = struct.Struct('<HHI')
+  _ITEM_TYPE = _MethodIdItem
 
 
 class _StringItemList(_MemoryItemList):
   def __init__(self, reader, offset, size):
-    reader.Seek(offset)
-    string_item_offsets = iter([reader.ReadUInt() for _ in range(size)])
-
-    def factory(x):
-      data_offset = next(string_item_offsets)
-      string = x.ReadString(data_offset)
-      return _StringDataItem(len(string), string)
+    super().__init__(reader, offset, size)
+    self._data_offsets = reader.ReadUIntArray(offset, size)
+    # Decoded strings, by index.
+    self._strings = [None] * size
+
+  def GetString(self, index):
+    ret = self._strings[index]
+    if ret is None:
+      ret = self._reader.ReadString(self._data_offsets[index])
+      self._strings[index] = ret
+    return ret
 
-    super().__init__(reader, offset, size, factory)
+  def _GetItem(self, index):
+    string = self.GetString(index)
+    return _StringDataItem(len(string), string)
 
 
 class _TypeListItem(_MemoryItemList):
-  def __init__(self, reader):
-    offset = reader.Tell()
-    size = reader.ReadUInt()
-    factory = lambda x: _TypeItem(x.ReadUShort())
-    # This is necessary because we need to extract the size of the type list
-    # (in other cases the list size is provided in the header).
-    first_item_offset = reader.Tell()
-    super().__init__(reader,
-                     offset,
-                     size,
-                     factory,
-                     alignment=4,
-                     first_item_offset=first_item_offset)
+  def __init__(self, reader, offset):
+    # Unlike for other lists, the size is part of the item.
+    super().__init__(reader, offset, reader.ReadUIntAt(offset))
+    self.type_idxs = reader.ReadUShortArray(offset + 4, self.size)
+
+  def _GetItem(self, index):
+    return _TypeItem(self.type_idxs[index])
 
 
 class _TypeListItemList(_MemoryItemList):
   def __init__(self, reader, offset, size):
-    super().__init__(reader, offset, size, _TypeListItem)
+    super().__init__(reader, offset, size)
+    self._item_offsets = None
 
+  def _GetItemOffsets(self):
+    if self._item_offsets is None:
+      # Type lists vary in size, so finding one requires walking the others.
+      self._item_offsets = []
+      item_offset = self.offset
+      for _ in range(self.size):
+        self._item_offsets.append(item_offset)
+        item_offset += 4 + 2 * self._reader.ReadUIntAt(item_offset)
+        # Each list is 4-byte aligned.
+        item_offset += -item_offset % 4
+    return self._item_offsets
+
+  def _GetItem(self, index):
+    return _TypeListItem(self._reader, self._GetItemOffsets()[index])
 
-class _ClassDefItemList(_MemoryItemList):
-  def __init__(self, reader, offset, size):
-    reader.Seek(offset)
 
-    def factory(x):
-      return _ClassDefItem(*(x.ReadUInt()
-                             for _ in range(len(_ClassDefItem._fields))))
+class _FieldIdItemList(_StructItemList):
+  _STRUCT = struct.Struct('<HHI')
+  _ITEM_TYPE = _FieldIdItem
 
-    super().__init__(reader, offset, size, factory)
+
+class _ClassDefItemList(_StructItemList):
+  _STRUCT = struct.Struct('<' + 'I' * len(_ClassDefItem._fields))
+  _ITEM_TYPE = _ClassDefItem
 
 
 class _DexMapItem:
@@ -213,7 +302,10 @@ class _DexMapList:
 
 class _DexReader:
   def __init__(self, data):
-    self._data = data
+    # A memoryview, so that slicing does not copy.
+    self.data = memoryview(data)
+    if self.data.format != 'B' or self.data.ndim != 1:
+      self.data = self.data.cast('B')
     self._pos = 0
 
   def Seek(self, offset):
@@ -223,19 +315,76 @@ class _DexReader:
     return self._pos
 
   def ReadUByte(self):
-    return self._ReadData('<B')
+    return self._ReadData(_UBYTE)
 
   def ReadUShort(self):
-    return self._ReadData('<H')
+    return self._ReadData(_USHORT)
 
   def ReadUInt(self):
-    return self._ReadData('<I')
+    return self._ReadData(_UINT)
+
+  def ReadUIntAt(self, offset):
+    return _UINT.unpack_from(self.data, offset)[0]
+
+  def ReadUShortArray(self, offset, size):
+    return self._ReadArray('H', offset, size)
+
+  def ReadUIntArray(self, offset, size):
+    return self._ReadArray('I', offset, size)
 
   def ReadString(self, data_offset):
     string_length, string_offset = self._ReadULeb128(data_offset)
     string_data_offset = string_offset + data_offset
+    # Most strings are ASCII, which MUTF-8 encodes as one byte per character.
+    string_end = string_data_offset + string_length
+    data = self.data[string_data_offset:string_end].tobytes()
+    if (data.isascii() and b'\0' not in data
+        and self.data[string_end:string_end + 1] == b'\0'):
+      return data.decode('ascii')
     return self._DecodeMUtf8(string_length, string_data_offset)
 
+  def ReadULeb128(self):
+    value, size = self._ReadULeb128(self._pos)
+    self._pos += size
+    return value
+
+  def ReadEncodedValue(self):
+    """Reads an encoded_value and returns it as an EncodedValue."""
+    header = self.ReadUByte()
+    value_type = header & 0x1f
+    value_arg = header >> 5
+    if value_type == VALUE_ARRAY:
+      value = [self.ReadEncodedValue() for _ in range(self.ReadULeb128())]
+    elif value_type == VALUE_ANNOTATION:
+      value = self.ReadEncodedAnnotation()
+    elif value_type == VALUE_NULL:
+      value = None
+    elif value_type == VALUE_BOOLEAN:
+      value = bool(value_arg)
+    else:
+      size = value_arg + 1
+      data = self.data[self._pos:self._pos + size].tobytes()
+      self._pos += size
+      if value_type == VALUE_FLOAT:
+        # Floating point values are zero-extended to the right.
+        value = struct.unpack('<f', data.rjust(4, b'\0'))[0]
+      elif value_type == VALUE_DOUBLE:
+        value = struct.unpack('<d', data.rjust(8, b'\0'))[0]
+      else:
+        value = int.from_bytes(data,
+                               'little',
+                               signed=value_type in _SIGNED_VALUE_TYPES)
+    return EncodedValue(value_type, value)
+
+  def ReadEncodedAnnotation(self):
+    """Reads an encoded_annotation and returns it as an EncodedAnnotation."""
+    type_idx = self.ReadULeb128()
+    elements = []
+    for _ in range(self.ReadULeb128()):
+      name_idx = self.ReadULeb128()
+      elements.append((name_idx, self.ReadEncodedValue()))
+    return EncodedAnnotation(type_idx, elements)
+
   def AlignUpTo(self, align_unit):
     off_by = self._pos % align_unit
     if off_by:
@@ -243,11 +392,19 @@ class _DexReader:
 
   def ReadHeader(self):
     header_fmt = '<' + ''.join(t[1] for t in _DEX_HEADER_FMT)
-    return DexHeader._make(struct.unpack_from(header_fmt, self._data))
+    return DexHeader._make(struct.unpack_from(header_fmt, self.data))
 
   def _ReadData(self, fmt):
-    ret = struct.unpack_from(fmt, self._data, self._pos)[0]
-    self._pos += struct.calcsize(fmt)
+    ret = fmt.unpack_from(self.data, self._pos)[0]
+    self._pos += fmt.size
+    return ret
+
+  def _ReadArray(self, typecode, offset, size):
+    ret = array.array(typecode)
+    ret.frombytes(self.data[offset:offset + size * ret.itemsize])
+    # Dex files are little-endian.
+    if sys.byteorder == 'big':
+      ret.byteswap()
     return ret
 
   def _ReadULeb128(self, data_offset):
@@ -262,7 +419,7 @@ class _DexReader:
     shift = 0
     cur_offset = data_offset
     while True:
-      byte = self._data[cur_offset]
+      byte = self.data[cur_offset]
       cur_offset += 1
       value |= (byte & 0b01111111) << shift
       if (byte & 0b10000000) == 0:
@@ -328,6 +485,10 @@ class DexFile:
   Parses and exposes access to dex file structure and contents, as described
   at https://source.android.com/devices/tech/dalvik/dex-format
 
+  Sections are decoded when they are first accessed, and items within them
+  when they are accessed, so that looking at a few items of a large dex file is
+  cheap.
+
   Fields:
     reader: _DexReader object used to decode dex file contents.
     header: DexHeader for this dex file.
@@ -355,55 +516,128 @@ class DexFile:
   }
 
   def __init__(self, data):
-    """Decodes dex file memory sections.
+    """Decodes the dex file header and map list.
 
     Args:
-      data: bytearray containing the contents of a dex file.
+      data: bytes-like object (e.g. bytes, bytearray, mmap or memoryview)
+        containing the contents of a dex file. It is not copied, and must not
+        change while the DexFile is in use.
     """
     self.reader = _DexReader(data)
     self.header = self.reader.ReadHeader()
     self.map_list = _DexMapList(self.reader, self.header.map_off)
-    self.type_item_list = _TypeIdItemList(self.reader, self.header.type_ids_off,
-                                          self.header.type_ids_size)
-    self.proto_item_list = _ProtoIdItemList(self.reader,
-                                            self.header.proto_ids_off,
-                                            self.header.proto_ids_size)
-    self.method_item_list = _MethodIdItemList(self.reader,
-                                              self.header.method_ids_off,
-                                              self.header.method_ids_size)
-    self.string_item_list = _StringItemList(self.reader,
-                                            self.header.string_ids_off,
-                                            self.header.string_ids_size)
-    self.class_def_item_list = _ClassDefItemList(self.reader,
-                                                 self.header.class_defs_off,
-                                                 self.header.class_defs_size)
-
+    self._type_lists_by_offset = {}
+
+  @functools.cached_property
+  def type_item_list(self):
+    return _TypeIdItemList(self.reader, self.header.type_ids_off,
+                           self.header.type_ids_size)
+
+  @functools.cached_property
+  def proto_item_list(self):
+    return _ProtoIdItemList(self.reader, self.header.proto_ids_off,
+                            self.header.proto_ids_size)
+
+  @functools.cached_property
+  def method_item_list(self):
+    return _MethodIdItemList(self.reader, self.header.method_ids_off,
+                             self.header.method_ids_size)
+
+  @functools.cached_property
+  def string_item_list(self):
+    return _StringItemList(self.reader, self.header.string_ids_off,
+                           self.header.string_ids_size)
+
+  @functools.cached_property
+  def field_item_list(self):
+    return _FieldIdItemList(self.reader, self.header.field_ids_off,
+                            self.header.field_ids_size)
+
+  @functools.cached_property
+  def class_def_item_list(self):
+    return _ClassDefItemList(self.reader, self.header.class_defs_off,
+                             self.header.class_defs_size)
+
+  @functools.cached_property
+  def type_list_item_list(self):
     type_list_key = _DexMapList.TYPE_TYPE_LIST
     if type_list_key in self.map_list:
       map_list_item = self.map_list[type_list_key]
-      self.type_list_item_list = _TypeListItemList(self.reader,
-                                                   map_list_item.offset,
-                                                   map_list_item.size)
-    else:
-      self.type_list_item_list = _TypeListItemList(self.reader, 0, 0)
-    self._type_lists_by_offset = {
-        type_list.offset: type_list
-        for type_list in self.type_list_item_list
-    }
+      return _TypeListItemList(self.reader, map_list_item.offset,
+                               map_list_item.size)
+    return _TypeListItemList(self.reader, 0, 0)
 
   def GetString(self, string_item_idx):
-    string_item = self.string_item_list[string_item_idx]
-    return string_item.data
+    return self.string_item_list.GetString(string_item_idx)
 
   def GetTypeString(self, type_item_idx):
-    type_item = self.type_item_list[type_item_idx]
-    return self.GetString(type_item.descriptor_idx)
+    return self.string_item_list.GetString(
+        self.type_item_list.descriptor_idxs[type_item_idx])
 
   def GetTypeListStringsByOffset(self, offset):
     if not offset:
       return ()
-    type_list = self._type_lists_by_offset[offset]
-    return tuple(self.GetTypeString(item.type_idx) for item in type_list)
+    type_list = self._type_lists_by_offset.get(offset)
+    if type_list is None:
+      type_list = tuple(
+          self.GetTypeString(type_idx)
+          for type_idx in _TypeListItem(self.reader, offset).type_idxs)
+      self._type_lists_by_offset[offset] = type_list
+    return type_list
+
+  def GetClassData(self, class_data_off):
+    """Returns the _ClassDataItem at |class_data_off|, or None if it is 0."""
+    if not class_data_off:
+      return None
+    reader = self.reader
+    reader.Seek(class_data_off)
+    static_fields_size = reader.ReadULeb128()
+    instance_fields_size = reader.ReadULeb128()
+    direct_methods_size = reader.ReadULeb128()
+    virtual_methods_size = reader.ReadULeb128()
+    # Each encoded_field is a field_idx_diff and access_flags.
+    for _ in range(2 * (static_fields_size + instance_fields_size)):
+      reader.ReadULeb128()
+
+    def read_methods(size):
+      ret = []
+      method_idx = 0
+      for _ in range(size):
+        method_idx += reader.ReadULeb128()
+        ret.append(
+            _EncodedMethod(method_idx, reader.ReadULeb128(),
+                           reader.ReadULeb128()))
+      return ret
+
+    direct_methods = read_methods(direct_methods_size)
+    return _ClassDataItem(direct_methods, read_methods(virtual_methods_size))
+
+  def GetAnnotationsDirectory(self, annotations_off):
+    """Returns the _AnnotationsDirectoryItem at |annotations_off|, or None."""
+    if not annotations_off:
+      return None
+    reader = self.reader
+    reader.Seek(annotations_off)
+    class_annotations_off = reader.ReadUInt()
+    sizes = [reader.ReadUInt() for _ in range(3)]
+    field_annotations, method_annotations, parameter_annotations = (
+        [(reader.ReadUInt(), reader.ReadUInt()) for _ in range(size)]
+        for size in sizes)
+    return _AnnotationsDirectoryItem(class_annotations_off, field_annotations,
+                                     method_annotations, parameter_annotations)
+
+  def GetAnnotationSet(self, annotation_set_off):
+    """Returns the list of _AnnotationItems of an annotation_set_item."""
+    if not annotation_set_off:
+      return []
+    reader = self.reader
+    ret = []
+    for annotation_off in reader.ReadUIntArray(
+        annotation_set_off + 4, reader.ReadUIntAt(annotation_set_off)):
+      reader.Seek(annotation_off)
+      visibility = reader.ReadUByte()
+      ret.append(_AnnotationItem(visibility, reader.ReadEncodedAnnotation()))
+    return ret
 
   @staticmethod
   def ResolveClassAccessFlags(access_flags):
@@ -418,14 +652,24 @@ class DexFile:
       Tuples that look like:
         (class name, return type, method name, (parameter type, ...)).
     """
-    for method_item in self.method_item_list:
-      class_name_string = self.GetTypeString(method_item.type_idx)
-      method_name_string = self.GetString(method_item.name_idx)
-      proto_item = self.proto_item_list[method_item.proto_idx]
-      return_type_string = self.GetTypeString(proto_item.return_type_idx)
-      parameter_types = self.GetTypeListStringsByOffset(
-          proto_item.parameters_off)
-      yield (class_name_string, return_type_string, method_name_string,
+    get_string = self.GetString
+    # Methods of a class are adjacent, and most share their protos.
+    class_name_string = None
+    last_type_idx = None
+    proto_parts_by_idx = {}
+    for type_idx, proto_idx, name_idx in self.method_item_list:
+      if type_idx != last_type_idx:
+        class_name_string = self.GetTypeString(type_idx)
+        last_type_idx = type_idx
+      proto_parts = proto_parts_by_idx.get(proto_idx)
+      if proto_parts is None:
+        proto_item = self.proto_item_list[proto_idx]
+        proto_parts = (self.GetTypeString(proto_item.return_type_idx),
+                       self.GetTypeListStringsByOffset(
+                           proto_item.parameters_off))
+        proto_parts_by_idx[proto_idx] = proto_parts
+      return_type_string, parameter_types = proto_parts
+      yield (class_name_string, return_type_string, get_string(name_idx),
              parameter_types)
 
   def __repr__(self):
@@ -442,6 +686,67 @@ class DexFile:
     return '\n'.join(str(item) for item in items)
 
 
+def _MapFile(path):
+  with open(path, 'rb') as f:
+    # The mapping stays valid after the file is closed.
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def ReadDexFile(path):
+  """Returns a DexFile for the .dex file at |path|.
+
+  The file is mapped into memory rather than read, and must not be modified
+  while the DexFile is in use.
+  """
+  return DexFile(_MapFile(path))
+
+
+def _GetZipEntryData(mapped_zip, info):
+  # The data follows the local file header, whose name and extra field may
+  # differ from those in the central directory.
+  name_size, extra_size = struct.unpack_from('<HH', mapped_zip,
+                                             info.header_offset + 26)
+  data_offset = info.header_offset + 30 + name_size + extra_size
+  return mapped_zip[data_offset:data_offset + info.file_size]
+
+
+def ReadDexFileFromZip(zip_path, name):
+  """Returns a DexFile for the entry |name| of a zip file.
+
+  See IterDexFilesInZip().
+  """
+  with zipfile.ZipFile(zip_path) as z:
+    info = z.getinfo(name)
+    if info.compress_type == zipfile.ZIP_STORED:
+      return DexFile(_GetZipEntryData(memoryview(_MapFile(zip_path)), info))
+    return DexFile(z.read(info))
+
+
+def IsDexPath(path):
+  """Returns whether |path| (e.g. a zip entry) is a classes*.dex file."""
+  return bool(_DEX_PATH_RE.match(path))
+
+
+def IterDexFilesInZip(zip_path):
+  """Yields (entry name, DexFile) for classes*.dex files in a zip (e.g. .apk).
+
+  Stored entries, as are common in .apk files, are mapped into memory rather
+  than being read. The zip must not be modified while the DexFiles are in use.
+  """
+  mapped = None
+  with zipfile.ZipFile(zip_path) as z:
+    for info in z.infolist():
+      if not IsDexPath(info.filename):
+        continue
+      if info.compress_type == zipfile.ZIP_STORED:
+        if mapped is None:
+          mapped = memoryview(_MapFile(zip_path))
+        data = _GetZipEntryData(mapped, info)
+      else:
+        data = z.read(info)
+      yield info.filename, DexFile(data)
+
+
 class _DumpCommand:
   def __init__(self, dexfile):
     self._dexfile = dexfile
@@ -482,8 +787,7 @@ class _DumpSummary(_DumpCommand):
     print(self._dexfile)
 
 
-def _DumpDexItems(dexfile_data, name, item):
-  dexfile = DexFile(bytearray(dexfile_data))
+def _DumpDexItems(dexfile, name, item):
   print('dex_parser: Dumping {} for {}'.format(item, name))
   cmds = {
       'summary': _DumpSummary,
@@ -511,21 +815,17 @@ def main():
   args = parser.parse_args()
 
   if os.path.splitext(args.input)[1] in ('.apk', '.jar', '.zip', '.aab'):
-    with zipfile.ZipFile(args.input) as z:
-      dex_file_paths = [
-          f for f in z.namelist() if re.match(r'.*classes[0-9]*\.dex$', f)
-      ]
-      if not dex_file_paths:
-        print('Error: {} does not contain any classes.dex files'.format(
-            args.input))
-        sys.exit(1)
-
-      for path in dex_file_paths:
-        _DumpDexItems(z.read(path), path, args.item)
+    found = False
+    for path, dexfile in IterDexFilesInZip(args.input):
+      found = True
+      _DumpDexItems(dexfile, path, args.item)
+    if not found:
+      print('Error: {} does not contain any classes.dex files'.format(
+          args.input))
+      sys.exit(1)
 
   else:
-    with open(args.input, 'rb') as f:
-      _DumpDexItems(f.read(), args.input, args.item)
+    _DumpDexItems(ReadDexFile(args.input), args.input, args.item)
 
 
 if __name__ == '__main__':
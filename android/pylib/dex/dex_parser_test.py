@@ -0,0 +1,338 @@
+#! /usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import struct
+import tempfile
+import unittest
+import zipfile
+
+from pylib.dex import dex_parser
+
+# pylint: disable=protected-access
+
+
+def _EncodeMUtf8(string):
+  ret = b''
+  for char in string:
+    code = ord(char)
+    if 0 < code < 0x80:
+      ret += bytes([code])
+    elif code < 0x800:
+      ret += bytes([0xc0 | code >> 6, 0x80 | code & 0x3f])
+    else:
+      ret += bytes([0xe0 | code >> 12, 0x80 | code >> 6 & 0x3f,
+                    0x80 | code & 0x3f])
+  return ret
+
+
+def _EncodeULeb128(value):
+  ret = b''
+  while True:
+    byte = value & 0x7f
+    value >>= 7
+    if value:
+      ret += bytes([byte | 0x80])
+    else:
+      return ret + bytes([byte])
+
+
+def EncodeValue(value_type, value_arg=0, payload=b''):
+  """Returns the bytes of an encoded_value."""
+  return bytes([value_arg << 5 | value_type]) + payload
+
+
+def EncodeAnnotation(type_idx, elements):
+  """Returns the bytes of an encoded_annotation.
+
+  Args:
+    type_idx: Type index of the annotation.
+    elements: List of (name_idx, encoded_value bytes).
+  """
+  ret = _EncodeULeb128(type_idx) + _EncodeULeb128(len(elements))
+  for name_idx, value in elements:
+    ret += _EncodeULeb128(name_idx) + value
+  return ret
+
+
+def BuildDexFile(strings, types, protos, methods, classes, fields=()):
+  """Returns the bytes of a minimal dex file.
+
+  Args:
+    strings: List of strings, sorted.
+    types: List of string indices.
+    protos: List of (shorty_idx, return_type_idx, [parameter type_idx]).
+    methods: List of (type_idx, proto_idx, name_idx).
+    classes: List of (class_idx, access_flags, superclass_idx, [interface
+      type_idx]), optionally followed by class data and annotations. Class
+      data is ([direct (method_idx, access_flags)], [virtual (method_idx,
+      access_flags)]). Annotations are ([class annotation], {method_idx:
+      [method annotation]}), where an annotation is (visibility,
+      encoded_annotation bytes).
+    fields: List of (class_idx, type_idx, name_idx).
+  """
+  header_size = 0x70
+  string_ids_off = header_size
+  type_ids_off = string_ids_off + 4 * len(strings)
+  proto_ids_off = type_ids_off + 4 * len(types)
+  field_ids_off = proto_ids_off + 12 * len(protos)
+  method_ids_off = field_ids_off + 8 * len(fields)
+  class_defs_off = method_ids_off + 8 * len(methods)
+  data_off = class_defs_off + 32 * len(classes)
+  classes = [tuple(c) + (None, ) * (6 - len(c)) for c in classes]
+
+  data = b''
+  type_list_offsets = {}
+  type_lists = [p[2] for p in protos] + [c[3] for c in classes]
+  for type_list in type_lists:
+    key = tuple(type_list)
+    if key and key not in type_list_offsets:
+      type_list_offsets[key] = data_off + len(data)
+      data += struct.pack('<I', len(key))
+      data += struct.pack('<%dH' % len(key), *key)
+      data += b'\0' * (-len(data) % 4)
+  type_lists_off = data_off if type_list_offsets else 0
+
+  string_data_offsets = []
+  for string in strings:
+    string_data_offsets.append(data_off + len(data))
+    data += _EncodeULeb128(len(string)) + _EncodeMUtf8(string) + b'\0'
+  data += b'\0' * (-len(data) % 4)
+
+  def add_annotation_set(annotations):
+    nonlocal data
+    annotation_offsets = []
+    for visibility, annotation in annotations:
+      annotation_offsets.append(data_off + len(data))
+      data += bytes([visibility]) + annotation
+    data += b'\0' * (-len(data) % 4)
+    offset = data_off + len(data)
+    data += struct.pack('<%dI' % (len(annotations) + 1), len(annotations),
+                        *annotation_offsets)
+    return offset
+
+  class_data_offsets = []
+  annotations_offsets = []
+  for class_def in classes:
+    class_data = class_def[4]
+    if class_data is None:
+      class_data_offsets.append(0)
+    else:
+      class_data_offsets.append(data_off + len(data))
+      data += b''.join(_EncodeULeb128(v) for v in (0, 0, len(class_data[0]),
+                                                   len(class_data[1])))
+      for encoded_methods in class_data:
+        prev_method_idx = 0
+        for method_idx, access_flags in encoded_methods:
+          data += _EncodeULeb128(method_idx - prev_method_idx)
+          data += _EncodeULeb128(access_flags) + _EncodeULeb128(0)
+          prev_method_idx = method_idx
+      data += b'\0' * (-len(data) % 4)
+
+    annotations = class_def[5]
+    if annotations is None:
+      annotations_offsets.append(0)
+    else:
+      class_annotations, method_annotations = annotations
+      class_annotations_off = (add_annotation_set(class_annotations)
+                               if class_annotations else 0)
+      method_annotation_offsets = [
+          (method_idx, add_annotation_set(method_annotations[method_idx]))
+          for method_idx in sorted(method_annotations)
+      ]
+      annotations_offsets.append(data_off + len(data))
+      data += struct.pack('<4I', class_annotations_off, 0,
+                          len(method_annotation_offsets), 0)
+      for item in method_annotation_offsets:
+        data += struct.pack('<II', *item)
+
+  map_off = data_off + len(data)
+  map_items = [(0x0001, len(strings), string_ids_off)]
+  if type_list_offsets:
+    map_items.append((0x1001, len(type_list_offsets), type_lists_off))
+  data += struct.pack('<I', len(map_items))
+  for item_type, size, offset in map_items:
+    data += struct.pack('<HHII', item_type, 0, size, offset)
+
+  ids = b''.join(struct.pack('<I', o) for o in string_data_offsets)
+  ids += b''.join(struct.pack('<I', t) for t in types)
+  for shorty_idx, return_type_idx, parameters in protos:
+    ids += struct.pack('<III', shorty_idx, return_type_idx,
+                       type_list_offsets.get(tuple(parameters), 0))
+  for field in fields:
+    ids += struct.pack('<HHI', *field)
+  for method in methods:
+    ids += struct.pack('<HHI', *method)
+  for i, class_def in enumerate(classes):
+    class_idx, access_flags, superclass_idx, interfaces = class_def[:4]
+    ids += struct.pack('<8I', class_idx, access_flags, superclass_idx,
+                       type_list_offsets.get(tuple(interfaces), 0), 0,
+                       annotations_offsets[i], class_data_offsets[i], 0)
+
+  file_size = data_off + len(data)
+  header = struct.pack('<8sI20s20I', b'dex\n035\0', 0, b'\0' * 20, file_size,
+                       header_size, 0x12345678, 0, 0, map_off, len(strings),
+                       string_ids_off, len(types), type_ids_off, len(protos),
+                       proto_ids_off, len(fields), field_ids_off, len(methods),
+                       method_ids_off, len(classes), class_defs_off, len(data),
+                       data_off)
+  return header + ids + data
+
+
+_STRINGS = [
+    'I', 'III', 'LBar;', 'LFoo;', 'Ljava/lang/Object;', 'Ljava/lang/Runnable;',
+    'café', 'run', 'snow☃'
+]
+_TYPES = [0, 2, 3, 4, 5]
+_PROTOS = [(1, 0, [0, 1])]
+_METHODS = [(2, 0, 7), (2, 0, 6)]
+_CLASSES = [(2, 0x11, 3, [4]), (1, 0x1, 3, [])]
+
+
+def _CreateTestDexFile():
+  return BuildDexFile(_STRINGS, _TYPES, _PROTOS, _METHODS, _CLASSES)
+
+
+class DexParserTest(unittest.TestCase):
+  def _CheckDexFile(self, dexfile):
+    self.assertEqual(len(_STRINGS), dexfile.header.string_ids_size)
+    self.assertEqual(_STRINGS, [s.data for s in dexfile.string_item_list])
+    self.assertEqual(len('snow☃'), dexfile.string_item_list[-1].utf16_size)
+    self.assertEqual('LFoo;', dexfile.GetTypeString(2))
+    self.assertEqual([
+        ('LFoo;', 'I', 'run', ('I', 'LBar;')),
+        ('LFoo;', 'I', 'café', ('I', 'LBar;')),
+    ], list(dexfile.IterMethodSignatureParts()))
+    class_item = dexfile.class_def_item_list[0]
+    self.assertEqual(('Ljava/lang/Runnable;', ),
+                     dexfile.GetTypeListStringsByOffset(
+                         class_item.interfaces_off))
+    self.assertEqual(('public', 'final'),
+                     dexfile.ResolveClassAccessFlags(class_item.access_flags))
+    self.assertEqual(2, len(dexfile.type_list_item_list))
+    self.assertEqual([[0, 1], [4]],
+                     [[t.type_idx for t in type_list]
+                      for type_list in dexfile.type_list_item_list])
+
+  def testDexFile(self):
+    self._CheckDexFile(dex_parser.DexFile(_CreateTestDexFile()))
+
+  def testDexFile_bytearray(self):
+    self._CheckDexFile(dex_parser.DexFile(bytearray(_CreateTestDexFile())))
+
+  def testSectionsAreLazy(self):
+    dexfile = dex_parser.DexFile(_CreateTestDexFile())
+    self.assertNotIn('string_item_list', vars(dexfile))
+    self.assertEqual('run', dexfile.GetString(7))
+    self.assertEqual([None] * 7 + ['run', None],
+                     dexfile.string_item_list._strings)
+
+  def testListIndexing(self):
+    dexfile = dex_parser.DexFile(_CreateTestDexFile())
+    methods = dexfile.method_item_list
+    self.assertEqual(methods[1], methods[-1])
+    self.assertEqual(list(methods), methods[:])
+    with self.assertRaises(IndexError):
+      methods[2]  # pylint: disable=pointless-statement
+
+  def testMUtf8DecodeError(self):
+    data = bytearray(_CreateTestDexFile())
+    # Replace the terminator of the first string.
+    string_data_off = dex_parser.DexFile(data).string_item_list._data_offsets[0]
+    data[string_data_off + 2] = ord('x')
+    with self.assertRaises(dex_parser._MUTf8DecodeError):
+      dex_parser.DexFile(data).GetString(0)
+
+  def testClassDataAndAnnotations(self):
+    # Strings: 0 'LAnno;', 1 'LFoo;', 2 'a', 3 'b', 4 'run'.
+    annotation = EncodeAnnotation(0, [
+        (2, EncodeValue(dex_parser.VALUE_INT, 1, b'\xfe\xff')),
+        (3,
+         EncodeValue(dex_parser.VALUE_ARRAY, 0,
+                     _EncodeULeb128(5) +
+                     EncodeValue(dex_parser.VALUE_STRING, 0, b'\x04') +
+                     EncodeValue(dex_parser.VALUE_FLOAT, 1, b'\x80\x3f') +
+                     EncodeValue(dex_parser.VALUE_LONG, 0, b'\x80') +
+                     EncodeValue(dex_parser.VALUE_BOOLEAN, 1) +
+                     EncodeValue(dex_parser.VALUE_ENUM, 0, b'\x00'))),
+    ])
+    nested = EncodeAnnotation(0, [
+        (2, EncodeValue(dex_parser.VALUE_ANNOTATION, 0, annotation)),
+        (3, EncodeValue(dex_parser.VALUE_NULL)),
+    ])
+    data = BuildDexFile(
+        ['LAnno;', 'LFoo;', 'a', 'b', 'run'], [0, 1], [(4, 0, [])],
+        [(1, 0, 4), (1, 0, 4), (1, 0, 4)], [
+            (1, 0x1, 0xffffffff, [], ([(0, 0x10001), (2, 0x1)], [(1, 0x1)]),
+             ([(dex_parser.VISIBILITY_RUNTIME, annotation)], {
+                 2: [(dex_parser.VISIBILITY_BUILD, nested)]
+             })),
+            (0, 0x2000, 0xffffffff, []),
+        ],
+        fields=[(1, 1, 4)])
+    dexfile = dex_parser.DexFile(data)
+    class_def, anno_def = dexfile.class_def_item_list
+
+    class_data = dexfile.GetClassData(class_def.class_data_off)
+    self.assertEqual([(0, 0x10001, 0), (2, 0x1, 0)],
+                     class_data.direct_methods)
+    self.assertEqual([(1, 0x1, 0)], class_data.virtual_methods)
+    self.assertIsNone(dexfile.GetClassData(anno_def.class_data_off))
+    self.assertIsNone(dexfile.GetAnnotationsDirectory(anno_def.annotations_off))
+
+    directory = dexfile.GetAnnotationsDirectory(class_def.annotations_off)
+    self.assertEqual([], directory.field_annotations)
+    self.assertEqual([2], [idx for idx, _ in directory.method_annotations])
+    expected_annotation = dex_parser.EncodedAnnotation(0, [
+        (2, dex_parser.EncodedValue(dex_parser.VALUE_INT, -2)),
+        (3,
+         dex_parser.EncodedValue(dex_parser.VALUE_ARRAY, [
+             dex_parser.EncodedValue(dex_parser.VALUE_STRING, 4),
+             dex_parser.EncodedValue(dex_parser.VALUE_FLOAT, 1.0),
+             dex_parser.EncodedValue(dex_parser.VALUE_LONG, -128),
+             dex_parser.EncodedValue(dex_parser.VALUE_BOOLEAN, True),
+             dex_parser.EncodedValue(dex_parser.VALUE_ENUM, 0),
+         ])),
+    ])
+    self.assertEqual([(dex_parser.VISIBILITY_RUNTIME, expected_annotation)],
+                     dexfile.GetAnnotationSet(directory.class_annotations_off))
+    (visibility, method_annotation), = dexfile.GetAnnotationSet(
+        directory.method_annotations[0][1])
+    self.assertEqual(dex_parser.VISIBILITY_BUILD, visibility)
+    self.assertEqual(
+        dex_parser.EncodedValue(dex_parser.VALUE_ANNOTATION,
+                                expected_annotation),
+        method_annotation.elements[0][1])
+    self.assertEqual(dex_parser.EncodedValue(dex_parser.VALUE_NULL, None),
+                     method_annotation.elements[1][1])
+    self.assertEqual(4, dexfile.field_item_list[0].name_idx)
+    self.assertEqual([], dexfile.GetAnnotationSet(0))
+
+  def testIterDexFilesInZip(self):
+    dex_data = _CreateTestDexFile()
+    with tempfile.TemporaryDirectory() as temp_dir:
+      zip_path = os.path.join(temp_dir, 'test.apk')
+      with zipfile.ZipFile(zip_path, 'w') as z:
+        z.writestr('AndroidManifest.xml', b'')
+        # Stored entries are mapped rather than read.
+        z.writestr('classes.dex', dex_data)
+        z.writestr('classes2.dex', dex_data, zipfile.ZIP_DEFLATED)
+        z.writestr('assets/classes.dex.txt', b'')
+      dexfiles = list(dex_parser.IterDexFilesInZip(zip_path))
+      self.assertEqual(['classes.dex', 'classes2.dex'],
+                       [name for name, _ in dexfiles])
+      for _, dexfile in dexfiles:
+        self._CheckDexFile(dexfile)
+
+  def testReadDexFile(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      dex_path = os.path.join(temp_dir, 'classes.dex')
+      with open(dex_path, 'wb') as f:
+        f.write(_CreateTestDexFile())
+      self._CheckDexFile(dex_parser.ReadDexFile(dex_path))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -18,6 +18,7 @@ from pylib.base import test_instance
 from pylib.constants import host_paths
 from pylib.instrumentation import test_result
 from pylib.instrumentation import instrumentation_parser
+from pylib.instrumentation import test_list_cache
 from pylib.symbols import deobfuscator
 from pylib.symbols import stack_symbolizer
 from pylib.utils import dexdump
@@ -51,7 +52,7 @@ _PARAMETERIZED_COMMAND_LINE_FLAGS = 'ParameterizedCommandLineFlags'
 _PARAMETERIZED_COMMAND_LINE_FLAGS_SWITCHES = (
     'ParameterizedCommandLineFlags$Switches')
 _NATIVE_CRASH_RE = re.compile('(process|native) crash', re.IGNORECASE)
-_PICKLE_FORMAT_VERSION = 12
+_PICKLE_FORMAT_VERSION = 13
 
 # The ID of the bundle value Instrumentation uses to report which test index the
 # results are for in a collection of tests. Note that this index is 1-based.
@@ -250,25 +251,8 @@ def FilterTests(tests,
   """
 
   def test_names_from_pattern(combined_pattern, test_names):
-    patterns = combined_pattern.split(':')
-
-    hashable_patterns = set()
-    filename_patterns = []
-    for pattern in patterns:
-      if ('*' in pattern or '?' in pattern or '[' in pattern):
-        filename_patterns.append(pattern)
-      else:
-        hashable_patterns.add(pattern)
-
-    filter_test_names = set(
-        unittest_util.FilterTestNames(test_names, ':'.join(
-            filename_patterns))) if len(filename_patterns) > 0 else set()
-
-    for test_name in test_names:
-      if test_name in hashable_patterns:
-        filter_test_names.add(test_name)
-
-    return filter_test_names
+    matcher = unittest_util.PatternMatcher(combined_pattern.split(':'))
+    return {name for name in test_names if matcher.Matches(name)}
 
   def get_test_names(test):
     test_names = set()
@@ -430,15 +414,19 @@ def FilterTests(tests,
   return return_tests
 
 
-def GetAllTestsFromApk(test_apk):
-  pickle_path = '%s-dexdump.pickle' % test_apk
-  try:
-    tests = GetTestsFromPickle(pickle_path, os.path.getmtime(test_apk))
-  except TestListPickleException as e:
-    logging.info('Could not get tests from pickle: %s', e)
-    logging.info('Getting tests from dex via dexdump.')
+def GetAllTestsFromApk(test_apk, cache_dir=None):
+  """Returns the tests of |test_apk|, reading them from its dex files.
+
+  Test lists are cached in |cache_dir| (see test_list_cache), keyed by the dex
+  files of the APK.
+  """
+  cache = test_list_cache.TestListCache(cache_dir)
+  key = test_list_cache.ComputeKey(test_apk, str(_PICKLE_FORMAT_VERSION))
+  tests = cache.Get(key)
+  if tests is None:
+    logging.info('Getting tests from dex.')
     tests = _GetTestsFromDexdump(test_apk)
-    SaveTestsToPickle(pickle_path, tests)
+    cache.Put(key, tests)
   return tests
 
 
@@ -627,6 +615,7 @@ class InstrumentationTestInstance(test_instance.TestInstance):
     self._screenshot_dir = None
     self._timeout_scale = None
     self._wait_for_java_debugger = None
+    self._test_list_cache_dir = None
     self._initializeTestControlAttributes(args)
 
     self._coverage_directory = None
@@ -846,6 +835,8 @@ class InstrumentationTestInstance(test_instance.TestInstance):
 
   def _initializeTestControlAttributes(self, args):
     self._screenshot_dir = args.screenshot_dir
+    if hasattr(args, 'test_list_cache_dir'):
+      self._test_list_cache_dir = args.test_list_cache_dir
     self._timeout_scale = args.timeout_scale or 1
     self._wait_for_java_debugger = args.wait_for_java_debugger
 
@@ -1125,7 +1116,8 @@ class InstrumentationTestInstance(test_instance.TestInstance):
       # .dex files listed in the .json.
       raise Exception('Support not implemented for incremental_install=true on '
                       'tests that do not use //base\'s test runner.')
-    raw_tests = GetAllTestsFromApk(self.test_apk.path)
+    raw_tests = GetAllTestsFromApk(self.test_apk.path,
+                                   self._test_list_cache_dir)
     return self.ProcessRawTests(raw_tests)
 
   def MaybeDeobfuscateLines(self, lines):
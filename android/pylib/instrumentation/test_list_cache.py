@@ -0,0 +1,128 @@
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""A cache of the tests listed from test APKs, shared by test runners.
+
+Entries are keyed by the dex entries of an APK as recorded in its zip central
+directory (names, CRC-32s and sizes), so computing a key does not depend on the
+size of the APK, and identical dex files in rebuilt or copied APKs share an
+entry. The cache directory can be shared by all shards on a machine.
+
+Entries are JSON lines: a header followed by one test class per line. Unlike
+pickles, loading them cannot run code. Entries that are not owned by the
+current user are ignored.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+from pylib.dex import dex_parser
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'gyp'))
+from util import build_utils
+
+# Bump when changing how entries are stored.
+_FORMAT_VERSION = 1
+# Per-user, since entries of other users are ignored.
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(),
+                                 'chromium_test_list_cache_%d' % os.getuid())
+# Entries not used for this long are deleted when adding new ones.
+_MAX_ENTRY_AGE_SECONDS = 7 * 24 * 60 * 60
+
+
+def ComputeKey(apk_path, *extra_parts):
+  """Returns the cache key for the tests of an APK.
+
+  Args:
+    apk_path: Path to the APK.
+    extra_parts: Strings that also affect the listed tests (e.g. the version
+      of the format of the listed tests).
+  """
+  sha1 = hashlib.sha1(b'%d' % _FORMAT_VERSION)
+  for part in extra_parts:
+    sha1.update(b'\0' + part.encode('utf-8'))
+  with zipfile.ZipFile(apk_path) as z:
+    infos = sorted(
+        (i for i in z.infolist() if dex_parser.IsDexPath(i.filename)),
+        key=lambda i: i.filename)
+  for info in infos:
+    sha1.update(b'\0%s\0%08x\0%d' %
+                (info.filename.encode('utf-8'), info.CRC, info.file_size))
+  return sha1.hexdigest()
+
+
+class TestListCache:
+  """A directory of test lists, keyed by ComputeKey()."""
+
+  def __init__(self, cache_dir=None):
+    self._cache_dir = cache_dir or DEFAULT_CACHE_DIR
+
+  def _EntryPath(self, key):
+    return os.path.join(self._cache_dir, key + '.jsonl')
+
+  def IterTests(self, key):
+    """Yields the cached test classes for |key|, or raises KeyError.
+
+    Test classes are parsed as they are iterated over.
+    """
+    path = self._EntryPath(key)
+    try:
+      f = open(path)
+    except FileNotFoundError:
+      raise KeyError(key) from None
+    with f:
+      # Entries written by other users could list arbitrary tests.
+      if os.fstat(f.fileno()).st_uid != os.getuid():
+        logging.warning('Ignoring test list cache entry %s of another user.',
+                        path)
+        raise KeyError(key)
+      header = json.loads(f.readline() or 'null')
+      if header != {'version': _FORMAT_VERSION, 'key': key}:
+        raise KeyError(key)
+      try:
+        os.utime(path)
+      except OSError:
+        pass
+      for line in f:
+        yield json.loads(line)
+
+  def Get(self, key):
+    """Returns the list of cached test classes for |key|, or None."""
+    try:
+      return list(self.IterTests(key))
+    except KeyError:
+      return None
+    except ValueError as e:
+      logging.warning('Ignoring corrupt test list cache entry %s: %s', key, e)
+      return None
+
+  def Put(self, key, tests):
+    """Stores the list of test classes for |key|."""
+    try:
+      # Concurrent readers never see a partial entry.
+      with build_utils.AtomicOutput(self._EntryPath(key),
+                                    only_if_changed=False,
+                                    mode='w') as f:
+        f.write(json.dumps({'version': _FORMAT_VERSION, 'key': key}) + '\n')
+        for test in tests:
+          f.write(json.dumps(test) + '\n')
+      self._DeleteOldEntries()
+    except OSError as e:
+      # Failing to cache is not fatal.
+      logging.warning('Could not write test list cache entry %s: %s', key, e)
+
+  def _DeleteOldEntries(self):
+    min_mtime = time.time() - _MAX_ENTRY_AGE_SECONDS
+    for entry in os.scandir(self._cache_dir):
+      try:
+        if entry.stat().st_mtime < min_mtime:
+          os.unlink(entry.path)
+      except FileNotFoundError:
+        # Deleted by another process.
+        pass
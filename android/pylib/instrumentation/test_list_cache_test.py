@@ -0,0 +1,98 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for test_list_cache."""
+
+# pylint: disable=protected-access
+
+import os
+import sys
+import unittest
+import zipfile
+
+import mock  # pylint: disable=import-error
+
+from pylib.instrumentation import test_list_cache
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'gyp'))
+from util import temp_dir_test_case
+
+_TESTS = [{
+    'class': 'org.chromium.FooTest',
+    'annotations': {
+        'Feature': {
+            'value': ['Foo', 'Bar']
+        }
+    },
+    'methods': [{
+        'method': 'testFoo',
+        'annotations': {
+            'MediumTest': None
+        }
+    }],
+    'superclass': 'java.lang.Object',
+}]
+
+
+class TestListCacheTest(temp_dir_test_case.TempDirTestCase):
+  def setUp(self):
+    super().setUp()
+    self.cache = test_list_cache.TestListCache(
+        os.path.join(self.temp_dir, 'cache'))
+
+  def _CreateApk(self, name, dex_data, resources=b''):
+    path = os.path.join(self.temp_dir, name)
+    with zipfile.ZipFile(path, 'w') as z:
+      z.writestr('AndroidManifest.xml', b'')
+      z.writestr('classes.dex', dex_data)
+      z.writestr('resources.arsc', resources)
+    return path
+
+  def testComputeKey(self):
+    key = test_list_cache.ComputeKey(self._CreateApk('a.apk', b'dex'))
+    # Only dex entries matter.
+    self.assertEqual(
+        key,
+        test_list_cache.ComputeKey(self._CreateApk('b.apk', b'dex', b'res')))
+    self.assertNotEqual(
+        key, test_list_cache.ComputeKey(self._CreateApk('c.apk', b'dex2')))
+    self.assertNotEqual(
+        key, test_list_cache.ComputeKey(self._CreateApk('d.apk', b'dex'), '2'))
+
+  def testGetAndPut(self):
+    self.assertIsNone(self.cache.Get('key'))
+    self.cache.Put('key', _TESTS)
+    self.assertEqual(_TESTS, self.cache.Get('key'))
+    self.assertEqual(_TESTS, list(self.cache.IterTests('key')))
+    self.assertIsNone(self.cache.Get('other_key'))
+
+  def testGet_corrupt(self):
+    self.cache.Put('key', _TESTS)
+    with open(self.cache._EntryPath('key'), 'a') as f:
+      f.write('{"truncated')
+    self.assertIsNone(self.cache.Get('key'))
+
+  def testGet_otherVersion(self):
+    self.cache.Put('key', _TESTS)
+    with open(self.cache._EntryPath('key'), 'w') as f:
+      f.write('{"version": 0, "key": "key"}\n')
+    self.assertIsNone(self.cache.Get('key'))
+
+  def testGet_otherUser(self):
+    self.cache.Put('key', _TESTS)
+    with mock.patch('os.getuid', return_value=os.getuid() + 1):
+      self.assertIsNone(self.cache.Get('key'))
+
+  def testPut_deletesOldEntries(self):
+    self.cache.Put('old', _TESTS)
+    old_path = self.cache._EntryPath('old')
+    os.utime(old_path, (0, 0))
+    self.cache.Put('new', _TESTS)
+    self.assertFalse(os.path.exists(old_path))
+    self.assertEqual(['new.jsonl'], os.listdir(self.cache._cache_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
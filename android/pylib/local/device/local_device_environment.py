@@ -23,6 +23,7 @@ from devil.utils import parallelizer
 from pylib import constants
 from pylib.constants import host_paths
 from pylib.base import environment
+from pylib.results import test_timings
 from pylib.utils import instrumentation_tracing
 from py_trace_event import trace_event
 
@@ -126,6 +127,10 @@ class LocalDeviceEnvironment(environment.Environment):
     self._preferred_abis = None
     self._recover_devices = args.recover_devices
     self._skip_clear_data = args.skip_clear_data
+    self._test_timings = None
+    if getattr(args, 'test_timings_file', None):
+      self._test_timings = test_timings.TestTimings.Load(
+          args.test_timings_file)
     self._tool_name = args.tool
     self._trace_output = None
     if hasattr(args, 'trace_output'):
@@ -248,6 +253,10 @@ class LocalDeviceEnvironment(environment.Environment):
   def skip_clear_data(self):
     return self._skip_clear_data
 
+  @property
+  def test_timings(self):
+    return self._test_timings
+
   @property
   def tool(self):
     return self._tool_name
@@ -4,6 +4,7 @@
 
 import fnmatch
 import hashlib
+import heapq
 import logging
 import posixpath
 import signal
@@ -57,6 +58,8 @@ class LocalDeviceTestRun(test_run.TestRun):
     self._tools = {}
     # This is intended to be filled by a child class.
     self._installed_packages = []
+    # Durations of tests in previous runs, used to balance partitions.
+    self._test_timings = env.test_timings
     env.SetPreferredAbis(test_instance.GetPreferredAbis())
 
   #override
@@ -72,7 +75,10 @@ class LocalDeviceTestRun(test_run.TestRun):
       # needs to be recovered.
       SetAppCompatibilityFlagsIfNecessary(self._installed_packages, dev)
       consecutive_device_errors = 0
-      for test in tests:
+      test_iter = tests
+      if isinstance(tests, test_collection.TestCollection):
+        test_iter = tests.iter_for_worker(str(dev))
+      for test in test_iter:
         if not test:
           logging.warning('No tests in shared. Continuing.')
           tests.test_completed()
@@ -135,7 +141,7 @@ class LocalDeviceTestRun(test_run.TestRun):
         finally:
           if isinstance(tests, test_collection.TestCollection):
             if rerun:
-              tests.add(rerun)
+              tests.add(rerun, failed_worker=str(dev))
             tests.test_completed()
 
       logging.info('Finished running tests on this device.')
@@ -186,7 +192,9 @@ class LocalDeviceTestRun(test_run.TestRun):
           try:
             if self._ShouldShardTestsForDevices():
               tc = test_collection.TestCollection(
-                  self._CreateShardsForDevices(grouped_tests))
+                  self._CreateShardsForDevices(grouped_tests),
+                  cost_fn=(self._GetExpectedDuration
+                           if self._test_timings else None))
               self._env.parallel_devices.pMap(
                   run_tests_on_device, tc, try_results).pGet(None)
             else:
@@ -290,7 +298,9 @@ class LocalDeviceTestRun(test_run.TestRun):
   # grouped (eg. batched tests), we cannot perfectly fill all paritions as that
   # would require breaking up groups.
   def _PartitionTests(self, tests, num_desired_partitions, max_partition_size):
-    # pylint: disable=no-self-use
+    if self._test_timings:
+      return self._PartitionTestsByDuration(tests, num_desired_partitions,
+                                            max_partition_size)
     partitions = []
 
 
@@ -335,6 +345,56 @@ class LocalDeviceTestRun(test_run.TestRun):
       partitions.pop()
     return partitions
 
+  def _PartitionTestsByDuration(self, tests, num_desired_partitions,
+                                max_partition_size):
+    """Partitions tests using their durations in previous runs.
+
+    Assigns test groups, longest first, to the partition with the smallest
+    total duration that has room for them (longest processing time first
+    scheduling), so that partitions take similar amounts of time rather than
+    having similar numbers of tests. Groups are never split and tests keep
+    their relative order within partitions. Ties are broken by position, so
+    the same tests and timings always result in the same partitions.
+    """
+    def group_count(test):
+      return len(test) if self._CountTestsIndividually(test) else 1
+
+    durations = [self._GetExpectedDuration(t) for t in tests]
+    order = sorted(range(len(tests)), key=lambda i: (-durations[i], i))
+    partitions = [[] for _ in range(min(num_desired_partitions, len(tests)))]
+    sizes = [0] * len(partitions)
+    # Heap of (duration, partition index) of partitions that may have room.
+    heap = [(0, i) for i in range(len(partitions))]
+    for index in order:
+      test = tests[index]
+      count = group_count(test)
+      skipped = []
+      while heap:
+        partition_duration, p = heapq.heappop(heap)
+        # As with count-based partitioning, a group larger than
+        # |max_partition_size| goes into an empty partition.
+        if sizes[p] == 0 or sizes[p] + count <= max_partition_size:
+          break
+        if sizes[p] < max_partition_size:
+          skipped.append((partition_duration, p))
+      else:
+        partition_duration, p = 0, len(partitions)
+        partitions.append([])
+        sizes.append(0)
+      partitions[p].append((index, test))
+      sizes[p] += count
+      heapq.heappush(heap, (partition_duration + durations[index], p))
+      for entry in skipped:
+        heapq.heappush(heap, entry)
+
+    return [[test for _, test in sorted(p)] for p in partitions if p]
+
+  def _GetExpectedDuration(self, test):
+    """Returns the duration of a test or test group in previous runs."""
+    if isinstance(test, list):
+      return sum(self._GetExpectedDuration(t) for t in test)
+    return self._test_timings.GetDuration(self._GetUniqueTestName(test))
+
   def _CountTestsIndividually(self, test):
     # pylint: disable=no-self-use
     if not isinstance(test, list):
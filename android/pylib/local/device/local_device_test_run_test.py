@@ -10,6 +10,7 @@ import unittest
 
 from pylib.base import base_test_result
 from pylib.local.device import local_device_test_run
+from pylib.results import test_timings
 
 import mock  # pylint: disable=import-error
 
@@ -44,8 +45,8 @@ class TestLocalDeviceTestRun(local_device_test_run.LocalDeviceTestRun):
 
   # pylint: disable=abstract-method
 
-  def __init__(self):
-    super().__init__(mock.MagicMock(), mock.MagicMock())
+  def __init__(self, timings=None):
+    super().__init__(mock.MagicMock(test_timings=timings), mock.MagicMock())
 
 
 class TestLocalDeviceNonStringTestRun(
@@ -54,7 +55,7 @@ class TestLocalDeviceNonStringTestRun(
   # pylint: disable=abstract-method
 
   def __init__(self):
-    super().__init__(mock.MagicMock(), mock.MagicMock())
+    super().__init__(mock.MagicMock(test_timings=None), mock.MagicMock())
 
   def _GetUniqueTestName(self, test):
     return test['name']
@@ -67,6 +68,73 @@ class LocalDeviceTestRunTest(unittest.TestCase):
     self.assertEqual(test_run._SortTests(['a', 'b', 'c', 'd', 'e', 'f', 'g']),
                      ['d', 'f', 'c', 'b', 'e', 'a', 'g'])
 
+  def testPartitionTests_byCount(self):
+    test_run = TestLocalDeviceTestRun()
+    self.assertEqual(
+        test_run._PartitionTests(['a', 'b', 'c', 'd', 'e'], 2, float('inf')),
+        [['a', 'b'], ['c', 'd', 'e']])
+
+  def testPartitionTests_byDuration(self):
+    timings = test_timings.TestTimings({
+        'a': 100,
+        'b': 10,
+        'c': 10,
+        'd': 10,
+        'e': 10,
+        'f': 50,
+    })
+    test_run = TestLocalDeviceTestRun(timings)
+    partitions = test_run._PartitionTests(['a', 'b', 'c', 'd', 'e', 'f'], 2,
+                                          float('inf'))
+    # The slow test gets a partition to itself and tests keep their order.
+    self.assertEqual(partitions, [['a'], ['b', 'c', 'd', 'e', 'f']])
+
+  def testPartitionTests_byDuration_unknownTests(self):
+    # Unknown tests are expected to take the median duration.
+    timings = test_timings.TestTimings({'a': 10, 'b': 20, 'c': 30})
+    test_run = TestLocalDeviceTestRun(timings)
+    partitions = test_run._PartitionTests(['a', 'b', 'c', 'x', 'y'], 2,
+                                          float('inf'))
+    self.assertEqual(partitions, [['c', 'y'], ['a', 'b', 'x']])
+
+  def testPartitionTests_byDuration_keepsGroups(self):
+    timings = test_timings.TestTimings({
+        'a1': 30,
+        'a2': 30,
+        'b': 50,
+        'c1': 5,
+        'c2': 5,
+    })
+    test_run = TestLocalDeviceNonStringTestRun()
+    test_run._test_timings = timings
+
+    def group(*names):
+      return [{'name': n, 'annotations': {}} for n in names]
+
+    tests = [group('a1', 'a2'), group('b'), group('c1', 'c2')]
+    partitions = test_run._PartitionTests(tests, 2, float('inf'))
+    self.assertEqual(partitions, [[tests[0]], [tests[1], tests[2]]])
+
+  def testPartitionTests_byDuration_maxPartitionSize(self):
+    timings = test_timings.TestTimings({'a': 100, 'b': 1, 'c': 1, 'd': 1})
+    test_run = TestLocalDeviceTestRun(timings)
+    partitions = test_run._PartitionTests(['a', 'b', 'c', 'd'], 2, 2)
+    self.assertEqual(partitions, [['a', 'd'], ['b', 'c']])
+    partitions = test_run._PartitionTests(['a', 'b', 'c', 'd'], 2, 1)
+    self.assertEqual(partitions, [['a'], ['b'], ['c'], ['d']])
+
+  def testPartitionTests_byDuration_deterministic(self):
+    timings = test_timings.TestTimings({str(i): i % 7 for i in range(100)})
+    tests = [str(i) for i in range(100)]
+    test_run = TestLocalDeviceTestRun(timings)
+    partitions = test_run._PartitionTests(tests, 8, float('inf'))
+    self.assertEqual(partitions,
+                     test_run._PartitionTests(tests, 8, float('inf')))
+    self.assertEqual(sorted(local_device_test_run.FlattenTestList(partitions)),
+                     sorted(tests))
+    totals = [sum(timings.GetDuration(t) for t in p) for p in partitions]
+    self.assertLessEqual(max(totals) - min(totals), 6)
+
   def testGetTestsToRetry_allTestsPassed(self):
     results = [
         base_test_result.BaseTestResult(
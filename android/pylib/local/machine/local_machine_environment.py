@@ -3,12 +3,21 @@
 # found in the LICENSE file.
 
 from pylib.base import environment
+from pylib.results import test_timings
 
 
 class LocalMachineEnvironment(environment.Environment):
 
-  def __init__(self, _args, output_manager, _error_func):
+  def __init__(self, args, output_manager, _error_func):
     super().__init__(output_manager)
+    self._test_timings = None
+    if getattr(args, 'test_timings_file', None):
+      self._test_timings = test_timings.TestTimings.Load(
+          args.test_timings_file)
+
+  @property
+  def test_timings(self):
+    return self._test_timings
 
   #override
   def SetUp(self):
@@ -2,16 +2,17 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
+import heapq
 import json
 import logging
 import multiprocessing
 import os
-import queue
 import re
+import selectors
+import statistics
 import subprocess
 import sys
-import tempfile
-import threading
 import time
 import zipfile
 
@@ -45,6 +46,11 @@ _EXCLUDED_SUITES = {
 # and 6 sec with 2 or more shards.
 _MIN_CLASSES_PER_SHARD = 8
 
+# Each shard runs several batches of test classes, starting a new JVM for the
+# next batch whenever one finishes. Shards that get faster batches run more of
+# them, which evens out shards when classes take longer than expected.
+_BATCHES_PER_SHARD = 3
+
 # Running the largest test suite with a single shard takes about 22 minutes.
 _SHARD_TIMEOUT = 30 * 60
 
@@ -165,18 +171,21 @@ class LocalMachineJunitTestRun(test_run.TestRun):
       test_classes = _GetTestClasses(self._wrapper_path)
       shards = ChooseNumOfShards(test_classes, self._test_instance.shards)
 
-    logging.info('Running tests on %d shard(s).', shards)
-    group_test_list = GroupTestsForShard(shards, test_classes)
+    batches = ChooseNumOfBatches(test_classes, shards)
+    logging.info('Running tests on %d shard(s) in %d batch(es).', shards,
+                 batches)
+    group_test_list = GroupTestsForShard(batches, test_classes,
+                                         self._GetClassDurations(test_classes))
 
     with tempfile_ext.NamedTemporaryDirectory() as temp_dir:
-      cmd_list = [[self._wrapper_path] for _ in range(shards)]
+      cmd_list = [[self._wrapper_path] for _ in range(batches)]
       json_result_file_paths = [
-          os.path.join(temp_dir, 'results%d.json' % i) for i in range(shards)
+          os.path.join(temp_dir, 'results%d.json' % i) for i in range(batches)
       ]
       jar_args_list = self._CreateJarArgsList(json_result_file_paths,
-                                              group_test_list, shards)
+                                              group_test_list, batches)
       if jar_args_list:
-        for i in range(shards):
+        for i in range(batches):
           cmd_list[i].extend(
               ['--jar-args', '"%s"' % ' '.join(jar_args_list[i])])
 
@@ -189,11 +198,15 @@ class LocalMachineJunitTestRun(test_run.TestRun):
 
       show_logcat = logging.getLogger().isEnabledFor(logging.INFO)
       num_omitted_lines = 0
-      for line in _RunCommandsAndSerializeOutput(cmd_list):
+      for shard, line in _RunCommandsAndStreamOutput(cmd_list, shards):
+        if shards > 1:
+          prefixed_line = '[Shard %d] %s' % (shard, line)
+        else:
+          prefixed_line = line
         if raw_logs_fh:
-          raw_logs_fh.write(line)
+          raw_logs_fh.write(prefixed_line)
         if show_logcat or not _LOGCAT_RE.match(line):
-          sys.stdout.write(line)
+          sys.stdout.write(prefixed_line)
         else:
           num_omitted_lines += 1
 
@@ -221,6 +234,21 @@ class LocalMachineJunitTestRun(test_run.TestRun):
       test_run_results.AddResults(results_list)
       results.append(test_run_results)
 
+  def _GetClassDurations(self, test_classes):
+    """Returns the durations of |test_classes| in previous runs, or None."""
+    timings = self._env.test_timings
+    if not timings or not test_classes:
+      return None
+    # Test names are of the form org.chromium.FooTest#testBar.
+    known_durations = timings.SumDurationsBy(lambda n: n.split('#')[0])
+    if not known_durations:
+      return None
+    default_duration = statistics.median(known_durations.values())
+    return {
+        c: known_durations.get(_GetClassName(c), default_duration)
+        for c in test_classes
+    }
+
   # override
   def TearDown(self):
     pass
@@ -265,122 +293,127 @@ def ChooseNumOfShards(test_classes, shards):
   return shards
 
 
-def GroupTestsForShard(num_of_shards, test_classes):
+def ChooseNumOfBatches(test_classes, shards):
+  """Returns the number of batches to split |test_classes| into."""
+  if shards == 1:
+    return 1
+  # Starting a JVM takes a while, so keep batches large enough to be worth it.
+  return max(shards,
+             min(shards * _BATCHES_PER_SHARD,
+                 len(test_classes) // _MIN_CLASSES_PER_SHARD))
+
+
+def GroupTestsForShard(num_of_shards, test_classes, class_durations=None):
   """Groups tests that will be ran on each shard.
 
   Args:
     num_of_shards: number of shards to split tests between.
     test_classes: A list of test_class files in the jar.
+    class_durations: Optional dict of the expected durations of test classes.
+      If given, classes are assigned longest first to the shard with the
+      smallest total duration.
 
   Return:
     Returns a dictionary containing a list of test classes.
   """
   test_dict = {i: [] for i in range(num_of_shards)}
 
+  if class_durations:
+    shard_durations = [(0, i) for i in range(num_of_shards)]
+    # Sorting is stable, so ties keep the order of |test_classes|.
+    for test_cls in sorted(test_classes,
+                           key=lambda c: class_durations[c],
+                           reverse=True):
+      duration, index = heapq.heappop(shard_durations)
+      test_dict[index].append(_GetClassFilter(test_cls))
+      heapq.heappush(shard_durations,
+                     (duration + class_durations[test_cls], index))
+    return test_dict
+
   # Round robin test distribiution to reduce chance that a sequential group of
   # classes all have an unusually high number of tests.
   for count, test_cls in enumerate(test_classes):
-    test_cls = test_cls.replace('.class', '*')
-    test_cls = test_cls.replace('/', '.')
-    test_dict[count % num_of_shards].append(test_cls)
+    test_dict[count % num_of_shards].append(_GetClassFilter(test_cls))
 
   return test_dict
 
 
-def _RunCommandsAndSerializeOutput(cmd_list):
-  """Runs multiple commands in parallel and yields serialized output lines.
+def _GetClassName(test_cls):
+  return test_cls.replace('.class', '').replace('/', '.')
+
+
+def _GetClassFilter(test_cls):
+  return test_cls.replace('.class', '*').replace('/', '.')
+
+
+def _RunCommandsAndStreamOutput(cmd_list, num_shards):
+  """Runs commands on parallel shards and yields their output as it comes.
+
+  Each shard runs the next command of |cmd_list| whenever its previous one
+  finishes. Output of all running commands is read as soon as it is available.
 
   Args:
-    cmd_list: List of commands.
+    cmd_list: List of commands, in the order they should be started.
+    num_shards: Maximum number of commands to run at once.
 
-  Returns: N/A
+  Yields:
+    (shard index, line) tuples. Lines always end with a newline.
 
   Raises:
     TimeoutError: If timeout is exceeded.
   """
-  num_shards = len(cmd_list)
-  assert num_shards > 0
-  procs = []
-  temp_files = []
-  for i, cmd in enumerate(cmd_list):
-    # Shard 0 yields results immediately, the rest write to files.
-    if i == 0:
-      temp_files.append(None)  # Placeholder.
-      procs.append(
-          cmd_helper.Popen(
-              cmd,
-              stdout=subprocess.PIPE,
-              stderr=subprocess.STDOUT,
-          ))
-    else:
-      temp_file = tempfile.TemporaryFile(mode='w+t', encoding='utf-8')
-      temp_files.append(temp_file)
-      procs.append(cmd_helper.Popen(
-          cmd,
-          stdout=temp_file,
-          stderr=temp_file,
-      ))
-
+  assert cmd_list and num_shards > 0
+  pending = collections.deque(enumerate(cmd_list))
+  running = {}
+  partial_lines = {}
   timeout_time = time.time() + _SHARD_TIMEOUT
-  timed_out = False
-
-  yield '\n'
-  yield 'Shard 0 output:\n'
-
-  # The following will be run from a thread to pump Shard 0 results, allowing
-  # live output while allowing timeout.
-  def pump_stream_to_queue(f, q):
-    try:
-      for line in iter(f.readline, ''):
-        q.put(line)
-    except ValueError:  # Triggered if |f.close()| gets called.
-      pass
-
-  shard_0_q = queue.Queue()
-  shard_0_pump = threading.Thread(target=pump_stream_to_queue,
-                                  args=(procs[0].stdout, shard_0_q))
-  shard_0_pump.start()
-
-  # Wait for processes to finish, while forwarding Shard 0 results.
-  shard_to_check = 0
-  while shard_to_check < num_shards:
-    if shard_0_pump.is_alive():
-      while not shard_0_q.empty():
-        yield shard_0_q.get_nowait()
-    if procs[shard_to_check].poll() is not None:
-      shard_to_check += 1
-    else:
-      time.sleep(.1)
-    if time.time() > timeout_time:
-      timed_out = True
-      break
-
-  # Handle Shard 0 timeout.
-  if shard_0_pump.is_alive():
-    procs[0].stdout.close()
-  shard_0_pump.join()
-
-  # Emit all output (possibly incomplete due to |time_out|) in shard order.
-  while not shard_0_q.empty():
-    yield shard_0_q.get_nowait()
-  for i in range(1, num_shards):
-    f = temp_files[i]
-    yield '\n'
-    yield 'Shard %d output:\n' % i
-    f.seek(0)
-    for line in f.readlines():
-      yield line
-    f.close()
-
-  # Handle Shard 1+ timeout.
-  if timed_out:
-    for i, p in enumerate(procs):
-      if p.poll() is None:
-        p.kill()
-        yield 'Index of timed out shard: %d\n' % i
-
-    yield 'Output in shards may be cutoff due to timeout.\n'
-    yield '\n'
+
+  with selectors.DefaultSelector() as selector:
+
+    def start_next_command(shard):
+      index, cmd = pending.popleft()
+      logging.debug('Starting batch %d on shard %d.', index, shard)
+      proc = cmd_helper.Popen(cmd,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+      selector.register(proc.stdout, selectors.EVENT_READ, shard)
+      running[shard] = proc
+      partial_lines[shard] = b''
+
+    for shard in range(min(num_shards, len(pending))):
+      start_next_command(shard)
+
+    while running:
+      timeout = timeout_time - time.time()
+      if timeout <= 0:
+        break
+      for key, _ in selector.select(timeout):
+        shard = key.data
+        data = os.read(key.fd, 64 * 1024)
+        if data:
+          lines = (partial_lines[shard] + data).split(b'\n')
+          partial_lines[shard] = lines.pop()
+          for line in lines:
+            yield shard, line.decode('utf-8', 'replace') + '\n'
+          continue
+        # The command finished.
+        if partial_lines[shard]:
+          yield shard, partial_lines[shard].decode('utf-8', 'replace') + '\n'
+        selector.unregister(key.fileobj)
+        proc = running.pop(shard)
+        proc.stdout.close()
+        proc.wait()
+        if pending:
+          start_next_command(shard)
+
+  if running:
+    for shard, proc in sorted(running.items()):
+      proc.kill()
+      proc.stdout.close()
+      yield shard, 'Index of timed out shard: %d\n' % shard
+    if pending:
+      yield 0, '%d batch(es) did not run.\n' % len(pending)
+    yield 0, 'Output in shards may be cutoff due to timeout.\n'
     raise cmd_helper.TimeoutError('Junit shards timed out.')
 
 
@@ -7,6 +7,7 @@
 
 
 import os
+import sys
 import unittest
 
 from pylib.local.machine import local_machine_junit_test_run
@@ -84,6 +85,48 @@ class LocalMachineJunitTestRunTests(unittest.TestCase):
     }
     self.assertDictEqual(results, ans_dict)
 
+  def testGroupTestsForShard_classDurations(self):
+    test_classes = ['a/A.class', 'a/B.class', 'a/C.class', 'a/D.class']
+    class_durations = {
+        'a/A.class': 10,
+        'a/B.class': 50,
+        'a/C.class': 20,
+        'a/D.class': 30,
+    }
+    results = local_machine_junit_test_run.GroupTestsForShard(
+        2, test_classes, class_durations)
+    self.assertDictEqual(results, {0: ['a.B*', 'a.A*'], 1: ['a.D*', 'a.C*']})
+
+  def testChooseNumOfBatches(self):
+    self.assertEqual(
+        1, local_machine_junit_test_run.ChooseNumOfBatches([1] * 100, 1))
+    self.assertEqual(
+        12, local_machine_junit_test_run.ChooseNumOfBatches([1] * 1000, 4))
+    # Batches have at least _MIN_CLASSES_PER_SHARD classes where possible.
+    self.assertEqual(
+        5, local_machine_junit_test_run.ChooseNumOfBatches([1] * 40, 4))
+    self.assertEqual(
+        4, local_machine_junit_test_run.ChooseNumOfBatches([1] * 10, 4))
+
+  def testRunCommandsAndStreamOutput(self):
+    cmd_list = [[
+        sys.executable, '-c',
+        'import sys; print("batch %d"); sys.stdout.write("no newline")' % i
+    ] for i in range(3)]
+    output = list(
+        local_machine_junit_test_run._RunCommandsAndStreamOutput(cmd_list, 2))
+    self.assertEqual(6, len(output))
+    for i in range(3):
+      lines = [line for shard, line in output if line.endswith('%d\n' % i)]
+      self.assertEqual(['batch %d\n' % i], lines)
+    shard_output = {}
+    for shard, line in output:
+      shard_output.setdefault(shard, []).append(line)
+    # Each shard's output is in order, and lines are never interleaved.
+    for lines in shard_output.values():
+      self.assertEqual(lines[1::2], ['no newline\n'] * (len(lines) // 2))
+    self.assertEqual({0, 1}, set(shard_output))
+
 
 if __name__ == '__main__':
   unittest.main()
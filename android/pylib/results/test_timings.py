@@ -0,0 +1,140 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Stores the durations of tests in previous runs.
+
+Durations are read from the JSON results written by test_runner.py
+(--json-results-file) and are used to balance tests across shards. The store is
+only updated explicitly (see main()), never while tests run, so that all shards
+of a run see the same durations and compute the same partitions.
+
+Usage:
+  test_timings.py --timings-file timings.json results1.json [results2.json ...]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+
+if __name__ == '__main__':
+  sys.path.append(
+      os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from pylib.base import base_test_result
+from pylib.results import json_results
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'gyp'))
+from util import build_utils
+
+# Bump when changing the format of timings files.
+_FORMAT_VERSION = 1
+# Weight of a new duration in the moving average of the durations of a test.
+_NEW_DURATION_WEIGHT = 0.5
+# Results of tests that did not actually run.
+_IGNORED_RESULT_TYPES = (base_test_result.ResultType.SKIP,
+                         base_test_result.ResultType.NOTRUN)
+
+
+class TestTimings:
+  """Maps test names to their expected durations in milliseconds."""
+
+  def __init__(self, durations=None):
+    self._durations = dict(durations or {})
+    self._default_duration = None
+
+  def __len__(self):
+    return len(self._durations)
+
+  @classmethod
+  def Load(cls, path):
+    """Reads timings from |path|. Returns empty timings if it does not exist."""
+    try:
+      with open(path) as f:
+        data = json.load(f)
+    except FileNotFoundError:
+      logging.warning('Test timings file %s not found.', path)
+      return cls()
+    if data.get('version') != _FORMAT_VERSION:
+      logging.warning('Ignoring test timings file %s with version %s.', path,
+                      data.get('version'))
+      return cls()
+    return cls(data['tests'])
+
+  def Save(self, path):
+    """Writes timings to |path|."""
+    with build_utils.AtomicOutput(os.path.abspath(path), mode='w') as f:
+      data = {'version': _FORMAT_VERSION, 'tests': self._durations}
+      json.dump(data, f, indent=0, sort_keys=True)
+
+  def Update(self, name, duration_ms):
+    """Records that test |name| took |duration_ms|."""
+    previous = self._durations.get(name)
+    if previous is not None:
+      duration_ms = (_NEW_DURATION_WEIGHT * duration_ms +
+                     (1 - _NEW_DURATION_WEIGHT) * previous)
+    self._durations[name] = duration_ms
+    self._default_duration = None
+
+  def UpdateFromJsonResults(self, json_dict):
+    """Records the durations of tests in a dict read from a JSON results file.
+
+    Args:
+      json_dict: A dict in the format created by
+        json_results.GenerateJsonResultsFile().
+    """
+    for result in json_results.ParseResultsFromJson(json_dict):
+      if result.GetType() not in _IGNORED_RESULT_TYPES:
+        self.Update(result.GetName(), result.GetDuration())
+
+  def SumDurationsBy(self, key_fn):
+    """Returns a dict of the total durations of tests grouped by |key_fn|.
+
+    Args:
+      key_fn: Function returning the group of a test (e.g. its class) given its
+        name.
+    """
+    ret = {}
+    for name, duration in self._durations.items():
+      key = key_fn(name)
+      ret[key] = ret.get(key, 0) + duration
+    return ret
+
+  def GetDuration(self, name):
+    """Returns the expected duration of test |name| in milliseconds.
+
+    Tests without recorded durations are expected to take the median duration
+    of the recorded tests.
+    """
+    duration = self._durations.get(name)
+    if duration is not None:
+      return duration
+    if self._default_duration is None:
+      self._default_duration = (statistics.median(self._durations.values())
+                                if self._durations else 0)
+    return self._default_duration
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--timings-file',
+                      required=True,
+                      help='Timings file to update. Created if it does not '
+                      'exist.')
+  parser.add_argument('json_results_files',
+                      nargs='+',
+                      help='JSON results files written by test_runner.py.')
+  args = parser.parse_args()
+
+  timings = TestTimings.Load(args.timings_file)
+  for path in args.json_results_files:
+    with open(path) as f:
+      timings.UpdateFromJsonResults(json.load(f))
+  timings.Save(args.timings_file)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for test_timings."""
+
+import json
+import os
+import sys
+import unittest
+
+from pylib.results import test_timings
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'gyp'))
+from util import temp_dir_test_case
+
+
+def _JsonResults(*runs):
+  return {
+      'per_iteration_data': [{
+          name: [{
+              'status': status,
+              'elapsed_time_ms': duration
+          }]
+          for name, status, duration in run
+      } for run in runs]
+  }
+
+
+class TestTimingsTest(temp_dir_test_case.TempDirTestCase):
+  def setUp(self):
+    super().setUp()
+    self.path = os.path.join(self.temp_dir, 'timings.json')
+
+  def testGetDuration(self):
+    timings = test_timings.TestTimings({'a': 10, 'b': 20, 'c': 60})
+    self.assertEqual(10, timings.GetDuration('a'))
+    # Unknown tests take the median duration.
+    self.assertEqual(20, timings.GetDuration('unknown'))
+    self.assertEqual(0, test_timings.TestTimings().GetDuration('unknown'))
+
+  def testSumDurationsBy(self):
+    timings = test_timings.TestTimings({'A#a': 10, 'A#b': 20, 'B#a': 5})
+    self.assertEqual({
+        'A': 30,
+        'B': 5
+    }, timings.SumDurationsBy(lambda n: n.split('#')[0]))
+
+  def testUpdateFromJsonResults(self):
+    timings = test_timings.TestTimings()
+    timings.UpdateFromJsonResults(
+        _JsonResults([('a', 'SUCCESS', 100), ('b', 'FAILURE', 40),
+                      ('c', 'SKIPPED', 0)], [('a', 'SUCCESS', 200)]))
+    self.assertEqual(2, len(timings))
+    self.assertEqual(150, timings.GetDuration('a'))
+    self.assertEqual(40, timings.GetDuration('b'))
+
+  def testLoadAndSave(self):
+    self.assertEqual(0, len(test_timings.TestTimings.Load(self.path)))
+    test_timings.TestTimings({'a': 10}).Save(self.path)
+    timings = test_timings.TestTimings.Load(self.path)
+    self.assertEqual(10, timings.GetDuration('a'))
+    self.assertEqual(['timings.json'], os.listdir(self.temp_dir))
+
+  def testLoad_otherVersion(self):
+    with open(self.path, 'w') as f:
+      json.dump({'version': 0, 'tests': {'a': 10}}, f)
+    self.assertEqual(0, len(test_timings.TestTimings.Load(self.path)))
+
+
+if __name__ == '__main__':
+  unittest.main()
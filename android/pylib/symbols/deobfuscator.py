@@ -3,187 +3,288 @@
 # found in the LICENSE file.
 
 import logging
-import os
-import subprocess
+import re
 import threading
-import time
-import uuid
 
-from devil.utils import reraiser_thread
-from pylib import constants
+from pylib.symbols import proguard_mapping
 
+# Mirrors the regular expression in
+# //build/android/stacktrace/java/org/chromium/build/FlushingReTrace.java
+# Placeholders (as in R8's retrace):
+#   %c: class name, %C: class name with "/" separators, %m: method name,
+#   %f: field name, %s: source file, %l: line number, %t: type,
+#   %a: argument types.
 
-_MINIUMUM_TIMEOUT = 10.0
-_PER_LINE_TIMEOUT = .005  # Should be able to process 200 lines per second.
-_PROCESS_START_TIMEOUT = 20.0
-_MAX_RESTARTS = 4  # Should be plenty unless tool is crashing on start-up.
+# E.g.: D/ConnectivityService(18029): Message
+# E.g.: W/GCM     ( 151): Message
+# E.g.: 09-08 14:22:59.995 18029 18055 I ProcessStatsService: Message
+# E.g.: 09-08 14:30:59.145 17731 18020 D MDnsDS  : Message
+_LOGCAT_PREFIX = (r'(?:[VDIWEF]/.*?\( *\d+\): |'
+                  r'\d\d-\d\d [0-9:. ]+[VDIWEF] .*?: )?')
+
+# Note: Order of these sub-patterns defines their precedence.
+_LINE_PARSE_REGEX = (
+    # Eagerly match logcat prefix to avoid conflicting with the patterns below.
+    _LOGCAT_PREFIX + '(?:'
+    # E.g.: 06-22 13:58:02.895  4674  4674 E THREAD_STATE:     bLA.a( PG : 173 )
+    # pylint: disable=line-too-long
+    # E.g.: \tat org.chromium.chrome.browser.tab.Tab.handleJavaCrash(Tab.java:682)
+    r'(?:.*?(?::|\bat)\s+%c\.%m\s*\(\s*%s(?:\s*:\s*%l\s*)?\))|'
+    # E.g.: 0xffffffff (chromium-TrichromeChromeGoogle.aab-canary-490400033: 70) ii2.p
+    # pylint: enable=line-too-long
+    r'(?:.*?\(\s*%s(?:\s*:\s*%l\s*)?\)\s*%c\.%m)|'
+    # E.g.: Caused by: java.lang.NullPointerException: Attempt to read from
+    #       field 'int bLA' on a null object reference
+    r'(?:.*java\.lang\.NullPointerException.*["\']%t\s*%c\.(?:%f|%m\(%a\))'
+    r'["\'].*)|'
+    # E.g.: java.lang.VerifyError: bLA
+    r'(?:java\.lang\.VerifyError: %c)|'
+    # E.g.: java.lang.NoSuchFieldError: No instance field e of type L...; in
+    #       class LbxK;
+    r'(?:java\.lang\.NoSuchFieldError: No instance field %f of type .*? in '
+    r'class L%C;)|'
+    # E.g.: Object of type Clazz was not destroyed... (See LifetimeAssert.java)
+    r'(?:.*?Object of type %c .*)|'
+    # E.g.: VFY: unable to resolve new-instance 3810 (LSome/Framework/Class;) in
+    #       Lfoo/Bar;
+    r'(?:.*L%C;.*)|'
+    # E.g.: END SomeTestClass#someMethod
+    r'(?:.*?%c#%m.*?)|'
+    # E.g.: java.lang.NoClassDefFoundError: SomeFrameworkClass in isTestClass
+    #       for Foo
+    r'(?:.* isTestClass for %c)|'
+    # E.g.: Caused by: java.lang.RuntimeException: Intentional Java Crash
+    r'(?:Caused by: %c:.*)|'
+    # Quoted values and lines that end with a class / class+method.
+    # Be careful about matching %c without %m since language tags look like
+    # class names.
+    r'(?:.*?%c\.%m)|'
+    r'(?:.*?"%c\.%m".*)|'
+    r'(?:.*\b(?:[Cc]lass|[Tt]ype)\b.*?"%c".*)|'
+    r'(?:.*\b(?:[Cc]lass|[Tt]ype)\b.*?%c)|'
+    # E.g.: java.lang.RuntimeException: Intentional Java Crash
+    r'(?:%c:.*)|'
+    # See if entire line matches a class name (e.g. for manual deobfuscation)
+    r'(?:%c)'
+    ')')
+
+_PLACEHOLDER_PATTERNS = {
+    'c': r'[\w$-]+(?:\.[\w$-]+)*',
+    'C': r'[\w$-]+(?:/[\w$-]+)*',
+    'm': r'[\w$<>-]+',
+    'f': r'[\w$-]+',
+    's': r'[^:()]*?',
+    'l': r'\d+',
+    't': r'[\w$.\[\]-]+',
+    'a': r'[\w$.\[\], -]*',
+}
+
+# Candidate (possibly dotted or slashed) class names.
+_TOKEN_RE = re.compile(r'[\w$-]+(?:[./][\w$-]+)*')
+
+# Prefix for alternative results when the mapping is ambiguous (as in R8).
+_AMBIGUOUS_PREFIX = '<OR> '
+
+
+def _CompileLineRegex(template):
+  """Returns the compiled regex and the placeholder of each capturing group."""
+  kinds = []
+
+  def replace(m):
+    kinds.append(m.group(1))
+    return '(' + _PLACEHOLDER_PATTERNS[m.group(1)] + ')'
+
+  return re.compile(re.sub(r'%(\w)', replace, template)), kinds
+
+
+_LINE_REGEX, _LINE_REGEX_KINDS = _CompileLineRegex(_LINE_PARSE_REGEX)
+
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+def _GetMapping(mapping_path):
+  """Returns a ProguardMapping that is shared by all users of |mapping_path|."""
+  with _mappings_lock:
+    ret = _mappings.get(mapping_path)
+    if ret is None:
+      ret = proguard_mapping.ProguardMapping(mapping_path)
+      _mappings[mapping_path] = ret
+    return ret
 
 
 class Deobfuscator:
+  """Deobfuscates Java class, method and field names in text.
+
+  The mapping is parsed in-process and shared between all instances with the
+  same mapping path. TransformLines() is safe to call from many threads at
+  once.
+  """
+
   def __init__(self, mapping_path):
-    script_path = os.path.join(constants.DIR_SOURCE_ROOT, 'build', 'android',
-                               'stacktrace', 'java_deobfuscate.py')
-    cmd = [script_path, mapping_path]
-    # Allow only one thread to call TransformLines() at a time.
-    self._lock = threading.Lock()
-    # Ensure that only one thread attempts to kill self._proc in Close().
-    self._close_lock = threading.Lock()
+    self._mapping_path = mapping_path
+    self._mapping = None
     self._closed_called = False
-    # Assign to None so that attribute exists if Popen() throws.
-    self._proc = None
-    # Start process eagerly to hide start-up latency.
-    self._proc_start_time = time.time()
-    self._proc = subprocess.Popen(cmd,
-                                  bufsize=1,
-                                  stdin=subprocess.PIPE,
-                                  stdout=subprocess.PIPE,
-                                  universal_newlines=True,
-                                  close_fds=True)
+    # Load the mapping eagerly to hide start-up latency.
+    try:
+      self._mapping = _GetMapping(mapping_path)
+    except (IOError, UnicodeDecodeError):
+      logging.exception('deobfuscator: Failed to load %s', mapping_path)
 
   def IsClosed(self):
-    return self._closed_called or self._proc.returncode is not None
+    return self._closed_called or self._mapping is None
 
   def IsBusy(self):
-    return self._lock.locked()
+    return False
 
   def IsReady(self):
-    return not self.IsClosed() and not self.IsBusy()
+    return not self.IsClosed()
+
+  def _DeobfuscateType(self, type_name):
+    base_type = type_name.rstrip('[]')
+    original = self._mapping.GetOriginalClassName(base_type)
+    if original is None:
+      return type_name
+    return original + type_name[len(base_type):]
+
+  def _DeobfuscateArgs(self, args):
+    parts = []
+    for arg in args.split(','):
+      stripped = arg.strip()
+      if stripped:
+        arg = arg.replace(stripped, self._DeobfuscateType(stripped))
+      parts.append(arg)
+    return ','.join(parts)
+
+  def _MightContainObfuscatedName(self, line):
+    # Much faster than _LINE_REGEX, and most lines do not refer to any class.
+    for token in _TOKEN_RE.findall(line):
+      token = token.replace('/', '.')
+      candidates = [token]
+      if token.startswith('L'):
+        candidates.append(token[1:])
+      for candidate in candidates:
+        end = -1
+        while True:
+          end = candidate.find('.', end + 1)
+          prefix = candidate if end == -1 else candidate[:end]
+          if self._mapping.GetOriginalClassName(prefix) is not None:
+            return True
+          if end == -1:
+            break
+    return False
+
+  def _TransformLine(self, line):
+    if not self._MightContainObfuscatedName(line):
+      return [line]
+    m = _LINE_REGEX.fullmatch(line)
+    if not m:
+      return [line]
+    groups = {}
+    for i, kind in enumerate(_LINE_REGEX_KINDS):
+      if m.start(i + 1) != -1:
+        groups[kind] = i + 1
+
+    def text(kind):
+      return m.group(groups[kind]) if kind in groups else None
+
+    class_name = text('c') or (text('C') or '').replace('/', '.')
+    class_mapping = self._mapping.GetClass(class_name) if class_name else None
+    line_num = text('l')
+    line_num = int(line_num) if line_num else None
+
+    # Each alternative is a list of frames to output lines for.
+    alternatives = [[None]]
+    if class_mapping:
+      default_frame = proguard_mapping.Frame(class_mapping.original_name, None,
+                                             line_num)
+      alternatives = [[default_frame]]
+      if 'm' in groups:
+        alternatives = (class_mapping.GetMethodFrames(text('m'), line_num)
+                        or alternatives)
+      elif 'f' in groups:
+        alternatives = [[default_frame._replace(method_name=f)]
+                        for f in class_mapping.GetFieldNames(text('f'))
+                        ] or alternatives
+
+    ret = []
+    for i, frames in enumerate(alternatives):
+      for frame in frames:
+        replacements = {}
+        if frame:
+          replacements['c'] = frame.class_name
+          replacements['C'] = frame.class_name.replace('.', '/')
+          if frame.method_name:
+            replacements['m'] = frame.method_name
+            replacements['f'] = frame.method_name
+          if frame.class_name == class_mapping.original_name:
+            replacements['s'] = class_mapping.source_file
+          else:
+            replacements['s'] = proguard_mapping.SourceFileForClass(
+                frame.class_name)
+          if frame.line is not None:
+            replacements['l'] = str(frame.line)
+        if 't' in groups:
+          replacements['t'] = self._DeobfuscateType(text('t'))
+        if 'a' in groups:
+          replacements['a'] = self._DeobfuscateArgs(text('a'))
+
+        parts = []
+        pos = 0
+        for kind, group in sorted(groups.items(), key=lambda x: x[1]):
+          if kind in replacements:
+            parts.append(line[pos:m.start(group)])
+            parts.append(replacements[kind])
+            pos = m.end(group)
+        parts.append(line[pos:])
+        new_line = ''.join(parts)
+        if i > 0:
+          indent = len(new_line) - len(new_line.lstrip())
+          new_line = new_line[:indent] + _AMBIGUOUS_PREFIX + new_line[indent:]
+        ret.append(new_line)
+    return ret
 
   def TransformLines(self, lines):
     """Deobfuscates obfuscated names found in the given lines.
 
-    If anything goes wrong (process crashes, timeout, etc), returns |lines|.
+    If anything goes wrong (e.g. the mapping failed to load), returns |lines|.
 
     Args:
       lines: A list of strings without trailing newlines.
 
     Returns:
-      A list of strings without trailing newlines.
+      A list of strings without trailing newlines. Deobfuscated stacks contain
+      more frames than obfuscated ones when method inlining occurs.
     """
     if not lines:
       return []
-
-    # Deobfuscated stacks contain more frames than obfuscated ones when method
-    # inlining occurs. To account for the extra output lines, keep reading until
-    # this eof_line token is reached.
-    eof_line = uuid.uuid4().hex
+    if self.IsClosed():
+      return lines
     out_lines = []
-
-    def deobfuscate_reader():
-      while True:
-        line = self._proc.stdout.readline()
-        # Return an empty string at EOF (when stdin is closed).
-        if not line:
-          break
-        line = line[:-1]
-        if line == eof_line:
-          break
-        out_lines.append(line)
-
-    if self.IsBusy():
-      logging.warning('deobfuscator: Having to wait for Java deobfuscation.')
-
-    # Allow only one thread to operate at a time.
-    with self._lock:
-      if self.IsClosed():
-        if not self._closed_called:
-          logging.warning('deobfuscator: Process exited with code=%d.',
-                          self._proc.returncode)
-          self.Close()
-        return lines
-
-      # TODO(agrieve): Can probably speed this up by only sending lines through
-      #     that might contain an obfuscated name.
-      reader_thread = reraiser_thread.ReraiserThread(deobfuscate_reader)
-      reader_thread.start()
-
-      try:
-        self._proc.stdin.write('\n'.join(lines))
-        self._proc.stdin.write('\n{}\n'.format(eof_line))
-        self._proc.stdin.flush()
-        time_since_proc_start = time.time() - self._proc_start_time
-        timeout = (max(0, _PROCESS_START_TIMEOUT - time_since_proc_start) +
-                   max(_MINIUMUM_TIMEOUT, len(lines) * _PER_LINE_TIMEOUT))
-        reader_thread.join(timeout)
-        if self.IsClosed():
-          logging.warning(
-              'deobfuscator: Close() called by another thread during join().')
-          return lines
-        if reader_thread.is_alive():
-          logging.error('deobfuscator: Timed out after %f seconds with input:',
-                        timeout)
-          # We are seeing timeouts but don't know why. Hopefully seeing the
-          # lines that cause timeouts can make it obvious what the deobfuscator
-          # is struggling with.
-          for l in lines:
-            logging.error(l)
-          logging.error('deobfuscator: End of timed out input.')
-          logging.error('deobfuscator: Timed out output was:')
-          for l in out_lines:
-            logging.error(l)
-          logging.error('deobfuscator: End of timed out output.')
-          self.Close()
-          return lines
-        return out_lines
-      except IOError:
-        logging.exception('deobfuscator: Exception during java_deobfuscate')
-        self.Close()
-        return lines
+    for line in lines:
+      out_lines.extend(self._TransformLine(line))
+    return out_lines
 
   def Close(self):
-    with self._close_lock:
-      needs_closing = not self.IsClosed()
-      self._closed_called = True
+    self._closed_called = True
 
-    if needs_closing:
-      self._proc.stdin.close()
-      self._proc.kill()
-      self._proc.wait()
 
-  def __del__(self):
-    # self._proc is None when Popen() fails.
-    if not self._closed_called and self._proc:
-      logging.error('deobfuscator: Forgot to Close()')
-      self.Close()
+class DeobfuscatorPool:
+  """Provides the Deobfuscator interface for use by multiple threads.
 
+  Historically, this held |pool_size| deobfuscator JVMs. Since the in-process
+  Deobfuscator handles concurrent requests, it now wraps a single instance.
+  """
 
-class DeobfuscatorPool:
-  # As of Sep 2017, each instance requires about 500MB of RAM, as measured by:
-  # /usr/bin/time -v build/android/stacktrace/java_deobfuscate.py \
-  #     out/Release/apks/ChromePublic.apk.mapping
   def __init__(self, mapping_path, pool_size=4):
-    self._mapping_path = mapping_path
-    self._pool = [Deobfuscator(mapping_path) for _ in range(pool_size)]
-    # Allow only one thread to select from the pool at a time.
-    self._lock = threading.Lock()
-    self._num_restarts = 0
+    del pool_size  # Unused.
+    self._deobfuscator = Deobfuscator(mapping_path)
 
   def TransformLines(self, lines):
-    with self._lock:
-      assert self._pool, 'TransformLines() called on a closed DeobfuscatorPool.'
-
-      # De-obfuscation is broken.
-      if self._num_restarts == _MAX_RESTARTS:
-        raise Exception('Deobfuscation seems broken.')
-
-      # Restart any closed Deobfuscators.
-      for i, d in enumerate(self._pool):
-        if d.IsClosed():
-          logging.warning('deobfuscator: Restarting closed instance.')
-          self._pool[i] = Deobfuscator(self._mapping_path)
-          self._num_restarts += 1
-          if self._num_restarts == _MAX_RESTARTS:
-            logging.warning('deobfuscator: MAX_RESTARTS reached.')
-
-      selected = next((x for x in self._pool if x.IsReady()), self._pool[0])
-      # Rotate the order so that next caller will not choose the same one.
-      self._pool.remove(selected)
-      self._pool.append(selected)
-
-    return selected.TransformLines(lines)
+    assert self._deobfuscator, (
+        'TransformLines() called on a closed DeobfuscatorPool.')
+    return self._deobfuscator.TransformLines(lines)
 
   def Close(self):
-    with self._lock:
-      for d in self._pool:
-        d.Close()
-      self._pool = None
+    self._deobfuscator.Close()
+    self._deobfuscator = None
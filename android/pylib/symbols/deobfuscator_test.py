@@ -0,0 +1,177 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import tempfile
+import threading
+import unittest
+
+from pylib.symbols import deobfuscator
+
+# pylint: disable=protected-access
+
+LINE_PREFIXES = [
+    '',
+    # logcat -v threadtime
+    '09-08 14:38:35.535 18029 18084 E qcom_sensors_hal: ',
+    # logcat
+    'W/GCM     (15158): ',
+    'W/GCM     (  158): ',
+]
+
+TEST_MAP = """\
+# compiler: R8
+this.was.Deobfuscated -> FOO:
+    int[] mFontFamily -> a
+    1:3:void someMethod(int,android.os.Bundle):65:67 -> bar
+never.Deobfuscated -> NOTFOO:
+    int[] mFontFamily -> a
+    1:3:void someMethod(int,android.os.Bundle):65:67 -> bar
+org.chromium.Outer$Inner -> a.b:
+# {"id":"sourceFile","fileName":"Inner.kt"}
+    1:1:void inlinedCallee():40:40 -> c
+    1:1:void other.Helper.inlinedMiddle():20 -> c
+    1:1:void caller():10:10 -> c
+      # {"id":"com.android.tools.r8.rewriteFrame"}
+    2:5:void caller():11:14 -> c
+    void first() -> d
+    void second() -> d
+    1:2:org.chromium.Outer$Inner create(FOO[]):30:31 -> e
+"""
+
+# Matches //build/android/stacktrace/java_deobfuscate_test.py.
+TEST_DATA = [
+    ('', ''),
+    ('FOO', 'this.was.Deobfuscated'),
+    ('FOO.bar', 'this.was.Deobfuscated.someMethod'),
+    ('Here is a FOO', 'Here is a FOO'),
+    ('Here is a class FOO', 'Here is a class this.was.Deobfuscated'),
+    ('Here is a class FOO baz', 'Here is a class FOO baz'),
+    ('Here is a "FOO" baz', 'Here is a "FOO" baz'),
+    ('Here is a type "FOO" baz', 'Here is a type "this.was.Deobfuscated" baz'),
+    ('Here is a "FOO.bar" baz',
+     'Here is a "this.was.Deobfuscated.someMethod" baz'),
+    ('SomeError: SomeFrameworkClass in isTestClass for FOO',
+     'SomeError: SomeFrameworkClass in isTestClass for this.was.Deobfuscated'),
+    ('Here is a FOO.bar', 'Here is a this.was.Deobfuscated.someMethod'),
+    ('Here is a FOO.bar baz', 'Here is a FOO.bar baz'),
+    ('END FOO#bar', 'END this.was.Deobfuscated#someMethod'),
+    ('new-instance 3810 (LSome/Framework/Class;) in LFOO;',
+     'new-instance 3810 (LSome/Framework/Class;) in Lthis/was/Deobfuscated;'),
+    ('FOO: Error message', 'this.was.Deobfuscated: Error message'),
+    ('Caused by: FOO: Error message',
+     'Caused by: this.was.Deobfuscated: Error message'),
+    ('\tat FOO.bar(PG:1)',
+     '\tat this.was.Deobfuscated.someMethod(Deobfuscated.java:65)'),
+    ('\t at\t FOO.bar\t (\t PG:\t 1\t )',
+     '\t at\t this.was.Deobfuscated.someMethod\t '
+     '(\t Deobfuscated.java:\t 65\t )'),
+    ('0xfff \t( \tPG:\t 1 \t)\tFOO.bar',
+     '0xfff \t( \tDeobfuscated.java:\t 65 \t)\t'
+     'this.was.Deobfuscated.someMethod'),
+    ('Unable to start activity ComponentInfo{garbage.in/here.test}:'
+     ' java.lang.NullPointerException: Attempt to invoke interface method'
+     ' \'void FOO.bar(int,android.os.Bundle)\' on a null object reference',
+     'Unable to start activity ComponentInfo{garbage.in/here.test}:'
+     ' java.lang.NullPointerException: Attempt to invoke interface method'
+     ' \'void this.was.Deobfuscated.someMethod(int,android.os.Bundle)\' on a'
+     ' null object reference'),
+    ('Caused by: java.lang.NullPointerException: Attempt to read from field'
+     ' \'int[] FOO.a\' on a null object reference',
+     'Caused by: java.lang.NullPointerException: Attempt to read from field'
+     ' \'int[] this.was.Deobfuscated.mFontFamily\' on a null object reference'),
+    ('java.lang.VerifyError: FOO',
+     'java.lang.VerifyError: this.was.Deobfuscated'),
+    ('java.lang.NoSuchFieldError: No instance field a of type '
+     'Ljava/lang/Class; in class LFOO;',
+     'java.lang.NoSuchFieldError: No instance field mFontFamily of type '
+     'Ljava/lang/Class; in class Lthis/was/Deobfuscated;'),
+    ('NOTFOO: Object of type FOO was not destroyed...',
+     'NOTFOO: Object of type this.was.Deobfuscated was not destroyed...'),
+]
+
+
+class DeobfuscatorTest(unittest.TestCase):
+  def setUp(self):
+    with tempfile.NamedTemporaryFile('w', suffix='.mapping',
+                                     delete=False) as f:
+      f.write(TEST_MAP)
+    self._mapping_path = f.name
+    self._deobfuscator = deobfuscator.Deobfuscator(self._mapping_path)
+
+  def tearDown(self):
+    self._deobfuscator.Close()
+    deobfuscator._mappings.pop(self._mapping_path, None)
+    os.unlink(self._mapping_path)
+
+  def testLinePatterns(self):
+    for prefix in LINE_PREFIXES:
+      for obfuscated, expected in TEST_DATA:
+        self.assertEqual([prefix + expected],
+                         self._deobfuscator.TransformLines([prefix + obfuscated
+                                                            ]))
+
+  def testInlinedFrames(self):
+    self.assertEqual([
+        '\tat org.chromium.Outer$Inner.inlinedCallee(Inner.kt:40)',
+        '\tat other.Helper.inlinedMiddle(Helper.java:20)',
+        '\tat org.chromium.Outer$Inner.caller(Inner.kt:10)',
+        # Unknown methods of known classes still have their class retraced.
+        '\tat this.was.Deobfuscated.notInMapping(Deobfuscated.java:1)',
+    ],
+                     self._deobfuscator.TransformLines([
+                         '\tat a.b.c(PG:1)',
+                         '\tat FOO.notInMapping(PG:1)',
+                     ]))
+
+  def testLineRanges(self):
+    self.assertEqual(['\tat org.chromium.Outer$Inner.caller(Inner.kt:13)'],
+                     self._deobfuscator.TransformLines(['\tat a.b.c(PG:4)']))
+    # Lines outside of any range fall back to the outer method.
+    self.assertEqual(['\tat org.chromium.Outer$Inner.caller(Inner.kt:99)'],
+                     self._deobfuscator.TransformLines(['\tat a.b.c(PG:99)']))
+
+  def testAmbiguousMethods(self):
+    self.assertEqual([
+        'END org.chromium.Outer$Inner#first',
+        '<OR> END org.chromium.Outer$Inner#second',
+    ], self._deobfuscator.TransformLines(['END a.b#d']))
+
+  def testArgumentTypes(self):
+    self.assertEqual([
+        'java.lang.NullPointerException: \'org.chromium.Outer$Inner '
+        'org.chromium.Outer$Inner.create(this.was.Deobfuscated[])\''
+    ],
+                     self._deobfuscator.TransformLines([
+                         'java.lang.NullPointerException: \'a.b a.b.e(FOO[])\''
+                     ]))
+
+  def testSharedBetweenThreads(self):
+    pool = deobfuscator.DeobfuscatorPool(self._mapping_path)
+    lines = [obfuscated for obfuscated, _ in TEST_DATA] * 50
+    expected = [e for _, e in TEST_DATA] * 50
+    results = []
+
+    def transform():
+      results.append(pool.TransformLines(lines))
+
+    threads = [threading.Thread(target=transform) for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    pool.Close()
+    self.assertEqual([expected] * 8, results)
+    self.assertEqual(1, sum(1 for p in deobfuscator._mappings
+                            if p == self._mapping_path))
+
+  def testMissingMapping(self):
+    d = deobfuscator.Deobfuscator(self._mapping_path + '.missing')
+    self.assertTrue(d.IsClosed())
+    self.assertEqual(['FOO'], d.TransformLines(['FOO']))
+
+
+if __name__ == '__main__':
+  unittest.main()
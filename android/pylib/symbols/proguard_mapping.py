@@ -0,0 +1,200 @@
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Pure-Python index of ProGuard / R8 mapping files.
+
+Loading a mapping only scans it for class headers. The members of a class are
+parsed the first time the class is looked up, so memory use stays close to the
+size of the (mmapped, shared) mapping file even for very large apps.
+
+Instances are safe to use from multiple threads.
+"""
+
+import collections
+import json
+import mmap
+import re
+import sys
+
+# E.g.: org.chromium.Foo -> a.b:
+_CLASS_RE = re.compile(rb'^([^\s#][^\n]*?) -> ([^\n]+?):\r?$', re.MULTILINE)
+# E.g.: 1:3:void someMethod(int,android.os.Bundle):65:67 -> bar
+# E.g.: 4:4:void other.Class.inlined():10:10 -> bar
+# E.g.: void noLineNumbers() -> c
+_METHOD_RE = re.compile(r'\s+(?:(\d+):(\d+):)?\S+\s+(?:(\S+)\.)?([^\s.(]+)'
+                        r'\([^)]*\)(?::(\d+)(?::(\d+))?)?\s+->\s+(\S+)')
+# E.g.: int[] mFontFamily -> a
+_FIELD_RE = re.compile(r'\s+\S+\s+([^\s(]+)\s+->\s+(\S+)')
+
+# A method (or inlined method) that obfuscated code maps back to.
+Frame = collections.namedtuple('Frame', ['class_name', 'method_name', 'line'])
+
+# One line of a class's member mapping. Fields that are not present in the
+# mapping are None.
+_MethodRange = collections.namedtuple('_MethodRange', [
+    'obfuscated_start', 'obfuscated_end', 'original_class', 'original_name',
+    'original_start', 'original_end'
+])
+
+
+def SourceFileForClass(class_name):
+  """Returns the default source file name for a class (Outer.java)."""
+  simple_name = class_name.rsplit('.', 1)[-1]
+  return simple_name.split('$', 1)[0] + '.java'
+
+
+def _OriginalLine(method_range, line):
+  if method_range.original_start is None:
+    return line
+  if (line is not None and method_range.obfuscated_start is not None
+      and method_range.original_end is not None
+      and (method_range.original_end - method_range.original_start ==
+           method_range.obfuscated_end - method_range.obfuscated_start)):
+    return method_range.original_start + line - method_range.obfuscated_start
+  return method_range.original_start
+
+
+class ClassMapping:
+  """The members of one class in a mapping."""
+
+  __slots__ = ('original_name', 'source_file', '_fields', '_inline_chains')
+
+  def __init__(self, original_name, body):
+    self.original_name = original_name
+    self.source_file = SourceFileForClass(original_name)
+    self._fields = {}
+    # Maps obfuscated method names to lists of inline chains. Each chain is a
+    # list of _MethodRange that share the same obfuscated line range, with the
+    # innermost inlined method first and the outer method last.
+    self._inline_chains = {}
+    self._Parse(body)
+
+  def _Parse(self, body):
+    prev = None
+    for line in body.splitlines():
+      stripped = line.lstrip()
+      if not stripped:
+        continue
+      if stripped.startswith('#'):
+        if line.startswith('#'):
+          self._ParseMetadata(stripped[1:])
+        continue
+      m = _METHOD_RE.fullmatch(line)
+      if m:
+        (obf_start, obf_end, orig_class, orig_name, orig_start, orig_end,
+         obf_name) = m.groups()
+        method_range = _MethodRange(
+            obf_start and int(obf_start), obf_end and int(obf_end),
+            orig_class and sys.intern(orig_class), sys.intern(orig_name),
+            orig_start and int(orig_start), orig_end and int(orig_end))
+        chains = self._inline_chains.setdefault(sys.intern(obf_name), [])
+        if (prev and prev[0] == obf_name
+            and method_range.obfuscated_start is not None
+            and prev[1].obfuscated_start == method_range.obfuscated_start
+            and prev[1].obfuscated_end == method_range.obfuscated_end):
+          chains[-1].append(method_range)
+        else:
+          chains.append([method_range])
+        prev = (obf_name, method_range)
+        continue
+      prev = None
+      m = _FIELD_RE.fullmatch(line)
+      if m:
+        self._fields.setdefault(sys.intern(m.group(2)),
+                                []).append(sys.intern(m.group(1)))
+
+  def _ParseMetadata(self, text):
+    # E.g.: # {"id":"sourceFile","fileName":"Foo.kt"}
+    try:
+      metadata = json.loads(text)
+    except ValueError:
+      return
+    if isinstance(metadata, dict) and metadata.get('id') == 'sourceFile':
+      self.source_file = metadata.get('fileName', self.source_file)
+
+  def _ToFrames(self, chain, line):
+    return [
+        Frame(r.original_class or self.original_name, r.original_name,
+              _OriginalLine(r, line)) for r in chain
+    ]
+
+  def GetMethodFrames(self, obfuscated_name, line=None):
+    """Returns the possible original frames of a method.
+
+    Args:
+      obfuscated_name: The obfuscated method name.
+      line: The obfuscated line number, or None if unknown.
+
+    Returns:
+      A list of alternatives (more than one when the mapping is ambiguous),
+      where each alternative is a list of Frames with the innermost inlined
+      method first. Returns an empty list for unknown methods.
+    """
+    chains = self._inline_chains.get(obfuscated_name)
+    if not chains:
+      return []
+    if line is not None:
+      matches = [
+          c for c in chains if c[0].obfuscated_start is not None
+          and c[0].obfuscated_start <= line <= c[0].obfuscated_end
+      ]
+      if matches:
+        return [self._ToFrames(c, line) for c in matches]
+    # Without a matching line, only the outer method of each chain can be
+    # named "obfuscated_name" in the obfuscated code.
+    ret = []
+    for chain in chains:
+      frame = Frame(chain[-1].original_class or self.original_name,
+                    chain[-1].original_name, None)
+      if [frame] not in ret:
+        ret.append([frame])
+    return ret
+
+  def GetFieldNames(self, obfuscated_name):
+    """Returns the possible original names of a field."""
+    return self._fields.get(obfuscated_name, [])
+
+
+class ProguardMapping:
+  """An index of an R8 / ProGuard mapping file, keyed by obfuscated names."""
+
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      # mmap does not support empty files.
+      if f.seek(0, 2) == 0:
+        self._data = b''
+      else:
+        self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self._class_offsets = {}
+    self._original_names = {}
+    self._classes = {}
+    prev_name = None
+    for m in _CLASS_RE.finditer(self._data):
+      original_name, obfuscated_name = (sys.intern(g.decode('utf-8'))
+                                        for g in m.groups())
+      if prev_name is not None:
+        self._class_offsets[prev_name] = (self._class_offsets[prev_name][0],
+                                          m.start())
+      self._class_offsets[obfuscated_name] = (m.end(), len(self._data))
+      self._original_names[obfuscated_name] = original_name
+      prev_name = obfuscated_name
+
+  def __len__(self):
+    return len(self._class_offsets)
+
+  def GetClass(self, obfuscated_name):
+    """Returns the ClassMapping for |obfuscated_name|, or None if unknown."""
+    ret = self._classes.get(obfuscated_name)
+    if ret is None:
+      offsets = self._class_offsets.get(obfuscated_name)
+      if offsets is None:
+        return None
+      body = self._data[offsets[0]:offsets[1]].decode('utf-8')
+      ret = ClassMapping(self._original_names[obfuscated_name], body)
+      # Another thread may have parsed the class concurrently, which is
+      # harmless since both results are equivalent.
+      ret = self._classes.setdefault(obfuscated_name, ret)
+    return ret
+
+  def GetOriginalClassName(self, obfuscated_name):
+    return self._original_names.get(obfuscated_name)
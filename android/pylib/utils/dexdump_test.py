@@ -3,13 +3,21 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import os
+import tempfile
 import unittest
+import zipfile
 from xml.etree import ElementTree
 
+from pylib.dex import dex_parser
+from pylib.dex import dex_parser_test
 from pylib.utils import dexdump
 
 # pylint: disable=protected-access
 
+_TEST_APK = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                         'CheckInstallApk-debug.apk')
+
 emptyAnnotations = dexdump.Annotations(classAnnotations={},
                                        methodsAnnotations={})
 
@@ -64,6 +72,20 @@ class DexdumpXMLParseTest(unittest.TestCase):
 
     self.assertEqual(expected, actual)
 
+  def testParseAnnotations_parameters(self):
+    example_xml_string = (
+        'Class #0 annotations:\n'
+        'Annotations on method #1 \'example\'\n'
+        '  VISIBILITY_RUNTIME Lorg/junit/Test;\n'
+        'Annotations on method #1 \'example\' parameters\n'
+        '  #0\n'
+        '    VISIBILITY_RUNTIME Landroidx/annotation/Nullable;\n'
+        '\n')
+
+    actual = dexdump._ParseAnnotations(example_xml_string)
+
+    self.assertEqual({0: ({}, {'example': {'Test': None}})}, actual)
+
   def testParseRootXmlNode(self):
     example_xml_string = ('<api>'
                           '<package name="com.foo.bar1">'
@@ -203,5 +225,170 @@ class DexdumpXMLParseTest(unittest.TestCase):
     self.assertEqual(expected, actual)
 
 
+def _EncodeString(string_idx):
+  return dex_parser_test.EncodeValue(dex_parser.VALUE_STRING, 0,
+                                     bytes([string_idx]))
+
+
+# A dex file with the classes:
+#   package org.foo;
+#   @Feature({"A&B", "C"})
+#   public abstract class FooTest extends Base {
+#     @Nullable public FooTest() {}
+#     @Test private void testBar() {}
+#     @Test @Restriction(type = Kind.X, timeout = 1.5) public void testFoo() {}
+#   }
+#   public class Base {}
+_STRINGS = [
+    '<init>', 'A&B', 'C', 'Landroidx/annotation/Nullable;',
+    'Ljava/lang/Object;', 'Lorg/foo/Base;', 'Lorg/foo/Feature;',
+    'Lorg/foo/FooTest;', 'Lorg/foo/Kind;', 'Lorg/foo/Restriction;',
+    'Lorg/junit/Test;', 'V', 'X', 'testBar', 'testFoo', 'timeout', 'type',
+    'value'
+]
+_TYPES = list(range(3, 12))
+_PROTOS = [(11, 8, [])]
+_METHODS = [(4, 0, 0), (4, 0, 13), (4, 0, 14)]
+_FIELDS = [(5, 5, 12)]
+_FEATURE = dex_parser_test.EncodeAnnotation(3, [
+    (17,
+     dex_parser_test.EncodeValue(dex_parser.VALUE_ARRAY, 0,
+                                 b'\x02' + _EncodeString(1) +
+                                 _EncodeString(2))),
+])
+_RESTRICTION = dex_parser_test.EncodeAnnotation(6, [
+    (16, dex_parser_test.EncodeValue(dex_parser.VALUE_ENUM, 0, b'\x00')),
+    (15, dex_parser_test.EncodeValue(dex_parser.VALUE_DOUBLE, 1,
+                                     b'\xf8\x3f')),
+])
+_RUNTIME = dex_parser.VISIBILITY_RUNTIME
+_CLASSES = [
+    (4, 0x401, 2, [], ([(0, 0x10001), (1, 0x2)], [(2, 0x1)]),
+     ([(_RUNTIME, _FEATURE),
+       (dex_parser.VISIBILITY_SYSTEM, dex_parser_test.EncodeAnnotation(1, []))
+       ], {
+           0: [(_RUNTIME, dex_parser_test.EncodeAnnotation(0, []))],
+           1: [(_RUNTIME, dex_parser_test.EncodeAnnotation(7, []))],
+           2: [(_RUNTIME, dex_parser_test.EncodeAnnotation(7, [])),
+               (_RUNTIME, _RESTRICTION)],
+       })),
+    (2, 0x1, 1, []),
+]
+
+# What dexdump -a -j -l xml outputs for the dex file above.
+_DEXDUMP_OUTPUT = """\
+<api>
+Class #0 annotations:
+Annotations on class
+  VISIBILITY_RUNTIME Lorg/foo/Feature; value={ A&amp;B C }
+  VISIBILITY_SYSTEM Ljava/lang/Object;
+Annotations on method #0 '<init>'
+  VISIBILITY_RUNTIME Landroidx/annotation/Nullable;
+Annotations on method #1 'testBar'
+  VISIBILITY_RUNTIME Lorg/junit/Test;
+Annotations on method #2 'testFoo'
+  VISIBILITY_RUNTIME Lorg/junit/Test;
+  VISIBILITY_RUNTIME Lorg/foo/Restriction; type=X timeout=1.5
+
+<package name="org.foo"
+>
+<class name="FooTest"
+ extends="org.foo.Base"
+ abstract="true"
+>
+<constructor name="FooTest"
+ visibility="public"
+>
+</constructor>
+<method name="testBar"
+ visibility="private"
+>
+</method>
+<method name="testFoo"
+ visibility="public"
+>
+</method>
+</class>
+<class name="Base"
+ extends="java.lang.Object"
+ abstract="false"
+>
+</class>
+</package>
+</api>
+"""
+
+
+class DexFileDumpTest(unittest.TestCase):
+  def setUp(self):
+    self.dex_data = dex_parser_test.BuildDexFile(_STRINGS, _TYPES, _PROTOS,
+                                                 _METHODS, _CLASSES, _FIELDS)
+
+  def testDumpDexFile(self):
+    actual = dexdump._DumpDexFile(dex_parser.DexFile(self.dex_data))
+
+    expected = {
+        'org.foo': {
+            'classes': {
+                'FooTest': {
+                    'methods': ['testFoo'],
+                    'superclass': 'org.foo.Base',
+                    'is_abstract': True,
+                    'annotations':
+                    dexdump.Annotations(
+                        classAnnotations={'Feature': {
+                            'value': ['A&amp;B', 'C']
+                        }},
+                        methodsAnnotations={
+                            'constructor': {
+                                'Nullable': None
+                            },
+                            'testBar': {
+                                'Test': None
+                            },
+                            'testFoo': {
+                                'Test': None,
+                                'Restriction': {
+                                    'type': 'X',
+                                    'timeout': '1.5'
+                                },
+                            },
+                        }),
+                },
+                'Base': {
+                    'methods': [],
+                    'superclass': 'java.lang.Object',
+                    'is_abstract': False,
+                    'annotations': emptyAnnotations,
+                },
+            },
+        },
+    }
+    self.assertEqual(expected, actual)
+
+  def testDumpDexFile_matchesDexdump(self):
+    xml = _DEXDUMP_OUTPUT.replace('<init>', 'constructor')
+    expected = dexdump._ParseRootNode(ElementTree.fromstring(xml),
+                                      dexdump._ParseAnnotations(xml))
+    actual = dexdump._DumpDexFile(dex_parser.DexFile(self.dex_data))
+    self.assertEqual(expected, actual)
+
+  def testDumpWithDexParser(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      apk_path = os.path.join(temp_dir, 'test.apk')
+      with zipfile.ZipFile(apk_path, 'w') as z:
+        z.writestr('classes.dex', self.dex_data)
+        z.writestr('classes2.dex', self.dex_data, zipfile.ZIP_DEFLATED)
+      dumps = dexdump.DumpWithDexParser(apk_path)
+    expected = dexdump._DumpDexFile(dex_parser.DexFile(self.dex_data))
+    self.assertEqual([expected, expected], dumps)
+
+  @unittest.skipUnless(os.path.exists(dexdump.DEXDUMP_PATH),
+                       'Requires the Android SDK\'s dexdump.')
+  def testDumpWithDexParser_matchesDexdumpOnApk(self):
+    self.assertEqual(dexdump.DumpWithDexdump(_TEST_APK),
+                     dexdump.DumpWithDexParser(_TEST_APK))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -102,6 +102,12 @@ def AddTestLauncherOptions(parser):
       '--test-launcher-total-shards',
       type=int, default=os.environ.get('GTEST_TOTAL_SHARDS', 1),
       help='Total number of external shards.')
+  parser.add_argument(
+      '--test-timings-file',
+      type=os.path.realpath,
+      help='If set, tests are balanced across shards using their durations '
+           'in this file, which is updated from previous --json-results-file '
+           'outputs by build/android/pylib/results/test_timings.py.')
 
   test_filter.AddFilterOptions(parser)
 
@@ -604,6 +610,13 @@ def AddInstrumentationTestOptions(parser):
       action='store_true',
       help='Install the test apk as an instant app. '
       'Instant apps run in a more restrictive execution environment.')
+  parser.add_argument(
+      '--test-list-cache-dir',
+      type=os.path.realpath,
+      help='Directory in which to cache the tests listed from test apks. '
+      'Can be shared by runs of different apks. Entries of other users are '
+      'ignored. Defaults to a per-user directory in the system temp '
+      'directory.')
   parser.add_argument(
       '--test-launcher-batch-limit',
       dest='test_launcher_batch_limit',
@@ -997,8 +1010,10 @@ def RunTestsInPlatformMode(args, result_sink_client=None):
 
   @contextlib.contextmanager
   def json_writer():
+    succeeded = False
     try:
       yield
+      succeeded = True
     except Exception:
       global_results_tags.add('UNRELIABLE_RESULTS')
       raise
@@ -1031,6 +1046,14 @@ def RunTestsInPlatformMode(args, result_sink_client=None):
               test_file_name = test_class_to_file_name_dict.get(
                   match.group(1)) if match else None
               _SinkTestResult(r, test_file_name, result_sink_client)
+        if succeeded:
+          result_sink_client.Flush()
+        else:
+          # Do not replace the exception that is already being raised.
+          try:
+            result_sink_client.Flush()
+          except Exception:  # pylint: disable=broad-except
+            logging.exception('Failed to upload test results to ResultSink.')
 
   @contextlib.contextmanager
   def upload_logcats_file():
@@ -1353,8 +1376,14 @@ def main():
       args.wait_for_java_debugger)):
     args.num_retries = 0
 
+  # Large test logs are written next to the run's other outputs, so that they
+  # are cleaned up with them.
+  artifacts_dir = None
+  if args.output_directory:
+    artifacts_dir = os.path.join(args.output_directory, 'result_sink_artifacts')
   # Result-sink may not exist in the environment if rdb stream is not enabled.
-  result_sink_client = result_sink.TryInitClient()
+  result_sink_client = result_sink.TryInitClient(upload_in_background=True,
+                                                 artifacts_dir=artifacts_dir)
 
   try:
     return RunTestsCommand(args, result_sink_client)
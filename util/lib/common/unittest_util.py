@@ -5,6 +5,7 @@
 """Utilities for dealing with the python unittest module."""
 
 import fnmatch
+import functools
 import re
 import sys
 import unittest
@@ -111,9 +112,10 @@ def FilterTests(all_tests, gtest_filter):
   Returns:
     Filtered subset of the given list of tests.
   """
-  test_names = [GetTestName(test) for test in all_tests]
-  filtered_names = FilterTestNames(test_names, gtest_filter)
-  return [test for test in all_tests if GetTestName(test) in filtered_names]
+  compiled_filter = CompileFilter(gtest_filter)
+  return [
+      test for test in all_tests if compiled_filter.Matches(GetTestName(test))
+  ]
 
 
 def FilterTestNames(all_tests, gtest_filter):
@@ -127,29 +129,124 @@ def FilterTestNames(all_tests, gtest_filter):
     gtest_filter: Filter to apply.
 
   Returns:
-    Filtered subset of the given list of test names.
+    Filtered subset of the given list of test names, ordered by the first
+    positive pattern that matches them.
   """
-  pattern_groups = gtest_filter.split('-')
-  positive_patterns = ['*']
-  if pattern_groups[0]:
-    positive_patterns = pattern_groups[0].split(':')
-  negative_patterns = []
-  if len(pattern_groups) > 1:
-    negative_patterns = pattern_groups[1].split(':')
-
-  neg_pats = None
-  if negative_patterns:
-    neg_pats = re.compile('|'.join(fnmatch.translate(p) for p in
-                                   negative_patterns))
+  return CompileFilter(gtest_filter).FilterNames(all_tests)
 
-  tests = []
-  test_set = set()
-  for pattern in positive_patterns:
-    pattern_tests = [
-        test for test in all_tests
-        if (fnmatch.fnmatch(test, pattern)
-            and not (neg_pats and neg_pats.match(test))
-            and test not in test_set)]
-    tests.extend(pattern_tests)
-    test_set.update(pattern_tests)
-  return tests
+
+# Keys of PatternMatcher's prefix trie nodes other than single characters.
+_TRIE_END = ''
+_TRIE_GLOBS = None
+_GLOB_RE = re.compile(r'[*?[]')
+
+
+class PatternMatcher:
+  """Matches names against a list of gtest filter patterns.
+
+  Patterns are compiled once into a set of exact names and a trie of literal
+  pattern prefixes. Patterns like "Foo.*" are matched by walking the trie.
+  Patterns with other wildcards are combined into one regex per trie node (the
+  root's holds those starting with a wildcard), which is only tried for names
+  that start with the literal prefix. Instances are not modified after
+  construction, so can be shared by threads.
+  """
+
+  def __init__(self, patterns):
+    self._exact = {}
+    self._prefix_trie = {}
+    globs_by_node = {}
+    for index, pattern in enumerate(patterns):
+      glob_match = _GLOB_RE.search(pattern)
+      if not glob_match:
+        self._exact.setdefault(pattern, index)
+        continue
+      node = self._prefix_trie
+      for char in pattern[:glob_match.start()]:
+        node = node.setdefault(char, {})
+      if glob_match.end() == len(pattern) and pattern[-1] == '*':
+        node.setdefault(_TRIE_END, index)
+      else:
+        globs_by_node.setdefault(id(node), (node, []))[1].append(
+            (index, pattern))
+    for node, globs in globs_by_node.values():
+      # Alternatives are tried in order, so the first one that matches is that
+      # of the first matching pattern.
+      node[_TRIE_GLOBS] = (globs[0][0],
+                           re.compile('|'.join(
+                               '(?P<p%d>%s)' % (i, fnmatch.translate(p))
+                               for i, p in globs)))
+
+  def MatchIndex(self, name):
+    """Returns the index of the first pattern matching |name|, or None."""
+    index = self._exact.get(name)
+    node = self._prefix_trie
+    pos = 0
+    while True:
+      end = node.get(_TRIE_END)
+      if end is not None and (index is None or end < index):
+        index = end
+      globs = node.get(_TRIE_GLOBS)
+      if globs and (index is None or globs[0] < index):
+        match = globs[1].match(name)
+        if match:
+          # The group that closes last is the one wrapping the alternative.
+          glob_index = int(match.lastgroup[1:])
+          if index is None or glob_index < index:
+            index = glob_index
+      if pos == len(name):
+        break
+      node = node.get(name[pos])
+      if node is None:
+        break
+      pos += 1
+    return index
+
+  def Matches(self, name):
+    """Returns whether any pattern matches |name|."""
+    return self.MatchIndex(name) is not None
+
+
+class GtestFilter:
+  """A compiled gtest filter. See FilterTestNames().
+
+  Prefer CompileFilter(), which reuses compiled filters.
+  """
+
+  def __init__(self, gtest_filter):
+    pattern_groups = gtest_filter.split('-')
+    positive_patterns = ['*']
+    if pattern_groups[0]:
+      positive_patterns = pattern_groups[0].split(':')
+    self._num_positive_patterns = len(positive_patterns)
+    self._positive = PatternMatcher(positive_patterns)
+    self._negative = None
+    if len(pattern_groups) > 1:
+      self._negative = PatternMatcher(pattern_groups[1].split(':'))
+
+  def _PositiveIndex(self, name):
+    index = self._positive.MatchIndex(name)
+    if index is not None and self._negative and self._negative.Matches(name):
+      return None
+    return index
+
+  def Matches(self, name):
+    """Returns whether the filter selects the test named |name|."""
+    return self._PositiveIndex(name) is not None
+
+  def FilterNames(self, names):
+    """Returns the selected names, ordered by their first matching pattern."""
+    if self._num_positive_patterns == 1:
+      return [name for name in names if self.Matches(name)]
+    names_by_pattern = [[] for _ in range(self._num_positive_patterns)]
+    for name in names:
+      index = self._PositiveIndex(name)
+      if index is not None:
+        names_by_pattern[index].append(name)
+    return [name for group in names_by_pattern for name in group]
+
+
+@functools.lru_cache(maxsize=64)
+def CompileFilter(gtest_filter):
+  """Returns a (shared) GtestFilter for |gtest_filter|."""
+  return GtestFilter(gtest_filter)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Benchmarks unittest_util.FilterTestNames() with large filters.
+
+Filters a synthetic list of test names with a filter like those generated from
+filter files: exact names, "Suite.*" prefixes and other globs, both positive
+and negative. The previous fnmatch-based implementation is too slow to run on
+the whole list, so it runs on a sample and its time is extrapolated.
+
+Run with:
+  build/util/lib/common/unittest_util_benchmark.py [--num-names N]
+"""
+
+import argparse
+import random
+import sys
+import timeit
+
+import unittest_util
+import unittest_util_test
+
+
+def _CreateNames(rand, num_names):
+  return [
+      'Suite%d.Test%d/%d' % (rand.randrange(num_names // 50), i, i % 3)
+      for i in range(num_names)
+  ]
+
+
+def _CreateFilter(rand, names, num_patterns):
+  suites = sorted({n.split('.')[0] for n in names})
+  positive = []
+  negative = []
+  for i in range(num_patterns):
+    kind = i % 4
+    if kind == 0:
+      positive.append(rand.choice(names))
+    elif kind == 1:
+      positive.append(rand.choice(suites) + '.*')
+    elif kind == 2:
+      negative.append(rand.choice(names))
+    elif i % 100 == 3:
+      negative.append('*.Test%d/?' % rand.randrange(len(names)))
+    else:
+      negative.append('%s.*Test%d*' %
+                      (rand.choice(suites), rand.randrange(len(names))))
+  return ':'.join(positive) + '-' + ':'.join(negative)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num-names', type=int, default=200000)
+  parser.add_argument('--num-patterns', type=int, default=4000)
+  parser.add_argument('--baseline-sample', type=int, default=2000)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  rand = random.Random(0)
+  names = _CreateNames(rand, args.num_names)
+  gtest_filter = _CreateFilter(rand, names, args.num_patterns)
+  print('{} names, {} patterns'.format(len(names), args.num_patterns))
+
+  def compile_filter():
+    return unittest_util.GtestFilter(gtest_filter)
+
+  compiled_filter = compile_filter()
+  times = timeit.repeat(compile_filter, number=1, repeat=args.repeat)
+  print('{:<40} min={:.0f}ms'.format('Compile filter', min(times) * 1000))
+  times = timeit.repeat(lambda: compiled_filter.FilterNames(names),
+                        number=1,
+                        repeat=args.repeat)
+  print('{:<40} min={:.0f}ms'.format('Compiled filter', min(times) * 1000))
+
+  sample = names[:args.baseline_sample]
+  # pylint: disable=protected-access
+  times = timeit.repeat(
+      lambda: unittest_util_test._FnmatchFilterTestNames(sample, gtest_filter),
+      number=1,
+      repeat=1)
+  estimate = min(times) * len(names) / len(sample)
+  print('{:<40} ~{:.0f}ms (from {} names)'.format('fnmatch (extrapolated)',
+                                                  estimate * 1000,
+                                                  len(sample)))
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -5,12 +5,43 @@
 
 # pylint: disable=protected-access
 
+import fnmatch
 import logging
+import random
+import re
 import sys
 import unittest
 import unittest_util
 
 
+def _FnmatchFilterTestNames(all_tests, gtest_filter):
+  """The previous implementation of FilterTestNames(), for comparison."""
+  pattern_groups = gtest_filter.split('-')
+  positive_patterns = ['*']
+  if pattern_groups[0]:
+    positive_patterns = pattern_groups[0].split(':')
+  negative_patterns = []
+  if len(pattern_groups) > 1:
+    negative_patterns = pattern_groups[1].split(':')
+
+  neg_pats = None
+  if negative_patterns:
+    neg_pats = re.compile('|'.join(fnmatch.translate(p) for p in
+                                   negative_patterns))
+
+  tests = []
+  test_set = set()
+  for pattern in positive_patterns:
+    pattern_tests = [
+        test for test in all_tests
+        if (fnmatch.fnmatch(test, pattern)
+            and not (neg_pats and neg_pats.match(test))
+            and test not in test_set)]
+    tests.extend(pattern_tests)
+    test_set.update(pattern_tests)
+  return tests
+
+
 class FilterTestNamesTest(unittest.TestCase):
 
   possible_list = ["Foo.One",
@@ -59,6 +90,51 @@ class FilterTestNamesTest(unittest.TestCase):
                           "Foo.Two",
                           "Quux.Two"])
 
+  def testMatchMixedPatterns(self):
+    x = unittest_util.FilterTestNames(self.possible_list,
+                                      "*.T?o:Quux.One:Foo.*-Foo.Thr[e]e")
+    self.assertEqual(x, ["Foo.Two", "Bar.Two", "Quux.Two", "Quux.One",
+                         "Foo.One"])
+
+  def testMatchExactNegative(self):
+    x = unittest_util.FilterTestNames(self.possible_list, "Foo.*-Foo.One")
+    self.assertEqual(x, ["Foo.Two", "Foo.Three"])
+
+  def testMatchesFnmatch(self):
+    rand = random.Random(0)
+    names = ['%s.%s' % (rand.choice(['Foo', 'FooBar', 'Bar', 'F']),
+                        rand.choice(['One', 'Two', 'O', 'Ten']))
+             for _ in range(200)]
+    patterns = ['*', 'Foo*', 'Foo.*', 'F*.O*', 'F?o.*', 'Bar.One', '*.T*',
+                'F.[OT]*', 'Foo', '']
+    for _ in range(200):
+      gtest_filter = ':'.join(rand.sample(patterns, rand.randint(0, 3)))
+      if rand.randint(0, 1):
+        gtest_filter += '-' + ':'.join(rand.sample(patterns,
+                                                   rand.randint(1, 2)))
+      self.assertEqual(_FnmatchFilterTestNames(names, gtest_filter),
+                       unittest_util.FilterTestNames(names, gtest_filter),
+                       gtest_filter)
+
+
+class PatternMatcherTest(unittest.TestCase):
+
+  def testMatchIndex(self):
+    matcher = unittest_util.PatternMatcher(
+        ['Foo.Bar', 'Foo.*', 'F*', '*', 'Foo.Bar'])
+    self.assertEqual(0, matcher.MatchIndex('Foo.Bar'))
+    self.assertEqual(1, matcher.MatchIndex('Foo.Baz'))
+    self.assertEqual(2, matcher.MatchIndex('Fo'))
+    self.assertEqual(3, matcher.MatchIndex('Bar'))
+
+  def testNoMatch(self):
+    matcher = unittest_util.PatternMatcher(['Foo.*', '*.Bar?', 'Baz'])
+    self.assertTrue(matcher.Matches('Foo.'))
+    self.assertTrue(matcher.Matches('Qux.Bar1'))
+    self.assertFalse(matcher.Matches('Foo'))
+    self.assertFalse(matcher.Matches('Qux.Bar'))
+    self.assertFalse(matcher.Matches('Baz.'))
+
 
 if __name__ == '__main__':
   logging.getLogger().setLevel(logging.DEBUG)
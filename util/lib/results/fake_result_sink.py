@@ -0,0 +1,76 @@
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""A local stand-in for the ResultSink server, for tests and benchmarks.
+
+It records the requests it receives instead of reporting them to ResultDB.
+"""
+
+import gzip
+import http.server
+import json
+import threading
+
+
+class FakeResultSink(object):
+  """Serves ResultSink requests on localhost from a background thread.
+
+  Use as a context manager, and pass |context| to result_sink.ResultSinkClient.
+  """
+
+  def __init__(self):
+    # List of (url path, headers, parsed body) of the received requests.
+    self.requests = []
+    # HTTP status to respond with.
+    self.status = 200
+    self._lock = threading.Lock()
+    fake = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def do_POST(self):
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+          data = gzip.decompress(data)
+        with fake._lock:
+          fake.requests.append((self.path, dict(self.headers),
+                                json.loads(data)))
+        self.send_response(fake.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+      def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    self._server = http.server.ThreadingHTTPServer(('localhost', 0), Handler)
+    self._thread = None
+    self.context = {
+        'address': 'localhost:%d' % self._server.server_address[1],
+        'auth_token': 'fake-auth-token',
+    }
+
+  def __enter__(self):
+    # A short poll interval makes shutting down quick.
+    self._thread = threading.Thread(target=self._server.serve_forever,
+                                    args=(0.01, ))
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self._server.shutdown()
+    self._server.server_close()
+    self._thread.join()
+
+  def GetBatches(self):
+    """Returns the lists of test results reported by each request."""
+    with self._lock:
+      return [
+          body['testResults'] for path, _, body in self.requests
+          if path.endswith('/ReportTestResults')
+      ]
+
+  def GetTestResults(self):
+    """Returns all reported test results, in order."""
+    return [tr for batch in self.GetBatches() for tr in batch]
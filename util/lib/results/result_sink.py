@@ -3,11 +3,17 @@
 # found in the LICENSE file.
 from __future__ import absolute_import
 import base64
+import gzip
+import hashlib
 import json
 import logging
 import os
+import tempfile
+import threading
+import time
 
 import six
+from six.moves import queue
 
 import requests  # pylint: disable=import-error
 from lib.results import result_types
@@ -24,19 +30,37 @@ RESULT_MAP = {
     result_types.NOTRUN: 'SKIP',
 }
 
+# Limits on the batches of test results uploaded by a background uploader.
+_MAX_BATCH_RESULTS = 500
+_MAX_BATCH_BYTES = 4 * 1024 * 1024
+_MAX_BATCH_DELAY_SECONDS = 1.0
+# Post() blocks when this many results are waiting to be uploaded.
+_MAX_QUEUED_RESULTS = 2000
+# Larger logs are written to files, once per distinct log, instead of being
+# base64-encoded into each request.
+_MIN_FILE_ARTIFACT_BYTES = 64 * 1024
+# Larger request bodies are gzip-compressed.
+_MIN_COMPRESSED_REQUEST_BYTES = 64 * 1024
 
-def TryInitClient():
+
+def TryInitClient(upload_in_background=False, artifacts_dir=None):
   """Tries to initialize a result_sink_client object.
 
   Assumes that rdb stream is already running.
 
+  Args:
+    upload_in_background: See ResultSinkClient.
+    artifacts_dir: See ResultSinkClient.
+
   Returns:
     A ResultSinkClient for the result_sink server else returns None.
   """
   try:
     with open(os.environ['LUCI_CONTEXT']) as f:
       sink = json.load(f)['result_sink']
-      return ResultSinkClient(sink)
+      return ResultSinkClient(sink,
+                              upload_in_background=upload_in_background,
+                              artifacts_dir=artifacts_dir)
   except KeyError:
     return None
 
@@ -46,9 +70,19 @@ class ResultSinkClient(object):
 
   This assumes that the rdb stream has been called already and that the
   server is listening.
+
+  Args:
+    context: The result_sink section of LUCI_CONTEXT.
+    upload_in_background: If True, Post() only queues results, which are
+      uploaded in batches from a background thread. Flush() or close() must
+      then be called to make sure that all results are uploaded.
+    artifacts_dir: Directory in which to write large test logs for the sink to
+      upload. Files are kept after the client is closed, since the sink may
+      upload them later, so this should be cleaned up along with the run's
+      other outputs. When None, all logs are sent inline.
   """
 
-  def __init__(self, context):
+  def __init__(self, context, upload_in_background=False, artifacts_dir=None):
     base_url = 'http://%s/prpc/luci.resultsink.v1.Sink' % context['address']
     self.test_results_url = base_url + '/ReportTestResults'
     self.report_artifacts_url = base_url + '/ReportInvocationLevelArtifacts'
@@ -60,6 +94,13 @@ class ResultSinkClient(object):
     }
     self.session = requests.Session()
     self.session.headers.update(headers)
+    self._artifacts_dir = artifacts_dir
+    self._artifact_paths = {}
+    self._artifacts_lock = threading.Lock()
+    self._uploader = None
+    if upload_in_background:
+      self._uploader = _BatchUploader(self._SerializeResult,
+                                      self._PostTestResults)
 
   def __enter__(self):
     return self
@@ -68,8 +109,21 @@ class ResultSinkClient(object):
     self.close()
 
   def close(self):
-    """Closes the session backing the sink."""
-    self.session.close()
+    """Uploads queued results and closes the session backing the sink."""
+    try:
+      if self._uploader:
+        self._uploader.Stop()
+    finally:
+      self.session.close()
+
+  def Flush(self):
+    """Waits until all results passed to Post() are uploaded.
+
+    Raises:
+      The first error that happened while uploading results in the background.
+    """
+    if self._uploader:
+      self._uploader.Flush()
 
   def Post(self,
            test_id,
@@ -128,15 +182,10 @@ class ResultSinkClient(object):
         }
     }
 
-    artifacts = artifacts or {}
+    tr['artifacts'] = dict(artifacts or {})
     tr['summaryHtml'] = html_artifact if html_artifact else ''
     if test_log:
-      # Upload the original log without any modifications.
-      b64_log = six.ensure_str(base64.b64encode(six.ensure_binary(test_log)))
-      artifacts.update({'Test Log': {'contents': b64_log}})
       tr['summaryHtml'] += '<text-artifact artifact-id="Test Log" />'
-    if artifacts:
-      tr['artifacts'] = artifacts
     if failure_reason:
       tr['failureReason'] = {
           'primaryErrorMessage': _TruncateToUTF8Bytes(failure_reason, 1024)
@@ -154,8 +203,57 @@ class ResultSinkClient(object):
           'repo': 'https://chromium.googlesource.com/chromium/src',
       }
 
+    if self._uploader:
+      self._uploader.Add((tr, test_log))
+    else:
+      self._PostTestResults([self._SerializeResult((tr, test_log))])
+
+  def _SerializeResult(self, tr_and_log):
+    """Adds the test log to a test result and returns it as JSON."""
+    tr, test_log = tr_and_log
+    if test_log:
+      # Upload the original log without any modifications.
+      test_log = six.ensure_binary(test_log)
+      if (self._artifacts_dir
+          and len(test_log) >= _MIN_FILE_ARTIFACT_BYTES):
+        tr['artifacts']['Test Log'] = {
+            'filePath': self._GetArtifactPath(test_log)
+        }
+      else:
+        b64_log = six.ensure_str(base64.b64encode(test_log))
+        tr['artifacts']['Test Log'] = {'contents': b64_log}
+    if not tr['artifacts']:
+      del tr['artifacts']
+    return json.dumps(tr)
+
+  def _GetArtifactPath(self, contents):
+    """Returns the path of a file with |contents|, writing it if needed."""
+    digest = hashlib.sha1(contents).hexdigest()
+    with self._artifacts_lock:
+      path = self._artifact_paths.get(digest)
+      if path:
+        return path
+      os.makedirs(self._artifacts_dir, exist_ok=True)
+      path = os.path.join(self._artifacts_dir, digest)
+      # Files are named after their contents, so other clients sharing the
+      # directory may be writing the same file.
+      with tempfile.NamedTemporaryFile(dir=self._artifacts_dir,
+                                       delete=False) as f:
+        f.write(contents)
+      os.replace(f.name, path)
+      self._artifact_paths[digest] = path
+      return path
+
+  def _PostTestResults(self, serialized_results):
+    """Uploads test results, each serialized as JSON, in a single request."""
+    data = '{"testResults": [%s]}' % ', '.join(serialized_results)
+    headers = {}
+    if len(data) >= _MIN_COMPRESSED_REQUEST_BYTES:
+      data = gzip.compress(data.encode('utf-8'))
+      headers['Content-Encoding'] = 'gzip'
     res = self.session.post(url=self.test_results_url,
-                            data=json.dumps({'testResults': [tr]}))
+                            data=data,
+                            headers=headers)
     res.raise_for_status()
 
   def ReportInvocationLevelArtifacts(self, artifacts):
@@ -172,6 +270,101 @@ class ResultSinkClient(object):
     res.raise_for_status()
 
 
+class _BatchUploader(object):
+  """Uploads test results in batches from a background thread.
+
+  Results are uploaded once a batch is full or once its oldest result has
+  waited for _MAX_BATCH_DELAY_SECONDS.
+
+  Args:
+    serialize_fn: Function returning an item passed to Add() as JSON.
+    upload_fn: Function uploading a list of serialized results.
+  """
+
+  def __init__(self, serialize_fn, upload_fn):
+    self._serialize_fn = serialize_fn
+    self._upload_fn = upload_fn
+    # Bounded, so that Add() blocks when results are posted faster than they
+    # can be uploaded.
+    self._queue = queue.Queue(maxsize=_MAX_QUEUED_RESULTS)
+    self._error = None
+    self._thread = threading.Thread(target=self._Run,
+                                    name='ResultSinkUploader')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Add(self, item):
+    self._queue.put(item)
+
+  def Flush(self):
+    if self._thread.is_alive():
+      flushed = threading.Event()
+      self._queue.put(flushed)
+      flushed.wait()
+    self._RaiseError()
+
+  def Stop(self):
+    if self._thread.is_alive():
+      self._queue.put(None)
+      self._thread.join()
+    self._RaiseError()
+
+  def _RaiseError(self):
+    error, self._error = self._error, None
+    if error:
+      raise error
+
+  def _Run(self):
+    batch = []
+    batch_bytes = 0
+    deadline = None
+
+    def upload():
+      if not batch:
+        return
+      try:
+        self._upload_fn(batch)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception('Failed to upload %d test results.', len(batch))
+        self._error = self._error or e
+      del batch[:]
+
+    def serialize(item):
+      try:
+        return self._serialize_fn(item)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.exception('Failed to serialize test result.')
+        self._error = self._error or e
+        return None
+
+    while True:
+      try:
+        timeout = max(0, deadline - time.time()) if batch else None
+        item = self._queue.get(timeout=timeout)
+      except queue.Empty:
+        upload()
+        continue
+      if item is None:
+        upload()
+        return
+      if isinstance(item, threading.Event):
+        upload()
+        item.set()
+        continue
+      serialized = serialize(item)
+      if serialized is None:
+        continue
+      if batch and batch_bytes + len(serialized) > _MAX_BATCH_BYTES:
+        upload()
+      if not batch:
+        batch_bytes = 0
+        deadline = time.time() + _MAX_BATCH_DELAY_SECONDS
+      batch.append(serialized)
+      batch_bytes += len(serialized)
+      if len(batch) >= _MAX_BATCH_RESULTS:
+        upload()
+
+
 def _TruncateToUTF8Bytes(s, length):
   """ Truncates a string to a given number of bytes when encoded as UTF-8.
 
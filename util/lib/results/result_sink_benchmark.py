@@ -0,0 +1,77 @@
+#!/usr/bin/env vpython3
+# Copyright 2023 The Chromium Authors
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+"""Measures the overhead of reporting test results to ResultSink.
+
+Posts results to a local stand-in server (fake_result_sink.py), both one
+request per result and in batches from a background thread. Reports the time
+spent in Post(), which delays the caller, and the time until all results are
+uploaded.
+
+Run with:
+  build/util/lib/results/result_sink_benchmark.py [--num-results N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+_BUILD_UTIL_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..'))
+if _BUILD_UTIL_PATH not in sys.path:
+  sys.path.insert(0, _BUILD_UTIL_PATH)
+
+from lib.results import fake_result_sink
+from lib.results import result_sink
+from lib.results import result_types
+
+
+def _Run(sink, upload_in_background, logs):
+  client = result_sink.ResultSinkClient(
+      sink.context, upload_in_background=upload_in_background)
+  post_time = 0
+  start = time.time()
+  for i, log in enumerate(logs):
+    post_start = time.time()
+    client.Post('org.chromium.FooTest#test%d' % i, result_types.PASS, 10, log,
+                '//foo/FooTest.java')
+    post_time += time.time() - post_start
+  client.close()
+  return post_time, time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num-results', type=int, default=10000)
+  parser.add_argument('--log-size', type=int, default=2000)
+  parser.add_argument('--large-log-size', type=int, default=200000)
+  parser.add_argument('--large-log-rate',
+                      type=float,
+                      default=0.01,
+                      help='Fraction of results with a large log, which is '
+                      'the same for all of them.')
+  args = parser.parse_args()
+
+  rand = random.Random(0)
+  large_log = 'x' * args.large_log_size
+  logs = [
+      large_log if rand.random() < args.large_log_rate else '%d%s' %
+      (i, 'y' * args.log_size) for i in range(args.num_results)
+  ]
+  per_10k = 10000.0 / args.num_results
+
+  for name, upload_in_background in (('One request per result', False),
+                                     ('Background batches', True)):
+    with fake_result_sink.FakeResultSink() as sink:
+      post_time, total_time = _Run(sink, upload_in_background, logs)
+      num_requests = len(sink.requests)
+    print('{:<40} post={:.0f}ms total={:.0f}ms per 10k results, '
+          '{} requests'.format(name, post_time * per_10k * 1000,
+                               total_time * per_10k * 1000, num_requests))
+
+
+if __name__ == '__main__':
+  sys.exit(main())
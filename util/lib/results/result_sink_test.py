@@ -3,14 +3,18 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import base64
 import json
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 # The following non-std imports are fetched via vpython. See the list at
 # //.vpython3
 import mock  # pylint: disable=import-error
+import requests  # pylint: disable=import-error
 import six
 
 _BUILD_UTIL_PATH = os.path.abspath(
@@ -18,6 +22,7 @@ _BUILD_UTIL_PATH = os.path.abspath(
 if _BUILD_UTIL_PATH not in sys.path:
   sys.path.insert(0, _BUILD_UTIL_PATH)
 
+from lib.results import fake_result_sink
 from lib.results import result_sink
 from lib.results import result_types
 
@@ -116,5 +121,99 @@ class ClientTest(unittest.TestCase):
     self.assertIsNotNone(data['testResults'][0]['summaryHtml'])
 
 
+class BackgroundUploadTest(unittest.TestCase):
+  def setUp(self):
+    self.sink = fake_result_sink.FakeResultSink()
+    self.sink.__enter__()
+    self.client = result_sink.ResultSinkClient(self.sink.context,
+                                               upload_in_background=True)
+
+  def tearDown(self):
+    self.client.close()
+    self.sink.__exit__(None, None, None)
+
+  @mock.patch.object(result_sink, '_MAX_BATCH_RESULTS', 10)
+  def testBatches(self):
+    for i in range(25):
+      self.client.Post('test%d' % i, result_types.PASS, 0, 'log', None)
+    self.client.close()
+    self.assertEqual([10, 10, 5], [len(b) for b in self.sink.GetBatches()])
+    results = self.sink.GetTestResults()
+    self.assertEqual(['test%d' % i for i in range(25)],
+                     [tr['testId'] for tr in results])
+    self.assertEqual(base64.b64encode(b'log').decode(),
+                     results[0]['artifacts']['Test Log']['contents'])
+
+  def testFlush(self):
+    self.client.Post('some-test', result_types.FAIL, 0, None, None)
+    self.client.Flush()
+    results = self.sink.GetTestResults()
+    self.assertEqual(1, len(results))
+    self.assertEqual('FAIL', results[0]['status'])
+    self.assertNotIn('artifacts', results[0])
+
+  @mock.patch.object(result_sink, '_MAX_QUEUED_RESULTS', 1)
+  def testBoundedQueue(self):
+    client = result_sink.ResultSinkClient(self.sink.context,
+                                          upload_in_background=True)
+    for i in range(20):
+      client.Post('test%d' % i, result_types.PASS, 0, None, None)
+    client.close()
+    self.assertEqual(20, len(self.sink.GetTestResults()))
+
+  @mock.patch.object(result_sink, '_MIN_FILE_ARTIFACT_BYTES', 10)
+  def testLargeLogsDeduplicated(self):
+    artifacts_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, artifacts_dir)
+    self.client.close()
+    self.client = result_sink.ResultSinkClient(self.sink.context,
+                                               upload_in_background=True,
+                                               artifacts_dir=os.path.join(
+                                                   artifacts_dir, 'logs'))
+    self.client.Post('test1', result_types.PASS, 0, 'large log' * 10, None)
+    self.client.Post('test2', result_types.PASS, 0, 'large log' * 10, None)
+    self.client.Post('test3', result_types.PASS, 0, 'other log' * 10, None)
+    self.client.Flush()
+    paths = [
+        tr['artifacts']['Test Log']['filePath']
+        for tr in self.sink.GetTestResults()
+    ]
+    self.assertEqual(paths[0], paths[1])
+    self.assertNotEqual(paths[0], paths[2])
+    self.assertEqual(os.path.join(artifacts_dir, 'logs'),
+                     os.path.dirname(paths[0]))
+    with open(paths[0]) as f:
+      self.assertEqual('large log' * 10, f.read())
+
+  @mock.patch.object(result_sink, '_MIN_FILE_ARTIFACT_BYTES', 10)
+  def testLargeLogsInlineWithoutArtifactsDir(self):
+    self.client.Post('test1', result_types.PASS, 0, 'large log' * 10, None)
+    self.client.Flush()
+    [tr] = self.sink.GetTestResults()
+    self.assertEqual(
+        base64.b64encode(b'large log' * 10).decode(),
+        tr['artifacts']['Test Log']['contents'])
+
+  @mock.patch.object(result_sink, '_MIN_COMPRESSED_REQUEST_BYTES', 0)
+  def testCompressedRequests(self):
+    self.client.Post('some-test', result_types.PASS, 0, 'log', None)
+    self.client.Flush()
+    _, headers, body = self.sink.requests[0]
+    self.assertEqual('gzip', headers['Content-Encoding'])
+    self.assertEqual('some-test', body['testResults'][0]['testId'])
+
+  def testUploadError(self):
+    self.sink.status = 500
+    self.client.Post('some-test', result_types.PASS, 0, 'log', None)
+    with self.assertRaises(requests.HTTPError):
+      self.client.Flush()
+    # Later uploads still happen.
+    self.sink.status = 200
+    self.client.Post('other-test', result_types.PASS, 0, 'log', None)
+    self.client.Flush()
+    self.assertEqual(['some-test', 'other-test'],
+                     [tr['testId'] for tr in self.sink.GetTestResults()])
+
+
 if __name__ == '__main__':
   unittest.main()